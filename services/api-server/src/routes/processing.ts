@@ -75,6 +75,8 @@ export const processingRouter: FastifyPluginAsync = async (fastify) => {
 
       // コンテキストの整形（空のテキストは除外）
       const context = {
+        // セッション単位で要約を保持し、前回以降に追加された文字起こしだけを要約する
+        sessionId,
         transcriptions: transcriptions
           .filter((t) => t.text && t.text.trim() !== '')
           .map((t) => ({
@@ -21,6 +21,7 @@ export class ModalGPUService {
    * 仕様書生成
    */
   async generateSpecification(context: {
+    sessionId?: string;
     transcriptions: Array<{ text: string; timestamp: Date; speaker?: string }>;
     photos: Array<{ filename: string; storageKey: string; timestamp: Date }>;
   }): Promise<{
@@ -34,12 +35,13 @@ export class ModalGPUService {
       }
 
       logger.info('Modal GPUサーバーに仕様書生成をリクエスト', {
+        sessionId: context.sessionId,
         transcriptionCount: context.transcriptions.length,
         photoCount: context.photos.length,
       });
 
       // Modal GPUサーバーのgenerate_specificationエンドポイントを呼び出し
-      // 注: modal_app.pyのRealworldAgentGPU.generate_specificationメソッドを呼び出す
+      // 注: modal_app.pyのRealworldAgentLLM.generate_specificationメソッドを呼び出す
       // コールドスタート対策として10分のタイムアウトを設定
       const controller = new AbortController();
       const timeoutId = setTimeout(() => controller.abort(), 600000); // 10分
@@ -130,6 +132,8 @@ export class ModalGPUService {
         logger.info('コード生成完了', {
           model: result.model,
           fileCount: result.files.length,
+          cachedPromptTokens: result.prompt_cache?.cached_tokens,
+          traceId: response.headers.get('x-trace-id'),
         });
 
         return result;
@@ -187,6 +191,63 @@ export class ModalGPUService {
     }
   }
 
+  /**
+   * 複数画像の一括分析
+   * 結果は画像の順番どおりに返り、失敗した画像は error を持つ
+   */
+  async analyzeImages(
+    imageBuffers: Buffer[],
+    options: { prompt?: string; pack?: boolean } = {}
+  ): Promise<{
+    results: Array<{ index: number; analysis?: string; model?: string; error?: string }>;
+    succeeded: number;
+    failed: number;
+    provider_calls: number;
+  }> {
+    try {
+      if (!this.apiUrl) {
+        throw new Error('Modal API URLが設定されていません');
+      }
+
+      logger.info('Modal GPUサーバーに画像一括分析をリクエスト', {
+        imageCount: imageBuffers.length,
+        pack: options.pack ?? false,
+      });
+
+      const formData = new FormData();
+      imageBuffers.forEach((imageBuffer, i) => {
+        formData.append('images', new Blob([imageBuffer]), `image_${i}`);
+      });
+      if (options.prompt) {
+        formData.append('prompt', options.prompt);
+      }
+      formData.append('pack', String(options.pack ?? false));
+
+      const response = await fetch(`${this.apiUrl}/api/analyze-images`, {
+        method: 'POST',
+        body: formData,
+      });
+
+      if (!response.ok) {
+        const errorText = await response.text();
+        throw new Error(`Modal API Error: ${response.status} - ${errorText}`);
+      }
+
+      const result = await response.json();
+
+      logger.info('画像一括分析完了', {
+        succeeded: result.succeeded,
+        failed: result.failed,
+        providerCalls: result.provider_calls,
+      });
+
+      return result;
+    } catch (error) {
+      logger.error('Modal画像一括分析エラー', error as Error);
+      throw error;
+    }
+  }
+
   /**
    * ヘルスチェック
    */
@@ -0,0 +1,283 @@
+"""
+長時間音声の分割文字起こし
+発話区間（VAD）の切れ目で音声を分割し、チャンクごとの文字起こし結果をタイムスタンプを補正して1つにまとめる
+
+分割は無音区間の中央で行うため、通常はチャンク同士が重ならない。
+切れ目のない発話が続いて最大長で強制的に分割する場合だけ前後を重ねて文字起こしし、
+重なった部分の単語は、中点がそのチャンクの担当区間に入るものだけを残して重複を除く。
+"""
+
+import os
+import subprocess
+import tempfile
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+
+# ffmpegが失敗したときにエラーに含める stderr の末尾の行数
+FFMPEG_ERROR_LINES = 10
+
+
+@dataclass(frozen=True)
+class ChunkingConfig:
+    """
+    分割文字起こしの設定
+
+    環境変数:
+        TRANSCRIBE_CHUNK_SECONDS: チャンクの目標の長さ（秒）。これを超えた最初の無音区間で分割する
+        TRANSCRIBE_CHUNK_MAX_SECONDS: チャンクの最大の長さ（秒）。無音区間がなければここで強制的に分割する
+        TRANSCRIBE_CHUNK_OVERLAP_SECONDS: 強制的に分割する場合に前後を重ねる長さ（秒）
+        TRANSCRIBE_MAX_PARALLEL: 同時に文字起こしするチャンク数（コンテナ数）の上限
+        TRANSCRIBE_VAD_WINDOW_SECONDS: VADで一度にデコードする長さ（秒）。メモリ使用量の上限になる
+        TRANSCRIBE_VAD_MIN_SILENCE_MS: 分割位置の候補にする無音区間の最小の長さ（ミリ秒）
+    """
+
+    chunk_seconds: float = 120.0
+    max_chunk_seconds: float = 180.0
+    overlap_seconds: float = 2.0
+    max_parallel: int = 16
+    vad_window_seconds: float = 600.0
+    vad_min_silence_ms: int = 500
+
+    @classmethod
+    def from_env(cls) -> "ChunkingConfig":
+        """環境変数から設定を読み込む"""
+        return cls(
+            chunk_seconds=float(os.getenv("TRANSCRIBE_CHUNK_SECONDS", cls.chunk_seconds)),
+            max_chunk_seconds=float(os.getenv("TRANSCRIBE_CHUNK_MAX_SECONDS", cls.max_chunk_seconds)),
+            overlap_seconds=float(os.getenv("TRANSCRIBE_CHUNK_OVERLAP_SECONDS", cls.overlap_seconds)),
+            max_parallel=int(os.getenv("TRANSCRIBE_MAX_PARALLEL", cls.max_parallel)),
+            vad_window_seconds=float(os.getenv("TRANSCRIBE_VAD_WINDOW_SECONDS", cls.vad_window_seconds)),
+            vad_min_silence_ms=int(os.getenv("TRANSCRIBE_VAD_MIN_SILENCE_MS", cls.vad_min_silence_ms)),
+        )
+
+
+@dataclass(frozen=True)
+class AudioChunk:
+    """
+    分割したチャンク
+
+    start〜end がこのチャンクの担当区間、decode_start〜decode_end が実際に文字起こしする区間
+    （強制的に分割した境界では前後に overlap_seconds だけ広がる）
+    """
+
+    index: int
+    start: float
+    end: float
+    decode_start: float
+    decode_end: float
+    last: bool = False
+
+    def owns(self, time: float) -> bool:
+        """その時刻がこのチャンクの担当区間に入るか（最後のチャンクは終端以降も含む）"""
+        return time >= self.start and (time < self.end or self.last)
+
+
+def _iter_pcm_windows(path: str, window_seconds: float) -> Iterator[np.ndarray]:
+    """ffmpegで16kHzモノラルにデコードし、window_seconds ごとにfloat32配列で返す"""
+    command = [
+        "ffmpeg", "-v", "error", "-nostdin",
+        "-i", path,
+        "-vn", "-ac", "1", "-ar", str(SAMPLE_RATE),
+        "-f", "s16le", "pipe:1",
+    ]
+    window_bytes = int(window_seconds * SAMPLE_RATE) * 2
+    # stderr はパイプにすると、壊れた部分の多い音声でエラー行がパイプの容量（約64KB）を超えたときに
+    # ffmpegが書き込みで止まり、stdout の読み込みも終わらなくなる。一時ファイルに書かせて、失敗時に末尾だけ読む
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr)
+        try:
+            while True:
+                data = process.stdout.read(window_bytes)
+                if not data:
+                    break
+                yield np.frombuffer(data[:len(data) - len(data) % 2], dtype=np.int16).astype(np.float32) / 32768.0
+
+            process.wait()
+            if process.returncode != 0:
+                raise RuntimeError(f"ffmpegエラー（終了コード {process.returncode}）: {_tail_lines(stderr, FFMPEG_ERROR_LINES)}")
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            process.stdout.close()
+
+
+def _tail_lines(file, lines: int, max_bytes: int = 8192) -> str:
+    """ファイルの末尾 lines 行（末尾 max_bytes バイトの中から）"""
+    file.seek(0, os.SEEK_END)
+    file.seek(max(0, file.tell() - max_bytes))
+    text = file.read().decode(errors="replace").strip()
+    return "\n".join(text.splitlines()[-lines:])
+
+
+def detect_speech(path: str, config: ChunkingConfig) -> Tuple[List[Tuple[float, float]], float]:
+    """
+    音声ファイルの発話区間をSilero VAD（faster-whisper同梱）で検出
+
+    ファイル全体をメモリに載せないよう vad_window_seconds ごとにデコードして処理する。
+    ウィンドウの境界で切れた発話は、間の無音が vad_min_silence_ms 未満ならつなげ直す。
+
+    Returns:
+        ([(開始秒, 終了秒)], 音声の長さ（秒）)
+    """
+    from faster_whisper.vad import VadOptions, get_speech_timestamps
+
+    options = VadOptions(min_silence_duration_ms=config.vad_min_silence_ms, speech_pad_ms=100)
+    spans: List[Tuple[float, float]] = []
+    offset = 0
+    for window in _iter_pcm_windows(path, config.vad_window_seconds):
+        for span in get_speech_timestamps(window, options):
+            spans.append(((offset + span["start"]) / SAMPLE_RATE, (offset + span["end"]) / SAMPLE_RATE))
+        offset += len(window)
+
+    return merge_spans(spans, config.vad_min_silence_ms / 1000), offset / SAMPLE_RATE
+
+
+def merge_spans(spans: List[Tuple[float, float]], min_gap: float) -> List[Tuple[float, float]]:
+    """間隔が min_gap 未満の発話区間をつなげる"""
+    merged: List[Tuple[float, float]] = []
+    for start, end in sorted(spans):
+        if merged and start - merged[-1][1] < min_gap:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def plan_chunks(spans: List[Tuple[float, float]], duration: float, config: ChunkingConfig) -> List[AudioChunk]:
+    """
+    発話区間の間（無音区間の中央）を分割位置にしてチャンクに分ける
+
+    目標の長さを超えた最初の無音区間で分割する。最大の長さまでに無音区間がない場合は、
+    最大の長さまでで最後の無音区間で、それもなければ最大の長さで強制的に分割する。
+    """
+    if duration <= 0:
+        return []
+
+    # 分割位置の候補（無音区間の中央）
+    candidates = [
+        (previous_end + next_start) / 2
+        for (_, previous_end), (next_start, _) in zip(spans, spans[1:])
+    ]
+
+    boundaries: List[Tuple[float, bool]] = []  # (分割位置, 強制的に分割したか)
+    start = 0.0
+    position = 0
+    while duration - start > config.max_chunk_seconds:
+        while position < len(candidates) and candidates[position] <= start:
+            position += 1
+
+        cut: Optional[float] = None
+        for candidate in candidates[position:]:
+            if candidate - start > config.max_chunk_seconds:
+                break
+            cut = candidate
+            if candidate - start >= config.chunk_seconds:
+                break
+
+        forced = cut is None
+        if forced:
+            cut = start + config.max_chunk_seconds
+        boundaries.append((cut, forced))
+        start = cut
+
+    chunks = []
+    edges = [(0.0, False)] + boundaries + [(duration, False)]
+    for index, ((chunk_start, forced_start), (chunk_end, forced_end)) in enumerate(zip(edges, edges[1:])):
+        chunks.append(AudioChunk(
+            index=index,
+            start=chunk_start,
+            end=chunk_end,
+            decode_start=max(0.0, chunk_start - config.overlap_seconds) if forced_start else chunk_start,
+            decode_end=min(duration, chunk_end + config.overlap_seconds) if forced_end else chunk_end,
+            last=index == len(edges) - 2,
+        ))
+    return chunks
+
+
+def load_audio_range(path: str, start: float, end: float) -> np.ndarray:
+    """音声ファイルの start〜end 秒だけを16kHzモノラルのfloat32配列としてデコード"""
+    command = [
+        "ffmpeg", "-v", "error", "-nostdin",
+        "-ss", f"{start:.3f}", "-t", f"{end - start:.3f}",
+        "-i", path,
+        "-vn", "-ac", "1", "-ar", str(SAMPLE_RATE),
+        "-f", "s16le", "pipe:1",
+    ]
+    result = subprocess.run(command, capture_output=True, check=False)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpegエラー（終了コード {result.returncode}）: {result.stderr.decode(errors='replace').strip()}")
+    data = result.stdout[:len(result.stdout) - len(result.stdout) % 2]
+    return np.frombuffer(data, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+def _shift(item: Dict[str, Any], offset: float) -> Dict[str, Any]:
+    shifted = dict(item)
+    for key in ("start", "end"):
+        if shifted.get(key) is not None:
+            shifted[key] = round(shifted[key] + offset, 3)
+    return shifted
+
+
+def _midpoint(item: Dict[str, Any], fallback: float) -> float:
+    if item.get("start") is None or item.get("end") is None:
+        return fallback
+    return (item["start"] + item["end"]) / 2
+
+
+def join_words(words: List[Dict[str, Any]], original_text: str = "") -> str:
+    """単語をテキストに連結"""
+    # faster-whisperの単語は先頭に空白を含む。whisperxの単語は空白なしで、空白区切りの言語のみ空白で連結する
+    if any(word["word"][:1].isspace() for word in words) or " " not in original_text.strip():
+        return "".join(word["word"] for word in words).strip()
+    return " ".join(word["word"].strip() for word in words)
+
+
+def stitch_chunk_segments(chunk: AudioChunk, segments: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    チャンクの文字起こし結果を音声全体の時刻に補正し、担当区間外（重なり部分）の単語を除く
+
+    Args:
+        chunk: チャンク
+        segments: チャンク内の時刻（decode_start を0とする）のセグメント
+
+    Returns:
+        音声全体の時刻のセグメント
+    """
+    stitched = []
+    for segment in segments:
+        segment = _shift(segment, chunk.decode_start)
+        segment_mid = _midpoint(segment, chunk.start)
+        words = segment.get("words")
+        if not words:
+            if chunk.owns(segment_mid):
+                stitched.append(segment)
+            continue
+
+        shifted_words = [_shift(word, chunk.decode_start) for word in words]
+        kept = [word for word in shifted_words if chunk.owns(_midpoint(word, segment_mid))]
+        if not kept:
+            continue
+        if len(kept) < len(shifted_words):
+            timed = [word for word in kept if word.get("start") is not None]
+            segment = {
+                **segment,
+                "start": timed[0]["start"] if timed else segment["start"],
+                "end": timed[-1]["end"] if timed else segment["end"],
+                "text": join_words(kept, segment.get("text", "")),
+            }
+        segment["words"] = kept
+        stitched.append(segment)
+    return stitched
+
+
+def stitch_chunks(results: List[Tuple[AudioChunk, List[Dict[str, Any]]]]) -> List[Dict[str, Any]]:
+    """全チャンクの結果を時刻順の1つのセグメントリストにまとめる"""
+    segments = []
+    for chunk, chunk_segments in sorted(results, key=lambda item: item[0].index):
+        segments.extend(stitch_chunk_segments(chunk, chunk_segments))
+    return segments
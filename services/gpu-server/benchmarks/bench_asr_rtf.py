@@ -0,0 +1,111 @@
+"""
+CPUでの文字起こしの実時間係数（RTF）のベンチマーク
+
+faster-whisper バックエンドをモデル・計算精度・スレッド数の組み合わせごとに読み込み、
+同じ音声を文字起こしして RTF（処理時間 / 音声の長さ、1未満なら実時間より速い）を計測する。
+モデルの読み込み時間とウォームアップ時間も表示する。
+
+--audio を省略した場合は、音声の長さだけを揃えた合成音声（音程の変わるトーンと雑音）を使う。
+認識結果に意味はないため、実際の性能は録音ファイルを指定して確認すること。
+
+実行方法（services/gpu-server で、faster-whisper が必要。初回はモデルをダウンロードする）:
+    python -m benchmarks.bench_asr_rtf --audio meeting.wav --models tiny small --compute-types int8 float32 --threads 4 8
+"""
+
+import argparse
+import dataclasses
+import time
+from typing import List, Optional
+
+import numpy as np
+
+from transcription import SAMPLE_RATE, FasterWhisperBackend, TranscriptionConfig
+
+
+def synthetic_audio(seconds: float, seed: int = 0) -> np.ndarray:
+    """0.3〜1秒ごとに音程が変わるトーンに雑音と無音を混ぜた16kHzモノラル音声"""
+    rng = np.random.default_rng(seed)
+    chunks = []
+    total = int(seconds * SAMPLE_RATE)
+    while sum(len(c) for c in chunks) < total:
+        length = int(rng.uniform(0.3, 1.0) * SAMPLE_RATE)
+        if rng.random() < 0.2:
+            chunks.append(np.zeros(length, dtype=np.float32))
+            continue
+        t = np.arange(length, dtype=np.float32) / SAMPLE_RATE
+        frequency = rng.uniform(120, 300)
+        tone = sum(np.sin(2 * np.pi * frequency * k * t) / k for k in range(1, 5))
+        envelope = np.minimum(1.0, np.minimum(t, t[::-1]) * 20)
+        chunks.append((0.2 * tone * envelope).astype(np.float32))
+    audio = np.concatenate(chunks)[:total]
+    return audio + rng.normal(0, 0.01, size=total).astype(np.float32)
+
+
+def load_audio(path: Optional[str], seconds: float) -> np.ndarray:
+    if path is None:
+        return synthetic_audio(seconds)
+    from faster_whisper import decode_audio
+
+    return decode_audio(path, sampling_rate=SAMPLE_RATE)
+
+
+def run(
+    audio_path: Optional[str],
+    seconds: float,
+    models: List[str],
+    compute_types: List[str],
+    threads: List[int],
+    language: str,
+    download_root: Optional[str],
+):
+    audio = load_audio(audio_path, seconds)
+    duration = len(audio) / SAMPLE_RATE
+    print(f"音声: {audio_path or '合成音声'}（{duration:.1f}秒）")
+    print(
+        f"  {'モデル':<10}{'精度':<10}{'スレッド':>8}{'読み込み':>10}{'ウォームアップ':>14}"
+        f"{'処理時間':>10}{'RTF':>8}{'セグメント':>10}"
+    )
+
+    for model in models:
+        for compute_type in compute_types:
+            for thread_count in threads:
+                config = dataclasses.replace(
+                    TranscriptionConfig(),
+                    model=model,
+                    compute_type=compute_type,
+                    cpu_threads=thread_count,
+                )
+                started = time.perf_counter()
+                backend = FasterWhisperBackend(config, "cpu", download_root)
+                load_seconds = time.perf_counter() - started
+
+                started = time.perf_counter()
+                backend.warm_up(language)
+                warmup_seconds = time.perf_counter() - started
+
+                started = time.perf_counter()
+                result = backend.transcribe(audio, language)
+                seconds_taken = time.perf_counter() - started
+
+                print(
+                    f"  {model:<10}{compute_type:<10}{config.threads:>8}{load_seconds:>9.1f}s{warmup_seconds:>13.2f}s"
+                    f"{seconds_taken:>9.1f}s{seconds_taken / duration:>8.3f}{len(result['segments']):>10}"
+                )
+                del backend
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--audio", help="音声ファイル（省略時は合成音声）")
+    parser.add_argument("--seconds", type=float, default=60.0, help="合成音声の長さ（秒）")
+    parser.add_argument("--models", nargs="+", default=["tiny", "small"])
+    parser.add_argument("--compute-types", nargs="+", default=["int8", "float32"])
+    parser.add_argument("--threads", type=int, nargs="+", default=[0], help="スレッド数（0はCPU数）")
+    parser.add_argument("--language", default="ja")
+    parser.add_argument("--download-root", help="モデルの保存先（省略時はHugging Faceのキャッシュ）")
+    args = parser.parse_args()
+    run(args.audio, args.seconds, args.models, args.compute_types, args.threads, args.language, args.download_root)
+
+
+if __name__ == "__main__":
+    main()
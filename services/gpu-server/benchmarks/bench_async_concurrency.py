@@ -0,0 +1,95 @@
+"""
+非同期リクエスト経路の同時実行ベンチマーク
+
+async def のハンドラ内で同期SDKを呼ぶ場合（旧実装: イベントループがブロックされ直列化される）と、
+AsyncOpenAI / AsyncAnthropic を await する場合（新実装）のスループットを、同時実行数ごとに比較する。
+
+実行方法（services/gpu-server で）:
+    python -m benchmarks.bench_async_concurrency --latency-ms 200 --concurrency 1 4 16 64
+"""
+
+import argparse
+import asyncio
+import time
+from typing import Any, Dict, List
+
+from benchmarks.stub_provider import StubConfig, StubProviderServer
+from llm_clients import HTTPPoolConfig, create_llm_client
+
+
+def _request_kwargs(provider: str) -> Dict[str, Any]:
+    if provider == "openai":
+        return {"model": "stub", "messages": [{"role": "user", "content": "ping"}], "max_tokens": 16}
+    return {"model": "stub", "max_tokens": 16, "messages": [{"role": "user", "content": "ping"}]}
+
+
+def _endpoint(client, provider: str):
+    return client.chat.completions if provider == "openai" else client.messages
+
+
+async def _run_level(client, provider: str, concurrency: int, total: int, blocking: bool) -> Dict[str, float]:
+    """同時実行数concurrencyでtotal件のリクエストを処理"""
+    endpoint = _endpoint(client, provider)
+    kwargs = _request_kwargs(provider)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+
+    async def handler():
+        async with semaphore:
+            start = time.perf_counter()
+            if blocking:
+                # 旧実装: async def 内で同期SDKを呼ぶ
+                endpoint.create(**kwargs)
+            else:
+                await endpoint.create(**kwargs)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(handler() for _ in range(total)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "throughput": total / elapsed,
+        "p50": latencies[len(latencies) // 2],
+        "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+    }
+
+
+async def run(latency_ms: float, levels: List[int], requests_per_level: int, provider: str):
+    max_level = max(levels)
+    pool_config = HTTPPoolConfig(max_connections=max_level, max_keepalive_connections=max_level)
+
+    with StubProviderServer(StubConfig(latency_ms=latency_ms)) as server:
+        base_url = server.openai_base_url if provider == "openai" else server.anthropic_base_url
+        sync_client = create_llm_client(provider, "stub", pool_config, base_url=base_url, asynchronous=False)
+        async_client = create_llm_client(provider, "stub", pool_config, base_url=base_url)
+
+        print(f"[{provider}] スタブ遅延 {latency_ms:.0f}ms")
+        print(f"  {'同時実行':>8}{'blocking req/s':>16}{'async req/s':>14}{'async p50':>12}{'async p95':>12}")
+
+        for level in levels:
+            total = max(requests_per_level, level * 2)
+            blocking = await _run_level(sync_client, provider, level, total, blocking=True)
+            non_blocking = await _run_level(async_client, provider, level, total, blocking=False)
+            print(
+                f"  {level:>8}{blocking['throughput']:>16.1f}{non_blocking['throughput']:>14.1f}"
+                f"{non_blocking['p50']:>10.1f}ms{non_blocking['p95']:>10.1f}ms"
+            )
+
+        sync_client.close()
+        await async_client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="スタブの応答遅延")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--requests", type=int, default=32, help="各同時実行数での最小リクエスト数")
+    parser.add_argument("--provider", choices=["openai", "anthropic"], default="openai")
+    args = parser.parse_args()
+    asyncio.run(run(args.latency_ms, args.concurrency, args.requests, args.provider))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+LLMクライアントのプーリング効果ベンチマーク
+
+リクエスト毎にクライアントを生成する場合（旧実装）と、
+load_modelsで生成したクライアントを使い回す場合の1リクエストあたりのレイテンシを比較する。
+ローカルのスタブプロバイダーに対して実行するため、APIキーやネットワークは不要。
+
+実行方法（services/gpu-server で）:
+    python -m benchmarks.bench_client_pool --requests 200 --connect-delay-ms 30
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from typing import Awaitable, Callable, Dict, List
+
+from benchmarks.stub_provider import StubConfig, StubProviderServer
+from llm_clients import HTTPPoolConfig, create_llm_client
+
+
+async def _call(client, provider: str):
+    if provider == "openai":
+        await client.chat.completions.create(
+            model="stub",
+            messages=[{"role": "user", "content": "ping"}],
+            max_tokens=16,
+        )
+    else:
+        await client.messages.create(
+            model="stub",
+            max_tokens=16,
+            messages=[{"role": "user", "content": "ping"}],
+        )
+
+
+async def _measure(fn: Callable[[], Awaitable[None]], requests: int) -> List[float]:
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        await fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def _summary(latencies: List[float]) -> Dict[str, float]:
+    ordered = sorted(latencies)
+    return {
+        "mean": statistics.fmean(ordered),
+        "p50": ordered[len(ordered) // 2],
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+    }
+
+
+async def run(requests: int, latency_ms: float, connect_delay_ms: float):
+    pool_config = HTTPPoolConfig.from_env()
+    config = StubConfig(latency_ms=latency_ms, connect_delay_ms=connect_delay_ms)
+
+    with StubProviderServer(config) as server:
+        base_urls = {
+            "openai": server.openai_base_url,
+            "anthropic": server.anthropic_base_url,
+        }
+
+        for provider, base_url in base_urls.items():
+            # 旧実装: リクエスト毎にクライアント（=コネクションプール）を生成
+            async def per_request():
+                client = create_llm_client(provider, "stub", pool_config, base_url=base_url)
+                await _call(client, provider)
+                await client.close()
+
+            # 新実装: 生成済みクライアントを使い回す
+            pooled_client = create_llm_client(provider, "stub", pool_config, base_url=base_url)
+
+            async def pooled():
+                await _call(pooled_client, provider)
+
+            # ウォームアップ
+            await per_request()
+            await pooled()
+
+            connections_before = server.counters["connections"]
+            fresh = _summary(await _measure(per_request, requests))
+            fresh_connections = server.counters["connections"] - connections_before
+
+            connections_before = server.counters["connections"]
+            reused = _summary(await _measure(pooled, requests))
+            reused_connections = server.counters["connections"] - connections_before
+            await pooled_client.close()
+
+            print(f"\n[{provider}] {requests} リクエスト")
+            print(f"  {'':<12}{'mean':>10}{'p50':>10}{'p95':>10}{'接続数':>8}")
+            for label, stats, conns in (
+                ("per-request", fresh, fresh_connections),
+                ("pooled", reused, reused_connections),
+            ):
+                print(
+                    f"  {label:<12}{stats['mean']:>9.2f}ms{stats['p50']:>8.2f}ms"
+                    f"{stats['p95']:>8.2f}ms{conns:>8}"
+                )
+            print(f"  削減: {fresh['mean'] - reused['mean']:.2f} ms/リクエスト")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="スタブの応答遅延")
+    parser.add_argument(
+        "--connect-delay-ms",
+        type=float,
+        default=30.0,
+        help="新規接続ごとの遅延（TLSハンドシェイク相当）",
+    )
+    args = parser.parse_args()
+    asyncio.run(run(args.requests, args.latency_ms, args.connect_delay_ms))
+
+
+if __name__ == "__main__":
+    main()
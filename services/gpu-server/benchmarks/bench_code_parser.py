@@ -0,0 +1,160 @@
+"""
+コード生成出力パーサーのベンチマーク
+
+従来の正規表現による抽出（フィールドごとに全文を走査し、代替形式の重複チェックが O(n²)）と、
+1回の走査で文書ツリーを作る parse_code_output の処理時間を、ファイル数ごとに比較する。
+両者の抽出結果が一致することも確認する。
+
+実行方法（services/gpu-server で）:
+    python -m benchmarks.bench_code_parser --files 10 100 300 1000 --alternate-ratio 0.5
+"""
+
+import argparse
+import os
+import re
+import time
+from typing import Any, Callable, Dict, List
+
+from benchmarks.corpus import make_code_output
+from code_output_parser import parse_code_output
+
+EXT_MAP = {
+    ".py": "python",
+    ".ts": "typescript",
+    ".js": "javascript",
+    ".go": "go",
+    ".json": "json",
+    ".md": "markdown",
+}
+
+
+def detect_language(filepath: str) -> str:
+    _, ext = os.path.splitext(filepath)
+    return EXT_MAP.get(ext.lower(), "text")
+
+
+def legacy_build_code_output(text: str) -> Dict[str, Any]:
+    """旧実装（modal_app の _extract_* ）と同じ処理"""
+    files = []
+    pattern = r'###\s*ファイル:\s*([^\n]+)\s*```(\w+)?\s*\n(.*?)```'
+    for match in re.finditer(pattern, text, re.DOTALL):
+        filepath = match.group(1).strip()
+        files.append({
+            "path": filepath,
+            "content": match.group(3).strip(),
+            "language": match.group(2) or detect_language(filepath),
+        })
+    alt_pattern = r'```(\w+):([^\n]+)\s*\n(.*?)```'
+    for match in re.finditer(alt_pattern, text, re.DOTALL):
+        filepath = match.group(2).strip()
+        if not any(f["path"] == filepath for f in files):
+            files.append({
+                "path": filepath,
+                "content": match.group(3).strip(),
+                "language": match.group(1).strip(),
+            })
+
+    dependencies = []
+    match = re.search(r'##\s*依存関係\s*```[^\n]*\n(.*?)```', text, re.DOTALL)
+    if match:
+        for line in match.group(1).strip().split('\n'):
+            line = line.strip()
+            if line and not line.startswith('#'):
+                dependencies.append(line)
+
+    instructions = []
+    setup_match = re.search(r'##\s*セットアップ手順\s*\n(.*?)(?=##|$)', text, re.DOTALL)
+    if setup_match:
+        instructions.append("# セットアップ手順")
+        instructions.append(setup_match.group(1).strip())
+    run_match = re.search(r'##\s*実行方法\s*\n(.*?)(?=##|$)', text, re.DOTALL)
+    if run_match:
+        instructions.append("\n# 実行方法")
+        instructions.append(run_match.group(1).strip())
+
+    summary = {
+        "name": "生成されたプロジェクト",
+        "description": "",
+        "features": [],
+        "tech_stack": {"language": "", "framework": "", "libraries": []},
+        "mermaid_diagram": "",
+    }
+    name_match = re.search(r'プロジェクト名:\s*(?:【)?([^】\n]+)(?:】)?', text)
+    if name_match:
+        summary["name"] = name_match.group(1).strip()
+    desc_match = re.search(r'説明:\s*(?:【)?([^】\n]+)(?:】)?', text)
+    if desc_match:
+        summary["description"] = desc_match.group(1).strip()
+    features_match = re.search(r'主な機能:?\s*\n((?:-\s+[^\n]+\n?)+)', text)
+    if features_match:
+        for line in features_match.group(1).split('\n'):
+            if line.strip().startswith('-'):
+                feature = line.strip()[1:].strip()
+                if feature:
+                    summary["features"].append(feature)
+    for key, label in (("language", "言語"), ("framework", "フレームワーク")):
+        field_match = re.search(rf'-\s*{label}:\s*(?:【)?([^】\n]+)(?:】)?', text)
+        if field_match:
+            summary["tech_stack"][key] = field_match.group(1).strip()
+    lib_match = re.search(r'-\s*主要ライブラリ:\s*(?:【)?([^】\n]+)(?:】)?', text)
+    if lib_match:
+        summary["tech_stack"]["libraries"] = [l.strip() for l in lib_match.group(1).split(',') if l.strip()]
+    mermaid_match = re.search(r'```mermaid\s*\n(.*?)```', text, re.DOTALL)
+    if mermaid_match:
+        summary["mermaid_diagram"] = mermaid_match.group(1).strip()
+
+    return {
+        "files": files,
+        "dependencies": dependencies,
+        "instructions": "\n".join(instructions) if instructions else "セットアップ手順は生成されたコードに含まれています。",
+        "summary": summary,
+    }
+
+
+def tree_build_code_output(text: str) -> Dict[str, Any]:
+    """新実装（modal_app の _build_code_output と同じ処理）"""
+    document = parse_code_output(text, detect_language)
+    return {
+        "files": document.files,
+        "dependencies": document.dependencies(),
+        "instructions": document.instructions(),
+        "summary": document.project_summary(),
+    }
+
+
+def _best_of(fn: Callable[[str], Any], text: str, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(text)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def run(file_counts: List[int], lines_per_file: int, alternate_ratio: float, repeat: int):
+    print(f"1ファイル {lines_per_file} 行、代替形式 {alternate_ratio:.0%}、{repeat} 回中の最速値")
+    print(f"  {'ファイル数':>10}{'サイズ':>10}{'regex':>12}{'tree':>12}{'倍率':>8}  一致")
+
+    for count in file_counts:
+        text = make_code_output(count, lines_per_file=lines_per_file, alternate_ratio=alternate_ratio)
+        matches = legacy_build_code_output(text) == tree_build_code_output(text)
+        legacy_ms = _best_of(legacy_build_code_output, text, repeat)
+        tree_ms = _best_of(tree_build_code_output, text, repeat)
+        print(
+            f"  {count:>10}{len(text) / 1024:>8.0f}KB{legacy_ms:>10.2f}ms{tree_ms:>10.2f}ms"
+            f"{legacy_ms / tree_ms:>7.1f}x  {'✅' if matches else '❌'}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, nargs="+", default=[10, 100, 300, 1000])
+    parser.add_argument("--lines-per-file", type=int, default=40)
+    parser.add_argument("--alternate-ratio", type=float, default=0.5, help="```言語:パス 形式のファイルの割合")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    run(args.files, args.lines_per_file, args.alternate_ratio, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
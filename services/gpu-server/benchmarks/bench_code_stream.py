@@ -0,0 +1,109 @@
+"""
+ストリーミングのコード生成（generate_code_stream）の逐次解析の時間
+
+スタブプロバイダーが応答（ファイル数ごとの合成コード生成出力）を CHARS_PER_TOKEN 文字ずつ待たずに送り、
+RealworldAgentLLM.generate_code_stream がプロバイダーのデルタごとに IncrementalCodeParser へ渡す処理の合計
+（done イベントの metrics.parse_ms。この間はイベントループが止まる）と全体の時間を、ファイル数ごとに計測する（--repeat 回の中央値）。
+
+逐次解析は応答の大きさに比例する（線形時間）はずなので、1KBあたりの解析時間を最も小さい応答と比べ、
+最も大きい応答で --max-growth 倍を超えた場合は終了コード1で終わる（二乗時間の回帰の検出）。
+
+実行方法（services/gpu-server で）:
+    python -m benchmarks.bench_code_stream
+    python -m benchmarks.bench_code_stream --files 100 200 400 --provider anthropic
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+from typing import Any, Dict, List
+
+from benchmarks.corpus import make_code_output, make_session
+from benchmarks.local_gpu import LocalGPU
+from benchmarks.stub_provider import StubConfig, StubProviderServer
+
+# 1KBあたりの解析時間がこの倍数を超えて増えたら回帰とする（--max-growth の既定値）
+DEFAULT_MAX_GROWTH = 1.5
+
+
+async def stream_once(gpu: LocalGPU, request: Dict[str, Any]) -> Dict[str, Any]:
+    """generate_code_stream を最後まで受信し、done イベントの metrics を返す"""
+    metrics: Dict[str, Any] = {}
+    async for event in gpu._raw["generate_code_stream"](gpu.instance, request):
+        if event["type"] == "done":
+            metrics = event["metrics"]
+    return metrics
+
+
+async def run(args) -> List[Dict[str, Any]]:
+    texts = {count: make_code_output(count) for count in args.files}
+    current = {"text": ""}
+    request = {
+        "prompt": "決済とログインを備えたAPIサーバーを作成してください",
+        "context": make_session(10),
+        "language": "python",
+        "framework": "FastAPI",
+        "use_cache": False,
+    }
+
+    results = []
+    with StubProviderServer(StubConfig(respond=lambda provider, body: current["text"])) as server:
+        gpu = LocalGPU({
+            "OPENAI_BASE_URL": server.openai_base_url,
+            "ANTHROPIC_BASE_URL": server.anthropic_base_url,
+            "PRIMARY_LLM_PROVIDER": args.provider,
+        })
+        try:
+            print(f"プロバイダー: {args.provider}、{args.repeat}回の中央値")
+            print(f"  {'ファイル数':>8}{'応答(KB)':>10}{'全体(ms)':>11}{'解析(ms)':>11}{'解析(µs/KB)':>13}")
+            for count, text in texts.items():
+                current["text"] = text
+                # 接続の確立・トークナイザーの読み込みなどを計測から除く
+                await stream_once(gpu, request)
+                runs = [await stream_once(gpu, request) for _ in range(args.repeat)]
+                size_kb = len(text.encode("utf-8")) / 1024
+                result = {
+                    "files": count,
+                    "size_kb": size_kb,
+                    "total_ms": statistics.median(run["total_ms"] for run in runs),
+                    "parse_ms": statistics.median(run["parse_ms"] for run in runs),
+                }
+                result["parse_us_per_kb"] = result["parse_ms"] * 1000 / size_kb
+                results.append(result)
+                print(
+                    f"  {count:>8}{size_kb:>10,.0f}{result['total_ms']:>11.1f}"
+                    f"{result['parse_ms']:>11.1f}{result['parse_us_per_kb']:>13.1f}"
+                )
+        finally:
+            gpu.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, nargs="+", default=[50, 100, 200], help="コード生成の応答のファイル数")
+    parser.add_argument("--provider", choices=["openai", "anthropic"], default="openai")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--max-growth", type=float, default=DEFAULT_MAX_GROWTH,
+        help="最も大きい応答の1KBあたりの解析時間が、最も小さい応答の何倍を超えたら回帰とするか",
+    )
+    args = parser.parse_args()
+
+    results = sorted(asyncio.run(run(args)), key=lambda result: result["size_kb"])
+    if len(results) < 2:
+        return
+    smallest, largest = results[0], results[-1]
+    growth = largest["parse_us_per_kb"] / max(smallest["parse_us_per_kb"], 1e-9)
+    if growth > args.max_growth:
+        print(
+            f"❌ 1KBあたりの解析時間が {smallest['files']}ファイルの{growth:.1f}倍になりました"
+            f"（{largest['files']}ファイル、許容 {args.max_growth:g}倍）"
+        )
+        sys.exit(1)
+    print(f"✅ 1KBあたりの解析時間: {largest['files']}ファイルは{smallest['files']}ファイルの{growth:.2f}倍（許容 {args.max_growth:g}倍）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+クラスごとのコールドスタートの内訳（LLMのクラスとメディアのクラス）
+
+RealworldAgentLLM と RealworldAgentMedia のそれぞれについて、新しいPythonプロセスで次の時間を計測する（--repeat 回の中央値）。
+
+    パッケージ      そのクラスのイメージにインストールするパッケージ（modal_app の LLM_PACKAGES / MEDIA_PACKAGES）のimport
+    modal_app       modal_app のimport（Modal のSDKとデコレーターの評価を含む）
+    スナップショット前  prepare_snapshot（@modal.enter(snap=True)。SDKのクライアント・テンプレート・パッケージのimportなど）
+    スナップショット後  load_models（@modal.enter(snap=False)。ログ・メトリクス・トレースの書き出し、文字起こしモデルなど）
+
+合計はメモリスナップショットを使わない場合の起動、復元後はスナップショットから復元したコンテナで実行する初期化
+（スナップショット後のみ。Modalによるメモリの復元の時間は含まない）。
+
+あわせて、初期化の後に読み込まれている重いモジュール（numpy・OpenCV・文字起こしモデルなど）と、
+イメージのパッケージ（依存パッケージを含む）がこの環境で占める大きさ（イメージの取得・展開の時間の目安）を表示する。
+インストールされていないパッケージは「未インストール」として計測から除く。
+Modal のコンテナの割り当て・イメージの取得は含まない（本番のコンテナの初期化の時間はトレースの container_init_ms で確認する）。
+
+実行方法（services/gpu-server で）:
+    python -m benchmarks.bench_cold_start
+    python -m benchmarks.bench_cold_start --repeat 5 --asr-backend faster-whisper
+"""
+
+import argparse
+import ast
+import importlib
+import importlib.metadata
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Set, Tuple
+
+MODAL_APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "modal_app.py")
+
+# 計測する構成 -> (初期化するクラス, イメージのパッケージの一覧の modal_app の変数名)
+# 「分割前」は1つのクラスが両方のイメージのパッケージを持ち、両方の初期化を行っていた構成に相当する
+SETUPS = {
+    "RealworldAgentLLM": (("RealworldAgentLLM",), ("LLM_PACKAGES",)),
+    "RealworldAgentMedia": (("RealworldAgentMedia",), ("MEDIA_PACKAGES",)),
+    "分割前（1つのクラス）": (("RealworldAgentLLM", "RealworldAgentMedia"), ("LLM_PACKAGES", "MEDIA_PACKAGES")),
+}
+
+# パッケージ名 -> import する名前（同じ場合は省略）
+IMPORT_NAMES = {
+    "Pillow": "PIL",
+    "opencv-python-headless": "cv2",
+    "faster-whisper": "faster_whisper",
+    "openai-whisper": "whisper",
+    "pyannote.audio": "pyannote.audio",
+    "scikit-learn": "sklearn",
+}
+
+# 初期化の後に読み込まれているかを確認するモジュール
+HEAVY_MODULES = ("numpy", "cv2", "faster_whisper", "ctranslate2", "torch", "whisperx", "PIL", "tiktoken", "openai", "anthropic")
+
+
+def image_packages(variables: Tuple[str, ...]) -> List[str]:
+    """modal_app.py の LLM_PACKAGES などのパッケージ名（バージョン指定を除く。modal_app は import しない）"""
+    with open(MODAL_APP_PATH, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    packages = []
+    for variable in variables:
+        node = next(
+            (node for node in tree.body if isinstance(node, ast.Assign) and any(getattr(target, "id", None) == variable for target in node.targets)),
+            None,
+        )
+        if node is None:
+            raise ValueError(f"{variable} が modal_app.py にありません")
+        packages.extend(re.split(r"[<>=!~\[]", spec)[0].strip() for spec in ast.literal_eval(node.value))
+    return packages
+
+
+def installed_size(packages: List[str]) -> float:
+    """パッケージと依存パッケージのこの環境でのインストール先の大きさ（MB。インストールされていないものは含めない）"""
+    seen: Set[str] = set()
+    total = 0
+    stack = list(packages)
+    while stack:
+        name = stack.pop()
+        key = re.sub(r"[-_.]+", "-", name).lower()
+        if key in seen:
+            continue
+        seen.add(key)
+        try:
+            distribution = importlib.metadata.distribution(name)
+        except importlib.metadata.PackageNotFoundError:
+            continue
+        for file in distribution.files or []:
+            path = file.locate()
+            if os.path.isfile(path):
+                total += os.path.getsize(path)
+        for requirement in distribution.requires or []:
+            # extras の依存（; extra == "..."）は含めない
+            if "extra ==" not in requirement:
+                stack.append(re.split(r"[\s<>=!~\[;(]", requirement, 1)[0])
+    return total / 1024 / 1024
+
+
+def child(setup: str, asr_backend: str) -> Dict[str, Any]:
+    """新しいプロセスで1回計測する（結果は標準出力にJSONで書く）"""
+    cls_names, variables = SETUPS[setup]
+    result: Dict[str, Any] = {"missing": []}
+
+    started_at = time.perf_counter()
+    for package in image_packages(variables):
+        try:
+            importlib.import_module(IMPORT_NAMES.get(package, package))
+        except ImportError:
+            result["missing"].append(package)
+    result["packages_ms"] = (time.perf_counter() - started_at) * 1000
+
+    started_at = time.perf_counter()
+    from benchmarks.local_gpu import LocalGPU
+    result["modal_app_ms"] = (time.perf_counter() - started_at) * 1000
+
+    started_at = time.perf_counter()
+    gpus = [LocalGPU({"ASR_BACKEND": asr_backend}, cls_name) for cls_name in cls_names]
+    enter_ms = (time.perf_counter() - started_at) * 1000
+    result["pre_snapshot_ms"] = sum(gpu.instance.startup.pre_snapshot_seconds for gpu in gpus) * 1000
+    result["post_snapshot_ms"] = enter_ms - result["pre_snapshot_ms"]
+    result["modules"] = [name for name in HEAVY_MODULES if name in sys.modules]
+    for gpu in gpus:
+        gpu.shutdown()
+    return result
+
+
+def run_child(setup: str, asr_backend: str) -> Dict[str, Any]:
+    command = [sys.executable, "-W", "ignore", "-m", "benchmarks.bench_cold_start", "--child", setup, "--asr-backend", asr_backend]
+    output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run(args):
+    print(f"新しいプロセスで{args.repeat}回ずつ計測した中央値（ASR_BACKEND={args.asr_backend}）")
+    print(
+        f"  {'構成':<22}{'パッケージ':>12}{'modal_app':>12}{'スナップショット前':>12}{'スナップショット後':>12}"
+        f"{'合計':>10}{'復元後':>10}{'サイズ(MB)':>12}  読み込まれた重いモジュール"
+    )
+    for setup, (_, variables) in SETUPS.items():
+        runs = [run_child(setup, args.asr_backend) for _ in range(args.repeat)]
+        timings = {
+            key: statistics.median(result[key] for result in runs)
+            for key in ("packages_ms", "modal_app_ms", "pre_snapshot_ms", "post_snapshot_ms")
+        }
+        size_mb = installed_size(image_packages(variables))
+        print(
+            f"  {setup:<22}{timings['packages_ms']:>10.0f}ms{timings['modal_app_ms']:>10.0f}ms"
+            f"{timings['pre_snapshot_ms']:>10.0f}ms{timings['post_snapshot_ms']:>10.0f}ms"
+            f"{sum(timings.values()):>8.0f}ms{timings['post_snapshot_ms']:>8.0f}ms{size_mb:>12.0f}  {', '.join(runs[-1]['modules']) or '-'}"
+        )
+        if runs[-1]["missing"]:
+            print(f"  {'':<22}未インストール: {', '.join(runs[-1]['missing'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3, help="クラスごとのプロセスの起動回数")
+    parser.add_argument("--asr-backend", default="none", help="RealworldAgentMedia の初期化で読み込む文字起こしモデル（ASR_BACKEND）")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(child(args.child, args.asr_backend)))
+        return
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
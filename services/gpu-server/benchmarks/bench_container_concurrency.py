@@ -0,0 +1,283 @@
+"""
+コンテナ内の同時実行（modal.concurrent）の負荷試験（スタブプロバイダー）
+
+Modal のオートスケーラーを模したディスパッチャーで、バースト的なリクエストを RealworldAgentLLM のコンテナに割り当てる。
+コンテナはこのプロセスで初期化した RealworldAgentLLM（LocalGPU）で、仕様書生成・コード生成を
+ローカルのスタブプロバイダーに向けて実際に実行する。コンテナの起動には --cold-start-seconds の遅延を入れる。
+
+スケジューリングの模擬:
+    - リクエストは到着順に待ち行列に入り、起動済みで処理中の入力が max_inputs 未満のコンテナ（最も空いているもの）に割り当てる
+    - 必要なコンテナ数は ceil((処理中 + 待ち) / target_inputs)。足りなければコンテナを起動する（起動中の分も数える）
+    - 処理中の入力がないまま --idle-timeout-seconds が経ったコンテナは停止する
+
+--max-inputs ごと（1 は同時実行なし = 変更前）に、起動したコンテナの数（コールドスタート）、同時に動いたコンテナの最大数、
+コンテナの稼働時間の合計（コストの目安）、レイテンシ（p50 / p95 / p99、到着から応答まで）を表示する。
+
+実行方法（services/gpu-server で）:
+    python -m benchmarks.bench_container_concurrency
+    python -m benchmarks.bench_container_concurrency --max-inputs 1 4 16 --burst-size 32 --cold-start-seconds 5
+"""
+
+import argparse
+import asyncio
+import math
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from benchmarks.bench_endpoints import make_responder, percentile
+from benchmarks.corpus import make_session
+from benchmarks.local_gpu import LocalGPU
+from benchmarks.stub_provider import StubConfig, StubProviderServer
+
+
+@dataclass
+class Container:
+    """模擬するコンテナ（起動中は gpu が None）"""
+
+    index: int
+    started_at: float
+    gpu: Optional[LocalGPU] = None
+    inflight: int = 0
+    idle_since: float = 0.0
+    stopped_at: Optional[float] = None
+
+
+@dataclass
+class Pending:
+    """割り当てを待つリクエスト"""
+
+    call: Callable[[LocalGPU], Any]
+    assigned: asyncio.Future = field(default_factory=lambda: asyncio.get_running_loop().create_future())
+
+
+class Fleet:
+    """
+    Modal のオートスケーラーを模したコンテナ群
+
+    Args:
+        max_inputs: 1つのコンテナで同時に処理する入力の上限
+        target_inputs: コンテナ数を決めるときのコンテナあたりの入力数
+        cold_start_seconds: コンテナの起動にかかる時間
+        idle_timeout_seconds: 処理中の入力がないコンテナを停止するまでの時間
+        env: コンテナ（LocalGPU）に設定する環境変数
+    """
+
+    def __init__(self, max_inputs: int, target_inputs: int, cold_start_seconds: float, idle_timeout_seconds: float, env: Dict[str, str]):
+        self.max_inputs = max_inputs
+        self.target_inputs = target_inputs
+        self.cold_start_seconds = cold_start_seconds
+        self.idle_timeout_seconds = idle_timeout_seconds
+        self.env = env
+        self.containers: List[Container] = []
+        self.queue: List[Pending] = []
+        self.peak_containers = 0
+        self._reaper: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> List[Container]:
+        return [container for container in self.containers if container.stopped_at is None]
+
+    async def start(self):
+        self._reaper = asyncio.create_task(self._reap())
+
+    async def stop(self):
+        self._reaper.cancel()
+        for container in self.running:
+            await self._stop(container)
+
+    async def submit(self, call: Callable[[LocalGPU], Any]) -> Tuple[Any, float]:
+        """空いているコンテナで call を実行し、(結果, 割り当てまでの待ち時間) を返す"""
+        queued_at = time.perf_counter()
+        pending = Pending(call)
+        self.queue.append(pending)
+        self._dispatch()
+        container = await pending.assigned
+        waited = time.perf_counter() - queued_at
+        try:
+            return await call(container.gpu), waited
+        finally:
+            container.inflight -= 1
+            if container.inflight == 0:
+                container.idle_since = time.perf_counter()
+            self._dispatch()
+
+    def _dispatch(self):
+        while self.queue:
+            ready = [c for c in self.running if c.gpu is not None and c.inflight < self.max_inputs]
+            if not ready:
+                break
+            container = min(ready, key=lambda c: c.inflight)
+            container.inflight += 1
+            self.queue.pop(0).assigned.set_result(container)
+        self._scale()
+
+    def _scale(self):
+        demand = sum(c.inflight for c in self.running) + len(self.queue)
+        desired = math.ceil(demand / self.target_inputs)
+        for _ in range(desired - len(self.running)):
+            container = Container(index=len(self.containers), started_at=time.perf_counter())
+            self.containers.append(container)
+            asyncio.create_task(self._boot(container))
+        self.peak_containers = max(self.peak_containers, len(self.running))
+
+    async def _boot(self, container: Container):
+        await asyncio.sleep(self.cold_start_seconds)
+        container.gpu = await asyncio.to_thread(LocalGPU, self.env)
+        container.idle_since = time.perf_counter()
+        self._dispatch()
+
+    async def _reap(self):
+        while True:
+            await asyncio.sleep(0.1)
+            now = time.perf_counter()
+            for container in self.running:
+                if container.gpu is not None and container.inflight == 0 and now - container.idle_since >= self.idle_timeout_seconds:
+                    await self._stop(container)
+
+    async def _stop(self, container: Container):
+        container.stopped_at = time.perf_counter()
+        if container.gpu is not None:
+            await asyncio.to_thread(container.gpu.shutdown)
+
+    def container_seconds(self) -> float:
+        now = time.perf_counter()
+        return sum((c.stopped_at or now) - c.started_at for c in self.containers)
+
+
+def make_arrivals(args) -> List[float]:
+    """到着時刻（秒）: 一定の割合のポアソン到着 + 一定間隔のバースト"""
+    rng = random.Random(args.seed)
+    duration = args.bursts * args.burst_interval
+    arrivals = []
+    t = rng.expovariate(args.base_rate) if args.base_rate > 0 else duration
+    while t < duration:
+        arrivals.append(t)
+        t += rng.expovariate(args.base_rate)
+    for burst in range(args.bursts):
+        start = burst * args.burst_interval + args.burst_interval / 2
+        arrivals.extend(start + rng.uniform(0, args.burst_window) for _ in range(args.burst_size))
+    return sorted(arrivals)
+
+
+def make_calls(transcriptions: int) -> List[Tuple[str, Callable[[LocalGPU], Any]]]:
+    """リクエストの種類（仕様書生成・コード生成を交互に送る）"""
+    session = make_session(transcriptions)
+    context = {"transcriptions": session["transcriptions"], "photos": session["photos"], "use_cache": False}
+    code_request = {
+        "prompt": "決済とログインを備えたAPIサーバーを作成してください",
+        "context": session,
+        "language": "python",
+        "framework": "FastAPI",
+        "use_cache": False,
+    }
+    return [
+        ("generate_specification", lambda gpu: gpu.generate_specification.remote.aio(context)),
+        ("generate_code", lambda gpu: gpu.generate_code.remote.aio(code_request)),
+    ]
+
+
+async def run_mode(args, max_inputs: int, env: Dict[str, str]) -> Dict[str, Any]:
+    target_inputs = max(1, round(max_inputs * args.target_ratio))
+    fleet = Fleet(max_inputs, target_inputs, args.cold_start_seconds, args.idle_timeout_seconds, env)
+    calls = make_calls(args.transcriptions)
+    latencies: List[float] = []
+    waits: List[float] = []
+    errors = 0
+
+    async def one(delay: float, index: int):
+        nonlocal errors
+        await asyncio.sleep(delay)
+        started_at = time.perf_counter()
+        try:
+            _, waited = await fleet.submit(calls[index % len(calls)][1])
+        except Exception:
+            errors += 1
+            return
+        latencies.append(time.perf_counter() - started_at)
+        waits.append(waited)
+
+    arrivals = make_arrivals(args)
+    await fleet.start()
+    try:
+        await asyncio.gather(*(one(t, i) for i, t in enumerate(arrivals)))
+    finally:
+        await fleet.stop()
+
+    latencies.sort()
+    waits.sort()
+    return {
+        "max_inputs": max_inputs,
+        "target_inputs": target_inputs,
+        "requests": len(arrivals),
+        "cold_starts": len(fleet.containers),
+        "peak_containers": fleet.peak_containers,
+        "container_seconds": round(fleet.container_seconds(), 1),
+        "p50_s": percentile(latencies, 0.50),
+        "p95_s": percentile(latencies, 0.95),
+        "p99_s": percentile(latencies, 0.99),
+        "wait_p95_s": percentile(waits, 0.95),
+        "errors": errors,
+    }
+
+
+async def run(args):
+    stub_config = StubConfig(
+        latency_ms=args.latency_ms,
+        tokens_per_second=args.tokens_per_second,
+        respond=make_responder(args.code_files),
+    )
+    with StubProviderServer(stub_config) as server:
+        env = {
+            "OPENAI_BASE_URL": server.openai_base_url,
+            "ANTHROPIC_BASE_URL": server.anthropic_base_url,
+        }
+        # トークナイザーなどの読み込みを計測から除く
+        warmup = LocalGPU(env)
+        for _, call in make_calls(args.transcriptions):
+            await call(warmup)
+        warmup.shutdown()
+
+        print(
+            f"到着: {args.base_rate} req/s + {args.burst_interval:.0f}秒ごとに{args.burst_size}件のバースト（{args.burst_window}秒間）× {args.bursts}、"
+            f"コールドスタート {args.cold_start_seconds}秒、アイドル停止 {args.idle_timeout_seconds}秒"
+        )
+        print(
+            f"  {'max_inputs':>10}{'target':>8}{'件数':>6}{'起動数':>8}{'最大数':>8}{'稼働(秒)':>10}"
+            f"{'p50':>9}{'p95':>9}{'p99':>9}{'待ちp95':>10}{'エラー':>6}"
+        )
+        for max_inputs in args.max_inputs:
+            result = await run_mode(args, max_inputs, env)
+            latencies = "".join(
+                f"{result[key]:>8.2f}s" if result[key] is not None else f"{'-':>9}"
+                for key in ("p50_s", "p95_s", "p99_s", "wait_p95_s")
+            )
+            print(
+                f"  {result['max_inputs']:>10}{result['target_inputs']:>8}{result['requests']:>6}{result['cold_starts']:>8}"
+                f"{result['peak_containers']:>8}{result['container_seconds']:>10.1f}{latencies} {result['errors']:>6}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-inputs", type=int, nargs="+", default=[1, 16], help="コンテナあたりの同時入力数（1は同時実行なし）")
+    parser.add_argument("--target-ratio", type=float, default=0.75, help="target_inputs = max_inputs × この値（LLM_TARGET_INPUTS の既定値と同じ比）")
+    parser.add_argument("--base-rate", type=float, default=2.0, help="バースト以外の到着の割合（req/s）")
+    parser.add_argument("--burst-size", type=int, default=24, help="1回のバーストのリクエスト数")
+    parser.add_argument("--burst-window", type=float, default=1.0, help="1回のバーストのリクエストが到着する時間（秒）")
+    parser.add_argument("--burst-interval", type=float, default=8.0, help="バーストの間隔（秒）")
+    parser.add_argument("--bursts", type=int, default=3)
+    parser.add_argument("--cold-start-seconds", type=float, default=3.0, help="コンテナの起動時間（実際は20〜60秒）")
+    parser.add_argument("--idle-timeout-seconds", type=float, default=4.0, help="処理中の入力がないコンテナを停止するまでの時間")
+    parser.add_argument("--latency-ms", type=float, default=500.0, help="スタブの最初のトークンまでの遅延")
+    parser.add_argument("--tokens-per-second", type=float, default=4000.0, help="スタブの出力トークンの生成速度")
+    parser.add_argument("--code-files", type=int, default=10, help="コード生成の応答に含めるファイル数")
+    parser.add_argument("--transcriptions", type=int, default=200, help="コンテキストの文字起こしの件数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
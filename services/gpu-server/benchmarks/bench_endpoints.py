@@ -0,0 +1,275 @@
+"""
+Webエンドポイントのエンドツーエンドのベンチマーク（スタブプロバイダー）
+
+ローカルのスタブプロバイダー（OpenAI / Anthropic 形式）に向けた RealworldAgentLLM をこのプロセスで初期化し、
+fastapi_app の /generate-spec・/api/generate-code・/api/analyze-image を同時実行数ごとに呼び出して、
+スループットとレイテンシ（p50 / p95 / p99）を計測する。
+.remote の呼び出しはこのプロセスのインスタンスのメソッドを実行する（入力・出力はModalと同様にpickleで往復させる）。
+Modal の入力の待ち時間・コールドスタートは含まない。
+
+結果はJSONのベースラインと比較し、p95 が --tolerance の割合を超えて悪化した場合・スループットが下がった場合・
+エラー率が上がった場合は終了コード1で終了する。ベースラインはスタブと負荷の設定が同じ場合だけ比較する。
+
+実行方法（services/gpu-server で）:
+    python -m benchmarks.bench_endpoints --concurrency 1 4 16 --requests 32
+    python -m benchmarks.bench_endpoints --update-baseline        # ベースラインを更新
+    python -m benchmarks.bench_endpoints --error-rate 0.05         # エラーを注入（SDKの再試行・フォールバックを含めて計測）
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+
+import modal_app
+from benchmarks.corpus import make_code_output, make_session
+from benchmarks.local_gpu import LocalGPU, local_remote
+from benchmarks.stub_provider import StubConfig, StubProviderServer
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baselines", "endpoints.json")
+
+# p95・スループットの悪化がこの割合を超えなければ回帰としない（--tolerance の既定値）
+DEFAULT_TOLERANCE = 0.2
+# エラー率はこの差を超えて上がった場合に回帰とする
+ERROR_RATE_MARGIN = 0.01
+
+SPECIFICATION_TEXT = """# 合成プロジェクト仕様書
+
+## 概要
+ベンチマーク用の仕様書
+
+## 要件
+### 機能要件
+- ログインと決済
+### 非機能要件
+- 応答時間は200ms以内
+
+## 技術詳細
+FastAPI と PostgreSQL
+
+## 実装手順
+1. API設計
+2. 実装
+
+## 備考
+なし
+"""
+
+IMAGE_ANALYSIS_TEXT = "ホワイトボードに決済処理の構成図が書かれている。APIサーバー、キュー、データベースの3つの箱が矢印で結ばれている。"
+
+
+def make_responder(code_files: int) -> Callable[[str, Dict[str, Any]], str]:
+    """リクエストの内容（画像・システムメッセージの有無）に応じて画像分析・コード生成・仕様書の応答を返す"""
+    code_text = make_code_output(code_files)
+
+    def respond(provider: str, body: Dict[str, Any]) -> str:
+        messages = body.get("messages", [])
+        content = messages[-1].get("content") if messages else None
+        if isinstance(content, list) and any(block.get("type") in ("image", "image_url") for block in content):
+            return IMAGE_ANALYSIS_TEXT
+        # コード生成は出力形式のテンプレートをシステムメッセージで送る
+        if body.get("system") or any(message.get("role") == "system" for message in messages):
+            return code_text
+        return SPECIFICATION_TEXT
+
+    return respond
+
+
+def make_image(width: int = 1600, height: int = 1200) -> bytes:
+    """前処理（縮小・再圧縮）の対象になる大きさの写真相当のJPEG"""
+    from PIL import Image
+
+    image = Image.effect_noise((width, height), 48).convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=92)
+    return buffer.getvalue()
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """最近接順位法のパーセンタイル（valuesは昇順）"""
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, int(round(q * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def make_endpoints(transcriptions: int) -> Dict[str, Callable[[httpx.AsyncClient], Any]]:
+    """計測するエンドポイント（名前 -> リクエストを送るコルーチン関数）"""
+    session = make_session(transcriptions)
+    spec_body = {"context": {
+        "transcriptions": session["transcriptions"],
+        "photos": session["photos"],
+        "use_cache": False,
+    }}
+    code_body = {
+        "prompt": "決済とログインを備えたAPIサーバーを作成してください",
+        "context": session,
+        "language": "python",
+        "framework": "FastAPI",
+        "use_cache": False,
+    }
+    image = make_image()
+
+    return {
+        "generate_specification": lambda client: client.post("/generate-spec", json=spec_body),
+        "generate_code": lambda client: client.post("/api/generate-code", json=code_body),
+        "analyze_image": lambda client: client.post(
+            "/api/analyze-image", files={"image": ("photo.jpg", image, "image/jpeg")}
+        ),
+    }
+
+
+async def _run_level(client: httpx.AsyncClient, send: Callable, concurrency: int, total: int) -> Dict[str, Any]:
+    """同時実行数concurrencyでtotal件のリクエストを送る"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors = 0
+
+    async def one():
+        nonlocal errors
+        async with semaphore:
+            started_at = time.perf_counter()
+            response = await send(client)
+            if response.status_code == 200:
+                latencies.append((time.perf_counter() - started_at) * 1000)
+            else:
+                errors += 1
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    elapsed = time.perf_counter() - started_at
+
+    latencies.sort()
+
+    def rounded(value: Optional[float]) -> Optional[float]:
+        return round(value, 1) if value is not None else None
+
+    return {
+        "throughput": round(len(latencies) / elapsed, 2),
+        "p50_ms": rounded(percentile(latencies, 0.50)),
+        "p95_ms": rounded(percentile(latencies, 0.95)),
+        "p99_ms": rounded(percentile(latencies, 0.99)),
+        "error_rate": round(errors / total, 3),
+    }
+
+
+def compare(results: Dict[str, Dict[str, Dict[str, Any]]], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """ベースラインより悪化した項目の説明（悪化がなければ空）"""
+    regressions = []
+    for endpoint, levels in results.items():
+        for level, current in levels.items():
+            base = baseline["results"].get(endpoint, {}).get(level)
+            if not base:
+                continue
+            label = f"{endpoint}（同時実行 {level}）"
+            if current["p95_ms"] is not None and base["p95_ms"] and current["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+                regressions.append(f"{label}: p95 {base['p95_ms']:.1f}ms → {current['p95_ms']:.1f}ms")
+            if current["throughput"] < base["throughput"] * (1 - tolerance):
+                regressions.append(f"{label}: スループット {base['throughput']:.2f} → {current['throughput']:.2f} req/s")
+            if current["error_rate"] > base["error_rate"] + ERROR_RATE_MARGIN:
+                regressions.append(f"{label}: エラー率 {base['error_rate']:.1%} → {current['error_rate']:.1%}")
+    return regressions
+
+
+async def run(settings: Dict[str, Any], levels: List[int]) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    stub_config = StubConfig(
+        latency_ms=settings["latency_ms"],
+        tokens_per_second=settings["tokens_per_second"],
+        error_rate=settings["error_rate"],
+        respond=make_responder(settings["code_files"]),
+    )
+    results: Dict[str, Dict[str, Dict[str, Any]]] = {}
+
+    with StubProviderServer(stub_config) as server:
+        gpu = LocalGPU({
+            "OPENAI_BASE_URL": server.openai_base_url,
+            "ANTHROPIC_BASE_URL": server.anthropic_base_url,
+            "PRIMARY_LLM_PROVIDER": settings["provider"],
+        })
+        try:
+            with local_remote(gpu):
+                web_app = modal_app.fastapi_app.get_raw_f()()
+                transport = httpx.ASGITransport(app=web_app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+                    for endpoint, send in make_endpoints(settings["transcriptions"]).items():
+                        # 接続の確立・トークナイザーの読み込みなどを計測から除く
+                        await send(client)
+                        print(f"[{endpoint}]")
+                        print(f"  {'同時実行':>8}{'req/s':>10}{'p50':>11}{'p95':>11}{'p99':>11}{'エラー':>9}")
+                        results[endpoint] = {}
+                        for level in levels:
+                            total = max(settings["requests"], level * 2)
+                            result = await _run_level(client, send, level, total)
+                            results[endpoint][str(level)] = result
+                            latencies = "".join(
+                                f"{result[key]:>9.1f}ms" if result[key] is not None else f"{'-':>11}"
+                                for key in ("p50_ms", "p95_ms", "p99_ms")
+                            )
+                            print(f"  {level:>8}{result['throughput']:>10.2f}{latencies}{result['error_rate']:>9.1%}")
+        finally:
+            gpu.shutdown()
+
+        print(f"スタブ: {server.counters['requests']}リクエスト（エラー注入 {server.counters['errors']}件）")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=32, help="各同時実行数での最小リクエスト数")
+    parser.add_argument("--provider", choices=["openai", "anthropic"], default="openai", help="プライマリのプロバイダー")
+    parser.add_argument("--latency-ms", type=float, default=100.0, help="スタブの最初のトークンまでの遅延")
+    parser.add_argument("--tokens-per-second", type=float, default=4000.0, help="スタブの出力トークンの生成速度")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="スタブがエラーを返すリクエストの割合")
+    parser.add_argument("--code-files", type=int, default=10, help="コード生成の応答に含めるファイル数")
+    parser.add_argument("--transcriptions", type=int, default=500, help="仕様書・コード生成のコンテキストの文字起こしの件数")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="ベースラインのJSONファイル")
+    parser.add_argument("--update-baseline", action="store_true", help="比較せずに結果をベースラインとして保存する")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="回帰とみなす悪化の割合")
+    args = parser.parse_args()
+
+    settings = {
+        "provider": args.provider,
+        "latency_ms": args.latency_ms,
+        "tokens_per_second": args.tokens_per_second,
+        "error_rate": args.error_rate,
+        "code_files": args.code_files,
+        "transcriptions": args.transcriptions,
+        "requests": args.requests,
+    }
+    results = asyncio.run(run(settings, args.concurrency))
+
+    if args.update_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"settings": settings, "results": results}, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        print(f"ベースラインを保存しました: {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"ベースラインがありません（--update-baseline で作成）: {args.baseline}")
+        return
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline["settings"] != settings:
+        print("ベースラインと設定が異なるため比較しません（同じ設定で --update-baseline を実行してください）")
+        return
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"❌ ベースラインより悪化しました（許容 {args.tolerance:.0%}）:")
+        for regression in regressions:
+            print(f"  - {regression}")
+        sys.exit(1)
+    print(f"✅ ベースラインとの比較: 悪化なし（許容 {args.tolerance:.0%}）")
+
+
+if __name__ == "__main__":
+    main()
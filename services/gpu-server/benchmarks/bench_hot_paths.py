@@ -0,0 +1,223 @@
+"""
+リクエストごとに実行するプロンプトの構築・応答の解析のマイクロベンチマーク
+
+合成したセッション（文字起こしの件数ごと）とコード生成の応答（ファイル数・出力形式ごと）に対して、
+次の関数の処理時間（初回と、2回目以降の中央値）とピークメモリ（tracemalloc、Pythonの割り当てのみ）を計測する。
+
+    _build_specification_prompt  仕様書生成のプロンプト（文字起こし・写真の分析をトークン予算に詰め込む）
+    _build_code_generation_prompt  コード生成のプロンプト（仕様書の節・文字起こし・写真の分析）
+    _build_code_output  応答全体の解析（parse_code_output）とファイル・依存関係・手順・概要の取り出し
+    IncrementalCodeParser  ストリーミング時の逐次解析（STREAM_CHUNK_CHARS 文字ずつ渡す）
+
+応答の形式は heading（### ファイル: パス + コードフェンス）と fence（```言語:パス）の2つ。
+--output で結果をJSONに保存し、--compare で以前の結果との比を表示する（変更前後の比較用）。
+
+最も多いファイル数の応答で、IncrementalCodeParser の時間が _build_code_output（全体の解析）の
+--max-stream-ratio 倍を超えた場合は終了コード1で終わる（テキスト片ごとに受信済みの全体を処理し直す二乗時間の回帰の検出）。
+
+実行方法（services/gpu-server で）:
+    python -m benchmarks.bench_hot_paths --sessions 10 1000 100000 --files 1 100 500
+    python -m benchmarks.bench_hot_paths --output before.json
+    python -m benchmarks.bench_hot_paths --compare before.json --only code_output
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+from benchmarks.corpus import make_code_output, make_session
+from benchmarks.local_gpu import LocalGPU
+from code_output_parser import IncrementalCodeParser
+
+FORMATS = {"heading": 0.0, "fence": 1.0}  # 形式 -> make_code_output の alternate_ratio
+STREAM_CHUNK_CHARS = 64  # ストリーミングで1回に届くテキスト片の大きさ（数トークン分）
+# 逐次解析が全体の解析のこの倍数を超えたら回帰とする（--max-stream-ratio の既定値）。
+# 64文字ずつに分けて渡すだけで全体の解析と同程度かかるため、線形時間でも2〜3倍になる。二乗時間の場合は500ファイルで100倍を超える
+DEFAULT_MAX_STREAM_RATIO = 4.0
+USER_PROMPT = "決済とログインを備えたAPIサーバーを作成してください"
+
+
+@dataclass
+class Case:
+    """計測する関数と入力"""
+
+    function: str
+    size: str
+    run: Callable[[], Any]
+
+    @property
+    def key(self) -> str:
+        return f"{self.function} / {self.size}"
+
+
+def make_cases(gpu: LocalGPU, provider: str, sessions: List[int], file_counts: List[int], lines_per_file: int) -> List[Case]:
+    instance = gpu.instance
+    cases = []
+
+    for count in sessions:
+        session = make_session(count)
+        spec_context = {"transcriptions": session["transcriptions"], "photos": session["photos"]}
+        code_request = {"prompt": USER_PROMPT, "context": session, "language": "python", "framework": "FastAPI"}
+        size = f"{count:,}件"
+        cases.append(Case(
+            "_build_specification_prompt", size,
+            lambda context=spec_context: instance._build_specification_prompt(context, provider),
+        ))
+        cases.append(Case(
+            "_build_code_generation_prompt", size,
+            lambda request=code_request: instance._build_code_generation_prompt(request, provider),
+        ))
+
+    for count in file_counts:
+        for name, alternate_ratio in FORMATS.items():
+            text = make_code_output(count, lines_per_file=lines_per_file, alternate_ratio=alternate_ratio)
+            size = f"{count:,}ファイル {name}（{len(text) / 1024:,.0f}KB）"
+            cases.append(Case(
+                "_build_code_output", size,
+                lambda text=text: instance._build_code_output(text, "stub"),
+            ))
+            cases.append(Case(
+                "IncrementalCodeParser", size,
+                lambda text=text: stream_parse(text, instance._detect_language_from_path),
+            ))
+    return cases
+
+
+def stream_parse(text: str, detect_language: Callable[[str], str]) -> int:
+    """ストリーミング時と同じく STREAM_CHUNK_CHARS 文字ずつ解析し、ファイル数を返す"""
+    parser = IncrementalCodeParser(detect_language)
+    files = 0
+    for i in range(0, len(text), STREAM_CHUNK_CHARS):
+        files += sum(event["type"] == "file" for event in parser.feed(text[i:i + STREAM_CHUNK_CHARS]))
+    files += sum(event["type"] == "file" for event in parser.finish())
+    return files
+
+
+def measure(case: Case, repeat: int, max_seconds: float) -> Dict[str, float]:
+    """
+    初回の時間、2回目以降の中央値（repeat回、またはmax_secondsを超えるまで）、ピークメモリを計測
+
+    トークン数のキャッシュなどが効く前の初回と、効いた後の時間を分けて記録する。
+    ピークメモリは時間の計測とは別に tracemalloc を有効にして1回実行する（tracemalloc は処理を遅くするため）。
+    """
+    started_at = time.perf_counter()
+    case.run()
+    first_ms = (time.perf_counter() - started_at) * 1000
+
+    timings = []
+    deadline = time.perf_counter() + max_seconds
+    while len(timings) < repeat and (not timings or time.perf_counter() < deadline):
+        started_at = time.perf_counter()
+        case.run()
+        timings.append((time.perf_counter() - started_at) * 1000)
+
+    tracemalloc.start()
+    try:
+        case.run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "first_ms": round(first_ms, 3),
+        "median_ms": round(statistics.median(timings), 3),
+        "runs": len(timings),
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+
+def _ratio(current: float, previous: Optional[float]) -> str:
+    if not previous:
+        return ""
+    return f"{current / previous:>7.2f}x"
+
+
+def stream_regressions(results: Dict[str, Dict[str, float]], file_count: int, max_ratio: float) -> List[str]:
+    """file_count ファイルの応答で、逐次解析が全体の解析の max_ratio 倍を超えたものの説明（なければ空）"""
+    regressions = []
+    for key, result in results.items():
+        function, _, size = key.partition(" / ")
+        if function != "IncrementalCodeParser" or not size.startswith(f"{file_count:,}ファイル "):
+            continue
+        full = results.get(f"_build_code_output / {size}")
+        if full and result["median_ms"] > full["median_ms"] * max_ratio:
+            regressions.append(
+                f"{size}: IncrementalCodeParser {result['median_ms']:.1f}ms / _build_code_output {full['median_ms']:.1f}ms"
+                f" = {result['median_ms'] / full['median_ms']:.1f}倍"
+            )
+    return regressions
+
+
+def run(args) -> Dict[str, Dict[str, float]]:
+    gpu = LocalGPU()
+    try:
+        cases = make_cases(gpu, args.provider, args.sessions, args.files, args.lines_per_file)
+        if args.only:
+            cases = [case for case in cases if args.only in case.function]
+
+        previous: Dict[str, Dict[str, float]] = {}
+        if args.compare:
+            with open(args.compare, encoding="utf-8") as f:
+                previous = json.load(f)["results"]
+
+        print(f"プロバイダー: {args.provider}、2回目以降は最大{args.repeat}回の中央値（--compare の比は 今回 / 以前）")
+        header = f"  {'関数':<32}{'入力':<30}{'初回(ms)':>11}{'中央値(ms)':>12}{'ピーク(KB)':>12}"
+        print(header + ("     時間比   メモリ比" if previous else ""))
+
+        results = {}
+        for case in cases:
+            result = measure(case, args.repeat, args.max_seconds)
+            results[case.key] = result
+            line = (
+                f"  {case.function:<32}{case.size:<30}{result['first_ms']:>11.2f}"
+                f"{result['median_ms']:>12.2f}{result['peak_kb']:>12,.0f}"
+            )
+            before = previous.get(case.key)
+            if before:
+                line += f"  {_ratio(result['median_ms'], before['median_ms'])}  {_ratio(result['peak_kb'], before['peak_kb'])}"
+            print(line)
+        return results
+    finally:
+        gpu.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, nargs="+", default=[10, 100, 1000, 10000, 100000], help="文字起こしの件数")
+    parser.add_argument("--files", type=int, nargs="+", default=[1, 10, 100, 500], help="コード生成の応答のファイル数")
+    parser.add_argument("--lines-per-file", type=int, default=40)
+    parser.add_argument("--provider", choices=["openai", "anthropic"], default="openai", help="トークン予算の計算に使うプロバイダー")
+    parser.add_argument("--repeat", type=int, default=5, help="2回目以降の実行回数の上限")
+    parser.add_argument("--max-seconds", type=float, default=2.0, help="1つの関数・入力の2回目以降の実行に使う時間の上限")
+    parser.add_argument("--only", help="関数名にこの文字列を含むものだけ計測する")
+    parser.add_argument("--output", help="結果を保存するJSONファイル")
+    parser.add_argument("--compare", help="比較する以前の結果（--output で保存したJSON）")
+    parser.add_argument(
+        "--max-stream-ratio", type=float, default=DEFAULT_MAX_STREAM_RATIO,
+        help="最も多いファイル数の応答で、逐次解析の時間が全体の解析の何倍を超えたら回帰とするか",
+    )
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.output:
+        settings = {key: getattr(args, key) for key in ("sessions", "files", "lines_per_file", "provider")}
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"settings": settings, "results": results}, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        print(f"結果を保存しました: {args.output}")
+
+    regressions = stream_regressions(results, max(args.files), args.max_stream_ratio)
+    if regressions:
+        print(f"❌ 逐次解析が全体の解析の{args.max_stream_ratio:g}倍を超えました:")
+        for regression in regressions:
+            print(f"  - {regression}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
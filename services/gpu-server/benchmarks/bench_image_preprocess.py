@@ -0,0 +1,98 @@
+"""
+画像前処理のベンチマーク
+
+スマートグラスやスマートフォンの写真に相当する合成画像（EXIF付きJPEG、PNGのスクリーンショット、透過PNGなど）を
+preprocess_image に通し、削減できたバイト数・画像トークン数と前処理時間を計測する。
+スレッド数ごとのスループットも比較する。
+
+実行方法（services/gpu-server で）:
+    python -m benchmarks.bench_image_preprocess --images 32 --workers 1 4
+"""
+
+import argparse
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+import numpy as np
+from PIL import Image
+
+from image_preprocessing import ImagePreprocessConfig, preprocess_image
+
+
+def _photo(rng: np.random.Generator, width: int, height: int) -> Image.Image:
+    x = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None, None]
+    color = rng.uniform(0.3, 1.0, size=3).astype(np.float32)
+    pixels = (x * 0.6 + y * 0.4) * color + rng.normal(0, 20, size=(height, width, 3)).astype(np.float32)
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+
+def make_samples(rng: np.random.Generator) -> List[Tuple[str, bytes]]:
+    """種類ごとの合成画像"""
+    samples = []
+
+    exif = Image.Exif()
+    exif[0x0112] = 6  # 90度回転
+    exif[0x010F] = "Smart Glasses"
+    buffer = io.BytesIO()
+    _photo(rng, 4032, 3024).save(buffer, format="JPEG", quality=92, exif=exif)
+    samples.append(("12MP JPEG（EXIF付き）", buffer.getvalue()))
+
+    buffer = io.BytesIO()
+    _photo(rng, 1920, 1080).save(buffer, format="JPEG", quality=95)
+    samples.append(("1080p JPEG", buffer.getvalue()))
+
+    buffer = io.BytesIO()
+    _photo(rng, 1280, 800).save(buffer, format="PNG")
+    samples.append(("PNG スクリーンショット", buffer.getvalue()))
+
+    buffer = io.BytesIO()
+    _photo(rng, 1600, 1200).convert("RGBA").save(buffer, format="PNG")
+    samples.append(("透過PNG", buffer.getvalue()))
+
+    buffer = io.BytesIO()
+    _photo(rng, 640, 480).save(buffer, format="JPEG", quality=80)
+    samples.append(("小さいJPEG", buffer.getvalue()))
+    return samples
+
+
+def run(images: int, worker_counts: List[int]):
+    config = ImagePreprocessConfig()
+    rng = np.random.default_rng(0)
+    samples = make_samples(rng)
+
+    print(f"最大 {config.max_pixels:,} ピクセル、目標 {config.target_bytes / 1024:.0f}KB")
+    print(f"  {'画像':<24}{'元サイズ':>10}{'前処理後':>10}{'形式':>12}{'トークン削減':>12}{'時間':>10}")
+    for label, data in samples:
+        prepared = preprocess_image(data, config)
+        report = prepared.report(config.upload_mbps)
+        print(
+            f"  {label:<24}{report['original_bytes'] / 1024:>8.0f}KB{report['bytes'] / 1024:>8.0f}KB"
+            f"{prepared.media_type.split('/')[1]:>12}{report.get('estimated_vision_tokens_saved', 0):>12}"
+            f"{report['preprocess_ms']:>8.0f}ms"
+        )
+
+    batch = [samples[i % len(samples)][1] for i in range(images)]
+    total_mb = sum(len(d) for d in batch) / 1024 / 1024
+    print(f"\n{images} 枚（合計 {total_mb:.0f}MB）のスループット")
+    for workers in worker_counts:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            started = time.perf_counter()
+            results = list(pool.map(lambda data: preprocess_image(data, config), batch))
+            seconds = time.perf_counter() - started
+        saved_mb = sum(r.original_bytes - len(r.data) for r in results) / 1024 / 1024
+        print(f"  {workers:>2} スレッド: {images / seconds:6.1f} 枚/秒（{saved_mb:.0f}MB 削減）")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=32)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4])
+    args = parser.parse_args()
+    run(args.images, args.workers)
+
+
+if __name__ == "__main__":
+    main()
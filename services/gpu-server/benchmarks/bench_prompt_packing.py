@@ -0,0 +1,76 @@
+"""
+プロンプトのトークン予算への詰め込み（prompt_packing）のベンチマーク
+
+合成した長いセッション（文字起こし・仕様書・写真の分析）を、セッションの長さごとに予算へ詰め込み、
+項目の作成・トークン数の計算・順位付けにかかる時間を計測する。
+同じセッションを2回目に詰め込む場合（トークン数のキャッシュが効く）の時間も表示する。
+
+tiktoken がインストールされていてエンコーディングを取得できる場合は、OpenAI向けは tiktoken で数える
+（取得できない場合は見積もりになる）。
+
+実行方法（services/gpu-server で）:
+    python -m benchmarks.bench_prompt_packing --sessions 100 1000 10000 50000 --budget 16000
+"""
+
+import argparse
+import time
+from typing import Any, Dict, List
+
+from benchmarks.corpus import make_session
+from prompt_packing import (
+    PromptBudgetConfig,
+    TokenCounter,
+    pack_context,
+    photo_items,
+    specification_items,
+    transcription_items,
+)
+
+def pack_once(session: Dict[str, Any], counter: TokenCounter, config: PromptBudgetConfig, query: str) -> Dict[str, Any]:
+    items = (
+        specification_items(session["specification"])
+        + transcription_items(session["transcriptions"], config.recency_half_life)
+        + photo_items(session["photos"], config.recency_half_life)
+    )
+    _, stats = pack_context(items, config.max_input_tokens, counter, query, config.recency_weight)
+    return stats
+
+
+def run(sizes: List[int], budget: int, query: str):
+    config = PromptBudgetConfig(max_input_tokens=budget)
+    print(f"予算: {budget:,}トークン、ユーザーの要求: {query}")
+    print(
+        f"  {'件数':>8}{'プロバイダー':>14}{'計算方法':>10}{'初回(ms)':>11}{'2回目(ms)':>11}"
+        f"{'選択':>8}{'トークン':>10}"
+    )
+    for size in sizes:
+        session = make_session(size)
+        for provider, model in (("openai", "gpt-4o"), ("anthropic", "claude-3-5-sonnet-20241022")):
+            # 計測ごとに新しいTokenCounterを使い、初回はトークン数のキャッシュがない状態にする
+            counter = TokenCounter(provider, model)
+
+            started = time.perf_counter()
+            stats = pack_once(session, counter, config, query)
+            cold_ms = (time.perf_counter() - started) * 1000
+
+            started = time.perf_counter()
+            pack_once(session, counter, config, query)
+            warm_ms = (time.perf_counter() - started) * 1000
+
+            print(
+                f"  {size:>8,}{provider:>14}{counter.method:>10}{cold_ms:>11.1f}{warm_ms:>11.1f}"
+                f"{stats['selected']:>8,}{stats['context_tokens']:>10,}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, nargs="+", default=[100, 1000, 10000, 50000], help="文字起こしの件数")
+    parser.add_argument("--budget", type=int, default=16000, help="コンテキストに使えるトークン数")
+    parser.add_argument("--query", default="決済APIを非同期で実装する", help="関連度の計算に使うユーザーの要求")
+    args = parser.parse_args()
+    run(args.sessions, args.budget, args.query)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+シーン変化検出のベンチマーク
+
+従来実装（全フレームをフル解像度でデコードし、前フレームのヒストグラムも毎回計算し直す逐次処理）と、
+scene_detection（ヒストグラムは1回だけ、縮小デコード + スレッドプール、類似度はNumPyで一括計算）の
+処理速度（フレーム/秒）を比較する。検出結果が従来実装と一致するかも確認する
+（縮小率1は一致する。2以上は近似で、SCENE_DECODE_REDUCTION で選んだときの速度と一致の度合いを確認する）。
+
+実行方法（services/gpu-server で）:
+    python -m benchmarks.bench_scene_detection --frames 2000 --width 1280 --height 720
+"""
+
+import argparse
+import time
+from typing import List
+
+import cv2
+import numpy as np
+
+from scene_detection import (
+    SceneDetectionConfig,
+    compute_histograms,
+    consecutive_similarities,
+    scene_change_indices,
+)
+
+
+def make_frames(count: int, width: int, height: int, scene_length: int, seed: int = 0) -> List[bytes]:
+    """シーンごとに色調が変わり、フレームごとに少し揺らぐJPEGフレーム列"""
+    rng = np.random.default_rng(seed)
+    frames = []
+    base = None
+    for i in range(count):
+        if i % scene_length == 0:
+            color = rng.integers(0, 256, size=3)
+            gradient = np.linspace(0, 1, width, dtype=np.float32)[None, :, None]
+            base = (color[None, None, :] * (0.4 + 0.6 * gradient)).astype(np.float32)
+            base = np.broadcast_to(base, (height, width, 3)).copy()
+            # 物体に相当する矩形
+            for _ in range(4):
+                x, y = rng.integers(0, width - 100), rng.integers(0, height - 100)
+                base[y:y + 100, x:x + 100] = rng.integers(0, 256, size=3)
+        noise = rng.normal(0, 6, size=(height // 8, width // 8, 3)).astype(np.float32)
+        noise = cv2.resize(noise, (width, height), interpolation=cv2.INTER_NEAREST)
+        frame = np.clip(base + noise + rng.normal(0, 3), 0, 255).astype(np.uint8)
+        ok, encoded = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
+        frames.append(encoded.tobytes())
+    return frames
+
+
+def legacy_detect(frames: List[bytes], threshold: float) -> List[int]:
+    """旧実装（modal_app の detect_scene_changes と同じ処理）"""
+    changes = []
+    prev_frame = None
+    for i, frame_data in enumerate(frames):
+        frame = cv2.imdecode(np.frombuffer(frame_data, np.uint8), cv2.IMREAD_COLOR)
+        if prev_frame is not None:
+            hist1 = cv2.calcHist([prev_frame], [0, 1, 2], None, [8, 8, 8], [0, 256, 0, 256, 0, 256])
+            hist2 = cv2.calcHist([frame], [0, 1, 2], None, [8, 8, 8], [0, 256, 0, 256, 0, 256])
+            cv2.normalize(hist1, hist1)
+            cv2.normalize(hist2, hist2)
+            if cv2.compareHist(hist1, hist2, cv2.HISTCMP_CORREL) < (1.0 - threshold):
+                changes.append(i)
+        prev_frame = frame
+    return changes
+
+
+def batched_detect(frames: List[bytes], threshold: float, config: SceneDetectionConfig) -> List[int]:
+    """新実装（modal_app の detect_scene_changes と同じ処理）"""
+    similarities = consecutive_similarities(compute_histograms(frames, config))
+    return scene_change_indices(similarities, threshold)
+
+
+def run(count: int, width: int, height: int, scene_length: int, threshold: float, reductions: List[int], workers: int):
+    print(f"フレーム生成中（{count} フレーム、{width}x{height}、{scene_length} フレームごとにシーン変化）...")
+    frames = make_frames(count, width, height, scene_length)
+    size_mb = sum(len(f) for f in frames) / 1024 / 1024
+    print(f"  合計 {size_mb:.1f}MB")
+
+    started = time.perf_counter()
+    expected = legacy_detect(frames, threshold)
+    legacy_seconds = time.perf_counter() - started
+
+    print(f"\n  {'実装':<24}{'フレーム/秒':>12}{'時間':>10}{'検出数':>8}  一致")
+    print(f"  {'legacy':<24}{count / legacy_seconds:>12.0f}{legacy_seconds:>9.2f}s{len(expected):>8}")
+
+    for reduction in reductions:
+        config = SceneDetectionConfig(decode_reduction=reduction, workers=workers)
+        started = time.perf_counter()
+        changes = batched_detect(frames, threshold, config)
+        seconds = time.perf_counter() - started
+        label = f"batched (1/{reduction}, {config.max_workers}スレッド)"
+        print(
+            f"  {label:<24}{count / seconds:>12.0f}{seconds:>9.2f}s{len(changes):>8}"
+            f"  {'✅' if changes == expected else '❌'}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=2000)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--scene-length", type=int, default=50, help="シーンが切り替わる間隔（フレーム数）")
+    parser.add_argument("--threshold", type=float, default=0.3)
+    parser.add_argument("--reductions", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--workers", type=int, default=0, help="スレッド数（0はCPU数）")
+    args = parser.parse_args()
+    run(args.frames, args.width, args.height, args.scene_length, args.threshold, args.reductions, args.workers)
+
+
+if __name__ == "__main__":
+    main()
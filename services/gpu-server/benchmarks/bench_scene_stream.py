@@ -0,0 +1,84 @@
+"""
+動画ファイルからのストリーミングシーン変化検出のベンチマーク
+
+長さの異なる合成動画（ffmpegのlavfiで生成）に対して stream_scene_changes を実行し、
+処理速度とPython側のピークメモリ（tracemalloc）を計測する。
+ピークメモリが動画の長さによらず一定であることを確認する。
+
+実行方法（services/gpu-server で、ffmpeg / ffprobe が必要）:
+    python -m benchmarks.bench_scene_stream --durations 60 300 900 --sample-fps 2
+"""
+
+import argparse
+import os
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from typing import List
+
+from scene_detection import SceneDetectionConfig, stream_scene_changes
+
+SCENE_COLORS = ["red", "blue", "green", "yellow", "purple", "orange", "gray", "white"]
+
+
+def make_video(path: str, duration: int, scene_seconds: int, width: int, height: int):
+    """scene_seconds ごとに背景色が切り替わり、テストパターンが重なる動画を生成"""
+    scenes = max(1, duration // scene_seconds)
+    inputs: List[str] = []
+    filters = []
+    for i in range(scenes):
+        color = SCENE_COLORS[i % len(SCENE_COLORS)]
+        inputs += ["-f", "lavfi", "-i", f"color=c={color}:s={width}x{height}:r=30:d={scene_seconds}"]
+        filters.append(f"[{i}]")
+    inputs += ["-f", "lavfi", "-i", f"testsrc2=s={width // 4}x{height // 4}:r=30:d={scenes * scene_seconds}"]
+    graph = f"{''.join(filters)}concat=n={scenes}:v=1:a=0[bg];[bg][{scenes}]overlay=20:20"
+    subprocess.run(
+        ["ffmpeg", "-v", "error", "-y", *inputs, "-filter_complex", graph,
+         "-c:v", "libx264", "-preset", "ultrafast", path],
+        check=True,
+    )
+
+
+def run(durations: List[int], scene_seconds: int, width: int, height: int, sample_fps: float, threshold: float):
+    config = SceneDetectionConfig(sample_fps=sample_fps)
+    print(f"{width}x{height}、{scene_seconds}秒ごとにシーン変化、{sample_fps} fps でサンプリング")
+    print(f"  {'長さ':>8}{'ファイル':>10}{'フレーム':>10}{'検出数':>8}{'フレーム/秒':>12}{'ピークメモリ':>14}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        for duration in durations:
+            path = os.path.join(directory, f"video_{duration}.mp4")
+            make_video(path, duration, scene_seconds, width, height)
+            size_mb = os.path.getsize(path) / 1024 / 1024
+
+            tracemalloc.start()
+            started = time.perf_counter()
+            done = None
+            for event in stream_scene_changes(path, threshold, config):
+                if event["type"] == "done":
+                    done = event
+            seconds = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            print(
+                f"  {duration:>7}s{size_mb:>8.1f}MB{done['frames']:>10}{done['changes']:>8}"
+                f"{done['frames'] / seconds:>12.0f}{peak / 1024 / 1024:>12.1f}MB"
+            )
+            os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--durations", type=int, nargs="+", default=[60, 300, 900], help="動画の長さ（秒）")
+    parser.add_argument("--scene-seconds", type=int, default=10, help="シーンが切り替わる間隔（秒）")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--sample-fps", type=float, default=2.0)
+    parser.add_argument("--threshold", type=float, default=0.3)
+    args = parser.parse_args()
+    run(args.durations, args.scene_seconds, args.width, args.height, args.sample_fps, args.threshold)
+
+
+if __name__ == "__main__":
+    main()
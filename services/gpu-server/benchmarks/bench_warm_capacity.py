@@ -0,0 +1,221 @@
+"""
+待機コンテナ数の調整（adjust_warm_capacity）とメモリスナップショットのシミュレーション
+
+時間帯で到着率が変わる数日分のリクエストを、Modalのコンテナの起動・停止を模したモデルで1秒刻みに処理し、
+次の方式ごとにコールドスタートを待ったリクエストの数、待ち時間、起動したコンテナの数、コンテナの稼働時間の合計（費用の目安）を比較する。
+
+    なし                  待機コンテナなし、起動は --cold-start-seconds（変更前）
+    スナップショット        待機コンテナなし、起動は --restore-seconds（メモリスナップショットから復元）
+    スナップショット + 常時N  min_containers を --always-warm に固定
+    スナップショット + 調整   warm_capacity の update_history / plan_warm_containers で --interval-minutes ごとに min_containers を決める
+
+コンテナのモデル:
+    - リクエストは処理中の入力が max_inputs 未満のコンテナに割り当て、なければ起動中のコンテナ（なければ新しく起動したもの）を待つ
+    - 処理中の入力が target_inputs を超えたらコンテナを追加する（割り当ては既存のコンテナのまま）
+    - 処理中の入力がないまま --scaledown-seconds が経ったコンテナは、待機コンテナ数を下回らない範囲で停止する
+    - 停止したコンテナの集計は、実際のメトリクスと同じく METRICS_STALE_SECONDS の間は調整に使われる
+
+実行方法（services/gpu-server で）:
+    python -m benchmarks.bench_warm_capacity
+    python -m benchmarks.bench_warm_capacity --schedule "mon-fri 09:00-19:00=1" --peak-rate 60 --days 7
+"""
+
+import argparse
+import random
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from benchmarks.bench_endpoints import percentile
+from cold_start import START_COLD, START_RESTORED
+from warm_capacity import ContainerUsage, WarmCapacityConfig, parse_schedule, plan_warm_containers, update_history
+
+# 時間帯（0〜23時）ごとの到着率（--peak-rate に対する割合）。平日の業務時間に多く、夜間はまれに届く
+WEEKDAY_PROFILE = (
+    0.02, 0.0, 0.0, 0.0, 0.0, 0.0, 0.02, 0.05, 0.3, 0.8, 1.0, 0.9,
+    0.5, 0.9, 1.0, 1.0, 0.9, 0.7, 0.4, 0.2, 0.1, 0.08, 0.05, 0.03,
+)
+WEEKEND_RATIO = 0.15
+
+# 2026-10-19（月曜）0時（日本時間）。スケジュールの曜日をシミュレーションの日に合わせる
+START_TIMESTAMP = 1792335600.0
+
+
+@dataclass
+class SimContainer:
+    """模擬するコンテナ"""
+
+    started_at: float
+    ready_at: float
+    restored: bool
+    init_seconds: float
+    inflight: List[float] = field(default_factory=list)  # 処理中の入力の終了時刻
+    assigned: int = 0  # 起動を待っている入力の数
+    idle_since: float = 0.0
+    stopped_at: Optional[float] = None
+    inputs: int = 0
+    busy_seconds: float = 0.0
+
+
+@dataclass(frozen=True)
+class Policy:
+    name: str
+    boot_seconds: float
+    restored: bool
+    always_warm: int = 0
+    adjust: bool = False
+
+
+def make_arrivals(args, rng: random.Random) -> List[float]:
+    """時間帯ごとの到着率のポアソン到着（秒。シミュレーションの開始からの時刻）"""
+    arrivals = []
+    for hour in range(args.days * 24):
+        weekday = (hour // 24) % 7 < 5
+        rate = args.peak_rate * WEEKDAY_PROFILE[hour % 24] * (1.0 if weekday else WEEKEND_RATIO) / 3600
+        if rate <= 0:
+            continue
+        t = hour * 3600 + rng.expovariate(rate)
+        while t < (hour + 1) * 3600:
+            arrivals.append(t)
+            t += rng.expovariate(rate)
+    return arrivals
+
+
+def simulate(args, policy: Policy, arrivals: List[float], service_times: List[float]) -> Dict[str, Any]:
+    config = WarmCapacityConfig(
+        window_minutes=args.window_minutes,
+        utc_offset_hours=9.0,
+        schedule=parse_schedule(args.schedule),
+        max_containers=args.max_warm,
+        inputs_per_container=args.target_inputs,
+    )
+    containers: List[SimContainer] = []
+    running: List[SimContainer] = []
+    history: Optional[Dict[str, Any]] = None
+    warm = policy.always_warm
+    waits: List[float] = []
+    cold_waits = 0
+    next_arrival = 0
+    duration = args.days * 86400
+
+    def boot(now: float) -> SimContainer:
+        container = SimContainer(now, now + policy.boot_seconds, policy.restored, policy.boot_seconds)
+        containers.append(container)
+        running.append(container)
+        return container
+
+    for second in range(duration):
+        now = float(second)
+
+        # 処理の終了と起動の完了
+        for container in running:
+            if container.inflight and container.inflight[0] <= now:
+                container.inflight = [end for end in container.inflight if end > now]
+                if not container.inflight:
+                    container.idle_since = now
+            if container.assigned and container.ready_at <= now:
+                container.assigned = 0
+
+        # 待機コンテナ数の調整（メトリクスは停止から METRICS_STALE_SECONDS の間は残る）
+        if policy.adjust and second % (args.interval_minutes * 60) == 0:
+            usage = {
+                str(index): ContainerUsage(c.inputs, c.busy_seconds, START_RESTORED if c.restored else START_COLD, c.init_seconds)
+                for index, c in enumerate(containers)
+                if c.ready_at <= now and (c.stopped_at is None or now - c.stopped_at <= args.stale_seconds)
+            }
+            timestamp = START_TIMESTAMP + now
+            history = update_history(history, usage, timestamp, config.window_minutes * 60)
+            warm = plan_warm_containers(config, history, timestamp).containers
+        while len(running) < warm:
+            boot(now)
+
+        # 到着したリクエストの割り当て
+        while next_arrival < len(arrivals) and arrivals[next_arrival] < now + 1:
+            arrived_at = arrivals[next_arrival]
+            service = service_times[next_arrival]
+            next_arrival += 1
+            ready = [c for c in running if c.ready_at <= arrived_at and len(c.inflight) < args.max_inputs]
+            if ready:
+                container = min(ready, key=lambda c: len(c.inflight))
+                started_at = arrived_at
+            else:
+                booting = [c for c in running if c.ready_at > arrived_at and c.assigned < args.max_inputs]
+                container = min(booting, key=lambda c: c.ready_at) if booting else boot(arrived_at)
+                container.assigned += 1
+                started_at = container.ready_at
+                cold_waits += 1
+            waits.append(started_at - arrived_at)
+            container.inflight = sorted(container.inflight + [started_at + service])
+            container.inputs += 1
+            container.busy_seconds += service
+            if sum(len(c.inflight) for c in running) > args.target_inputs * len(running):
+                boot(arrived_at)
+
+        # アイドルのコンテナの停止（待機コンテナ数は残す）
+        idle = sorted(
+            (c for c in running if c.ready_at <= now and not c.inflight and not c.assigned and now - c.idle_since >= args.scaledown_seconds),
+            key=lambda c: c.idle_since,
+        )
+        for container in idle[:max(0, len(running) - warm)]:
+            container.stopped_at = now
+            running.remove(container)
+
+    container_seconds = sum((c.stopped_at if c.stopped_at is not None else duration) - c.started_at for c in containers)
+    waits.sort()
+    cold_wait_values = sorted(w for w in waits if w > 0)
+    return {
+        "policy": policy.name,
+        "requests": len(arrivals),
+        "cold_waits": cold_waits,
+        "starts": len(containers),
+        "wait_mean_s": sum(cold_wait_values) / len(cold_wait_values) if cold_wait_values else 0.0,
+        "wait_p99_s": percentile(waits, 0.99) or 0.0,
+        "container_hours": container_seconds / 3600,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=7, help="シミュレーションの日数（月曜から）")
+    parser.add_argument("--peak-rate", type=float, default=30.0, help="平日の最も多い時間帯の到着率（件/時）")
+    parser.add_argument("--service-seconds", type=float, default=20.0, help="1件の処理時間の平均（指数分布）")
+    parser.add_argument("--cold-start-seconds", type=float, default=30.0, help="スナップショットを使わない起動時間")
+    parser.add_argument("--restore-seconds", type=float, default=5.0, help="スナップショットから復元する起動時間")
+    parser.add_argument("--scaledown-seconds", type=float, default=60.0, help="アイドルのコンテナを停止するまでの時間（Modal の scaledown_window）")
+    parser.add_argument("--max-inputs", type=int, default=16)
+    parser.add_argument("--target-inputs", type=int, default=12)
+    parser.add_argument("--always-warm", type=int, default=1, help="常時待機させるコンテナ数（比較用）")
+    parser.add_argument("--interval-minutes", type=int, default=5, help="WARM_CAPACITY_INTERVAL_MINUTES")
+    parser.add_argument("--window-minutes", type=int, default=15, help="WARM_CAPACITY_WINDOW_MINUTES")
+    parser.add_argument("--schedule", default="", help="LLM_WARM_SCHEDULE（例: mon-fri 09:00-19:00=1）")
+    parser.add_argument("--max-warm", type=int, default=2, help="LLM_WARM_MAX_CONTAINERS")
+    parser.add_argument("--stale-seconds", type=float, default=300.0, help="METRICS_STALE_SECONDS")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    arrivals = make_arrivals(args, rng)
+    service_times = [rng.expovariate(1 / args.service_seconds) for _ in arrivals]
+    policies = [
+        Policy("なし", args.cold_start_seconds, restored=False),
+        Policy("スナップショット", args.restore_seconds, restored=True),
+        Policy(f"スナップショット + 常時{args.always_warm}", args.restore_seconds, restored=True, always_warm=args.always_warm),
+        Policy("スナップショット + 調整", args.restore_seconds, restored=True, adjust=True),
+    ]
+
+    print(
+        f"{args.days}日間、平日のピーク {args.peak_rate:.0f}件/時、処理 平均{args.service_seconds:.0f}秒、"
+        f"起動 {args.cold_start_seconds:.0f}秒（復元 {args.restore_seconds:.0f}秒）、アイドル停止 {args.scaledown_seconds:.0f}秒"
+        + (f"、スケジュール {args.schedule}" if args.schedule else "")
+    )
+    print(f"  {'方式':<24}{'件数':>7}{'起動待ち':>9}{'割合':>8}{'待ち平均':>10}{'p99待ち':>10}{'起動数':>8}{'稼働(時間)':>12}")
+    for policy in policies:
+        result = simulate(args, policy, arrivals, service_times)
+        print(
+            f"  {result['policy']:<24}{result['requests']:>7}{result['cold_waits']:>9}"
+            f"{result['cold_waits'] / max(1, result['requests']):>8.1%}{result['wait_mean_s']:>9.1f}s{result['wait_p99_s']:>9.1f}s"
+            f"{result['starts']:>8}{result['container_hours']:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+ベンチマーク用の合成データ
+
+コード生成プロンプトの出力形式に沿ったLLM応答と、会議のセッション（文字起こし・仕様書・写真の分析）を生成する。
+"""
+
+import random
+from typing import Any, Dict, List
+
+LANGUAGES = [
+    ("python", ".py"),
+    ("typescript", ".ts"),
+    ("javascript", ".js"),
+    ("go", ".go"),
+    ("", ".json"),
+]
+
+
+def _file_body(rng: random.Random, lines: int) -> List[str]:
+    body = []
+    for i in range(lines):
+        indent = "    " * rng.randint(0, 2)
+        body.append(f"{indent}value_{i} = compute_{rng.randint(0, 999)}(item, limit={rng.randint(1, 64)})")
+    return body
+
+
+def make_code_output(files: int, lines_per_file: int = 40, alternate_ratio: float = 0.0, seed: int = 0) -> str:
+    """
+    コード生成のLLM応答を生成
+
+    Args:
+        files: ファイル数
+        lines_per_file: 1ファイルあたりの行数
+        alternate_ratio: ```言語:パス 形式で出力するファイルの割合
+        seed: 乱数シード
+
+    Returns:
+        Markdown形式の応答テキスト
+    """
+    rng = random.Random(seed)
+    out = [
+        "## プロジェクト概要",
+        "プロジェクト名: 【合成プロジェクト】",
+        "説明: ベンチマーク用に生成したプロジェクト",
+        "主な機能:",
+        "- 機能1: データの取り込み",
+        "- 機能2: 集計とレポート",
+        "- 機能3: API提供",
+        "",
+        "## 技術スタック",
+        "- 言語: Python",
+        "- フレームワーク: FastAPI",
+        "- 主要ライブラリ: fastapi, uvicorn, pydantic",
+        "",
+        "## プロジェクト構造",
+        "```mermaid",
+        "graph TD",
+    ]
+    out.extend(f"    M{i}[module_{i}] --> M{i + 1}[module_{i + 1}]" for i in range(min(files, 30)))
+    out.extend([
+        "```",
+        "",
+        "## 依存関係",
+        "```",
+        "fastapi==0.100.0",
+        "# サーバー",
+        "uvicorn==0.23.0",
+        "pydantic==2.0.0",
+        "```",
+        "",
+        "---",
+        "",
+        "## コード",
+        "",
+        "### ファイル: README.md",
+        "```markdown",
+        "# 合成プロジェクト",
+        "",
+        "## 📋 概要",
+        "ベンチマーク用のREADME",
+        "```",
+        "",
+    ])
+
+    for index in range(files):
+        language, extension = LANGUAGES[index % len(LANGUAGES)]
+        path = f"src/package_{index // 20}/module_{index}{extension}"
+        body = _file_body(rng, lines_per_file)
+        if rng.random() < alternate_ratio:
+            out.append(f"```{language or 'json'}:{path}")
+        else:
+            out.append(f"### ファイル: {path}")
+            out.append(f"```{language}")
+        out.extend(body)
+        out.append("```")
+        out.append("")
+
+    out.extend([
+        "## セットアップ手順",
+        "1. 依存関係をインストール",
+        "   pip install -r requirements.txt",
+        "2. 環境変数を設定",
+        "",
+        "## 実行方法",
+        "python -m app",
+        "",
+    ])
+    return "\n".join(out)
+
+
+SPEAKERS = ["SPEAKER_00", "SPEAKER_01", "SPEAKER_02"]
+TOPICS = ["ログイン", "決済", "通知", "検索", "レポート", "API", "データベース", "キャッシュ", "認証", "デプロイ"]
+
+
+def make_session(transcriptions: int, seed: int = 0) -> Dict[str, Any]:
+    """合成セッション（文字起こし・仕様書・分析済みの写真）"""
+    rng = random.Random(seed)
+    items = []
+    for i in range(transcriptions):
+        topic = rng.choice(TOPICS)
+        items.append({
+            "speaker": rng.choice(SPEAKERS),
+            "text": f"{topic}の件ですが、{rng.randint(1, 99)}件目の要件として{topic}の処理を"
+                    f"{rng.choice(['非同期', '同期', 'バッチ'])}で実装する方向で進めます。",
+        })
+
+    spec_lines = ["# 合成プロジェクト仕様書", "", "## 概要", "ベンチマーク用の仕様書", ""]
+    for topic in TOPICS:
+        spec_lines.append(f"## {topic}")
+        spec_lines.extend(f"- {topic}の要件{j}: 応答時間は{rng.randint(50, 500)}ms以内" for j in range(20))
+        spec_lines.append("")
+
+    photos = [
+        {"filename": f"photo_{i}.jpg", "analysis": f"ホワイトボードに{rng.choice(TOPICS)}の構成図が書かれている"}
+        for i in range(max(1, transcriptions // 50))
+    ]
+    return {"transcriptions": items, "specification": "\n".join(spec_lines), "photos": photos}
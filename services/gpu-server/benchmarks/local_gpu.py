@@ -0,0 +1,88 @@
+"""
+ベンチマーク用にこのプロセスで初期化するModalのクラス
+
+文字起こしモデル・共有Dict・Volume を使わずに RealworldAgentLLM（または RealworldAgentMedia）を初期化（prepare_snapshot・load_models）し、
+fastapi_app からの .remote の呼び出しをこのプロセスのインスタンスのメソッドで実行する。
+"""
+
+import os
+import pickle
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional
+
+import modal_app
+
+# クラスの初期化を外部サービスなしで行うための環境変数
+BENCHMARK_ENV = {
+    "ASR_BACKEND": "none",  # 文字起こしモデルは読み込まない
+    "METRICS_ENABLED": "false",  # 共有Dictに書き込まない
+    "TRACE_EXPORTER": "none",
+    "RESPONSE_CACHE_ENABLED": "false",  # 毎回プロバイダーを呼び出す
+    "OPENAI_API_KEY": "stub",
+    "ANTHROPIC_API_KEY": "stub",
+    "LOG_LEVEL": "ERROR",
+}
+
+
+class _LocalFunction:
+    """Modal の gpu.method.remote.aio(...) と同じ呼び出し方で、このプロセスのインスタンスのメソッドを実行する"""
+
+    def __init__(self, method: Callable):
+        self.remote = self
+        self._method = method
+
+    async def aio(self, *args, **kwargs):
+        # Modalと同様に入力・出力をシリアライズする
+        args, kwargs = pickle.loads(pickle.dumps((args, kwargs)))
+        result = await self._method(*args, **kwargs)
+        return pickle.loads(pickle.dumps(result))
+
+
+class LocalGPU:
+    """
+    このプロセスで初期化したクラス（prepare_snapshot・load_models まで実行済み）
+
+    Modal のデコレーターを付ける前の関数を呼び出す（Modal 0.75 の内部の属性を使う）。
+    プロンプトの構築などのヘルパーメソッドは instance から直接呼び出せる。
+
+    Args:
+        env: BENCHMARK_ENV に加えて設定する環境変数（スタブプロバイダーのURLなど）
+        cls_name: modal_app のクラス名
+    """
+
+    def __init__(self, env: Optional[Dict[str, str]] = None, cls_name: str = "RealworldAgentLLM"):
+        from modal._utils.async_utils import synchronizer
+
+        os.environ.update(BENCHMARK_ENV)
+        os.environ.update(env or {})
+
+        self.cls_name = cls_name
+        user_cls = getattr(modal_app, cls_name)._get_user_cls()
+        self._raw = {
+            name: synchronizer._translate_in(value).raw_f
+            for name, value in vars(user_cls).items()
+            if type(value).__name__ == "PartialFunction"
+        }
+        self.instance = user_cls()
+        # Modalと同じ順番で、メモリスナップショットの前・後の初期化を実行する
+        self._raw["prepare_snapshot"](self.instance)
+        self._raw["load_models"](self.instance)
+
+    def __getattr__(self, name: str) -> _LocalFunction:
+        return _LocalFunction(self._raw[name].__get__(self.instance))
+
+    def shutdown(self):
+        self._raw["shutdown"](self.instance)
+        if getattr(self.instance, "image_executor", None) is not None:
+            self.instance.image_executor.shutdown()
+
+
+@contextmanager
+def local_remote(gpu: LocalGPU) -> Iterator[LocalGPU]:
+    """with ブロック内では fastapi_app のハンドラーの gpu.cls_name のクラスの呼び出し（RealworldAgentLLM() など）が gpu を返す"""
+    remote_cls = getattr(modal_app, gpu.cls_name)
+    setattr(modal_app, gpu.cls_name, lambda: gpu)
+    try:
+        yield gpu
+    finally:
+        setattr(modal_app, gpu.cls_name, remote_cls)
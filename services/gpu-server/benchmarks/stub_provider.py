@@ -0,0 +1,295 @@
+"""
+ローカルスタブLLMプロバイダー
+OpenAI chat-completions / Anthropic messages 形式（ストリーミングを含む）に応答するベンチマーク用HTTPサーバー
+"""
+
+import json
+import random
+import socket
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional
+
+# 応答テキストのトークン数の見積もり（1トークンあたりの文字数）
+CHARS_PER_TOKEN = 4
+
+
+@dataclass
+class StubConfig:
+    """
+    スタブの挙動設定
+
+    latency_ms: 1リクエストあたりの応答遅延（最初のトークンまでの時間）
+    connect_delay_ms: 新規TCP接続ごとの遅延（TLSハンドシェイク相当）
+    response_text: 返却するテキスト
+    tokens_per_second: 出力トークンの生成速度（0の場合は待たない。ストリーミングでは逐次、それ以外は全体の生成時間を待ってから返す）
+    error_rate: エラーを返すリクエストの割合（0〜1）
+    error_status: エラー時のHTTPステータス（500 / 429 / 529 など。SDKの再試行の対象になる）
+    respond: (プロバイダー, リクエスト本文) から応答テキストを決める関数（省略時は response_text）
+    seed: エラーを返すリクエストを決める乱数のシード
+    """
+
+    latency_ms: float = 0.0
+    connect_delay_ms: float = 0.0
+    response_text: str = "スタブ応答"
+    tokens_per_second: float = 0.0
+    error_rate: float = 0.0
+    error_status: int = 500
+    respond: Optional[Callable[[str, Dict[str, Any]], str]] = None
+    seed: int = 0
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def _request_text(body: Dict[str, Any]) -> str:
+    """リクエストのシステムメッセージ・ユーザーメッセージのテキスト部分（入力トークン数の見積もり用）"""
+    parts: List[str] = []
+    system = body.get("system")
+    if isinstance(system, str):
+        parts.append(system)
+    elif isinstance(system, list):
+        parts.extend(block.get("text", "") for block in system)
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            parts.extend(block.get("text", "") for block in content if block.get("type") == "text")
+    return "".join(parts)
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-aliveを有効にする
+
+    def setup(self):
+        super().setup()
+        # ヘッダーと本文の分割送信でNagle遅延が発生しないようにする
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # 新規接続ごとにハンドシェイク相当の遅延を入れる
+        delay = self.server.config.connect_delay_ms
+        if delay > 0:
+            time.sleep(delay / 1000)
+        self.server.count("connections")
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        self.server.count("requests")
+
+        if self.path.endswith("/chat/completions"):
+            provider = "openai"
+        elif self.path.endswith("/messages"):
+            provider = "anthropic"
+        else:
+            self._send_json(404, {"error": {"message": f"unknown path: {self.path}"}})
+            return
+
+        config = self.server.config
+        if config.latency_ms > 0:
+            time.sleep(config.latency_ms / 1000)
+
+        if self.server.inject_error():
+            self.server.count("errors")
+            self._send_json(config.error_status, self._error_response(provider, config.error_status))
+            return
+
+        text = config.respond(provider, body) if config.respond else config.response_text
+        usage = {"input_tokens": estimate_tokens(_request_text(body)), "output_tokens": estimate_tokens(text)}
+        model = body.get("model", "stub")
+
+        if body.get("stream"):
+            self._stream(provider, model, text, usage, body)
+            return
+
+        if config.tokens_per_second > 0:
+            time.sleep(usage["output_tokens"] / config.tokens_per_second)
+        if provider == "openai":
+            payload = self._openai_response(model, text, usage)
+        else:
+            payload = self._anthropic_response(model, text, usage)
+        self._send_json(200, payload)
+
+    def _send_json(self, status: int, payload: Dict[str, Any]):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, provider: str, model: str, text: str, usage: Dict[str, int], body: Dict[str, Any]):
+        """Server-Sent Events で tokens_per_second の速度でテキストを送る（chunked転送でkeep-aliveを維持する）"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send(event: Optional[str], data: Any):
+            line = (f"event: {event}\n" if event else "") + f"data: {data if isinstance(data, str) else json.dumps(data)}\n\n"
+            encoded = line.encode("utf-8")
+            self.wfile.write(f"{len(encoded):X}\r\n".encode("ascii") + encoded + b"\r\n")
+            self.wfile.flush()
+
+        pieces = [text[i:i + CHARS_PER_TOKEN] for i in range(0, len(text), CHARS_PER_TOKEN)]
+        rate = self.server.config.tokens_per_second
+        started_at = time.perf_counter()
+        if provider == "openai":
+            message_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+            def chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None) -> Dict[str, Any]:
+                return {
+                    "id": message_id,
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                }
+
+            send(None, chunk({"role": "assistant", "content": ""}))
+            for i, piece in enumerate(pieces):
+                self._pace(started_at, i, rate)
+                send(None, chunk({"content": piece}))
+            send(None, chunk({}, "stop"))
+            if (body.get("stream_options") or {}).get("include_usage"):
+                send(None, {**chunk({}), "choices": [], "usage": self._openai_usage(usage)})
+            send(None, "[DONE]")
+        else:
+            message = {**self._anthropic_response(model, "", usage), "content": [], "stop_reason": None}
+            message["usage"] = {"input_tokens": usage["input_tokens"], "output_tokens": 1}
+            send("message_start", {"type": "message_start", "message": message})
+            send("content_block_start", {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}})
+            for i, piece in enumerate(pieces):
+                self._pace(started_at, i, rate)
+                send("content_block_delta", {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": piece}})
+            send("content_block_stop", {"type": "content_block_stop", "index": 0})
+            send("message_delta", {
+                "type": "message_delta",
+                "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                "usage": {"output_tokens": usage["output_tokens"]},
+            })
+            send("message_stop", {"type": "message_stop"})
+        self.wfile.write(b"0\r\n\r\n")
+
+    @staticmethod
+    def _pace(started_at: float, index: int, tokens_per_second: float):
+        # 1トークンごとに眠らず、開始時刻からの予定時刻まで待つ（sleepの誤差を積み上げない）
+        if tokens_per_second <= 0:
+            return
+        delay = started_at + index / tokens_per_second - time.perf_counter()
+        if delay > 0.001:
+            time.sleep(delay)
+
+    @staticmethod
+    def _openai_usage(usage: Dict[str, int]) -> Dict[str, Any]:
+        return {
+            "prompt_tokens": usage["input_tokens"],
+            "completion_tokens": usage["output_tokens"],
+            "total_tokens": usage["input_tokens"] + usage["output_tokens"],
+            "prompt_tokens_details": {"cached_tokens": 0},
+        }
+
+    @classmethod
+    def _openai_response(cls, model: str, text: str, usage: Dict[str, int]) -> Dict[str, Any]:
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": text},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": cls._openai_usage(usage),
+        }
+
+    @staticmethod
+    def _anthropic_response(model: str, text: str, usage: Dict[str, int]) -> Dict[str, Any]:
+        return {
+            "id": f"msg_{uuid.uuid4().hex}",
+            "type": "message",
+            "role": "assistant",
+            "model": model,
+            "content": [{"type": "text", "text": text}],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": {"input_tokens": usage["input_tokens"], "output_tokens": usage["output_tokens"]},
+        }
+
+    @staticmethod
+    def _error_response(provider: str, status: int) -> Dict[str, Any]:
+        message = f"stub injected error ({status})"
+        if provider == "openai":
+            return {"error": {"message": message, "type": "server_error", "code": None}}
+        error_type = "overloaded_error" if status == 529 else "rate_limit_error" if status == 429 else "api_error"
+        return {"type": "error", "error": {"type": error_type, "message": message}}
+
+
+class StubProviderServer(ThreadingHTTPServer):
+    """
+    スタブプロバイダーサーバー
+
+    使い方:
+        with StubProviderServer(StubConfig(latency_ms=50)) as server:
+            client = OpenAI(api_key="stub", base_url=server.openai_base_url)
+    """
+
+    daemon_threads = True
+    request_queue_size = 256  # 同時接続が多いベンチマークでlistenキューが溢れないようにする
+
+    def __init__(self, config: StubConfig, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _StubHandler)
+        self.config = config
+        self.counters: Dict[str, int] = {"connections": 0, "requests": 0, "errors": 0}
+        self._counter_lock = threading.Lock()
+        self._random = random.Random(config.seed)
+        self._thread = None
+
+    def count(self, name: str):
+        with self._counter_lock:
+            self.counters[name] += 1
+
+    def inject_error(self) -> bool:
+        """このリクエストでエラーを返すか（error_rate の割合）"""
+        if self.config.error_rate <= 0:
+            return False
+        with self._counter_lock:
+            return self._random.random() < self.config.error_rate
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def openai_base_url(self) -> str:
+        return f"{self.base_url}/v1"
+
+    @property
+    def anthropic_base_url(self) -> str:
+        return self.base_url
+
+    def start(self) -> "StubProviderServer":
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self) -> "StubProviderServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,515 @@
+"""
+コード生成出力のパーサー
+LLMの出力を1回だけ走査して文書ツリーを作り、ファイル・依存関係・手順・プロジェクト概要を取り出す
+
+走査は TOKEN_RE に一致する行（コードフェンス、見出し、「キー:」行など）だけを対象にし、
+ファイル内容やセクション本文は開始・終了位置からスライスで取り出す。ファイル内容の各行は Python 側で処理しない。
+ストリーミング時は同じ走査処理にテキスト片を逐次渡し、ファイルブロックやセクションが閉じた時点でイベントを発行する。
+
+抽出結果は従来の正規表現による抽出（_extract_code_files など）と同じ規則に従う:
+    - ### ファイル: パス の直後（空行は可）のコードフェンスをファイルとみなし、次の ``` までを内容とする
+    - ```言語:パス 形式のブロックは、同じパスのファイルがなければ追加する
+    - 依存関係・Mermaid図・手順などはテキスト中で最初に見つかったものを使う
+"""
+
+import bisect
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+FENCE = "```"
+
+# 状態が変わりうる行の目印。これを含まない行は読み飛ばす
+# （行頭の # や - は ^ ではなく直前の改行で表す。^ を使うと正規表現エンジンの前方一致の最適化が効かない）
+TOKEN_RE = re.compile(
+    r"```|##|\n#|\n-[ \t]|ファイル:|プロジェクト名:|説明:|言語:|フレームワーク:|主要ライブラリ:|主な機能"
+)
+NON_BLANK_RE = re.compile(r"\S")
+NON_BLANK_LINE_RE = re.compile(r"^[^\n]*\S[^\n]*$", re.MULTILINE)
+
+# ### ファイル: path/to/file.ext
+FILE_HEADING_RE = re.compile(r"###\s*ファイル:\s*(.+)$")
+# ```language（任意）
+FILE_FENCE_RE = re.compile(r"^\s*```(\w+)?\s*$")
+# ```language:path/to/file.ext（代替形式）
+ALT_FILE_FENCE_RE = re.compile(r"^\s*```(\w+):(.+)$")
+# ## 見出し
+HEADING_RE = re.compile(r"^(#{1,6})\s+(.+?)\s*$")
+DEPENDENCIES_HEADING_RE = re.compile(r"##\s*依存関係\s*$")
+MERMAID_FENCE_RE = re.compile(r"```mermaid\s*$")
+INSTRUCTION_HEADING_RES = {
+    "setup": re.compile(r"##\s*セットアップ手順\s*$"),
+    "run": re.compile(r"##\s*実行方法\s*$"),
+}
+FEATURES_HEADING_RE = re.compile(r"主な機能:?\s*$")
+FEATURE_ITEM_RE = re.compile(r"^-\s+\S")
+
+# プロジェクト概要の「キー: 値」行（テキスト中で最初に一致したものを使う）
+SUMMARY_FIELD_RES = {
+    "name": ("プロジェクト名:", re.compile(r"プロジェクト名:\s*(?:【)?([^】\n]+)(?:】)?")),
+    "description": ("説明:", re.compile(r"説明:\s*(?:【)?([^】\n]+)(?:】)?")),
+    "language": ("言語:", re.compile(r"-\s*言語:\s*(?:【)?([^】\n]+)(?:】)?")),
+    "framework": ("フレームワーク:", re.compile(r"-\s*フレームワーク:\s*(?:【)?([^】\n]+)(?:】)?")),
+    "libraries": ("主要ライブラリ:", re.compile(r"-\s*主要ライブラリ:\s*(?:【)?([^】\n]+)(?:】)?")),
+}
+# 「キー:」の次の行に書かれた値
+FIELD_VALUE_RE = re.compile(r"^\s*(?:【)?([^】\n]+)(?:】)?")
+
+DEFAULT_PROJECT_NAME = "生成されたプロジェクト"
+DEFAULT_INSTRUCTIONS = "セットアップ手順は生成されたコードに含まれています。"
+
+
+class CodeOutputDocument:
+    """
+    コード生成出力の文書ツリー
+
+    sections: ## 見出しのセクション（### 見出しをchildrenに持つ）。コードフェンス内の見出しは含まない
+    files: 抽出されたファイル（従来の _extract_code_files と同じ順序・内容）
+    """
+
+    def __init__(self):
+        self.sections: List[Dict[str, Any]] = []
+        self.primary_files: List[Dict[str, str]] = []
+        self.alternate_files: List[Dict[str, str]] = []
+        self.dependency_text: Optional[str] = None
+        self.mermaid: Optional[str] = None
+        self.instruction_blocks: Dict[str, str] = {}
+        self.fields: Dict[str, str] = {}
+        self.features: Optional[List[str]] = None
+
+    @property
+    def files(self) -> List[Dict[str, str]]:
+        """### ファイル: 形式のファイル + 同じパスがない代替形式のファイル"""
+        files = list(self.primary_files)
+        seen = {f["path"] for f in files}
+        for file in self.alternate_files:
+            if file["path"] not in seen:
+                seen.add(file["path"])
+                files.append(file)
+        return files
+
+    def dependencies(self) -> List[str]:
+        """## 依存関係 直後のコードブロックの各行（空行・コメント行を除く）"""
+        dependencies = []
+        for line in (self.dependency_text or "").split("\n"):
+            line = line.strip()
+            if line and not line.startswith("#"):
+                dependencies.append(line)
+        return dependencies
+
+    def instructions(self) -> str:
+        """## セットアップ手順 と ## 実行方法 の本文"""
+        instructions = []
+        if "setup" in self.instruction_blocks:
+            instructions.append("# セットアップ手順")
+            instructions.append(self.instruction_blocks["setup"])
+        if "run" in self.instruction_blocks:
+            instructions.append("\n# 実行方法")
+            instructions.append(self.instruction_blocks["run"])
+        return "\n".join(instructions) if instructions else DEFAULT_INSTRUCTIONS
+
+    def project_summary(self) -> Dict[str, Any]:
+        """プロジェクト概要（名前・説明・主な機能・技術スタック・Mermaid図）"""
+        libraries = self.fields.get("libraries", "")
+        return {
+            "name": self.fields.get("name", DEFAULT_PROJECT_NAME),
+            "description": self.fields.get("description", ""),
+            "features": list(self.features or []),
+            "tech_stack": {
+                "language": self.fields.get("language", ""),
+                "framework": self.fields.get("framework", ""),
+                "libraries": [l.strip() for l in libraries.split(",") if l.strip()],
+            },
+            "mermaid_diagram": self.mermaid or "",
+        }
+
+
+class CodeOutputTokenizer:
+    """
+    コード生成出力のトークナイザー
+
+    目印を含む行ごとに、独立した小さな状態機械（ファイル、代替形式ファイル、依存関係、Mermaid図、
+    手順、概要フィールド、セクションツリー）を進める。各位置は1回しか走査しないので全体で線形時間。
+    """
+
+    def __init__(self, detect_language: Callable[[str], str]):
+        """
+        Args:
+            detect_language: フェンスに言語指定がない場合にファイルパスから言語を推測する関数
+        """
+        self._detect_language = detect_language
+        self.document = CodeOutputDocument()
+        # 受信済みのテキストは改行で終わる区間ごとに持ち、位置は先頭からの通し番号で表す
+        # （全体を連結し直すとテキスト片ごとに受信済みの全体をコピーすることになり、二乗時間になる）。
+        # 1行目も直前の改行で行頭を判定できるよう、改行の区間から始める
+        self._segments: List[str] = ["\n"]
+        self._offsets: List[int] = [0]
+        self._length = 1
+        # 改行を含まない未処理のテキスト片
+        self._chunks: List[str] = []
+
+        # 「直後の空でない行」を待つ状態は、待ち始めた位置（見出し行の末尾）を持つ
+        self._pending_path: Optional[Tuple[str, int]] = None
+        self._file: Optional[Dict[str, Any]] = None
+        self._alt_file: Optional[Dict[str, Any]] = None
+        self._dependencies_pending: Optional[int] = None
+        self._dependencies_start: Optional[int] = None
+        self._mermaid_start: Optional[int] = None
+        self._instruction_starts: Dict[str, int] = {}
+        self._field_pending: Dict[str, int] = {}
+        self._features_pending: Optional[int] = None
+        self._features: Optional[List[str]] = None
+        self._features_end = 0
+        # セクションツリー（情報文字列付きフェンスは入れ子として数える）
+        self._fence_depth = 0
+        self._section: Optional[Dict[str, Any]] = None
+        self._subsection: Optional[Dict[str, Any]] = None
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """
+        テキスト片を追加し、改行までの完結した行を処理
+
+        Returns:
+            確定したイベント（file / section）
+        """
+        cut = chunk.rfind("\n") + 1
+        if not cut:
+            self._chunks.append(chunk)
+            return []
+        if self._chunks:
+            self._chunks.append(chunk[:cut])
+            segment = "".join(self._chunks)
+        else:
+            segment = chunk[:cut]
+        self._chunks = [chunk[cut:]] if cut < len(chunk) else []
+        return self._append_and_scan(segment)
+
+    def finish(self) -> List[Dict[str, Any]]:
+        """入力の終端。最後の行を処理し、開いているセクションと手順を閉じる"""
+        events = self._append_and_scan("".join(self._chunks))
+        self._chunks = []
+        end = self._length
+
+        self._resolve_fields(end, None)
+        for key, start in self._instruction_starts.items():
+            self.document.instruction_blocks.setdefault(key, self._slice(start, end).strip())
+        self._instruction_starts = {}
+        if self._features is not None and self.document.features is None:
+            self.document.features = self._features
+        self._close_section(end, events)
+        return events
+
+    def _append_and_scan(self, segment: str) -> List[Dict[str, Any]]:
+        """新しい区間を追加し、その区間の行だけを走査する"""
+        if not segment:
+            return []
+        # 直前の区間の末尾の改行から走査する（次の行の「改行 + #」を見落とさないため。
+        # finish() の区間は最後なので、それより前の区間は必ず改行で終わる）
+        base = self._length - 1
+        text = "\n" + segment
+        self._segments.append(segment)
+        self._offsets.append(self._length)
+        self._length += len(segment)
+
+        events: List[Dict[str, Any]] = []
+        limit = len(text)
+        pos = 0
+        while pos < limit:
+            token = TOKEN_RE.search(text, pos)
+            if token is None:
+                break
+            # 改行から始まる目印は次の行のもの
+            anchor = token.end() - 1
+            start = text.rfind("\n", 0, anchor) + 1
+            end = text.find("\n", anchor)
+            if end < 0:
+                end = limit
+            self._push_line(text[start:end], base + start, base + end, events)
+            pos = end
+        return events
+
+    def _slice(self, start: int, end: int) -> str:
+        """受信済みのテキストの [start, end) の部分（区間をまたぐ場合は連結する）"""
+        first = bisect.bisect_right(self._offsets, start) - 1
+        last = bisect.bisect_left(self._offsets, end) - 1
+        if first >= last:
+            offset = self._offsets[first]
+            return self._segments[first][start - offset:end - offset]
+        parts = self._segments[first:last + 1]
+        parts[0] = parts[0][start - self._offsets[first]:]
+        parts[-1] = parts[-1][:end - self._offsets[last]]
+        return "".join(parts)
+
+    def _blank(self, start: int, end: int) -> bool:
+        """text[start:end] が空白のみか"""
+        return NON_BLANK_RE.search(self._slice(start, end)) is None
+
+    def _push_line(self, line: str, start: int, end: int, events: List[Dict[str, Any]]):
+        fence = line.find(FENCE)
+        document = self.document
+        self._push_section(line, start, end, events)
+        self._push_file(line, start, end, fence, events)
+        if fence >= 0:
+            self._push_alt_file(line, start, end, fence, events)
+        if document.dependency_text is None:
+            self._push_dependencies(line, start, end, fence)
+        if fence >= 0 and document.mermaid is None:
+            self._push_mermaid(line, start, end, fence)
+        if "##" in line:
+            self._push_instructions(line, start, end)
+        if self._field_pending or len(document.fields) < len(SUMMARY_FIELD_RES) or document.features is None:
+            self._push_summary_fields(line, start, end)
+
+    # ファイル
+
+    def _push_file(self, line: str, start: int, end: int, fence: int, events: List[Dict[str, Any]]):
+        if self._file is not None:
+            if fence >= 0:
+                file = self._file
+                self._file = None
+                file["content"] = self._slice(file.pop("start"), start + fence).strip()
+                self.document.primary_files.append(file)
+                events.append(self._file_event(file, alternate=False))
+            return
+
+        if self._pending_path is not None:
+            path, after = self._pending_path
+            self._pending_path = None
+            opening = FILE_FENCE_RE.match(line) if fence >= 0 else None
+            if opening and self._blank(after, start):
+                self._file = {
+                    "path": path,
+                    "content": "",
+                    "language": opening.group(1) or self._detect_language(path),
+                    "start": end + 1,
+                }
+                return
+
+        if "ファイル:" in line:
+            heading = FILE_HEADING_RE.search(line)
+            if heading:
+                self._pending_path = (heading.group(1).strip(), end)
+
+    def _push_alt_file(self, line: str, start: int, end: int, fence: int, events: List[Dict[str, Any]]):
+        if self._alt_file is not None:
+            file = self._alt_file
+            self._alt_file = None
+            file["content"] = self._slice(file.pop("start"), start + fence).strip()
+            self.document.alternate_files.append(file)
+            events.append(self._file_event(file, alternate=True))
+            return
+
+        alt = ALT_FILE_FENCE_RE.match(line)
+        if alt:
+            self._alt_file = {
+                "path": alt.group(2).strip(),
+                "content": "",
+                "language": alt.group(1).strip(),
+                "start": end + 1,
+            }
+
+    @staticmethod
+    def _file_event(file: Dict[str, str], alternate: bool) -> Dict[str, Any]:
+        return {"type": "file", "alternate": alternate, **file}
+
+    # 依存関係・Mermaid図・手順
+
+    def _push_dependencies(self, line: str, start: int, end: int, fence: int):
+        if self._dependencies_start is not None:
+            if fence >= 0:
+                self.document.dependency_text = self._slice(self._dependencies_start, start + fence)
+                self._dependencies_start = None
+            return
+
+        if self._dependencies_pending is not None:
+            after = self._dependencies_pending
+            self._dependencies_pending = None
+            if line.lstrip().startswith(FENCE) and self._blank(after, start):
+                self._dependencies_start = end + 1
+                return
+
+        if "依存関係" in line and DEPENDENCIES_HEADING_RE.search(line):
+            self._dependencies_pending = end
+
+    def _push_mermaid(self, line: str, start: int, end: int, fence: int):
+        if self._mermaid_start is not None:
+            self.document.mermaid = self._slice(self._mermaid_start, start + fence).strip()
+            self._mermaid_start = None
+        elif MERMAID_FENCE_RE.search(line):
+            self._mermaid_start = end + 1
+
+    def _push_instructions(self, line: str, start: int, end: int):
+        marker = line.find("##")
+        # 本文は次の "##" の直前まで
+        for key, body_start in self._instruction_starts.items():
+            self.document.instruction_blocks[key] = self._slice(body_start, start + marker).strip()
+        self._instruction_starts = {}
+
+        for key, pattern in INSTRUCTION_HEADING_RES.items():
+            if key not in self.document.instruction_blocks and pattern.search(line):
+                self._instruction_starts[key] = end + 1
+
+    # プロジェクト概要
+
+    def _push_summary_fields(self, line: str, start: int, end: int):
+        fields = self.document.fields
+        if self._field_pending:
+            self._resolve_fields(start, line)
+
+        if len(fields) < len(SUMMARY_FIELD_RES):
+            for key, (marker, pattern) in SUMMARY_FIELD_RES.items():
+                if key in fields or marker not in line:
+                    continue
+                match = pattern.search(line)
+                if match:
+                    fields[key] = match.group(1).strip()
+                elif line.rstrip().endswith(marker):
+                    # 値は次の空でない行
+                    self._field_pending[key] = end
+
+        if self.document.features is None:
+            self._push_features(line, start, end)
+
+    def _resolve_fields(self, until: int, line: Optional[str]):
+        """「キー:」の次の空でない行から値を取り出す"""
+        for key, after in self._field_pending.items():
+            value_line = NON_BLANK_LINE_RE.search(self._slice(after, until))
+            if value_line is not None:
+                value = value_line.group()
+            else:
+                value = line or ""
+            match = FIELD_VALUE_RE.search(value)
+            if match and key not in self.document.fields:
+                self.document.fields[key] = match.group(1).strip()
+        self._field_pending = {}
+
+    def _push_features(self, line: str, start: int, end: int):
+        if self._features is not None:
+            # 「主な機能」直後の連続する箇条書き
+            if start == self._features_end + 1 and FEATURE_ITEM_RE.match(line):
+                self._features.append(line.strip()[1:].strip())
+                self._features_end = end
+                return
+            self.document.features = self._features
+            self._features = None
+            return
+
+        if self._features_pending is not None:
+            after = self._features_pending
+            self._features_pending = None
+            if FEATURE_ITEM_RE.match(line) and self._blank(after, start):
+                self._features = [line.strip()[1:].strip()]
+                self._features_end = end
+                return
+
+        if "主な機能" in line and FEATURES_HEADING_RE.search(line):
+            self._features_pending = end
+
+    # セクションツリー
+
+    def _push_section(self, line: str, start: int, end: int, events: List[Dict[str, Any]]):
+        stripped = line.strip()
+
+        if stripped.startswith(FENCE):
+            # 情報文字列付きのフェンスは開始、素の ``` は最も内側のフェンスを閉じる
+            if stripped == FENCE and self._fence_depth > 0:
+                self._fence_depth -= 1
+            else:
+                self._fence_depth += 1
+            return
+
+        if self._fence_depth > 0 or not line.startswith("#"):
+            return
+        heading = HEADING_RE.match(line)
+        if heading is None:
+            return
+
+        level = len(heading.group(1))
+        if level == 2:
+            self._close_section(start, events)
+            self._section = {"level": 2, "title": heading.group(2), "start": end + 1, "children": []}
+            self.document.sections.append(self._section)
+        elif level == 3 and self._section is not None:
+            self._close_subsection(start)
+            self._subsection = {"level": 3, "title": heading.group(2), "start": end + 1}
+            self._section["children"].append(self._subsection)
+
+    def _close_subsection(self, end: int):
+        if self._subsection is not None:
+            subsection = self._subsection
+            subsection["content"] = self._slice(subsection.pop("start"), end).strip()
+            self._subsection = None
+
+    def _close_section(self, end: int, events: List[Dict[str, Any]]):
+        self._close_subsection(end)
+        if self._section is None:
+            return
+        section = self._section
+        section["content"] = self._slice(section.pop("start"), end).strip()
+        self._section = None
+        events.append({"type": "section", "title": section["title"], "content": section["content"]})
+
+
+def parse_code_output(text: str, detect_language: Callable[[str], str]) -> CodeOutputDocument:
+    """
+    コード生成出力全体を1回の走査で解析
+
+    Args:
+        text: LLMの出力
+        detect_language: ファイルパスから言語を推測する関数
+
+    Returns:
+        文書ツリー
+    """
+    tokenizer = CodeOutputTokenizer(detect_language)
+    tokenizer.feed(text)
+    tokenizer.finish()
+    return tokenizer.document
+
+
+class IncrementalCodeParser:
+    """
+    コード生成出力のインクリメンタルパーサー
+
+    feed() に受信したテキスト片を渡すと、その時点で確定したイベントのリストを返す。
+
+    イベント:
+        {"type": "file", "path", "language", "content"}
+            ### ファイル: ブロック（または ```lang:path ブロック）のコードフェンスが閉じた時
+        {"type": "section", "title", "content"}
+            ## 見出しのセクションが次の ## 見出し、またはストリーム終端で閉じた時
+    """
+
+    def __init__(self, detect_language: Callable[[str], str]):
+        """
+        Args:
+            detect_language: フェンスに言語指定がない場合にファイルパスから言語を推測する関数
+        """
+        self._tokenizer = CodeOutputTokenizer(detect_language)
+        self._emitted_paths = set()
+        self.files_emitted = 0
+
+    @property
+    def document(self) -> CodeOutputDocument:
+        """これまでに解析した文書ツリー（finish()後は全体の解析結果）"""
+        return self._tokenizer.document
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """テキスト片を追加し、確定したイベントを返す"""
+        return self._filter(self._tokenizer.feed(chunk))
+
+    def finish(self) -> List[Dict[str, Any]]:
+        """ストリーム終端。残りのテキストを処理し、開いているセクションを閉じる"""
+        return self._filter(self._tokenizer.finish())
+
+    def _filter(self, events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        filtered = []
+        for event in events:
+            if event["type"] == "file":
+                alternate = event.pop("alternate")
+                # 代替形式は同じパスのファイルが既に送信済みならスキップ
+                if alternate and event["path"] in self._emitted_paths:
+                    continue
+                self._emitted_paths.add(event["path"])
+                self.files_emitted += 1
+            filtered.append(event)
+        return filtered
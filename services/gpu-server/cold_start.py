@@ -0,0 +1,89 @@
+"""
+コンテナの起動（コールドスタート）の計測
+
+LLM・メディアのクラスはModalのメモリスナップショット（enable_memory_snapshot）を使い、初期化を2つに分ける。
+
+    @modal.enter(snap=True)   SDKのimport・クライアントの生成・テンプレートやエンコーディングの読み込みなど。
+                              スナップショットの作成時に1回だけ実行し、以降のコンテナはその状態のメモリから復元する
+    @modal.enter(snap=False)  スレッド・Volume・コンテナIDを使うもの（メトリクス・トレースの書き出しなど）。コンテナごとに実行する
+
+ContainerStartup は2つの段階の時間と、スナップショットから復元したかを
+gpu_container_starts_total / gpu_container_init_seconds と最初の入力のスパン（container_start / container_init_ms）に記録する。
+"""
+
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from metrics import CONTAINER_INIT_SECONDS, CONTAINER_STARTS
+from tracing import mark_container_ready
+
+logger = logging.getLogger(__name__)
+
+# このモジュールの import（modal_app の import 中）の時刻。復元しないコンテナの初期化の時間の起点にする
+_IMPORTED_AT = time.perf_counter()
+
+START_COLD = "cold"
+START_RESTORED = "restored"
+
+PHASE_PRE_SNAPSHOT = "pre_snapshot"
+PHASE_POST_SNAPSHOT = "post_snapshot"
+PHASE_TOTAL = "total"
+
+
+class ContainerStartup:
+    """
+    コンテナの初期化の段階ごとの時間
+
+    snapshot_phase() で @modal.enter(snap=True) の初期化を、post_snapshot_phase() で @modal.enter(snap=False) の初期化を囲む。
+    復元したコンテナでは snapshot_phase() は実行されず、スナップショットの作成時の値がメモリごと戻る。
+    Modalは復元したコンテナのタスク ID（MODAL_TASK_ID）を書き換えるため、作成時のタスク ID と異なれば復元したと判定する。
+    """
+
+    def __init__(self):
+        self.snapshot_task_id: Optional[str] = None
+        self.pre_snapshot_seconds: Optional[float] = None
+        self.start: Optional[str] = None
+        self.init_seconds: Optional[float] = None
+
+    @property
+    def restored(self) -> bool:
+        return self.pre_snapshot_seconds is not None and self.snapshot_task_id != os.getenv("MODAL_TASK_ID")
+
+    @contextmanager
+    def snapshot_phase(self) -> Iterator[None]:
+        started_at = time.perf_counter()
+        yield
+        self.pre_snapshot_seconds = time.perf_counter() - started_at
+        self.snapshot_task_id = os.getenv("MODAL_TASK_ID")
+        logger.info(f"📸 スナップショット前の初期化: {self.pre_snapshot_seconds:.1f}秒")
+
+    @contextmanager
+    def post_snapshot_phase(self) -> Iterator[None]:
+        """with ブロックを抜けたときに、入力を受け付けるまでの時間を記録する"""
+        started_at = time.perf_counter()
+        yield
+        finished_at = time.perf_counter()
+        post_snapshot_seconds = finished_at - started_at
+
+        if self.restored:
+            # 復元の前の時間（スナップショットの作成・Modalによる復元）はこのプロセスからは測れない
+            self.start = START_RESTORED
+            self.init_seconds = post_snapshot_seconds
+        else:
+            self.start = START_COLD
+            self.init_seconds = finished_at - _IMPORTED_AT
+            if self.pre_snapshot_seconds is not None:
+                CONTAINER_INIT_SECONDS.observe(self.pre_snapshot_seconds, start=self.start, phase=PHASE_PRE_SNAPSHOT)
+        CONTAINER_INIT_SECONDS.observe(post_snapshot_seconds, start=self.start, phase=PHASE_POST_SNAPSHOT)
+        CONTAINER_INIT_SECONDS.observe(self.init_seconds, start=self.start, phase=PHASE_TOTAL)
+        CONTAINER_STARTS.inc(start=self.start)
+
+        # 最初の入力のスパンにコールドスタート（初期化の時間）として記録する
+        mark_container_ready(self.init_seconds, self.start)
+        logger.info(
+            f"✅ 初期化完了（{'スナップショットから復元、' if self.start == START_RESTORED else ''}"
+            f"{self.init_seconds:.1f}秒）"
+        )
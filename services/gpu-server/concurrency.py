@@ -0,0 +1,208 @@
+"""
+Modalのクラスのコンテナ内の同時実行
+1つのコンテナで同時に受け付ける入力の数と、メソッドごとの同時実行数の上限
+
+LLMの呼び出し（仕様書・コード生成、画像分析）は処理時間のほとんどがプロバイダーの応答待ちのため、
+1つのコンテナで多数の入力を同時に処理する（非同期メソッドはイベントループ上のタスク、通常のメソッドはスレッドで動く）。
+文字起こし・シーン変化検出のようにCPU（GPU）を使い切るメソッドは、コンテナあたりの入力を少なくしたうえで、
+メソッドごとの上限までしか同時に実行せず、残りは空きを待つ（待ち時間は gpu_method_queue_seconds に記録する）。
+"""
+
+import asyncio
+import functools
+import inspect
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+
+from metrics import METHOD_QUEUE_SECONDS
+from tracing import current_span
+
+# 文字起こしモデルを使うメソッド（既定の上限は ASR_NUM_WORKERS）
+ASR_METHODS = ("transcribe_audio", "transcribe_chunk", "transcribe_pcm", "assign_speakers")
+
+
+def _parse_method_limits(value: str) -> Dict[str, int]:
+    """'transcribe_audio=1,detect_scene_changes=2' 形式の設定を辞書に変換"""
+    result = {}
+    for item in value.split(","):
+        if "=" in item:
+            method, limit = item.split("=", 1)
+            result[method.strip()] = int(limit)
+    return result
+
+
+@dataclass(frozen=True)
+class ConcurrencyConfig:
+    """
+    コンテナ内の同時実行の設定
+
+    環境変数（{prefix} はクラスごとの接頭辞。LLM / MEDIA）:
+        {prefix}_MAX_INPUTS: 1つのコンテナで同時に処理する入力の上限（デプロイ時に読み込む）
+        {prefix}_TARGET_INPUTS: オートスケーラーが目標にするコンテナあたりの入力数（0は {prefix}_MAX_INPUTS と同じ。デプロイ時に読み込む）
+        METHOD_CONCURRENCY: メソッドごとの同時実行数の上限（例: transcribe_audio=1,detect_scene_changes=2。0は上限なし）
+    """
+
+    max_inputs: int = 16
+    target_inputs: int = 12
+    method_limits: Tuple[Tuple[str, int], ...] = (
+        ("detect_scene_changes", 1),
+        ("detect_scene_changes_in_video", 1),
+    )
+
+    @classmethod
+    def from_env(cls, prefix: str = "LLM", max_inputs: Optional[int] = None, target_inputs: Optional[int] = None) -> "ConcurrencyConfig":
+        """
+        環境変数から設定を読み込む（文字起こしのメソッドの既定の上限は ASR_NUM_WORKERS）
+
+        Args:
+            prefix: 入力数の環境変数の接頭辞
+            max_inputs / target_inputs: 環境変数がない場合の値（省略時はクラスの既定値）
+        """
+        asr_workers = max(1, int(os.getenv("ASR_NUM_WORKERS", 1)))
+        method_limits = {method: asr_workers for method in ASR_METHODS}
+        method_limits.update(cls.method_limits)
+        method_limits.update(_parse_method_limits(os.getenv("METHOD_CONCURRENCY", "")))
+        max_inputs = max(1, int(os.getenv(f"{prefix}_MAX_INPUTS", max_inputs or cls.max_inputs)))
+        target_inputs = int(os.getenv(f"{prefix}_TARGET_INPUTS", target_inputs or cls.target_inputs))
+        return cls(
+            max_inputs=max_inputs,
+            target_inputs=min(target_inputs, max_inputs) if target_inputs > 0 else max_inputs,
+            method_limits=tuple(method_limits.items()),
+        )
+
+    def limit_for(self, method: str) -> int:
+        """メソッドの同時実行数の上限（0は上限なし。max_inputs を超える値は意味がない）"""
+        return dict(self.method_limits).get(method, 0)
+
+
+class MethodLimiter:
+    """
+    1つのメソッドの同時実行数の上限
+
+    非同期メソッドはイベントループ上で asyncio.Semaphore を、通常のメソッドはスレッド間で threading.BoundedSemaphore を使う
+    （Modalは非同期の入力をすべて1つのイベントループで、通常の入力をスレッドで実行する）。
+    上限はコンテナで最初に呼び出されたときに環境変数から読み込む。
+    """
+
+    def __init__(self, method: str):
+        self.method = method
+        self._lock = threading.Lock()
+        self._limit: Optional[int] = None
+        self._thread_semaphore: Optional[threading.BoundedSemaphore] = None
+        self._async_semaphore: Optional[asyncio.Semaphore] = None
+
+    @property
+    def limit(self) -> int:
+        if self._limit is None:
+            with self._lock:
+                if self._limit is None:
+                    self._limit = ConcurrencyConfig.from_env().limit_for(self.method)
+        return self._limit
+
+    def acquire(self) -> bool:
+        """スレッドで空きを待つ（上限がない場合はFalseを返し、release は不要）"""
+        if self.limit <= 0:
+            return False
+        with self._lock:
+            if self._thread_semaphore is None:
+                self._thread_semaphore = threading.BoundedSemaphore(self.limit)
+        started_at = time.perf_counter()
+        self._thread_semaphore.acquire()
+        self._record_wait(time.perf_counter() - started_at)
+        return True
+
+    def release(self):
+        self._thread_semaphore.release()
+
+    async def acquire_async(self) -> bool:
+        """イベントループ上で空きを待つ（上限がない場合はFalseを返し、release_async は不要）"""
+        if self.limit <= 0:
+            return False
+        if self._async_semaphore is None:
+            self._async_semaphore = asyncio.Semaphore(self.limit)
+        started_at = time.perf_counter()
+        await self._async_semaphore.acquire()
+        self._record_wait(time.perf_counter() - started_at)
+        return True
+
+    def release_async(self):
+        self._async_semaphore.release()
+
+    def _record_wait(self, seconds: float):
+        METHOD_QUEUE_SECONDS.observe(seconds, method=self.method)
+        method_span = current_span()
+        if method_span is not None:
+            method_span.set_attributes(queue_ms=round(seconds * 1000, 1))
+
+
+_limiters: Dict[str, MethodLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def limiter(method: str) -> MethodLimiter:
+    """メソッドの MethodLimiter（コンテナで1つ）"""
+    with _limiters_lock:
+        if method not in _limiters:
+            _limiters[method] = MethodLimiter(method)
+        return _limiters[method]
+
+
+def limit_concurrency(method: str) -> Callable:
+    """
+    クラスのメソッドの同時実行数を METHOD_CONCURRENCY の上限までにするデコレーター
+
+    通常の関数・コルーチン関数・ジェネレーター・非同期ジェネレーターのいずれにも使え、元の関数と同じ種類の関数を返す。
+    ジェネレーターは最後のイベントまで（途中で閉じられた場合はそこまで）枠を使う。
+    @traced の内側に付けると、空きを待った時間がメソッドのスパンに queue_ms として付く。
+    """
+    method_limiter = limiter(method)
+
+    def decorator(func: Callable) -> Callable:
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def async_gen_wrapper(*args, **kwargs):
+                acquired = await method_limiter.acquire_async()
+                try:
+                    async for event in func(*args, **kwargs):
+                        yield event
+                finally:
+                    if acquired:
+                        method_limiter.release_async()
+            return async_gen_wrapper
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def gen_wrapper(*args, **kwargs):
+                acquired = method_limiter.acquire()
+                try:
+                    yield from func(*args, **kwargs)
+                finally:
+                    if acquired:
+                        method_limiter.release()
+            return gen_wrapper
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                acquired = await method_limiter.acquire_async()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    if acquired:
+                        method_limiter.release_async()
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            acquired = method_limiter.acquire()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                if acquired:
+                    method_limiter.release()
+        return wrapper
+
+    return decorator
@@ -0,0 +1,110 @@
+"""
+複数画像の一括分析
+同時に実行するプロバイダー呼び出しの上限と、小さい画像を1回の呼び出しにまとめる計画・応答の分割
+"""
+
+import json
+import os
+from dataclasses import dataclass
+from typing import List, Optional
+
+
+@dataclass(frozen=True)
+class ImageBatchConfig:
+    """
+    複数画像の一括分析の設定
+
+    環境変数:
+        IMAGE_BATCH_CONCURRENCY: 同時に実行するプロバイダー呼び出しの上限
+        IMAGE_BATCH_MAX_IMAGES: 1リクエストで受け付ける画像の最大枚数
+        IMAGE_PACK_MAX_IMAGES: 1回の呼び出しにまとめる画像の最大枚数
+        IMAGE_PACK_MAX_BYTES: まとめる対象にする画像の最大サイズ（前処理後のバイト数）
+    """
+
+    concurrency: int = 8
+    max_images: int = 64
+    pack_max_images: int = 4
+    pack_max_bytes: int = 300_000
+
+    @classmethod
+    def from_env(cls) -> "ImageBatchConfig":
+        """環境変数から設定を読み込む"""
+        return cls(
+            concurrency=int(os.getenv("IMAGE_BATCH_CONCURRENCY", cls.concurrency)),
+            max_images=int(os.getenv("IMAGE_BATCH_MAX_IMAGES", cls.max_images)),
+            pack_max_images=int(os.getenv("IMAGE_PACK_MAX_IMAGES", cls.pack_max_images)),
+            pack_max_bytes=int(os.getenv("IMAGE_PACK_MAX_BYTES", cls.pack_max_bytes)),
+        )
+
+
+def plan_image_groups(sizes: List[Optional[int]], config: ImageBatchConfig, pack: bool) -> List[List[int]]:
+    """
+    画像を1回のプロバイダー呼び出しで処理する単位に分ける
+
+    pack が有効な場合、pack_max_bytes 以下の画像を先頭から pack_max_images 枚ずつまとめる。
+    それより大きい画像は1枚ずつ処理する。
+
+    Args:
+        sizes: 前処理後の画像のバイト数（前処理に失敗した画像はNone）
+        config: 一括分析の設定
+        pack: 小さい画像をまとめるか
+
+    Returns:
+        画像のインデックスのリストのリスト
+    """
+    groups: List[List[int]] = []
+    current: List[int] = []
+    for index, size in enumerate(sizes):
+        if size is None:
+            continue
+        if not pack or config.pack_max_images <= 1 or size > config.pack_max_bytes:
+            groups.append([index])
+            continue
+        current.append(index)
+        if len(current) >= config.pack_max_images:
+            groups.append(current)
+            current = []
+    if current:
+        groups.append(current)
+    return groups
+
+
+def build_packed_prompt(prompt: str, count: int) -> str:
+    """複数の画像をまとめて分析する際のプロンプト"""
+    return f"""これから{count}枚の画像（画像1〜画像{count}）を送ります。
+それぞれの画像について、次の指示に従って個別に分析してください。
+
+{prompt.strip()}
+
+回答は、画像の順番どおりに{count}個の要素を持つJSON配列だけにしてください（各要素が1枚分の回答です）。
+"""
+
+
+def split_packed_analysis(text: str, count: int) -> List[str]:
+    """
+    まとめて分析した応答を画像ごとの回答に分割
+
+    Returns:
+        画像ごとの回答（JSONの要素は文字列に戻す）
+
+    Raises:
+        ValueError: 応答がcount個の要素を持つJSON配列でない場合
+    """
+    start = text.find("[")
+    end = text.rfind("]")
+    if start < 0 or end < start:
+        raise ValueError("応答にJSON配列がありません")
+
+    try:
+        items = json.loads(text[start:end + 1])
+    except json.JSONDecodeError as e:
+        raise ValueError(f"応答のJSON配列を解析できません: {e}")
+
+    if not isinstance(items, list) or len(items) != count:
+        found = len(items) if isinstance(items, list) else 0
+        raise ValueError(f"応答の要素数が画像の枚数と一致しません（{found} / {count}）")
+
+    return [
+        item if isinstance(item, str) else json.dumps(item, ensure_ascii=False, indent=2)
+        for item in items
+    ]
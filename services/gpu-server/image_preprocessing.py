@@ -0,0 +1,260 @@
+"""
+画像の前処理
+Vision API に送る前に、実際の形式の判定・ピクセル数の上限までの縮小・目標サイズまでの再圧縮・メタデータの削除を行う
+"""
+
+import io
+import math
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+# Vision API（OpenAI / Anthropic）が受け付ける形式
+SUPPORTED_MEDIA_TYPES = ("image/jpeg", "image/png", "image/gif", "image/webp")
+
+# 再圧縮で縮小をやり直す最大回数と、1回あたりの縮小率
+MAX_DOWNSCALE_ATTEMPTS = 3
+DOWNSCALE_STEP = 0.75
+
+# Anthropic のドキュメントにある画像トークン数の目安（幅 × 高さ / 750）
+PIXELS_PER_VISION_TOKEN = 750
+
+
+@dataclass(frozen=True)
+class ImagePreprocessConfig:
+    """
+    画像前処理の設定
+
+    環境変数:
+        IMAGE_PREPROCESS_ENABLED: 前処理を行うか（false の場合は形式の判定のみ）
+        IMAGE_MAX_PIXELS: 縮小後のピクセル数の上限（幅 × 高さ）
+        IMAGE_TARGET_BYTES: 再圧縮後のファイルサイズの目標（バイト）
+        IMAGE_JPEG_QUALITY: JPEG の初期品質
+        IMAGE_MIN_JPEG_QUALITY: 目標サイズに収めるために下げる品質の下限
+        IMAGE_PREPROCESS_WORKERS: 前処理を行うスレッド数（0はCPU数）
+        IMAGE_UPLOAD_MBPS: 削減できた送信時間の見積もりに使う帯域（Mbps）
+    """
+
+    enabled: bool = True
+    max_pixels: int = 1_150_000
+    target_bytes: int = 500_000
+    jpeg_quality: int = 85
+    min_jpeg_quality: int = 55
+    workers: int = 0
+    upload_mbps: float = 50.0
+
+    @classmethod
+    def from_env(cls) -> "ImagePreprocessConfig":
+        """環境変数から設定を読み込む"""
+        return cls(
+            enabled=os.getenv("IMAGE_PREPROCESS_ENABLED", "true").lower() == "true",
+            max_pixels=int(os.getenv("IMAGE_MAX_PIXELS", cls.max_pixels)),
+            target_bytes=int(os.getenv("IMAGE_TARGET_BYTES", cls.target_bytes)),
+            jpeg_quality=int(os.getenv("IMAGE_JPEG_QUALITY", cls.jpeg_quality)),
+            min_jpeg_quality=int(os.getenv("IMAGE_MIN_JPEG_QUALITY", cls.min_jpeg_quality)),
+            workers=int(os.getenv("IMAGE_PREPROCESS_WORKERS", cls.workers)),
+            upload_mbps=float(os.getenv("IMAGE_UPLOAD_MBPS", cls.upload_mbps)),
+        )
+
+    @property
+    def max_workers(self) -> int:
+        return self.workers if self.workers > 0 else (os.cpu_count() or 1)
+
+
+@dataclass
+class PreprocessedImage:
+    """前処理済みの画像"""
+
+    data: bytes
+    media_type: str
+    original_bytes: int
+    original_media_type: Optional[str]
+    original_size: Optional[Tuple[int, int]]
+    size: Optional[Tuple[int, int]]
+    elapsed_ms: float
+
+    def report(self, upload_mbps: float) -> Dict[str, Any]:
+        """前処理で削減できたバイト数・送信時間・画像トークン数"""
+        bytes_saved = self.original_bytes - len(self.data)
+        # リクエストにはBase64で埋め込まれる（4/3倍）
+        base64_bytes_saved = math.ceil(self.original_bytes / 3) * 4 - math.ceil(len(self.data) / 3) * 4
+        upload_ms_saved = base64_bytes_saved * 8 / (upload_mbps * 1_000_000) * 1000 if upload_mbps > 0 else 0.0
+
+        report = {
+            "original_media_type": self.original_media_type,
+            "media_type": self.media_type,
+            "original_bytes": self.original_bytes,
+            "bytes": len(self.data),
+            "bytes_saved": bytes_saved,
+            "base64_bytes_saved": base64_bytes_saved,
+            "original_size": list(self.original_size) if self.original_size else None,
+            "size": list(self.size) if self.size else None,
+            "preprocess_ms": round(self.elapsed_ms, 1),
+            "estimated_upload_ms_saved": round(upload_ms_saved, 1),
+        }
+        if self.original_size and self.size:
+            report["estimated_vision_tokens"] = _vision_tokens(self.size)
+            report["estimated_vision_tokens_saved"] = _vision_tokens(self.original_size) - _vision_tokens(self.size)
+        return report
+
+
+def _vision_tokens(size: Tuple[int, int]) -> int:
+    return math.ceil(size[0] * size[1] / PIXELS_PER_VISION_TOKEN)
+
+
+def sniff_media_type(data: bytes) -> Optional[str]:
+    """先頭バイトから画像形式を判定（判定できない場合はNone）"""
+    if data[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[4:12] in (b"ftypheic", b"ftypheix", b"ftypmif1", b"ftypmsf1"):
+        return "image/heic"
+    if data[:2] == b"BM":
+        return "image/bmp"
+    if data[:4] in (b"II*\x00", b"MM\x00*"):
+        return "image/tiff"
+    return None
+
+
+def preprocess_image(data: bytes, config: ImagePreprocessConfig) -> PreprocessedImage:
+    """
+    画像を Vision API 向けに前処理
+
+    - 実際の形式を判定し、正しい media_type を付ける
+    - EXIFの回転情報を画素に反映してから、EXIF / XMP / ICC などのメタデータを削除する
+    - ピクセル数が max_pixels を超える場合は縮小する
+    - target_bytes を超える場合は品質を下げ、それでも超える場合はさらに縮小して再圧縮する
+
+    上限内でメタデータもない対応形式の画像はそのまま返す。
+
+    Raises:
+        ValueError: 画像として読み込めない、または対応していない形式の場合
+    """
+    started_at = time.perf_counter()
+    media_type = sniff_media_type(data)
+
+    def result(output: bytes, output_type: str, original_size=None, size=None) -> PreprocessedImage:
+        return PreprocessedImage(
+            data=output,
+            media_type=output_type,
+            original_bytes=len(data),
+            original_media_type=media_type,
+            original_size=original_size,
+            size=size,
+            elapsed_ms=(time.perf_counter() - started_at) * 1000,
+        )
+
+    if not config.enabled:
+        if media_type not in SUPPORTED_MEDIA_TYPES:
+            raise ValueError(f"未対応の画像形式です: {media_type or '不明'}")
+        return result(data, media_type)
+
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    try:
+        image = Image.open(io.BytesIO(data))
+        original_size = image.size
+    except UnidentifiedImageError:
+        if media_type in SUPPORTED_MEDIA_TYPES:
+            # Pillowで開けなくても Vision API が受け付ける形式ならそのまま送る
+            return result(data, media_type)
+        raise ValueError(f"画像として読み込めません: {media_type or '不明な形式'}")
+
+    width, height = original_size
+    has_metadata = any(key in image.info for key in ("exif", "xmp", "icc_profile", "comment"))
+    if (
+        media_type in SUPPORTED_MEDIA_TYPES
+        and width * height <= config.max_pixels
+        and len(data) <= config.target_bytes
+        and not has_metadata
+    ):
+        return result(data, media_type, original_size, original_size)
+
+    # JPEGはデコード時にDCTの段階で縮小できる（目標サイズの2倍以上を保つ）
+    scale = min(1.0, math.sqrt(config.max_pixels / (width * height)))
+    if image.format == "JPEG" and scale < 0.5:
+        image.draft("RGB", (int(width * scale * 2), int(height * scale * 2)))
+
+    # 回転情報を画素に反映（メタデータを削除すると向きが失われるため）。アニメーションは先頭フレームのみ
+    image = ImageOps.exif_transpose(image)
+
+    has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+    image = image.convert("RGBA" if has_alpha else "RGB")
+
+    target = _fit_pixels(image.size, config.max_pixels)
+    for _ in range(MAX_DOWNSCALE_ATTEMPTS + 1):
+        resized = image if target == image.size else image.resize(target, Image.LANCZOS)
+        output, output_type = _encode(resized, has_alpha, config)
+        if len(output) <= config.target_bytes:
+            break
+        target = (max(1, int(target[0] * DOWNSCALE_STEP)), max(1, int(target[1] * DOWNSCALE_STEP)))
+
+    if (
+        len(output) >= len(data)
+        and media_type in SUPPORTED_MEDIA_TYPES
+        and not has_metadata
+        and resized.size == original_size
+    ):
+        # 縮小も不要で再圧縮しても小さくならない場合は元の画像を使う
+        return result(data, media_type, original_size, original_size)
+
+    return result(output, output_type, original_size, resized.size)
+
+
+def _fit_pixels(size: Tuple[int, int], max_pixels: int) -> Tuple[int, int]:
+    """アスペクト比を保ってピクセル数を max_pixels 以下にしたサイズ"""
+    width, height = size
+    if width * height <= max_pixels:
+        return size
+    scale = math.sqrt(max_pixels / (width * height))
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def _encode(image, has_alpha: bool, config: ImagePreprocessConfig) -> Tuple[bytes, str]:
+    """
+    目標サイズに収まるよう圧縮（メタデータは書き込まない）
+
+    透過のある画像はPNG、それ以外（またはPNGで目標サイズを超える場合）はJPEGにする。
+    JPEGの品質は jpeg_quality から min_jpeg_quality の範囲で二分探索する。
+    """
+    if has_alpha:
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG", optimize=True)
+        if buffer.tell() <= config.target_bytes:
+            return buffer.getvalue(), "image/png"
+        # 透過部分を白で塗りつぶしてJPEGにする
+        from PIL import Image
+
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        image = background
+
+    def encode_jpeg(quality: int) -> bytes:
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=quality, optimize=True, progressive=True)
+        return buffer.getvalue()
+
+    best = encode_jpeg(config.jpeg_quality)
+    if len(best) <= config.target_bytes:
+        return best, "image/jpeg"
+
+    low, high = config.min_jpeg_quality, config.jpeg_quality - 1
+    smallest = None
+    while low <= high:
+        quality = (low + high) // 2
+        output = encode_jpeg(quality)
+        if len(output) <= config.target_bytes:
+            best = output
+            low = quality + 1
+        else:
+            smallest = output
+            high = quality - 1
+    if len(best) > config.target_bytes and smallest is not None:
+        best = smallest
+    return best, "image/jpeg"
@@ -0,0 +1,260 @@
+"""
+ライブ文字起こし
+連続した音声ストリームをスライディングウィンドウで繰り返し文字起こしし、途中結果（partial）と確定結果（final）を返す
+
+確定していない音声（最後に確定した単語の終わり以降）だけをウィンドウとして文字起こしし、
+連続する2回の結果で先頭から一致した単語を確定する（一致するまでは途中結果として返す）。
+ウィンドウの末尾が無音の場合（発話の区切り）や、ウィンドウが長くなりすぎた場合はその時点の結果を確定する。
+"""
+
+import asyncio
+import os
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from audio_chunking import join_words
+
+SAMPLE_RATE = 16000
+
+# 入力の形式（pcm_s16le はそのまま、それ以外はffmpegでデコードする）
+FFMPEG_INPUT_FORMATS = {"webm": "matroska", "ogg": "ogg"}
+
+
+@dataclass(frozen=True)
+class LiveTranscriptionConfig:
+    """
+    ライブ文字起こしの設定
+
+    環境変数:
+        LIVE_HOP_MS: 新しい音声がこの長さだけ届くごとに文字起こしする（ミリ秒）
+        LIVE_WINDOW_SECONDS: 確定していない音声の最大の長さ（秒）。超えた場合は古い部分を確定する
+        LIVE_SILENCE_MS: ウィンドウの末尾がこの長さだけ無音なら発話の区切りとして確定する（ミリ秒）
+        LIVE_SILENCE_RMS: 無音とみなす音量（RMS、0〜1）
+        LIVE_BEAM_SIZE: ライブ文字起こしのビームサーチの幅（小さいほど低遅延）
+    """
+
+    hop_ms: int = 500
+    window_seconds: float = 15.0
+    silence_ms: int = 700
+    silence_rms: float = 0.01
+    beam_size: int = 1
+
+    @classmethod
+    def from_env(cls) -> "LiveTranscriptionConfig":
+        """環境変数から設定を読み込む"""
+        return cls(
+            hop_ms=int(os.getenv("LIVE_HOP_MS", cls.hop_ms)),
+            window_seconds=float(os.getenv("LIVE_WINDOW_SECONDS", cls.window_seconds)),
+            silence_ms=int(os.getenv("LIVE_SILENCE_MS", cls.silence_ms)),
+            silence_rms=float(os.getenv("LIVE_SILENCE_RMS", cls.silence_rms)),
+            beam_size=int(os.getenv("LIVE_BEAM_SIZE", cls.beam_size)),
+        )
+
+
+def pcm_to_float(data: bytes) -> np.ndarray:
+    """16bit リトルエンディアンのPCMをfloat32配列に変換"""
+    return np.frombuffer(data[:len(data) - len(data) % 2], dtype="<i2").astype(np.float32) / 32768.0
+
+
+def float_to_pcm(audio: np.ndarray) -> bytes:
+    """float32配列を16bit リトルエンディアンのPCMに変換"""
+    return (np.clip(audio, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+
+def resample(audio: np.ndarray, sample_rate: int) -> np.ndarray:
+    """16kHzに変換（音声認識向けの線形補間）"""
+    if sample_rate == SAMPLE_RATE or len(audio) == 0:
+        return audio
+    length = int(round(len(audio) * SAMPLE_RATE / sample_rate))
+    positions = np.arange(length, dtype=np.float64) * (sample_rate / SAMPLE_RATE)
+    return np.interp(positions, np.arange(len(audio)), audio).astype(np.float32)
+
+
+def _normalize(word: str) -> str:
+    return re.sub(r"[\s\W]+", "", word.lower())
+
+
+def hypothesis_words(segments: List[Dict[str, Any]], offset: float) -> List[Dict[str, Any]]:
+    """文字起こし結果の単語をストリーム全体の時刻で並べる（単語がないセグメントはセグメント全体を1単語とする）"""
+    words = []
+    for segment in segments:
+        for word in segment.get("words") or [segment]:
+            text = word.get("word", word.get("text", ""))
+            if not text.strip():
+                continue
+            words.append({
+                "word": text,
+                "start": round(word["start"] + offset, 3) if word.get("start") is not None else None,
+                "end": round(word["end"] + offset, 3) if word.get("end") is not None else None,
+            })
+    return words
+
+
+class LiveTranscriber:
+    """
+    スライディングウィンドウによる逐次文字起こしの状態
+
+    保持するのは確定していない音声だけなので、長時間のストリームでもメモリ使用量は window_seconds 程度に収まる。
+    文字起こしの呼び出しは同時に1つだけ行う前提（window で取り出し、結果を update に渡す）。
+    """
+
+    def __init__(self, config: LiveTranscriptionConfig):
+        self.config = config
+        self._audio = np.empty(0, dtype=np.float32)
+        self._offset = 0.0
+        self._received = 0
+        self._decoded_until = 0
+        self._window_silent = False
+        self._previous: List[Dict[str, Any]] = []
+        self.segments: List[Dict[str, Any]] = []
+
+    @property
+    def duration(self) -> float:
+        """受信した音声の長さ（秒）"""
+        return self._received / SAMPLE_RATE
+
+    def add_audio(self, audio: np.ndarray):
+        """16kHzモノラルの音声を追加"""
+        if len(audio):
+            self._audio = np.concatenate([self._audio, audio])
+            self._received += len(audio)
+
+    def ready(self) -> bool:
+        """前回の文字起こしから hop_ms 以上の音声が届いたか"""
+        return self._received - self._decoded_until >= self.config.hop_ms * SAMPLE_RATE // 1000
+
+    def unfinished(self) -> bool:
+        """確定していない音声が残っているか"""
+        return len(self._audio) > 0
+
+    def window(self) -> Tuple[np.ndarray, float]:
+        """
+        文字起こしする音声（確定していない部分）を取り出す
+
+        Returns:
+            (音声, ストリーム上の開始時刻（秒）)
+        """
+        self._decoded_until = self._received
+        silence = self.config.silence_ms * SAMPLE_RATE // 1000
+        tail = self._audio[-silence:]
+        self._window_silent = (
+            len(self._audio) > silence
+            and float(np.sqrt(np.mean(tail * tail))) < self.config.silence_rms
+        )
+        return self._audio.copy(), self._offset
+
+    def update(self, segments: List[Dict[str, Any]], offset: float, window_seconds: float, final: bool = False) -> List[Dict[str, Any]]:
+        """
+        ウィンドウの文字起こし結果から確定する単語を決め、送信するイベントを返す
+
+        Args:
+            segments: ウィンドウ内の時刻のセグメント
+            offset: window が返した開始時刻
+            window_seconds: 文字起こししたウィンドウの長さ（秒）
+            final: ストリームの終了時（残りをすべて確定する）
+
+        Returns:
+            [{"type": "final", "start", "end", "text", "words"}, {"type": "partial", "start", "end", "text"}]
+        """
+        words = hypothesis_words(segments, offset)
+        original_text = " ".join(segment.get("text", "") for segment in segments)
+
+        if final or self._window_silent:
+            commit = len(words)
+        else:
+            # 前回の結果と先頭から一致した単語を確定
+            commit = 0
+            for current, previous in zip(words, self._previous):
+                if _normalize(current["word"]) != _normalize(previous["word"]):
+                    break
+                commit += 1
+            if window_seconds > self.config.window_seconds:
+                # 確定しないままウィンドウが長くなりすぎた場合は、末尾1秒より前の単語を確定する
+                limit = offset + window_seconds - 1.0
+                while commit < len(words) and (words[commit]["end"] or limit) < limit:
+                    commit += 1
+
+        events = []
+        committed, remaining = words[:commit], words[commit:]
+        if committed:
+            segment = {
+                "start": next((w["start"] for w in committed if w["start"] is not None), offset),
+                "end": next((w["end"] for w in reversed(committed) if w["end"] is not None), offset + window_seconds),
+                "text": join_words(committed, original_text),
+                "words": committed,
+            }
+            self.segments.append(segment)
+            events.append({"type": "final", **segment})
+            self._trim(segment["end"])
+        elif final or (self._window_silent and not words):
+            # 無音のみのウィンドウは破棄する
+            self._trim(offset + window_seconds)
+        elif window_seconds > self.config.window_seconds:
+            # 単語にならない音（雑音など）が続く場合も末尾1秒だけ残して捨てる
+            self._trim(offset + window_seconds - 1.0)
+
+        self._previous = remaining
+        if remaining:
+            events.append({
+                "type": "partial",
+                "start": next((w["start"] for w in remaining if w["start"] is not None), offset),
+                "end": next((w["end"] for w in reversed(remaining) if w["end"] is not None), offset + window_seconds),
+                "text": join_words(remaining, original_text),
+            })
+        return events
+
+    def _trim(self, until: float):
+        """until 秒より前の音声を捨てる"""
+        cut = min(len(self._audio), max(0, int(round((until - self._offset) * SAMPLE_RATE))))
+        self._audio = self._audio[cut:]
+        self._offset += cut / SAMPLE_RATE
+
+
+class StreamDecoder:
+    """WebM / Ogg に入ったOpusなどのストリームをffmpegで16kHzモノラルのPCMに逐次デコード"""
+
+    def __init__(self, encoding: str):
+        if encoding not in FFMPEG_INPUT_FORMATS:
+            raise ValueError(f"未サポートの音声形式: {encoding}（pcm_s16le / {' / '.join(FFMPEG_INPUT_FORMATS)}）")
+        self.input_format = FFMPEG_INPUT_FORMATS[encoding]
+        self.process: Optional[asyncio.subprocess.Process] = None
+
+    async def start(self):
+        # 低遅延のため入力の解析を最小限にする
+        self.process = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-v", "error", "-nostdin",
+            "-probesize", "4096", "-analyzeduration", "0", "-fflags", "nobuffer",
+            "-f", self.input_format, "-i", "pipe:0",
+            "-vn", "-ac", "1", "-ar", str(SAMPLE_RATE),
+            "-f", "s16le", "pipe:1",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+
+    async def write(self, data: bytes):
+        self.process.stdin.write(data)
+        await self.process.stdin.drain()
+
+    async def read(self) -> Optional[bytes]:
+        """デコード済みのPCMを読み込む（終了時はNone）"""
+        data = await self.process.stdout.read(SAMPLE_RATE // 10 * 2)
+        return data or None
+
+    async def close_input(self):
+        if self.process and not self.process.stdin.is_closing():
+            self.process.stdin.close()
+
+    async def close(self):
+        if self.process is None:
+            return
+        await self.close_input()
+        if self.process.returncode is None:
+            try:
+                await asyncio.wait_for(self.process.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                self.process.kill()
+                await self.process.wait()
@@ -0,0 +1,170 @@
+"""
+LLMプロバイダークライアント
+コンテナ内で使い回す長寿命クライアントとkeep-alive HTTPコネクションプールの生成
+"""
+
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+SUPPORTED_PROVIDERS = ("openai", "anthropic")
+
+
+@dataclass(frozen=True)
+class HTTPPoolConfig:
+    """
+    HTTPコネクションプール設定
+
+    環境変数:
+        LLM_HTTP_MAX_CONNECTIONS: 同時接続数の上限
+        LLM_HTTP_MAX_KEEPALIVE: keep-aliveで保持する接続数の上限
+        LLM_HTTP_KEEPALIVE_EXPIRY: アイドル接続を保持する秒数
+        LLM_HTTP_CONNECT_TIMEOUT: 接続タイムアウト（秒）
+        LLM_HTTP_READ_TIMEOUT: 読み取りタイムアウト（秒）
+    """
+
+    max_connections: int = 20
+    max_keepalive_connections: int = 10
+    keepalive_expiry: float = 60.0
+    connect_timeout: float = 10.0
+    read_timeout: float = 600.0
+
+    @classmethod
+    def from_env(cls) -> "HTTPPoolConfig":
+        """環境変数から設定を読み込む"""
+        return cls(
+            max_connections=int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", cls.max_connections)),
+            max_keepalive_connections=int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", cls.max_keepalive_connections)),
+            keepalive_expiry=float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", cls.keepalive_expiry)),
+            connect_timeout=float(os.getenv("LLM_HTTP_CONNECT_TIMEOUT", cls.connect_timeout)),
+            read_timeout=float(os.getenv("LLM_HTTP_READ_TIMEOUT", cls.read_timeout)),
+        )
+
+    def httpx_options(self) -> Dict[str, Any]:
+        """httpxクライアントに渡すlimits/timeout"""
+        import httpx
+
+        return {
+            "limits": httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+            "timeout": httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+        }
+
+
+def create_llm_client(
+    provider: str,
+    api_key: str,
+    pool_config: HTTPPoolConfig,
+    base_url: Optional[str] = None,
+    asynchronous: bool = True,
+) -> Any:
+    """
+    プロバイダーのSDKクライアントを生成
+
+    Args:
+        provider: 'openai' または 'anthropic'
+        api_key: APIキー
+        pool_config: HTTPコネクションプール設定
+        base_url: エンドポイントの上書き（未指定時はSDKのデフォルト / 環境変数）
+        asynchronous: Trueの場合はAsyncOpenAI / AsyncAnthropicを返す
+
+    Returns:
+        OpenAI / AsyncOpenAI または Anthropic / AsyncAnthropic クライアント
+    """
+    if provider == "openai":
+        import openai
+
+        if asynchronous:
+            return openai.AsyncOpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                http_client=openai.DefaultAsyncHttpxClient(**pool_config.httpx_options()),
+            )
+        return openai.OpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=openai.DefaultHttpxClient(**pool_config.httpx_options()),
+        )
+
+    elif provider == "anthropic":
+        import anthropic
+
+        if asynchronous:
+            return anthropic.AsyncAnthropic(
+                api_key=api_key,
+                base_url=base_url,
+                http_client=anthropic.DefaultAsyncHttpxClient(**pool_config.httpx_options()),
+            )
+        return anthropic.Anthropic(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=anthropic.DefaultHttpxClient(**pool_config.httpx_options()),
+        )
+
+    raise ValueError(f"未サポートのプロバイダー: {provider}")
+
+
+def create_provider_clients(
+    api_keys: Dict[str, Optional[str]],
+    pool_config: HTTPPoolConfig,
+    asynchronous: bool = True,
+) -> Dict[str, Any]:
+    """
+    APIキーが設定されているプロバイダーのクライアントをまとめて生成
+
+    Args:
+        api_keys: プロバイダー名 -> APIキー
+        pool_config: HTTPコネクションプール設定
+        asynchronous: Trueの場合は非同期クライアントを生成
+
+    Returns:
+        プロバイダー名 -> クライアント
+    """
+    return {
+        provider: create_llm_client(provider, api_key, pool_config, asynchronous=asynchronous)
+        for provider, api_key in api_keys.items()
+        if api_key
+    }
+
+
+def anthropic_system_blocks(system: str) -> List[Dict[str, Any]]:
+    """
+    Anthropicのシステムプロンプトをプロンプトキャッシュの対象にする
+
+    cache_control のブレークポイントまでのプレフィックスがキャッシュされ、
+    有効期間（5分、使われるたびに延長）内に同じプレフィックスで呼び出すと入力の処理が省かれる。
+    """
+    return [{"type": "text", "text": system, "cache_control": {"type": "ephemeral"}}]
+
+
+def usage_summary(provider: str, usage: Any) -> Dict[str, int]:
+    """
+    プロバイダーのusageを共通の形式にする
+
+    OpenAIは1024トークン以上のプロンプトの先頭が前回と一致すれば自動的にキャッシュされ、cached_tokens に現れる。
+
+    Returns:
+        {"input_tokens"（キャッシュ分を含む入力全体）, "output_tokens",
+         "cached_tokens"（キャッシュから読み込んだ分）, "cache_write_tokens"（キャッシュに書き込んだ分、Anthropicのみ）}
+    """
+    if usage is None:
+        return {}
+    if provider == "openai":
+        details = getattr(usage, "prompt_tokens_details", None)
+        return {
+            "input_tokens": usage.prompt_tokens or 0,
+            "output_tokens": usage.completion_tokens or 0,
+            "cached_tokens": (getattr(details, "cached_tokens", None) or 0) if details else 0,
+            "cache_write_tokens": 0,
+        }
+    cache_read = getattr(usage, "cache_read_input_tokens", None) or 0
+    cache_write = getattr(usage, "cache_creation_input_tokens", None) or 0
+    return {
+        "input_tokens": (usage.input_tokens or 0) + cache_read + cache_write,
+        "output_tokens": usage.output_tokens or 0,
+        "cached_tokens": cache_read,
+        "cache_write_tokens": cache_write,
+    }
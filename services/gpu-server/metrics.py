@@ -0,0 +1,514 @@
+"""
+Prometheus形式のメトリクス
+カウンター・ゲージ・ヒストグラムをコンテナ内のメモリに集計し、/metrics でテキスト形式（text/plain; version=0.0.4）に変換する
+
+GPUクラスのコンテナは複数起動し、Webエンドポイントとは別のコンテナで動くため、
+各コンテナは集計結果（snapshot）を一定間隔で共有Dictに書き込み、/metrics はそれらを container ラベルを付けてまとめて返す。
+記録はメモリ上の加算だけで、リクエストの処理中にI/Oは発生しない。
+"""
+
+import asyncio
+import bisect
+import functools
+import inspect
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# レイテンシのバケット（秒）。画像の前処理（数ミリ秒）からコード生成（数分）までを1つの区切りで扱う
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# ペイロードのサイズのバケット（バイト）
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+# 処理の段階（stage ラベル）
+STAGE_QUEUE = "queue"
+STAGE_PROVIDER = "provider"
+STAGE_PARSE = "parse"
+
+
+@dataclass(frozen=True)
+class MetricsConfig:
+    """
+    メトリクスの設定
+
+    環境変数:
+        METRICS_ENABLED: メトリクスを共有Dictに書き込むか（無効の場合もコンテナ内の集計は行う）
+        METRICS_PUBLISH_INTERVAL_SECONDS: 各コンテナが集計結果を共有Dictに書き込む間隔（秒）
+        METRICS_STALE_SECONDS: この時間より前に書き込まれたコンテナの集計結果は /metrics に含めない（秒）
+    """
+
+    enabled: bool = True
+    publish_interval: float = 15.0
+    stale_seconds: float = 300.0
+
+    @classmethod
+    def from_env(cls) -> "MetricsConfig":
+        """環境変数から設定を読み込む"""
+        return cls(
+            enabled=os.getenv("METRICS_ENABLED", "true").lower() == "true",
+            publish_interval=max(1.0, float(os.getenv("METRICS_PUBLISH_INTERVAL_SECONDS", cls.publish_interval))),
+            stale_seconds=float(os.getenv("METRICS_STALE_SECONDS", cls.stale_seconds)),
+        )
+
+
+class _Metric:
+    """ラベルの値の組ごとに値を持つメトリクスの共通部分"""
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} のラベルは {', '.join(self.labelnames)} です: {sorted(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            samples = [[list(key), self._copy(value)] for key, value in self._values.items()]
+        return {
+            "type": self.kind,
+            "help": self.documentation,
+            "labels": list(self.labelnames),
+            "samples": samples,
+        }
+
+    @staticmethod
+    def _copy(value: Any) -> Any:
+        return value
+
+
+class Counter(_Metric):
+    """増えるだけの値（件数・トークン数など）"""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """増減する値（処理中の数など）"""
+
+    kind = "gauge"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """
+    分布（レイテンシ・サイズなど）
+
+    値は {"buckets": バケットごとの件数（累積ではない）, "sum", "count"} で持ち、出力時に累積にする。
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = {"buckets": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            entry["buckets"][index] += 1
+            entry["sum"] += value
+            entry["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """with ブロックの所要時間（秒）を記録"""
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def snapshot(self) -> Dict[str, Any]:
+        snapshot = super().snapshot()
+        snapshot["buckets"] = list(self.buckets)
+        return snapshot
+
+    @staticmethod
+    def _copy(value: Any) -> Any:
+        return {"buckets": list(value["buckets"]), "sum": value["sum"], "count": value["count"]}
+
+
+class Registry:
+    """メトリクスの登録先"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"メトリクスが重複しています: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Iterable[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """全メトリクスの現在値（pickle・JSONにできる形式。共有Dictに書き込む）"""
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+
+REGISTRY = Registry()
+
+# GPUクラスのメソッド
+METHOD_INFLIGHT = REGISTRY.gauge(
+    "gpu_method_inflight", "処理中のメソッド呼び出しの数", ("method",)
+)
+METHOD_SECONDS = REGISTRY.histogram(
+    "gpu_method_duration_seconds", "メソッド呼び出しの所要時間（ストリーミングは最後のイベントまで）", ("method", "status")
+)
+METHOD_ERRORS = REGISTRY.counter(
+    "gpu_method_errors_total", "例外で終了したメソッド呼び出しの数", ("method", "error")
+)
+METHOD_QUEUE_SECONDS = REGISTRY.histogram(
+    "gpu_method_queue_seconds", "メソッドごとの同時実行数の上限（METHOD_CONCURRENCY）の空き待ちの時間", ("method",)
+)
+PAYLOAD_BYTES = REGISTRY.histogram(
+    "gpu_method_payload_bytes", "メソッドの引数（request）・戻り値（response）のおおよそのサイズ", ("method", "direction"), SIZE_BUCKETS
+)
+STAGE_SECONDS = REGISTRY.histogram(
+    "gpu_stage_duration_seconds", "処理の段階（queue: ワーカープールの空き待ち / provider: LLM呼び出し / parse: 応答の解析）ごとの所要時間", ("operation", "stage")
+)
+
+# コンテナの起動
+CONTAINER_STARTS = REGISTRY.counter(
+    "gpu_container_starts_total", "起動したコンテナの数（start: cold = 初期化をすべて実行 / restored = メモリスナップショットから復元）", ("start",)
+)
+CONTAINER_INIT_SECONDS = REGISTRY.histogram(
+    "gpu_container_init_seconds",
+    "コンテナの初期化の所要時間（phase: pre_snapshot / post_snapshot = スナップショットの前後の初期化 / total = 入力を受け付けるまで）",
+    ("start", "phase"),
+)
+
+# LLMプロバイダー
+LLM_REQUEST_SECONDS = REGISTRY.histogram(
+    "llm_request_duration_seconds", "LLMプロバイダー呼び出しの所要時間", ("provider", "operation", "status")
+)
+LLM_PROMPT_TOKENS = REGISTRY.counter(
+    "llm_prompt_tokens_total", "プロンプト（入力）のトークン数", ("provider", "model", "operation")
+)
+LLM_CACHED_PROMPT_TOKENS = REGISTRY.counter(
+    "llm_cached_prompt_tokens_total", "プロンプトのうちプロンプトキャッシュから読み込んだトークン数", ("provider", "model", "operation")
+)
+LLM_COMPLETION_TOKENS = REGISTRY.counter(
+    "llm_completion_tokens_total", "生成（出力）のトークン数", ("provider", "model", "operation")
+)
+LLM_ERRORS = REGISTRY.counter(
+    "llm_errors_total", "失敗したLLMプロバイダー呼び出しの数", ("provider", "operation", "error")
+)
+LLM_FALLBACKS = REGISTRY.counter(
+    "llm_fallbacks_total", "プライマリ以外のプロバイダーの結果を使った数（reason: error / hedge / circuit_open）", ("operation", "provider", "reason")
+)
+RESPONSE_CACHE_LOOKUPS = REGISTRY.counter(
+    "llm_response_cache_lookups_total", "応答キャッシュの参照（result: memory / disk / miss）", ("operation", "result")
+)
+
+# Webエンドポイント（GPUクラスの呼び出しの待ち時間・コールドスタートを含む）
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTPリクエストの所要時間（ストリーミングはレスポンスヘッダーまで）", ("method", "path", "status")
+)
+HTTP_INFLIGHT = REGISTRY.gauge(
+    "http_requests_inflight", "処理中のHTTPリクエストの数"
+)
+
+
+def record_usage(provider: str, model: str, operation: str, usage: Optional[Dict[str, int]]):
+    """llm_clients.usage_summary の形式のトークン数を記録"""
+    if not usage:
+        return
+    LLM_PROMPT_TOKENS.inc(usage.get("input_tokens", 0), provider=provider, model=model, operation=operation)
+    LLM_CACHED_PROMPT_TOKENS.inc(usage.get("cached_tokens", 0), provider=provider, model=model, operation=operation)
+    LLM_COMPLETION_TOKENS.inc(usage.get("output_tokens", 0), provider=provider, model=model, operation=operation)
+
+
+@contextmanager
+def stage(operation: str, name: str):
+    """処理の段階の所要時間を記録"""
+    with STAGE_SECONDS.time(operation=operation, stage=name):
+        yield
+
+
+def payload_size(value: Any, depth: int = 0) -> int:
+    """
+    引数・戻り値のおおよそのサイズ（バイト）
+
+    シリアライズはせず、バイト列・文字列の長さを足し合わせる（深い入れ子は途中で打ち切る）
+    """
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value)
+    if value is None or isinstance(value, (bool, int, float)):
+        return 8
+    if depth >= 8:
+        return 0
+    if isinstance(value, dict):
+        return sum(len(str(key)) + payload_size(item, depth + 1) for key, item in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return sum(payload_size(item, depth + 1) for item in value)
+    nbytes = getattr(value, "nbytes", None)
+    return nbytes if isinstance(nbytes, int) else 0
+
+
+def instrument(method: str) -> Callable:
+    """
+    GPUクラスのメソッドの処理中の数・所要時間・例外・ペイロードのサイズを記録するデコレーター
+
+    通常の関数・コルーチン関数・ジェネレーター・非同期ジェネレーターのいずれにも使え、元の関数と同じ種類の関数を返す
+    （Modalはメソッドがジェネレーターかどうかで呼び出し方を変えるため）。
+    ジェネレーターの場合は最後のイベントまでの時間を記録し、response のサイズはイベントの合計にする。
+    """
+
+    def start(args, kwargs) -> float:
+        METHOD_INFLIGHT.inc(method=method)
+        # args[0] は self
+        PAYLOAD_BYTES.observe(payload_size(args[1:]) + payload_size(kwargs), method=method, direction="request")
+        return time.perf_counter()
+
+    def finish(started_at: float, error: Optional[BaseException], response_bytes: int):
+        METHOD_INFLIGHT.dec(method=method)
+        if isinstance(error, (GeneratorExit, asyncio.CancelledError)):
+            status = "cancelled"
+        elif error is not None:
+            status = "error"
+            METHOD_ERRORS.inc(method=method, error=type(error).__name__)
+        else:
+            status = "ok"
+            PAYLOAD_BYTES.observe(response_bytes, method=method, direction="response")
+        METHOD_SECONDS.observe(time.perf_counter() - started_at, method=method, status=status)
+
+    def decorator(func: Callable) -> Callable:
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def async_gen_wrapper(*args, **kwargs):
+                started_at = start(args, kwargs)
+                size = 0
+                try:
+                    async for event in func(*args, **kwargs):
+                        size += payload_size(event)
+                        yield event
+                except BaseException as e:
+                    finish(started_at, e, size)
+                    raise
+                finish(started_at, None, size)
+            return async_gen_wrapper
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def gen_wrapper(*args, **kwargs):
+                started_at = start(args, kwargs)
+                size = 0
+                try:
+                    for event in func(*args, **kwargs):
+                        size += payload_size(event)
+                        yield event
+                except BaseException as e:
+                    finish(started_at, e, size)
+                    raise
+                finish(started_at, None, size)
+            return gen_wrapper
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started_at = start(args, kwargs)
+                try:
+                    result = await func(*args, **kwargs)
+                except BaseException as e:
+                    finish(started_at, e, 0)
+                    raise
+                finish(started_at, None, payload_size(result))
+                return result
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started_at = start(args, kwargs)
+            try:
+                result = func(*args, **kwargs)
+            except BaseException as e:
+                finish(started_at, e, 0)
+                raise
+            finish(started_at, None, payload_size(result))
+            return result
+        return wrapper
+
+    return decorator
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: List[str], values: List[str], extra: Dict[str, str]) -> str:
+    pairs = [*extra.items(), *zip(names, values)]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def render(snapshots: List[Tuple[Dict[str, str], Dict[str, Dict[str, Any]]]]) -> str:
+    """
+    snapshot をPrometheusのテキスト形式に変換
+
+    Args:
+        snapshots: [(全サンプルに付けるラベル（container など）, Registry.snapshot() の結果)]
+    """
+    metrics: Dict[str, Dict[str, Any]] = {}
+    for extra, snapshot in snapshots:
+        for name, metric in snapshot.items():
+            entry = metrics.setdefault(name, {**metric, "samples": []})
+            entry["samples"].extend((extra, labels, value) for labels, value in metric["samples"])
+
+    lines = []
+    for name, metric in sorted(metrics.items()):
+        lines.append(f"# HELP {name} {_escape(metric['help'])}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        labelnames = metric["labels"]
+        for extra, labels, value in metric["samples"]:
+            if metric["type"] != "histogram":
+                lines.append(f"{name}{_format_labels(labelnames, labels, extra)} {_format_value(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip([*metric["buckets"], math.inf], value["buckets"]):
+                cumulative += count
+                bucket_labels = _format_labels(labelnames + ["le"], labels + [_format_value(float(bound))], extra)
+                lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labelnames, labels, extra)} {_format_value(value['sum'])}")
+            lines.append(f"{name}_count{_format_labels(labelnames, labels, extra)} {value['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def published_snapshots(
+    items: Iterable[Tuple[str, Any]],
+    stale_seconds: float,
+    now: float,
+) -> Tuple[List[Tuple[Dict[str, str], Dict[str, Dict[str, Any]]]], List[str]]:
+    """
+    共有Dictの項目から各コンテナの集計結果を取り出す
+
+    Returns:
+        ([({"container": コンテナID, "service": クラス（llm / media）}, snapshot)], 古くなったキー（削除してよい）)
+    """
+    snapshots = []
+    stale = []
+    for key, value in items:
+        if not isinstance(key, str) or not key.startswith("metrics:"):
+            continue
+        if not isinstance(value, dict) or now - value.get("updated_at", 0) > stale_seconds:
+            stale.append(key)
+            continue
+        labels = {"container": key[len("metrics:"):]}
+        if value.get("service"):
+            labels["service"] = value["service"]
+        snapshots.append((labels, value["snapshot"]))
+    return snapshots, stale
+
+
+@functools.lru_cache(maxsize=None)
+def container_id() -> str:
+    """このコンテナの識別子（Modalのタスク ID、なければプロセスごとの乱数）"""
+    import uuid
+
+    return os.getenv("MODAL_TASK_ID") or uuid.uuid4().hex[:12]
+
+
+class MetricsPublisher:
+    """
+    集計結果を一定間隔で共有Dict（modal.Dict）に書き込むバックグラウンドスレッド
+
+    キーは metrics:{コンテナID}、値は {"snapshot", "updated_at", "service"}。
+    """
+
+    def __init__(self, state: Any, config: MetricsConfig, service: Optional[str] = None, registry: Registry = REGISTRY):
+        self.state = state
+        self.config = config
+        self.service = service
+        self.registry = registry
+        self.key = f"metrics:{container_id()}"
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if not self.config.enabled or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="metrics-publisher", daemon=True)
+        self._thread.start()
+
+    def publish(self):
+        self.state.put(self.key, {"snapshot": self.registry.snapshot(), "updated_at": time.time(), "service": self.service})
+
+    def stop(self):
+        """スレッドを止め、最後の集計結果を書き込む"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self._thread = None
+        self._publish_safely()
+
+    def _run(self):
+        while not self._stop.wait(self.config.publish_interval):
+            self._publish_safely()
+
+    def _publish_safely(self):
+        try:
+            self.publish()
+        except Exception as e:
+            logger.warning(f"⚠️ メトリクスの書き込みエラー: {e}")
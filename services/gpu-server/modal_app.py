@@ -4,10 +4,22 @@ WhisperX、pyannote、Vision LLMを使用した高度なAI処理
 """
 
 import modal
+import logging
 import os
-from typing import Dict, List, Any, Optional
+import threading
+import weakref
+from typing import Dict, List, Any, Optional, Awaitable, Callable, Tuple
 from datetime import datetime
 
+from cold_start import ContainerStartup
+from concurrency import ConcurrencyConfig, limit_concurrency
+from metrics import instrument
+from tracing import current_traceparent, span, traced
+from upload_retention import UploadRetentionConfig
+from warm_capacity import WarmCapacityConfig
+
+logger = logging.getLogger(__name__)
+
 # Modalアプリの作成
 app = modal.App("realworld-agent")
 
@@ -15,7 +27,52 @@ app = modal.App("realworld-agent")
 models_volume = modal.Volume.from_name("realworld-agent-models", create_if_missing=True)
 
 # Docker イメージの定義
-image = (
+# どのコンテナでも読み込むローカルモジュール（modal_app.pyと同じディレクトリ）
+COMMON_SOURCES = ("metrics", "service_logging", "tracing", "concurrency", "cold_start", "warm_capacity", "upload_retention")
+
+# LLMを呼び出すクラス用の最小構成（ffmpeg・numpy・OpenCV・文字起こしモデルを含めず、起動を速くする）
+LLM_PACKAGES = (
+    "anthropic>=0.40.0",
+    "openai>=1.54.0",
+    # 画像の前処理用
+    "Pillow>=10.2.0",
+    # プロンプトのトークン数の計算用
+    "tiktoken==0.7.0",
+)
+llm_image = (
+    modal.Image.debian_slim(python_version="3.11")
+    .pip_install(*LLM_PACKAGES)
+    .add_local_python_source(
+        "llm_clients",
+        "code_output_parser",
+        "response_cache",
+        "provider_routing",
+        "image_preprocessing",
+        "image_batching",
+        "session_summary",
+        "prompt_packing",
+        "code_generation_prompt",
+        *COMMON_SOURCES,
+    )
+)
+
+# 音声・動画を処理するクラス用
+MEDIA_PACKAGES = (
+    # シーン変化検出用
+    "numpy==1.24.3",
+    "opencv-python-headless==4.8.1.78",
+    # 音声文字起こし用（CPU: faster-whisper int8）
+    "faster-whisper==0.10.0",
+    # GPUでの文字起こし・話者分離用（現在は無効化）
+    # "torch==2.1.0",
+    # "torchaudio==2.1.0",
+    # "whisperx==3.1.1",
+    # "pyannote.audio==3.1.1",
+    # "openai-whisper==20231117",
+    # "scipy==1.11.4",
+    # "scikit-learn==1.3.2",
+)
+media_image = (
     modal.Image.debian_slim(python_version="3.11")
     .apt_install(
         "ffmpeg",
@@ -29,157 +86,255 @@ image = (
         "libswresample-dev",
         "libavfilter-dev",
     )
+    .pip_install(*MEDIA_PACKAGES)
+    .add_local_python_source(
+        "scene_detection",
+        "transcription",
+        "audio_chunking",
+        "live_transcription",
+        *COMMON_SOURCES,
+    )
+)
+
+# Webエンドポイント用（ライブ文字起こしの音声のデコードに ffmpeg・numpy を使う）
+web_image = (
+    modal.Image.debian_slim(python_version="3.11")
+    .apt_install("ffmpeg")
     .pip_install(
-        # 仕様書生成に必要なパッケージ（最小構成）
-        "anthropic>=0.40.0",
-        "openai>=1.54.0",
-        "Pillow>=10.2.0",
-        "python-dotenv>=1.0.1",
         "fastapi[all]>=0.109.2",
         "pydantic>=2.6.1",
-        # 音声文字起こし用（現在は無効化）
-        # "torch==2.1.0",
-        # "torchaudio==2.1.0",
-        # "whisperx==3.1.1",
-        # "pyannote.audio==3.1.1",
-        # "openai-whisper==20231117",
-        # "faster-whisper==0.9.0",
-        # "numpy==1.24.3",
-        # "scipy==1.11.4",
-        # "scikit-learn==1.3.2",
-        # "opencv-python-headless==4.8.1.78",
+        "python-dotenv>=1.0.1",
+        "numpy==1.24.3",
+    )
+    .add_local_python_source(
+        "live_transcription",
+        "audio_chunking",
+        *COMMON_SOURCES,
     )
 )
 
+# コンテナ間で共有する状態（サーキットブレーカーの状態、各コンテナのメトリクスなど）
+service_state = modal.Dict.from_name("realworld-agent-state", create_if_missing=True)
+
 # Secrets（環境変数）
 secrets = [
     modal.Secret.from_name("realworld-agent-secrets"),
 ]
 
+# models_volumeのマウント先
+MODELS_DIR = "/models"
+
+# 文字起こしモデルの重みの保存先（models_volume上）
+ASR_MODELS_DIR = "/models/asr"
+
+# 応答キャッシュの保存先（models_volume上）
+RESPONSE_CACHE_DIR = "/models/response_cache"
+
+# セッション要約の保存先（models_volume上）
+SESSION_SUMMARY_DIR = "/models/session_summaries"
+
+# アップロードファイルの保存先（models_volume上、内容のハッシュをファイル名にする。古いものは prune_uploads が削除する）
+UPLOAD_DIR = "/models/uploads"
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+# ストリーミング時のトークンイベント送信間隔（細かいトークンをまとめて送る）
+STREAM_TOKEN_FLUSH_CHARS = 256
+STREAM_TOKEN_FLUSH_SECONDS = 0.1
+
+# 生成の最大トークン数（プロンプトのトークン予算はここから差し引いて決める）
+SPEC_MAX_TOKENS = 4096
+CODE_MAX_TOKENS = 16384  # コード生成は長めに（完全なREADME生成のため増量）
+
+# コンテナ内の同時実行数（modal.concurrent の設定はデプロイ時の環境変数で決まる）
+LLM_CONCURRENCY = ConcurrencyConfig.from_env("LLM")
+MEDIA_CONCURRENCY = ConcurrencyConfig.from_env("MEDIA", max_inputs=4, target_inputs=1)
+
+# メディアのクラスのGPU（None はCPUのみ。"A10G" などを指定すると whisperx で文字起こしする）
+MEDIA_GPU: Optional[str] = None
+
+# 待機コンテナ数の調整の間隔（adjust_warm_capacity の schedule はデプロイ時の環境変数で決まる）
+WARM_CAPACITY_INTERVAL_MINUTES = WarmCapacityConfig.from_env().interval_minutes
+
+# アップロードファイルの削除の間隔（prune_uploads の schedule はデプロイ時の環境変数で決まる）
+UPLOAD_PRUNE_INTERVAL_MINUTES = UploadRetentionConfig.from_env().interval_minutes
+
 
 @app.cls(
-    image=image,
-    # gpu="A10G",  # GPUは音声文字起こし時のみ必要（現在は無効化）
+    image=llm_image,
     secrets=secrets,
-    volumes={"/models": models_volume},
-    timeout=600,  # 10分タイムアウト
-    # keep_warm=1,  # コスト削減のため無効化（コールドスタートあり：20-60秒）
+    volumes={MODELS_DIR: models_volume},
+    timeout=600,  # 10分タイムアウト（コード生成のストリーミングを含む）
+    # SDKのimport・クライアントの生成を済ませたメモリから起動する（prepare_snapshot）
+    enable_memory_snapshot=True,
+    # 待機コンテナ数（update_autoscaler の min_containers）は adjust_warm_capacity が直近の入力と時間帯から調整する
 )
-class RealworldAgentGPU:
+# LLMの応答待ちの間に他の入力を処理し、バーストでも起動済みのコンテナを使い回す
+@modal.concurrent(max_inputs=LLM_CONCURRENCY.max_inputs, target_inputs=LLM_CONCURRENCY.target_inputs)
+class RealworldAgentLLM:
     """
-    GPUを使用したAI処理クラス
+    LLMを呼び出す処理（仕様書生成・コード生成・画像分析）のクラス
+
+    処理時間のほとんどはプロバイダーの応答待ちのため、文字起こし・シーン変化検出の依存パッケージを含まない
+    最小構成のイメージで動かし、コンテナの起動を速くする。
     """
 
     def __init__(self):
         """初期化"""
-        self.whisperx_model = None
-        self.diarization_pipeline = None
         self.openai_api_key = os.getenv("OPENAI_API_KEY")
         self.anthropic_api_key = os.getenv("ANTHROPIC_API_KEY")
         self.primary_llm_provider = os.getenv("PRIMARY_LLM_PROVIDER", "openai")
         self.enable_llm_fallback = os.getenv("ENABLE_LLM_FALLBACK", "true").lower() == "true"
         self.openai_model = os.getenv("OPENAI_MODEL", "gpt-4o")
         self.anthropic_model = os.getenv("ANTHROPIC_MODEL", "claude-3-5-sonnet-20241022")
+        self.llm_clients = {}
+        self.response_cache = None
+        self.latency_tracker = None
+        self.prompt_cache_latency = None
+        self.hedging_config = None
+        self.circuit_breakers = {}
+        self.image_config = None
+        self.image_executor = None
+        self.image_batch_config = None
+        self.summary_config = None
+        # 更新中のセッション要約のロック（更新が終わって参照がなくなれば消える）
+        self.session_summary_locks = weakref.WeakValueDictionary()
+        self.prompt_budget_config = None
+        self.metrics_publisher = None
+        self.startup = ContainerStartup()
+
+    @modal.enter(snap=True)
+    def prepare_snapshot(self):
+        """LLMクライアント・ルーティング・テンプレートの初期化（メモリスナップショットの作成時に1回だけ実行）"""
+        from llm_clients import HTTPPoolConfig, create_provider_clients
+        from llm_clients import SUPPORTED_PROVIDERS
+        from provider_routing import CircuitBreaker, CircuitBreakerConfig, HedgingConfig, LatencyTracker
+        from image_preprocessing import ImagePreprocessConfig
+        from image_batching import ImageBatchConfig
+        from session_summary import SessionSummaryConfig
+        from prompt_packing import PromptBudgetConfig
+        from service_logging import configure_logging
+
+        # ログの出力スレッドはスナップショットに含めず、load_models で起動する
+        configure_logging(background=False)
+        with self.startup.snapshot_phase():
+            logger.info("🚀 初期化中...")
+
+            # LLMクライアントはコンテナ内で使い回す（TLSハンドシェイク・接続確立を毎回行わない）
+            # 生成時には接続しないため、スナップショットに含めて復元したコンテナでもそのまま使える
+            pool_config = HTTPPoolConfig.from_env()
+            self.llm_clients = create_provider_clients(
+                {
+                    "openai": self.openai_api_key,
+                    "anthropic": self.anthropic_api_key,
+                },
+                pool_config,
+            )
+            logger.info(
+                f"🔌 LLMクライアント初期化: {', '.join(self.llm_clients) or 'なし'} "
+                f"(max_connections={pool_config.max_connections}, "
+                f"keepalive={pool_config.max_keepalive_connections})"
+            )
+            if pool_config.max_connections < LLM_CONCURRENCY.max_inputs:
+                logger.warning(
+                    f"⚠️ LLM_HTTP_MAX_CONNECTIONS（{pool_config.max_connections}）が LLM_MAX_INPUTS（{LLM_CONCURRENCY.max_inputs}）より小さいため、"
+                    "同時実行の入力がコネクションの空きを待ちます"
+                )
+
+            # プロバイダーのレイテンシ計測とヘッジ設定
+            self.latency_tracker = LatencyTracker()
+            # プロンプトキャッシュの効果の計測用（キャッシュから読み込んだ呼び出しとそうでない呼び出しで分けて記録）
+            self.prompt_cache_latency = LatencyTracker()
+            self.hedging_config = HedgingConfig.from_env()
+            if self.hedging_config.enabled:
+                logger.info(f"🔀 ヘッジリクエスト: 有効（p{self.hedging_config.percentile * 100:.0f} × {self.hedging_config.multiplier}）")
+
+            # プロバイダーごとのサーキットブレーカー
+            breaker_config = CircuitBreakerConfig.from_env()
+            self.circuit_breakers = {
+                provider: CircuitBreaker(provider, breaker_config)
+                for provider in SUPPORTED_PROVIDERS
+            }
 
-    @modal.enter()
-    def load_models(self):
-        """モデルの読み込み（起動時に1回だけ実行）"""
-        print("🚀 初期化中...")
-        print("✅ 初期化完了")
-        print("ℹ️  WhisperX/pyannoteは現在無効化されています（仕様書生成のみ利用可能）")
-
-    @modal.method()
-    def transcribe_audio(
-        self,
-        audio_path: str,
-        language: str = "ja",
-        enable_diarization: bool = True,
-        min_speakers: int = 1,
-        max_speakers: int = 10,
-    ) -> Dict[str, Any]:
-        """
-        音声文字起こし（WhisperX + 話者分離）
-
-        Args:
-            audio_path: 音声ファイルのパス
-            language: 言語コード
-            enable_diarization: 話者分離を有効にするか
-            min_speakers: 最小話者数
-            max_speakers: 最大話者数
+            self.image_config = ImagePreprocessConfig.from_env()
+            self.image_batch_config = ImageBatchConfig.from_env()
 
-        Returns:
-            文字起こし結果
-        """
-        import whisperx
+            # セッション要約（仕様書生成で使う）
+            self.summary_config = SessionSummaryConfig.from_env()
 
-        print(f"🎙️ 音声文字起こし開始: {audio_path}")
+            # プロンプトのトークン予算（仕様書生成・コード生成）
+            self.prompt_budget_config = PromptBudgetConfig.from_env()
 
-        try:
-            # 音声読み込み
-            audio = whisperx.load_audio(audio_path)
-
-            # WhisperXで文字起こし
-            print("📝 WhisperXで文字起こし中...")
-            result = self.whisperx_model.transcribe(
-                audio,
-                language=language,
-                batch_size=16,
-            )
+            self._preload_request_modules()
 
-            # 単語レベルのアライメント
-            print("🔤 単語レベルのアライメント中...")
-            model_a, metadata = whisperx.load_align_model(
-                language_code=language,
-                device=self.device,
+    @modal.enter(snap=False)
+    def load_models(self):
+        """コンテナごとの初期化（メトリクス・トレースの書き出し、応答キャッシュ、画像の前処理のスレッド）"""
+        from response_cache import ResponseCache
+        from metrics import MetricsConfig, MetricsPublisher, container_id
+        from tracing import configure_tracing
+        from concurrent.futures import ThreadPoolExecutor
+        from service_logging import configure_logging
+
+        # コンテナIDは復元したコンテナごとに異なるため、スナップショットの後で決める
+        with self.startup.post_snapshot_phase():
+            configure_logging()
+            configure_tracing("llm", container_id(), commit=models_volume.commit)
+
+            # メトリクスは一定間隔で共有Dictに書き込み、/metrics（Webエンドポイント）から読む
+            self.metrics_publisher = MetricsPublisher(service_state, MetricsConfig.from_env(), service="llm")
+            self.metrics_publisher.start()
+
+            # 応答キャッシュ（メモリ + Volume）
+            self.response_cache = ResponseCache.from_env(RESPONSE_CACHE_DIR)
+            logger.info(f"💾 応答キャッシュ: {'有効' if self.response_cache.enabled else '無効'}（{RESPONSE_CACHE_DIR}）")
+
+            # 画像の前処理（縮小・再圧縮）はスレッドプールで実行（Pillowの処理中はGILが解放される）
+            self.image_executor = ThreadPoolExecutor(
+                max_workers=self.image_config.max_workers,
+                thread_name_prefix="image-preprocess",
             )
-            result = whisperx.align(
-                result["segments"],
-                model_a,
-                metadata,
-                audio,
-                self.device,
-                return_char_alignments=False,
+            logger.info(
+                f"🗜️ 画像前処理: {'有効' if self.image_config.enabled else '無効'}"
+                f"（最大 {self.image_config.max_pixels:,} ピクセル、目標 {self.image_config.target_bytes / 1024:.0f}KB）"
             )
 
-            # 話者分離
-            speakers_result = None
-            if enable_diarization and self.diarization_pipeline:
-                print("🎤 話者分離中...")
-                try:
-                    diarization = self.diarization_pipeline(
-                        audio_path,
-                        min_speakers=min_speakers,
-                        max_speakers=max_speakers,
-                    )
-
-                    # 話者情報を結果に統合
-                    result = whisperx.assign_word_speakers(diarization, result)
-                    speakers_result = self._extract_speakers(result)
-                    print(f"✅ {len(set(speakers_result))} 人の話者を検出")
-                except Exception as e:
-                    print(f"⚠️ 話者分離エラー: {e}")
-
-            # 結果の整形
-            output = {
-                "text": " ".join([seg["text"] for seg in result["segments"]]),
-                "segments": result["segments"],
-                "language": language,
-                "speakers": speakers_result,
-                "timestamp": datetime.now().isoformat(),
-            }
-
-            print("✅ 音声文字起こし完了")
-            return output
+    def _preload_request_modules(self):
+        """
+        最初のリクエストで読み込まれるモジュール・データを先に読み込む（スナップショットに含める）
 
-        except Exception as e:
-            print(f"❌ 音声文字起こしエラー: {e}")
-            raise
+        SDKのAPIリソース（client.chat / client.messages）、プロンプトのテンプレート・応答の解析、
+        Pillowの画像形式、トークン数の計算に使うtiktokenのエンコーディング（初回はダウンロード）。
+        """
+        import code_generation_prompt  # noqa: F401
+        import code_output_parser  # noqa: F401
+        from PIL import Image
+        from prompt_packing import get_token_counter
+
+        for provider, client in self.llm_clients.items():
+            # SDKのAPIリソースは最初の参照で読み込まれる
+            _ = client.chat.completions if provider == "openai" else client.messages
+        Image.init()
+        for provider in self.llm_clients:
+            get_token_counter(provider, self._model_for_provider(provider))
+
+    @modal.exit()
+    def shutdown(self):
+        """コンテナの終了時に最後のメトリクス・トレースを書き出す"""
+        from tracing import shutdown_tracing
+
+        if self.metrics_publisher is not None:
+            self.metrics_publisher.stop()
+        shutdown_tracing()
 
     @modal.method()
-    def analyze_image(
+    @instrument("analyze_image")
+    @traced("analyze_image")
+    @limit_concurrency("analyze_image")
+    async def analyze_image(
         self,
         image_data: bytes,
         prompt: Optional[str] = None,
+        traceparent: Optional[str] = None,
     ) -> Dict[str, Any]:
         """
         画像分析（Claude Vision or GPT-4V）
@@ -187,197 +342,259 @@ class RealworldAgentGPU:
         Args:
             image_data: 画像データ（バイト列）
             prompt: カスタムプロンプト
+            traceparent: トレースの親のスパン（Webエンドポイントから渡す）
 
         Returns:
             画像分析結果
         """
         import base64
 
-        print(f"🖼️ 画像分析開始（プライマリ: {self.primary_llm_provider}）")
-
-        # Base64エンコード
-        image_base64 = base64.b64encode(image_data).decode("utf-8")
-
-        # デフォルトプロンプト
-        if not prompt:
-            prompt = """
-この画像を詳しく分析してください：
-1. 何が映っているか（オブジェクト、人物、風景など）
-2. 技術的な要素（コード、図、UI、ホワイトボードなど）
-3. 重要な情報（テキスト、数字、記号など）
-4. 全体的なシーンの説明
-
-JSON形式で回答してください：
-{
-  "description": "全体的な説明",
-  "objects": ["検出されたオブジェクトリスト"],
-  "text": "画像内のテキスト",
-  "scene": "シーンの種類",
-  "technical_elements": ["技術的な要素"]
-}
-"""
+        logger.info(f"🖼️ 画像分析開始（プライマリ: {self.primary_llm_provider}）")
 
-        try:
-            # プライマリLLMで試行
-            result = self._analyze_image_with_provider(
-                image_base64, 
-                prompt, 
-                self.primary_llm_provider
-            )
-            return result
+        # 形式の判定・縮小・再圧縮・メタデータ削除（ワーカープールで実行）
+        prepared, preprocessing = await self._prepare_image(image_data)
 
-        except Exception as e:
-            print(f"⚠️ プライマリLLM（{self.primary_llm_provider}）エラー: {e}")
-            
-            # フォールバックが有効な場合
-            if self.enable_llm_fallback:
-                fallback_provider = "anthropic" if self.primary_llm_provider == "openai" else "openai"
-                print(f"🔄 フォールバック: {fallback_provider}で再試行")
-                
-                try:
-                    result = self._analyze_image_with_provider(
-                        image_base64, 
-                        prompt, 
-                        fallback_provider
-                    )
-                    return result
-                except Exception as fallback_error:
-                    print(f"❌ フォールバックLLMもエラー: {fallback_error}")
-                    raise
-            else:
-                raise
+        # Base64エンコード
+        image_base64 = base64.b64encode(prepared.data).decode("utf-8")
+
+        result, routing = await self._call_with_fallback(
+            "image",
+            lambda provider: self._provider_call(
+                provider,
+                "image",
+                self._analyze_image_with_provider(
+                    image_base64,
+                    self._build_image_prompt(prompt),
+                    provider,
+                    prepared.media_type,
+                ),
+            ),
+        )
+        result["routing"] = routing
+        result["preprocessing"] = preprocessing
+        return result
 
     @modal.method()
-    def detect_scene_changes(
+    @instrument("analyze_images")
+    @traced("analyze_images")
+    @limit_concurrency("analyze_images")
+    async def analyze_images(
         self,
-        frames: List[bytes],
-        threshold: float = 0.3,
-    ) -> List[int]:
+        images: List[bytes],
+        prompt: Optional[str] = None,
+        pack: bool = False,
+        traceparent: Optional[str] = None,
+    ) -> Dict[str, Any]:
         """
-        シーン変化検出
+        複数画像の一括分析
+
+        前処理はワーカープールで並列に行い、プロバイダー呼び出しは IMAGE_BATCH_CONCURRENCY 件まで同時に実行する。
+        pack が有効な場合は小さい画像を IMAGE_PACK_MAX_IMAGES 枚ずつ1回の呼び出しにまとめる
+        （応答を画像ごとに分割できなかった場合は1枚ずつ分析し直す）。
 
         Args:
-            frames: フレーム画像のリスト
-            threshold: 変化検出の閾値
+            images: 画像データ（バイト列）のリスト
+            prompt: カスタムプロンプト（全画像に共通）
+            pack: 小さい画像を1回の呼び出しにまとめるか
+            traceparent: トレースの親のスパン（Webエンドポイントから渡す）
 
         Returns:
-            シーン変化が検出されたフレームのインデックス
+            {"results": 画像の順番どおりの結果（失敗した画像は {"index", "error"}）, "count", "succeeded", "failed", "provider_calls", "elapsed_ms"}
         """
-        import cv2
-        import numpy as np
-
-        print(f"🎬 シーン変化検出開始（{len(frames)} フレーム）")
-
-        try:
-            changes = []
-            prev_frame = None
-
-            for i, frame_data in enumerate(frames):
-                # バイト列から画像に変換
-                nparr = np.frombuffer(frame_data, np.uint8)
-                frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-
-                if prev_frame is not None:
-                    # ヒストグラム比較
-                    hist1 = cv2.calcHist([prev_frame], [0, 1, 2], None, [8, 8, 8], [0, 256, 0, 256, 0, 256])
-                    hist2 = cv2.calcHist([frame], [0, 1, 2], None, [8, 8, 8], [0, 256, 0, 256, 0, 256])
-
-                    cv2.normalize(hist1, hist1)
-                    cv2.normalize(hist2, hist2)
-
-                    # 類似度計算
-                    similarity = cv2.compareHist(hist1, hist2, cv2.HISTCMP_CORREL)
-
-                    # 閾値以下なら変化とみなす
-                    if similarity < (1.0 - threshold):
-                        changes.append(i)
-                        print(f"  📍 フレーム {i}: 変化検出（類似度: {similarity:.3f}）")
-
-                prev_frame = frame
-
-            print(f"✅ {len(changes)} 箇所のシーン変化を検出")
-            return changes
+        import asyncio
+        import base64
+        import time
+        from image_batching import build_packed_prompt, plan_image_groups, split_packed_analysis
+        from metrics import STAGE_PARSE, STAGE_QUEUE, STAGE_SECONDS, stage
+
+        config = self.image_batch_config
+        if len(images) > config.max_images:
+            raise ValueError(f"画像が多すぎます（{len(images)}枚、上限 {config.max_images}枚）")
+
+        started_at = time.perf_counter()
+        logger.info(f"🖼️ 画像一括分析開始: {len(images)}枚（同時実行 {config.concurrency}、まとめる: {'有効' if pack else '無効'}）")
+
+        results: List[Optional[Dict[str, Any]]] = [None] * len(images)
+        prepared_images = await asyncio.gather(
+            *(self._prepare_image(image_data) for image_data in images),
+            return_exceptions=True,
+        )
+        for index, prepared in enumerate(prepared_images):
+            if isinstance(prepared, Exception):
+                logger.warning(f"⚠️ 画像{index + 1}の前処理エラー: {prepared}")
+                results[index] = {"index": index, "error": str(prepared)}
+
+        sizes = [
+            None if isinstance(prepared, Exception) else len(prepared[0].data)
+            for prepared in prepared_images
+        ]
+        groups = plan_image_groups(sizes, config, pack)
+        prompt = self._build_image_prompt(prompt)
+        semaphore = asyncio.Semaphore(max(1, config.concurrency))
+        provider_calls = 0
+
+        async def analyze(group: List[int], group_prompt: str, max_tokens: int) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+            nonlocal provider_calls
+            encoded = [
+                (base64.b64encode(prepared_images[i][0].data).decode("utf-8"), prepared_images[i][0].media_type)
+                for i in group
+            ]
+            queued_at = time.perf_counter()
+            async with semaphore:
+                STAGE_SECONDS.observe(time.perf_counter() - queued_at, operation="image", stage=STAGE_QUEUE)
+                provider_calls += 1
+                return await self._call_with_fallback(
+                    "image",
+                    lambda provider: self._provider_call(
+                        provider,
+                        "image",
+                        self._analyze_images_with_provider(encoded, group_prompt, provider, max_tokens),
+                    ),
+                )
+
+        def store(index: int, result: Dict[str, Any], routing: Dict[str, Any], **extra):
+            results[index] = {
+                "index": index,
+                **result,
+                "routing": routing,
+                "preprocessing": prepared_images[index][1],
+                **extra,
+            }
 
-        except Exception as e:
-            print(f"❌ シーン変化検出エラー: {e}")
-            raise
+        async def run_single(index: int):
+            try:
+                result, routing = await analyze([index], prompt, 1024)
+            except Exception as e:
+                logger.error(f"❌ 画像{index + 1}の分析エラー: {e}")
+                results[index] = {"index": index, "error": str(e)}
+                return
+            store(index, result, routing)
+
+        async def run_group(group: List[int]):
+            if len(group) == 1:
+                await run_single(group[0])
+                return
+
+            try:
+                result, routing = await analyze(
+                    group,
+                    build_packed_prompt(prompt, len(group)),
+                    min(4096, 1024 * len(group)),
+                )
+            except Exception as e:
+                logger.error(f"❌ 画像{', '.join(str(i + 1) for i in group)}の分析エラー: {e}")
+                for index in group:
+                    results[index] = {"index": index, "error": str(e)}
+                return
+
+            try:
+                with stage("image", STAGE_PARSE):
+                    analyses = split_packed_analysis(result["analysis"], len(group))
+            except ValueError as e:
+                # 応答を画像ごとに分割できない場合は1枚ずつ分析し直す
+                logger.warning(f"⚠️ まとめた分析結果を分割できないため1枚ずつ再分析: {e}")
+                await asyncio.gather(*(run_single(index) for index in group))
+                return
+
+            for index, analysis in zip(group, analyses):
+                store(index, {**result, "analysis": analysis}, routing, packed_with=[i for i in group if i != index])
+
+        await asyncio.gather(*(run_group(group) for group in groups))
+
+        failed = sum(1 for result in results if "error" in result)
+        elapsed_ms = round((time.perf_counter() - started_at) * 1000, 1)
+        logger.info(f"✅ 画像一括分析完了: 成功 {len(images) - failed}枚 / 失敗 {failed}枚（呼び出し {provider_calls}回、{elapsed_ms:.0f}ms）")
+        return {
+            "results": results,
+            "count": len(images),
+            "succeeded": len(images) - failed,
+            "failed": failed,
+            "provider_calls": provider_calls,
+            "elapsed_ms": elapsed_ms,
+        }
 
     @modal.method()
-    def generate_specification(
+    @instrument("generate_specification")
+    @traced("generate_specification")
+    @limit_concurrency("generate_specification")
+    async def generate_specification(
         self,
         context: Dict[str, Any],
+        traceparent: Optional[str] = None,
     ) -> Dict[str, Any]:
         """
         仕様書生成
 
+        context に sessionId がある場合は、セッションの文字起こしを要約の木に取り込み、
+        要約 + まだ要約していない最新の文字起こしからプロンプトを作る（セッション全体を反映する）。
+        sessionId がない場合は文字起こしを新しい順にトークン予算に入るだけ使う。
+
         Args:
             context: コンテキスト情報（文字起こし、画像など）
+                - sessionId: セッションID（オプション）
+            traceparent: トレースの親のスパン（Webエンドポイントから渡す）
 
         Returns:
             生成された仕様書
         """
-        print(f"📄 仕様書生成開始（プライマリ: {self.primary_llm_provider}）")
-
-        # プロンプトの構築
-        prompt = self._build_specification_prompt(context)
-
-        try:
-            # プライマリLLMで試行
-            result = self._generate_text_with_provider(
-                prompt,
-                self.primary_llm_provider,
-                max_tokens=4096
+        logger.info(f"📄 仕様書生成開始（プライマリ: {self.primary_llm_provider}）")
+
+        summary, recent, summary_info = None, None, None
+        session_id = context.get("sessionId")
+        if session_id and self.summary_config.enabled:
+            summary, recent, summary_info = await self._update_session_summary(
+                str(session_id),
+                context.get("transcriptions", []),
+                use_cache=context.get("use_cache", True),
             )
-            
-            specification_text = result["content"]
-            
-            output = {
-                "title": self._extract_title(specification_text),
-                "content": specification_text,
-                "model": result["model"],
-                "timestamp": datetime.now().isoformat(),
-            }
 
-            print("✅ 仕様書生成完了")
-            return output
+        # プロンプトはプロバイダーのトークン予算ごとに構築する（フォールバック時はそのプロバイダー向けに作り直す）
+        prompts = {}
 
-        except Exception as e:
-            print(f"⚠️ プライマリLLM（{self.primary_llm_provider}）エラー: {e}")
-            
-            # フォールバックが有効な場合
-            if self.enable_llm_fallback:
-                fallback_provider = "anthropic" if self.primary_llm_provider == "openai" else "openai"
-                print(f"🔄 フォールバック: {fallback_provider}で再試行")
-                
-                try:
-                    result = self._generate_text_with_provider(
-                        prompt,
-                        fallback_provider,
-                        max_tokens=4096
+        def prompt_for(provider: str) -> str:
+            if provider not in prompts:
+                with span("prompt.build", operation="specification", provider=provider) as build_span:
+                    prompts[provider] = self._build_specification_prompt(
+                        context, provider, SPEC_MAX_TOKENS, summary=summary, recent=recent
                     )
-                    
-                    specification_text = result["content"]
-                    
-                    output = {
-                        "title": self._extract_title(specification_text),
-                        "content": specification_text,
-                        "model": result["model"],
-                        "timestamp": datetime.now().isoformat(),
-                    }
+                    build_span.set_attributes(prompt_tokens=prompts[provider][1]["prompt_tokens"])
+            return prompts[provider][0]
+
+        (result, cache_info), routing = await self._call_with_fallback(
+            "specification",
+            lambda provider: self._generate_text_cached(
+                prompt_for(provider),
+                provider,
+                max_tokens=SPEC_MAX_TOKENS,
+                use_cache=context.get("use_cache", True),
+                operation="specification",
+            ),
+        )
+
+        specification_text = result["content"]
+
+        output = {
+            "title": self._extract_title(specification_text),
+            "content": specification_text,
+            "model": result["model"],
+            "cache": cache_info,
+            "routing": routing,
+            "summary": summary_info,
+            "prompt": prompts[routing["provider"]][1],
+            "timestamp": datetime.now().isoformat(),
+        }
 
-                    print("✅ 仕様書生成完了（フォールバック）")
-                    return output
-                    
-                except Exception as fallback_error:
-                    print(f"❌ フォールバックLLMもエラー: {fallback_error}")
-                    raise
-            else:
-                raise
+        logger.info(f"✅ 仕様書生成完了{'（フォールバック）' if routing['fallback_used'] else ''}")
+        return output
 
     @modal.method()
-    def generate_code(
+    @instrument("generate_code")
+    @traced("generate_code")
+    @limit_concurrency("generate_code")
+    async def generate_code(
         self,
         request: Dict[str, Any],
+        traceparent: Optional[str] = None,
     ) -> Dict[str, Any]:
         """
         コード生成
@@ -388,108 +605,483 @@ JSON形式で回答してください：
                 - context: コンテキスト情報（文字起こし、仕様書など）
                 - language: プログラミング言語（オプション）
                 - framework: フレームワーク（オプション）
+            traceparent: トレースの親のスパン（Webエンドポイントから渡す）
 
         Returns:
             生成されたコード
         """
-        print(f"💻 コード生成開始（プライマリ: {self.primary_llm_provider}）")
+        from code_generation_prompt import CODE_GENERATION_SYSTEM_PROMPT
+
+        logger.info(f"💻 コード生成開始（プライマリ: {self.primary_llm_provider}）")
+
+        # 出力形式のテンプレートはシステムメッセージ（プロンプトキャッシュの対象）、リクエストごとの内容はユーザーメッセージにする
+        # プロンプトはプロバイダーのトークン予算ごとに構築する（フォールバック時はそのプロバイダー向けに作り直す）
+        prompts = {}
+
+        def prompt_for(provider: str) -> str:
+            if provider not in prompts:
+                with span("prompt.build", operation="code", provider=provider) as build_span:
+                    prompts[provider] = self._build_code_generation_prompt(request, provider, CODE_MAX_TOKENS)
+                    build_span.set_attributes(prompt_tokens=prompts[provider][1]["prompt_tokens"])
+            return prompts[provider][0]
+
+        (result, cache_info), routing = await self._call_with_fallback(
+            "code",
+            lambda provider: self._generate_text_cached(
+                prompt_for(provider),
+                provider,
+                max_tokens=CODE_MAX_TOKENS,
+                use_cache=request.get("use_cache", True),
+                operation="code",
+                system=CODE_GENERATION_SYSTEM_PROMPT,
+            ),
+        )
+
+        output = self._build_code_output(result["content"], result["model"])
+        output["cache"] = cache_info
+        output["routing"] = routing
+        output["prompt"] = prompts[routing["provider"]][1]
+        output["prompt_cache"] = self._prompt_cache_report(
+            routing["provider"],
+            "code",
+            result.get("usage"),
+            result.get("latency_ms"),
+            record=not cache_info["hit"],
+        )
+
+        fallback_note = "フォールバック、" if routing["fallback_used"] else ""
+        logger.info(f"✅ コード生成完了（{fallback_note}{len(output['files'])}ファイル）")
+        logger.debug("📊 プロジェクト名: %s", output["summary"]["name"])
+        return output
 
-        # プロンプトの構築
-        prompt = self._build_code_generation_prompt(request)
+    @modal.method()
+    @instrument("generate_code_stream")
+    @traced("generate_code_stream")
+    @limit_concurrency("generate_code_stream")
+    async def generate_code_stream(
+        self,
+        request: Dict[str, Any],
+        traceparent: Optional[str] = None,
+    ):
+        """
+        コード生成（ストリーミング）
 
-        try:
-            # プライマリLLMで試行
-            result = self._generate_text_with_provider(
-                prompt,
-                self.primary_llm_provider,
-                max_tokens=16384  # コード生成は長めに（完全なREADME生成のため増量）
+        プロバイダーのトークンを逐次受信し、ファイルブロックやセクションが閉じた時点でイベントを返す。
+
+        Args:
+            request: コード生成リクエスト（generate_codeと同じ形式）
+            traceparent: トレースの親のスパン（Webエンドポイントから渡す）
+
+        Yields:
+            イベント
+                - {"type": "start", "provider", "model"}
+                - {"type": "token", "text"}
+                - {"type": "section", "title", "content"}
+                - {"type": "file", "path", "language", "content"}
+                - {"type": "done", "result", "metrics"}
+                  resultはgenerate_codeと同じ形式。metricsに初回トークン・初回ファイルまでの時間と逐次解析の時間を含む
+        """
+        import asyncio
+        import time
+        from code_generation_prompt import CODE_GENERATION_SYSTEM_PROMPT
+        from code_output_parser import IncrementalCodeParser
+        from metrics import LLM_FALLBACKS, RESPONSE_CACHE_LOOKUPS, STAGE_PARSE, STAGE_SECONDS, record_usage
+        from tracing import start_span
+
+        logger.info(f"💻 コード生成開始（ストリーミング、プライマリ: {self.primary_llm_provider}）")
+
+        first, second, _ = self._route_providers()
+        providers = [first] + ([second] if second else [])
+
+        for attempt, provider in enumerate(providers):
+            started_at = time.perf_counter()
+            first_token_at = None
+            first_file_at = None
+            parser = IncrementalCodeParser(self._detect_language_from_path)
+            chunks = []
+            pending_text = ""
+            last_flush = started_at
+            with span("prompt.build", operation="code", provider=provider) as build_span:
+                prompt, prompt_info = self._build_code_generation_prompt(request, provider, CODE_MAX_TOKENS)
+                build_span.set_attributes(prompt_tokens=prompt_info["prompt_tokens"])
+            usage: Dict[str, int] = {}
+            parse_seconds = 0.0
+
+            # キャッシュヒット時はキャッシュ済みの全文を1チャンクとして流す
+            cache_key = self._response_cache_key(prompt, provider, CODE_MAX_TOKENS, CODE_GENERATION_SYSTEM_PROMPT)
+            cached = None
+            if request.get("use_cache", True):
+                cached, cache_tier = await asyncio.to_thread(self.response_cache.get, cache_key)
+                RESPONSE_CACHE_LOOKUPS.inc(operation="code", result=cache_tier or "miss")
+            # 試行ごとのスパン（yield をまたぐため with ではなく手動で終了する）
+            stream_span = start_span(
+                "llm.stream",
+                provider=provider,
+                model=self._model_for_provider(provider),
+                role="primary" if attempt == 0 else "fallback",
+                cache=cache_tier if cached is not None else "miss",
             )
-            
-            code_text = result["content"]
-            
-            # コードファイルの抽出
-            files = self._extract_code_files(code_text)
-            
-            # プロジェクト概要の抽出
-            project_summary = self._extract_project_summary(code_text)
-            
-            output = {
-                "files": files,
-                "dependencies": self._extract_dependencies(code_text),
-                "instructions": self._extract_instructions(code_text),
-                "summary": project_summary,
-                "model": result["model"],
-                "timestamp": datetime.now().isoformat(),
+            if cached is not None:
+                logger.debug("💾 キャッシュヒット（%s）", cache_tier)
+                deltas = _iterate_async([cached["content"]])
+            else:
+                deltas = self._stream_text_with_provider(
+                    prompt,
+                    provider,
+                    max_tokens=CODE_MAX_TOKENS,
+                    system=CODE_GENERATION_SYSTEM_PROMPT,
+                    usage=usage,
+                )
+                self.circuit_breakers[provider].on_call_start()
+
+            try:
+                async for delta in deltas:
+                    now = time.perf_counter()
+                    if first_token_at is None:
+                        first_token_at = now
+                        yield {"type": "start", "provider": provider, "model": self._model_for_provider(provider)}
+
+                    chunks.append(delta)
+                    pending_text += delta
+
+                    # 細かいトークンはまとめて送る
+                    if len(pending_text) >= STREAM_TOKEN_FLUSH_CHARS or now - last_flush >= STREAM_TOKEN_FLUSH_SECONDS:
+                        yield {"type": "token", "text": pending_text}
+                        pending_text = ""
+                        last_flush = now
+
+                    parse_started_at = time.perf_counter()
+                    events = parser.feed(delta)
+                    parse_seconds += time.perf_counter() - parse_started_at
+                    for event in events:
+                        if event["type"] == "file" and first_file_at is None:
+                            first_file_at = time.perf_counter()
+                            logger.debug("⏱️ 初回ファイルまで: %.0fms（%s）", (first_file_at - started_at) * 1000, event["path"])
+                        yield event
+
+            except Exception as e:
+                stream_span.end(e)
+                if cached is None:
+                    await self._record_provider_failure(provider, "code", e, time.perf_counter() - started_at)
+                # トークン送信前の失敗のみフォールバック可能
+                if first_token_at is None and attempt + 1 < len(providers):
+                    logger.warning(f"⚠️ プライマリLLM（{provider}）エラー: {e}")
+                    logger.warning(f"🔄 フォールバック: {providers[attempt + 1]}で再試行")
+                    continue
+                logger.error(f"❌ ストリーミングコード生成エラー: {e}")
+                raise
+            except BaseException as e:
+                # クライアント切断などによる中断
+                stream_span.end(e)
+                if cached is None:
+                    self.circuit_breakers[provider].release()
+                raise
+
+            if pending_text:
+                yield {"type": "token", "text": pending_text}
+            parse_started_at = time.perf_counter()
+            events = parser.finish()
+            parse_seconds += time.perf_counter() - parse_started_at
+            STAGE_SECONDS.observe(parse_seconds, operation="code", stage=STAGE_PARSE)
+            for event in events:
+                yield event
+
+            code_text = "".join(chunks)
+            if cached is None:
+                await self._record_provider_success(provider, "code", time.perf_counter() - started_at)
+                record_usage(provider, self._model_for_provider(provider), "code", usage)
+                await self._store_cached_response(
+                    cache_key,
+                    {"content": code_text, "model": self._model_for_provider(provider), "usage": usage},
+                )
+
+            # ストリーミング中に作った文書ツリーをそのまま使う（全文を再解析しない）
+            output = self._build_code_output(code_text, self._model_for_provider(provider), parser.document)
+            output["cache"] = self._cache_info(cache_tier if cached is not None else None)
+            output["prompt"] = prompt_info
+            finished_at = time.perf_counter()
+
+            def elapsed_ms(at):
+                return round((at - started_at) * 1000, 1) if at is not None else None
+
+            # ストリーミングではキャッシュの効果が初回トークンまでの時間に現れる
+            output["prompt_cache"] = self._prompt_cache_report(
+                provider,
+                "code_first_token",
+                usage if cached is None else cached.get("usage"),
+                elapsed_ms(first_token_at),
+                record=cached is None,
+            )
+
+            metrics = {
+                "time_to_first_token_ms": elapsed_ms(first_token_at),
+                "time_to_first_file_ms": elapsed_ms(first_file_at),
+                "total_ms": elapsed_ms(finished_at),
+                # 受信中の逐次解析の合計（イベントループを止めている時間）
+                "parse_ms": round(parse_seconds * 1000, 1),
+                "files": len(output["files"]),
             }
+            stream_span.set_attributes(
+                ttft_ms=metrics["time_to_first_token_ms"],
+                first_file_ms=metrics["time_to_first_file_ms"],
+                parse_ms=metrics["parse_ms"],
+                files=metrics["files"],
+                **{f"usage.{key}": value for key, value in usage.items()},
+            )
+            stream_span.end()
 
-            print(f"✅ コード生成完了（{len(files)}ファイル）")
-            print(f"📊 プロジェクト名: {project_summary['name']}")
-            return output
+            if provider != self.primary_llm_provider:
+                # 最初のプロバイダーがプライマリでない場合はサーキットオープンで除外された
+                LLM_FALLBACKS.inc(operation="code", provider=provider, reason="error" if attempt else "circuit_open")
+            logger.info(f"✅ コード生成完了（ストリーミング、{len(output['files'])}ファイル、{metrics['total_ms']:.0f}ms）")
+            yield {"type": "done", "result": output, "metrics": metrics}
+            return
 
-        except Exception as e:
-            print(f"⚠️ プライマリLLM（{self.primary_llm_provider}）エラー: {e}")
-            
-            # フォールバックが有効な場合
-            if self.enable_llm_fallback:
-                fallback_provider = "anthropic" if self.primary_llm_provider == "openai" else "openai"
-                print(f"🔄 フォールバック: {fallback_provider}で再試行")
-                
+    # ヘルパーメソッド
+
+    async def _prepare_image(self, image_data: bytes) -> Tuple[Any, Dict[str, Any]]:
+        """
+        画像をワーカープールで前処理
+
+        Returns:
+            (PreprocessedImage, 前処理のレポート)
+        """
+        import asyncio
+        import time
+        from image_preprocessing import preprocess_image
+        from metrics import STAGE_QUEUE, STAGE_SECONDS
+
+        submitted_at = time.perf_counter()
+
+        def run():
+            # ワーカープールの空き待ち
+            STAGE_SECONDS.observe(time.perf_counter() - submitted_at, operation="image", stage=STAGE_QUEUE)
+            return preprocess_image(image_data, self.image_config)
+
+        with span("image.preprocess", bytes=len(image_data)):
+            prepared = await asyncio.get_running_loop().run_in_executor(self.image_executor, run)
+        preprocessing = prepared.report(self.image_config.upload_mbps)
+        logger.debug(
+            "🗜️ 前処理: %.0fKB → %.0fKB（%s → %s、%.0fms、送信 約%.0fms削減）",
+            preprocessing["original_bytes"] / 1024,
+            preprocessing["bytes"] / 1024,
+            preprocessing["original_media_type"],
+            prepared.media_type,
+            preprocessing["preprocess_ms"],
+            preprocessing["estimated_upload_ms_saved"],
+        )
+        return prepared, preprocessing
+
+    def _build_image_prompt(self, prompt: Optional[str]) -> str:
+        """画像分析のプロンプト（指定がなければデフォルト）"""
+        if prompt:
+            return prompt
+        return """
+この画像を詳しく分析してください：
+1. 何が映っているか（オブジェクト、人物、風景など）
+2. 技術的な要素（コード、図、UI、ホワイトボードなど）
+3. 重要な情報（テキスト、数字、記号など）
+4. 全体的なシーンの説明
+
+JSON形式で回答してください：
+{
+  "description": "全体的な説明",
+  "objects": ["検出されたオブジェクトリスト"],
+  "text": "画像内のテキスト",
+  "scene": "シーンの種類",
+  "technical_elements": ["技術的な要素"]
+}
+"""
+
+    async def _update_session_summary(
+        self,
+        session_id: str,
+        transcriptions: List[Dict[str, Any]],
+        use_cache: bool = True,
+    ) -> Tuple[str, List[str], Dict[str, Any]]:
+        """
+        セッションの要約の木を更新する（前回以降に追加された文字起こしだけを要約する）
+
+        要約の木はmodels_volumeに保存する。他のコンテナが更新した直後は古い状態を読むことがあるが、
+        その場合は差分が多くなるだけで、同じチャンクの要約は応答キャッシュから返る。
+
+        Returns:
+            (要約, 差分（まだ要約していない最新の文字起こしの行）, 統計)
+        """
+        import asyncio
+        import time
+        from session_summary import SessionSummarizer, load_state, render_summary, save_state
+
+        config = self.summary_config
+
+        async def summarize(prompt: str) -> str:
+            (result, _), _ = await self._call_with_fallback(
+                "summary",
+                lambda provider: self._generate_text_cached(
+                    prompt,
+                    provider,
+                    max_tokens=config.max_tokens,
+                    use_cache=use_cache,
+                    operation="summary",
+                ),
+            )
+            return result["content"]
+
+        # 同じセッションの要約を同時に更新すると同じチャンクを二重に要約するため、コンテナ内では順番に更新する
+        lock = self.session_summary_locks.get(session_id)
+        if lock is None:
+            lock = self.session_summary_locks[session_id] = asyncio.Lock()
+
+        started_at = time.perf_counter()
+        async with lock:
+            with span("session_summary.update", session_id=session_id) as summary_span:
+                state = await asyncio.to_thread(load_state, SESSION_SUMMARY_DIR, session_id)
+                state, recent, stats = await SessionSummarizer(config, summarize).update(state, session_id, transcriptions)
+                summary_span.set_attributes(summary_calls=stats["summary_calls"], folded=stats["folded"])
+
+            if stats["summary_calls"] or stats["rebuilt"]:
                 try:
-                    result = self._generate_text_with_provider(
-                        prompt,
-                        fallback_provider,
-                        max_tokens=16384
-                    )
-                    
-                    code_text = result["content"]
-                    files = self._extract_code_files(code_text)
-                    project_summary = self._extract_project_summary(code_text)
-                    
-                    output = {
-                        "files": files,
-                        "dependencies": self._extract_dependencies(code_text),
-                        "instructions": self._extract_instructions(code_text),
-                        "summary": project_summary,
-                        "model": result["model"],
-                        "timestamp": datetime.now().isoformat(),
-                    }
+                    await asyncio.to_thread(save_state, SESSION_SUMMARY_DIR, state)
+                    await models_volume.commit.aio()
+                except Exception as e:
+                    logger.warning(f"⚠️ セッション要約の保存エラー: {e}")
+
+        summary = render_summary(state)
+        stats["seconds"] = round(time.perf_counter() - started_at, 3)
+        stats["summary_chars"] = len(summary)
+        logger.info(
+            f"🧾 セッション要約: {stats['folded']}件を要約済み（要約 {stats['nodes']}個、{stats['summary_chars']}文字）、"
+            f"差分 {stats['delta']}件、要約の生成 {stats['summary_calls']}回"
+        )
+        return summary, recent, stats
+
+    def _prompt_cache_report(
+        self,
+        provider: str,
+        operation: str,
+        usage: Optional[Dict[str, int]],
+        latency_ms: Optional[float],
+        record: bool = True,
+    ) -> Dict[str, Any]:
+        """
+        プロンプトキャッシュの利用状況（キャッシュから読み込んだトークン数と、キャッシュの有無によるレイテンシの差）
 
-                    print(f"✅ コード生成完了（フォールバック、{len(files)}ファイル）")
-                    print(f"📊 プロジェクト名: {project_summary['name']}")
-                    return output
-                    
-                except Exception as fallback_error:
-                    print(f"❌ フォールバックLLMもエラー: {fallback_error}")
-                    raise
-            else:
-                raise
+        レイテンシはキャッシュから読み込んだ呼び出しとそうでない呼び出しに分けて記録し、それぞれの中央値を比べる。
 
-    # ヘルパーメソッド
+        Args:
+            usage: llm_clients.usage_summary の形式のトークン数
+            latency_ms: この呼び出しのレイテンシ
+            record: レイテンシを記録するか（応答キャッシュから返した場合は記録しない）
+        """
+        usage = usage or {}
+        input_tokens = usage.get("input_tokens", 0)
+        cached_tokens = usage.get("cached_tokens", 0)
+        if record and usage and latency_ms is not None:
+            kind = "cached" if cached_tokens else "uncached"
+            self.prompt_cache_latency.record(provider, f"{operation}:{kind}", latency_ms / 1000)
+
+        def p50_ms(kind: str) -> Optional[float]:
+            seconds = self.prompt_cache_latency.percentile(provider, f"{operation}:{kind}", 0.5)
+            return round(seconds * 1000, 1) if seconds is not None else None
+
+        cached_p50 = p50_ms("cached")
+        uncached_p50 = p50_ms("uncached")
+        report = {
+            "provider": provider,
+            "input_tokens": input_tokens,
+            "cached_tokens": cached_tokens,
+            "cache_write_tokens": usage.get("cache_write_tokens", 0),
+            "cached_ratio": round(cached_tokens / input_tokens, 3) if input_tokens else 0.0,
+            "latency_ms": latency_ms,
+            "p50_latency_ms": {"cached": cached_p50, "uncached": uncached_p50},
+            "latency_saving_ms": (
+                round(uncached_p50 - cached_p50, 1)
+                if cached_p50 is not None and uncached_p50 is not None
+                else None
+            ),
+        }
+        if usage:
+            details = [f"{cached_tokens:,}/{input_tokens:,}トークン（{report['cached_ratio']:.0%}）"]
+            if report["cache_write_tokens"]:
+                details.append(f"書き込み {report['cache_write_tokens']:,}トークン")
+            if report["latency_saving_ms"] is not None:
+                details.append(f"キャッシュなしとのp50の差 {report['latency_saving_ms']:.0f}ms")
+            logger.debug("🧊 プロンプトキャッシュ: %s", "、".join(details))
+        return report
+
+    def _pack_prompt_context(
+        self,
+        provider: str,
+        max_tokens: int,
+        fixed_text: str,
+        items: List[Any],
+        query: str = "",
+    ) -> Tuple[Dict[str, List[str]], Dict[str, Any]]:
+        """
+        コンテキスト項目をプロバイダーのトークン予算に収まるように選ぶ
 
-    def _extract_speakers(self, result: Dict) -> List[str]:
-        """話者リストを抽出"""
-        speakers = set()
-        for segment in result.get("segments", []):
-            if "speaker" in segment:
-                speakers.add(segment["speaker"])
-        return sorted(list(speakers))
+        Args:
+            provider: 'openai' または 'anthropic'
+            max_tokens: 出力に確保するトークン数
+            fixed_text: テンプレートなど必ず含める部分
+            items: 候補の項目（prompt_packing.ContextItem）
+            query: 関連度の計算に使うユーザーの要求
+
+        Returns:
+            ({種類: [テキスト]}, プロンプトの統計)
+        """
+        from prompt_packing import get_token_counter, pack_context
+
+        model = self._model_for_provider(provider)
+        counter = get_token_counter(provider, model)
+        fixed_tokens = counter.count(fixed_text)
+        budget = self.prompt_budget_config.budget(model, max_tokens, fixed_tokens)
+        packed, stats = pack_context(items, budget, counter, query, self.prompt_budget_config.recency_weight)
+        stats.update({
+            "provider": provider,
+            "model": model,
+            "prompt_tokens": fixed_tokens + stats["context_tokens"],
+            "max_tokens": max_tokens,
+        })
+        if any(stats["dropped"].values()):
+            logger.debug(
+                "✂️ プロンプト: %d/%d項目（%dトークン、予算 %d、%s）",
+                stats["selected"], stats["candidates"], stats["prompt_tokens"], budget, stats["counter"],
+            )
+        return packed, stats
+
+    def _build_specification_prompt(
+        self,
+        context: Dict[str, Any],
+        provider: str,
+        max_tokens: int = SPEC_MAX_TOKENS,
+        summary: Optional[str] = None,
+        recent: Optional[List[str]] = None,
+    ) -> Tuple[str, Dict[str, Any]]:
+        """
+        仕様書生成用のプロンプトを構築
+
+        文字起こし（と写真の分析）は新しい順にトークン予算に入るだけ含める。
+
+        Args:
+            provider: 'openai' または 'anthropic'（トークン予算の計算に使う）
+            max_tokens: 出力に確保するトークン数
+            summary: セッションの要約
+            recent: まだ要約していない最新の文字起こしの行（省略時は context の文字起こしをすべて候補にする）
+
+        Returns:
+            (プロンプト, プロンプトの統計)
+        """
+        from prompt_packing import ContextItem, photo_items, transcription_items, transcription_line_items
 
-    def _build_specification_prompt(self, context: Dict[str, Any]) -> str:
-        """仕様書生成用のプロンプトを構築"""
+        half_life = self.prompt_budget_config.recency_half_life
         transcriptions = context.get("transcriptions", [])
         photos = context.get("photos", [])
 
-        prompt = """
+        header = """
 以下の会議・作業の記録から、技術仕様書を作成してください。
-
-# 文字起こし
 """
-        for trans in transcriptions[-20:]:  # 最新20件
-            speaker = trans.get("speaker", "不明")
-            text = trans.get("text", "")
-            prompt += f"\n[{speaker}] {text}"
-
-        prompt += """
+        footer = """
 
 # 要求事項
 - 明確で構造化された仕様書を作成
@@ -506,7 +1098,25 @@ JSON形式で回答してください：
 ## 実装手順
 ## 備考
 """
-        return prompt
+        if recent is not None:
+            items = transcription_line_items(recent, half_life)
+            if summary:
+                items.append(ContextItem(kind="summary", index=0, text=summary, pinned=True))
+        else:
+            items = transcription_items(transcriptions, half_life)
+        items += photo_items(photos, half_life)
+        packed, stats = self._pack_prompt_context(provider, max_tokens, header + footer, items)
+
+        prompt = header
+        if packed["summary"]:
+            prompt += f"\n# これまでの記録の要約\n{packed['summary'][0]}\n"
+        prompt += "\n# 文字起こし（最新）\n" if recent is not None else "\n# 文字起こし\n"
+        prompt += "".join(f"\n{line}" for line in packed["transcription"])
+        if packed["photo"]:
+            prompt += "\n\n# 写真の分析\n"
+            prompt += "".join(f"\n{line}" for line in packed["photo"])
+        prompt += footer
+        return prompt, stats
 
     def _extract_title(self, text: str) -> str:
         """タイトルを抽出"""
@@ -516,8 +1126,29 @@ JSON形式で回答してください：
                 return line.replace("# ", "").strip()
         return "仕様書"
 
-    def _build_code_generation_prompt(self, request: Dict[str, Any]) -> str:
-        """コード生成用のプロンプトを構築"""
+    def _build_code_generation_prompt(
+        self,
+        request: Dict[str, Any],
+        provider: str,
+        max_tokens: int = CODE_MAX_TOKENS,
+    ) -> Tuple[str, Dict[str, Any]]:
+        """
+        コード生成用のプロンプト（ユーザーメッセージ）を構築
+
+        出力形式のテンプレートは含めない（code_generation_prompt.CODE_GENERATION_SYSTEM_PROMPT をシステムメッセージとして送る）。
+        仕様書の節・文字起こし・写真の分析は、新しさとユーザーの要求との関連度の高い順にトークン予算に入るだけ含める。
+
+        Args:
+            request: コード生成リクエスト
+            provider: 'openai' または 'anthropic'（トークン予算の計算に使う）
+            max_tokens: 出力に確保するトークン数
+
+        Returns:
+            (プロンプト, プロンプトの統計)
+        """
+        from code_generation_prompt import CODE_GENERATION_SYSTEM_PROMPT
+        from prompt_packing import photo_items, specification_items, transcription_items
+
         user_prompt = request.get("prompt", "")
         context = request.get("context", {})
         language = request.get("language", "")
@@ -525,433 +1156,97 @@ JSON形式で回答してください：
         
         transcriptions = context.get("transcriptions", [])
         specification = context.get("specification", "")
+        half_life = self.prompt_budget_config.recency_half_life
         
-        prompt = f"""
-あなたはプロフェッショナルなソフトウェアエンジニアです。
-以下の要求に基づいて、実装可能なプロジェクトを生成してください。
-
+        header = f"""
 # ユーザーの要求
 {user_prompt}
 
 """
-        
-        # コンテキスト情報を追加
-        if specification:
-            prompt += f"""
-# 仕様書
-{specification}
-
-"""
-        
-        if transcriptions:
-            prompt += """
-# 会議の文字起こし
-"""
-            for trans in transcriptions[-10:]:  # 最新10件
-                speaker = trans.get("speaker", "不明")
-                text = trans.get("text", "")
-                prompt += f"\n[{speaker}] {text}"
-            prompt += "\n"
+        footer = ""
         
         # 言語・フレームワーク指定
         if language:
-            prompt += f"""
+            footer += f"""
 # 使用する言語
 {language}
 """
         
         if framework:
-            prompt += f"""
+            footer += f"""
 # 使用するフレームワーク
 {framework}
 """
         
-        prompt += """
-
----
-
-# 出力形式
-
-以下の形式で**必ず厳密に**出力してください。各セクションは**必須**です。
-**絶対に省略せず、すべてのセクションを完全に出力してください。**
-
-## プロジェクト概要
-プロジェクト名: 【要求内容に基づいた具体的なプロジェクト名】
-説明: 【プロジェクトの目的と機能を1-2行で簡潔に説明】
-主な機能:
-- 【機能1: 具体的な説明】
-- 【機能2: 具体的な説明】
-- 【機能3: 具体的な説明】
-
-## 技術スタック
-- 言語: 【使用言語】
-- フレームワーク: 【使用フレームワーク（ある場合）】
-- 主要ライブラリ: 【主要なライブラリをカンマ区切りで】
-
-## プロジェクト構造
-```mermaid
-graph TD
-    A[【エントリーポイント名】] --> B[【主要モジュール名】]
-    B --> C[【サブモジュール1名】]
-    B --> D[【サブモジュール2名】]
-    C --> E[【ユーティリティ名】]
-    D --> E
-    
-    style A fill:#667eea
-    style B fill:#764ba2
-    style C fill:#f093fb
-    style D fill:#f093fb
-    style E fill:#4facfe
-```
-
-## 依存関係
-```
-【パッケージ1==バージョン】
-【パッケージ2==バージョン】
-【パッケージ3==バージョン】
-```
-
----
-
-## コード
-
-### ファイル: README.md
-```markdown
-# 【プロジェクト名（要求内容に基づいた具体的な名前）】
-
-<div align="center">
-
-![Version](https://img.shields.io/badge/version-1.0.0-blue.svg)
-![License](https://img.shields.io/badge/license-MIT-green.svg)
-![Language](https://img.shields.io/badge/【言語】-【バージョン】-orange.svg)
-
-【プロジェクトの簡潔な説明（1行）】
-
-</div>
-
----
-
-## 📋 概要
-
-【プロジェクトの目的、背景、解決する課題を3-5行で説明】
-
-### なぜこのプロジェクトが必要か？
-
-- 📌 【解決する問題1】
-- 📌 【解決する問題2】
-- 📌 【解決する問題3】
-
-## ✨ 主な機能
-
-| 機能 | 説明 |
-|------|------|
-| 🎯 **【機能1】** | 【詳細説明】 |
-| 🚀 **【機能2】** | 【詳細説明】 |
-| 💡 **【機能3】** | 【詳細説明】 |
-
-## 🏗️ アーキテクチャ
-
-【このセクションは必須です。必ず2つのMermaid図を含めてください】
-
-### システム構成図
-
-\```mermaid
-graph TD
-    A[【エントリーポイント名】] -->|入力| B[【メインモジュール名】]
-    B -->|処理| C[【サブモジュール1名】]
-    B -->|処理| D[【サブモジュール2名】]
-    C -->|利用| E[【ユーティリティ名】]
-    D -->|利用| E
-    
-    style A fill:#667eea,stroke:#333,stroke-width:2px,color:#fff
-    style B fill:#764ba2,stroke:#333,stroke-width:2px,color:#fff
-    style C fill:#f093fb,stroke:#333,stroke-width:2px
-    style D fill:#f5576c,stroke:#333,stroke-width:2px,color:#fff
-    style E fill:#4facfe,stroke:#333,stroke-width:2px
-\```
-
-### データフロー
-
-【必須: シーケンス図を必ず含めてください】
-
-\```mermaid
-sequenceDiagram
-    participant User as ユーザー
-    participant App as アプリケーション
-    participant Logic as 処理ロジック
-    
-    User->>App: リクエスト
-    App->>Logic: 処理依頼
-    Logic-->>App: 結果
-    App-->>User: レスポンス
-\```
-
-## 🛠️ 技術スタック
-
-- 🔤 **言語**: 【言語】 【バージョン】
-- ⚡ **フレームワーク**: 【フレームワーク】
-- 📦 **主要ライブラリ**: 【ライブラリ1】, 【ライブラリ2】, 【ライブラリ3】
-
-## 📦 セットアップ
-
-【このセクションは必須です。省略しないでください】
-
-### 前提条件
-
-- ✅ 【言語名】 【バージョン】以上
-- ✅ 【その他の依存関係】
-
-### インストール手順
-
-\```bash
-# 1. リポジトリのクローン
-git clone https://github.com/yourusername/project-name.git
-cd project-name
-
-# 2. 依存関係のインストール
-【インストールコマンド（例: pip install -r requirements.txt）】
-
-# 3. 環境変数の設定（必要な場合）
-cp .env.example .env
-
-# 4. 初期化
-【初期化コマンド（ある場合）】
-\```
-
-## 🚀 使い方
-
-【このセクションは必須です。省略しないでください】
-
-### クイックスタート
-
-\```bash
-# アプリケーションを起動
-【実行コマンド（例: python app.py）】
-
-# ブラウザで開く（Webアプリの場合）
-# http://localhost:【ポート番号】
-\```
-
-### 基本的な使用例
-
-\```bash
-# 例1: 【使用例1の説明】
-【コマンド例1】
-
-# 例2: 【使用例2の説明】
-【コマンド例2】
-\```
-
-## 📁 ファイル構成
-
-【このセクションは必須です。省略しないでください】
-
-\```
-【プロジェクト名】/
-│
-├── README.md              # このファイル
-├── 【依存関係ファイル】    # requirements.txt など
-├── 【メインファイル】      # app.py / main.py など
-└── 【その他のファイル】
-\```
-
-## 🔧 トラブルシューティング
-
-【このセクションは必須です。最低2つの問題と解決方法を記載してください】
-
-### 問題1: 【問題の内容】
-
-**症状**: 【症状の説明】
-
-**解決方法**:
-\```bash
-【解決コマンド】
-\```
-
-### 問題2: 【問題の内容】
-
-**症状**: 【症状の説明】
-
-**解決方法**: 【解決手順】
-
-## 📄 ライセンス
-
-MIT License - 詳細は [LICENSE](LICENSE) ファイルを参照してください。
-
----
-
-<div align="center">
-Made with ❤️
-</div>
-\```
-
-### ファイル: 【ファイルパス1（例: app.py）】
-```【言語名】
-【実装コード - 必要最低限だが動作する完全なコード】
-【詳細なコメントを含める】
-【エラーハンドリングを実装】
-```
-
-### ファイル: 【ファイルパス2】
-```【言語名】
-【実装コード】
-```
-
-### ファイル: requirements.txt
-```
-【依存関係リスト】
-```
-
----
-
-## セットアップ手順
-1. 【具体的な手順1】
-2. 【具体的な手順2】
-3. 【具体的な手順3】
-
-## 実行方法
-\```bash
-# 【実行コマンドの説明】
-【実行コマンド】
-\```
-
----
-
-**🚨 必須チェックリスト - 以下をすべて満たしてください:**
-
-README.mdに必ず含めること:
-- ✅ 📋 概要セクション
-- ✅ ✨ 主な機能セクション
-- ✅ 🏗️ アーキテクチャセクション（**Mermaid図2つ必須**）
-  - システム構成図（graph TD形式）
-  - データフロー図（sequenceDiagram形式）
-- ✅ 🛠️ 技術スタックセクション
-- ✅ 📦 セットアップセクション（具体的なコマンド付き）
-- ✅ 🚀 使い方セクション（具体的な実行例付き）
-- ✅ 📁 ファイル構成セクション
-- ✅ 🔧 トラブルシューティングセクション（最低2つ）
-- ✅ 📄 ライセンスセクション
-
-その他の要件:
-1. ✅ プロジェクト名は要求内容を反映した具体的な名前
-2. ✅ README.mdを**必ず最初に**生成
-3. ✅ Mermaid図は実際のプロジェクト構造を正確に反映
-4. ✅ コードは完全に動作する状態
-5. ✅ エラーハンドリング、ログ、詳細なコメントを含める
-
-**重要: すべてのセクションを省略せず完全に出力してください。特にMermaid図、セットアップ、使い方、ファイル構成、トラブルシューティング、ライセンスは必須です。**
-
----
-
-⚠️ **出力前の最終確認**
-
-README.mdを生成する前に、以下を確認してください：
-1. アーキテクチャセクションに2つのMermaid図（システム構成図 + データフロー図）が含まれているか？
-2. セットアップセクションに具体的なbashコマンドが含まれているか？
-3. 使い方セクションに具体的な実行例が含まれているか？
-4. ファイル構成セクションにディレクトリツリーが含まれているか？
-5. トラブルシューティングセクションに最低2つの問題と解決方法が含まれているか？
-6. ライセンスセクションが含まれているか？
-
-すべて「はい」の場合のみ、出力を開始してください。
-途中で止めず、最後まで完全に出力してください。
+        footer += """
+上記の要求に基づいて、指定の出力形式に従ってプロジェクトを生成してください。
 """
         
-        return prompt
+        # コンテキスト情報を追加
+        items = (
+            specification_items(specification or "")
+            + transcription_items(transcriptions, half_life)
+            + photo_items(context.get("photos", []), half_life)
+        )
+        query = " ".join(part for part in (user_prompt, language, framework) if part)
+        packed, stats = self._pack_prompt_context(
+            provider, max_tokens, CODE_GENERATION_SYSTEM_PROMPT + header + footer, items, query
+        )
+
+        prompt = header
+        if packed["specification"]:
+            prompt += f"""
+# 仕様書
+{"".join(packed["specification"]).rstrip()}
 
-    def _extract_code_files(self, text: str) -> List[Dict[str, str]]:
-        """
-        生成されたテキストからコードファイルを抽出
-        
-        形式: ### ファイル: path/to/file.ext
-              ```language
-              code here
-              ```
-        """
-        import re
-        
-        files = []
-        
-        # パターン: ### ファイル: path/to/file.ext の後に ``` で囲まれたコード
-        pattern = r'###\s*ファイル:\s*([^\n]+)\s*```(\w+)?\s*\n(.*?)```'
-        matches = re.finditer(pattern, text, re.DOTALL)
-        
-        for match in matches:
-            filepath = match.group(1).strip()
-            language = match.group(2) or self._detect_language_from_path(filepath)
-            content = match.group(3).strip()
-            
-            files.append({
-                "path": filepath,
-                "content": content,
-                "language": language,
-            })
-            
-            print(f"  📄 抽出: {filepath} ({language})")
+"""
         
-        # 代替パターン: ```language:filename
-        alt_pattern = r'```(\w+):([^\n]+)\s*\n(.*?)```'
-        alt_matches = re.finditer(alt_pattern, text, re.DOTALL)
+        if packed["transcription"]:
+            prompt += """
+# 会議の文字起こし
+"""
+            prompt += "".join(f"\n{line}" for line in packed["transcription"])
+            prompt += "\n"
         
-        for match in alt_matches:
-            language = match.group(1).strip()
-            filepath = match.group(2).strip()
-            content = match.group(3).strip()
-            
-            # 既に同じファイルが抽出されていないかチェック
-            if not any(f["path"] == filepath for f in files):
-                files.append({
-                    "path": filepath,
-                    "content": content,
-                    "language": language,
-                })
-                print(f"  📄 抽出（代替形式）: {filepath} ({language})")
+        if packed["photo"]:
+            prompt += """
+# 写真の分析
+"""
+            prompt += "".join(f"\n{line}" for line in packed["photo"])
+            prompt += "\n"
         
-        return files
+        prompt += footer
+        return prompt, stats
 
-    def _extract_dependencies(self, text: str) -> List[str]:
-        """依存関係を抽出"""
-        import re
-        
-        dependencies = []
-        
-        # ## 依存関係 セクションを探す
-        dep_pattern = r'##\s*依存関係\s*```[^\n]*\n(.*?)```'
-        match = re.search(dep_pattern, text, re.DOTALL)
-        
-        if match:
-            dep_text = match.group(1).strip()
-            # 各行を依存関係として追加
-            for line in dep_text.split('\n'):
-                line = line.strip()
-                if line and not line.startswith('#'):
-                    dependencies.append(line)
-        
-        return dependencies
+    def _build_code_output(self, code_text: str, model: str, document: Any = None) -> Dict[str, Any]:
+        """
+        生成テキストからコード生成結果を組み立てる
 
-    def _extract_instructions(self, text: str) -> str:
-        """セットアップ手順と実行方法を抽出"""
-        import re
-        
-        instructions = []
-        
-        # ## セットアップ手順 セクションを探す
-        setup_pattern = r'##\s*セットアップ手順\s*\n(.*?)(?=##|$)'
-        setup_match = re.search(setup_pattern, text, re.DOTALL)
-        
-        if setup_match:
-            instructions.append("# セットアップ手順")
-            instructions.append(setup_match.group(1).strip())
-        
-        # ## 実行方法 セクションを探す
-        run_pattern = r'##\s*実行方法\s*\n(.*?)(?=##|$)'
-        run_match = re.search(run_pattern, text, re.DOTALL)
-        
-        if run_match:
-            instructions.append("\n# 実行方法")
-            instructions.append(run_match.group(1).strip())
-        
-        return "\n".join(instructions) if instructions else "セットアップ手順は生成されたコードに含まれています。"
+        テキストを1回だけ走査して文書ツリーを作り、ファイル・依存関係・手順・概要をそこから取り出す
+
+        Args:
+            code_text: LLMの出力
+            model: 使用したモデル
+            document: 解析済みの文書ツリー（ストリーミング時）。省略時はcode_textを解析する
+        """
+        from code_output_parser import parse_code_output
+        from metrics import STAGE_PARSE, stage
+
+        if document is None:
+            with stage("code", STAGE_PARSE), span("parse.code_output", chars=len(code_text)):
+                document = parse_code_output(code_text, self._detect_language_from_path)
+        files = document.files
+        for file in files:
+            logger.debug("📄 抽出: %s (%s)", file["path"], file["language"])
+
+        return {
+            "files": files,
+            "dependencies": document.dependencies(),
+            "instructions": document.instructions(),
+            "summary": document.project_summary(),
+            "model": model,
+            "timestamp": datetime.now().isoformat(),
+        }
 
     def _detect_language_from_path(self, filepath: str) -> str:
         """ファイルパスから言語を推測"""
@@ -985,74 +1280,217 @@ README.mdを生成する前に、以下を確認してください：
         _, ext = os.path.splitext(filepath)
         return ext_map.get(ext.lower(), 'text')
     
-    def _extract_project_summary(self, text: str) -> Dict[str, Any]:
-        """プロジェクト概要を抽出"""
-        import re
-        
-        summary = {
-            "name": "生成されたプロジェクト",
-            "description": "",
-            "features": [],
-            "tech_stack": {
-                "language": "",
-                "framework": "",
-                "libraries": []
-            },
-            "mermaid_diagram": ""
+    def _get_llm_client(self, provider: str) -> Any:
+        """
+        初期化済みのLLMクライアントを取得
+
+        Args:
+            provider: 'openai' または 'anthropic'
+
+        Returns:
+            OpenAI または Anthropic クライアント
+        """
+        from llm_clients import SUPPORTED_PROVIDERS
+
+        if provider not in SUPPORTED_PROVIDERS:
+            raise ValueError(f"未サポートのプロバイダー: {provider}")
+
+        client = self.llm_clients.get(provider)
+        if client is None:
+            raise ValueError(f"{provider}のAPIキーが設定されていません")
+        return client
+
+    def _fallback_provider(self) -> str:
+        """フォールバック先のプロバイダー"""
+        return "anthropic" if self.primary_llm_provider == "openai" else "openai"
+
+    async def _provider_call(self, provider: str, operation: str, coro: Awaitable[Any]) -> Any:
+        """プロバイダー呼び出しを実行し、結果をレイテンシ計測・サーキットブレーカー・メトリクスに記録"""
+        import asyncio
+        import time
+        from metrics import LLM_REQUEST_SECONDS
+
+        self.circuit_breakers[provider].on_call_start()
+        started_at = time.perf_counter()
+        with span("llm.call", provider=provider, model=self._model_for_provider(provider), operation=operation) as call_span:
+            try:
+                result = await coro
+            except asyncio.CancelledError:
+                # ヘッジで不採用になった呼び出しなど
+                self.circuit_breakers[provider].release()
+                LLM_REQUEST_SECONDS.observe(
+                    time.perf_counter() - started_at, provider=provider, operation=operation, status="cancelled"
+                )
+                raise
+            except Exception as e:
+                await self._record_provider_failure(provider, operation, e, time.perf_counter() - started_at)
+                raise
+
+            if isinstance(result, dict) and result.get("usage"):
+                call_span.set_attributes(**{f"usage.{key}": value for key, value in result["usage"].items()})
+        await self._record_provider_success(provider, operation, time.perf_counter() - started_at)
+        return result
+
+    async def _record_provider_success(self, provider: str, operation: str, seconds: float):
+        """成功したプロバイダー呼び出しを記録"""
+        from metrics import LLM_REQUEST_SECONDS, STAGE_PROVIDER, STAGE_SECONDS
+
+        self.latency_tracker.record(provider, operation, seconds)
+        self.circuit_breakers[provider].record_success(operation, seconds)
+        LLM_REQUEST_SECONDS.observe(seconds, provider=provider, operation=operation, status="ok")
+        STAGE_SECONDS.observe(seconds, operation=operation, stage=STAGE_PROVIDER)
+        await self._publish_circuit_state(provider)
+
+    async def _record_provider_failure(self, provider: str, operation: str, error: Exception, seconds: float):
+        """失敗したプロバイダー呼び出しを記録"""
+        from metrics import LLM_ERRORS, LLM_REQUEST_SECONDS
+
+        self.circuit_breakers[provider].record_failure(error)
+        LLM_REQUEST_SECONDS.observe(seconds, provider=provider, operation=operation, status="error")
+        LLM_ERRORS.inc(provider=provider, operation=operation, error=type(error).__name__)
+        await self._publish_circuit_state(provider)
+
+    def _record_fallback(self, operation: str, routing: Dict[str, Any]):
+        """ルーティングの結果を現在のスパンに付け、プライマリ以外のプロバイダーの結果を使った場合はメトリクスに記録"""
+        from metrics import LLM_FALLBACKS
+        from tracing import current_span
+
+        routed_span = current_span()
+        if routed_span is not None:
+            routed_span.set_attributes(
+                provider=routing["provider"],
+                fallback_used=routing["fallback_used"],
+                hedged=routing["hedged"],
+                circuit_skipped=",".join(routing["circuit_skipped"]),
+            )
+        if not routing["fallback_used"]:
+            return
+        if routing["circuit_skipped"]:
+            reason = "circuit_open"
+        elif routing["hedged"]:
+            reason = "hedge"
+        else:
+            reason = "error"
+        LLM_FALLBACKS.inc(operation=operation, provider=routing["provider"], reason=reason)
+
+    async def _publish_circuit_state(self, provider: str):
+        """サーキットの状態が変わった場合、/health から参照できるよう共有Dictに書き込む"""
+        import time
+
+        breaker = self.circuit_breakers[provider]
+        if not breaker.consume_state_change():
+            return
+
+        snapshot = breaker.snapshot()
+        logger.info(f"⚡ サーキット状態変更: {provider} → {snapshot['state']}")
+        if snapshot["retry_in_seconds"] is not None:
+            snapshot["open_until"] = time.time() + snapshot["retry_in_seconds"]
+        snapshot["updated_at"] = time.time()
+
+        try:
+            await service_state.put.aio(f"circuit:{provider}", snapshot)
+        except Exception as e:
+            logger.warning(f"⚠️ サーキット状態の共有エラー: {e}")
+
+    async def _call_with_fallback(
+        self,
+        operation: str,
+        call: Callable[[str], Awaitable[Any]],
+    ) -> Tuple[Any, Dict[str, Any]]:
+        """
+        プライマリLLMで実行し、失敗時はフォールバックLLMで実行
+
+        ヘッジが有効な場合は、プライマリが待ち時間（直近レイテンシのパーセンタイル）内に
+        応答しなければフォールバックも並行して実行し、先に成功した結果を採用する。
+
+        Args:
+            operation: 処理種別（'image' / 'specification' / 'summary' / 'code'）
+            call: プロバイダー名を受け取って処理を実行するコルーチン関数
+
+        Returns:
+            (結果, ルーティング情報 {"provider", "fallback_used", "hedged"})
+        """
+        from provider_routing import hedge_delay, hedged_call
+
+        primary, fallback, skipped = self._route_providers()
+
+        async def attempt(provider: str) -> Any:
+            # プロバイダーごとの試行（フォールバック・ヘッジを含む）を1つのスパンにする
+            with span("llm.attempt", operation=operation, provider=provider, role="primary" if provider == primary else "fallback"):
+                return await call(provider)
+
+        if fallback and self.hedging_config.enabled:
+            delay = hedge_delay(self.latency_tracker, self.hedging_config, primary, operation)
+            result, provider, hedged = await hedged_call(
+                attempt,
+                primary,
+                fallback,
+                delay,
+                on_error=lambda p, e: logger.warning(f"⚠️ LLM（{p}）エラー: {e}"),
+                on_hedge=lambda p, d: logger.info(f"🔀 ヘッジ: {d:.1f}秒以内に応答がないため{p}でも実行"),
+            )
+            routing = self._routing_info(provider, hedged, skipped)
+            self._record_fallback(operation, routing)
+            return result, routing
+
+        try:
+            result = await attempt(primary)
+            routing = self._routing_info(primary, False, skipped)
+            self._record_fallback(operation, routing)
+            return result, routing
+
+        except Exception as e:
+            logger.warning(f"⚠️ プライマリLLM（{primary}）エラー: {e}")
+
+            # フォールバックが有効な場合
+            if not fallback:
+                raise
+            logger.warning(f"🔄 フォールバック: {fallback}で再試行")
+
+            try:
+                result = await attempt(fallback)
+            except Exception as fallback_error:
+                logger.error(f"❌ フォールバックLLMもエラー: {fallback_error}")
+                raise
+            routing = self._routing_info(fallback, False, skipped)
+            self._record_fallback(operation, routing)
+            return result, routing
+
+    def _route_providers(self) -> Tuple[str, Optional[str], List[str]]:
+        """
+        サーキットの状態を踏まえて試行するプロバイダーを決める
+
+        Returns:
+            (最初に試すプロバイダー, 次に試すプロバイダー, サーキットオープンで除外したプロバイダー)
+        """
+        from provider_routing import order_providers
+
+        providers = [self.primary_llm_provider]
+        if self.enable_llm_fallback:
+            providers.append(self._fallback_provider())
+
+        ordered = order_providers(providers, self.circuit_breakers)
+        skipped = [p for p in providers if p not in ordered]
+        if skipped:
+            logger.warning(f"⚡ サーキットオープン中のため {', '.join(skipped)} をスキップし {ordered[0]} で実行")
+
+        return ordered[0], (ordered[1] if len(ordered) > 1 else None), skipped
+
+    def _routing_info(self, provider: str, hedged: bool, skipped: List[str]) -> Dict[str, Any]:
+        """レスポンスに含めるルーティング情報"""
+        return {
+            "provider": provider,
+            "fallback_used": provider != self.primary_llm_provider,
+            "hedged": hedged,
+            "circuit_skipped": skipped,
         }
-        
-        # プロジェクト名
-        name_pattern = r'プロジェクト名:\s*(?:【)?([^】\n]+)(?:】)?'
-        name_match = re.search(name_pattern, text)
-        if name_match:
-            summary["name"] = name_match.group(1).strip()
-        
-        # 説明
-        desc_pattern = r'説明:\s*(?:【)?([^】\n]+)(?:】)?'
-        desc_match = re.search(desc_pattern, text)
-        if desc_match:
-            summary["description"] = desc_match.group(1).strip()
-        
-        # 主な機能
-        features_pattern = r'主な機能:?\s*\n((?:-\s+[^\n]+\n?)+)'
-        features_match = re.search(features_pattern, text)
-        if features_match:
-            for line in features_match.group(1).split('\n'):
-                if line.strip().startswith('-'):
-                    feature = line.strip()[1:].strip()
-                    if feature:
-                        summary["features"].append(feature)
-        
-        # 技術スタック
-        lang_pattern = r'-\s*言語:\s*(?:【)?([^】\n]+)(?:】)?'
-        lang_match = re.search(lang_pattern, text)
-        if lang_match:
-            summary["tech_stack"]["language"] = lang_match.group(1).strip()
-        
-        fw_pattern = r'-\s*フレームワーク:\s*(?:【)?([^】\n]+)(?:】)?'
-        fw_match = re.search(fw_pattern, text)
-        if fw_match:
-            summary["tech_stack"]["framework"] = fw_match.group(1).strip()
-        
-        lib_pattern = r'-\s*主要ライブラリ:\s*(?:【)?([^】\n]+)(?:】)?'
-        lib_match = re.search(lib_pattern, text)
-        if lib_match:
-            libs = lib_match.group(1).strip()
-            summary["tech_stack"]["libraries"] = [l.strip() for l in libs.split(',') if l.strip()]
-        
-        # Mermaid図
-        mermaid_pattern = r'```mermaid\s*\n(.*?)```'
-        mermaid_match = re.search(mermaid_pattern, text, re.DOTALL)
-        if mermaid_match:
-            summary["mermaid_diagram"] = mermaid_match.group(1).strip()
-        
-        return summary
 
-    def _analyze_image_with_provider(
+    async def _analyze_image_with_provider(
         self,
         image_base64: str,
         prompt: str,
         provider: str,
+        media_type: str = "image/jpeg",
     ) -> Dict[str, Any]:
         """
         指定されたプロバイダーで画像分析を実行
@@ -1061,37 +1499,64 @@ README.mdを生成する前に、以下を確認してください：
             image_base64: Base64エンコードされた画像
             prompt: プロンプト
             provider: 'openai' または 'anthropic'
+            media_type: 画像のMIMEタイプ
+
+        Returns:
+            画像分析結果
+        """
+        return await self._analyze_images_with_provider([(image_base64, media_type)], prompt, provider)
+
+    async def _analyze_images_with_provider(
+        self,
+        images: List[Tuple[str, str]],
+        prompt: str,
+        provider: str,
+        max_tokens: int = 1024,
+    ) -> Dict[str, Any]:
+        """
+        指定されたプロバイダーで1枚以上の画像を1回の呼び出しで分析
+
+        Args:
+            images: (Base64エンコードされた画像, MIMEタイプ) のリスト
+            prompt: プロンプト
+            provider: 'openai' または 'anthropic'
+            max_tokens: 最大トークン数
 
         Returns:
             画像分析結果
         """
+        from llm_clients import usage_summary
+        from metrics import record_usage
+
+        # 複数枚の場合は各画像の前に番号を付ける
+        labels = [f"画像{i + 1}:" if len(images) > 1 else None for i in range(len(images))]
+
         if provider == "openai":
-            from openai import OpenAI
-            
-            print(f"  🤖 OpenAI ({self.openai_model})で画像分析中...")
-            client = OpenAI(api_key=self.openai_api_key)
-            
-            response = client.chat.completions.create(
+            logger.debug("🤖 OpenAI (%s)で画像分析中...（%d枚）", self.openai_model, len(images))
+            client = self._get_llm_client(provider)
+
+            content: List[Dict[str, Any]] = [{"type": "text", "text": prompt}]
+            for label, (image_base64, media_type) in zip(labels, images):
+                if label:
+                    content.append({"type": "text", "text": label})
+                content.append({
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:{media_type};base64,{image_base64}"
+                    }
+                })
+
+            response = await client.chat.completions.create(
                 model=self.openai_model,
                 messages=[
                     {
                         "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": prompt
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{image_base64}"
-                                }
-                            }
-                        ]
+                        "content": content,
                     }
                 ],
-                max_tokens=1024,
+                max_tokens=max_tokens,
             )
+            record_usage(provider, self.openai_model, "image", usage_summary(provider, response.usage))
             
             return {
                 "analysis": response.choices[0].message.content,
@@ -1100,31 +1565,34 @@ README.mdを生成する前に、以下を確認してください：
             }
             
         elif provider == "anthropic":
-            from anthropic import Anthropic
-            
-            print(f"  🤖 Anthropic ({self.anthropic_model})で画像分析中...")
-            client = Anthropic(api_key=self.anthropic_api_key)
-            
-            response = client.messages.create(
+            logger.debug("🤖 Anthropic (%s)で画像分析中...（%d枚）", self.anthropic_model, len(images))
+            client = self._get_llm_client(provider)
+
+            content = []
+            for label, (image_base64, media_type) in zip(labels, images):
+                if label:
+                    content.append({"type": "text", "text": label})
+                content.append({
+                    "type": "image",
+                    "source": {
+                        "type": "base64",
+                        "media_type": media_type,
+                        "data": image_base64,
+                    },
+                })
+            content.append({"type": "text", "text": prompt})
+
+            response = await client.messages.create(
                 model=self.anthropic_model,
-                max_tokens=1024,
+                max_tokens=max_tokens,
                 messages=[
                     {
                         "role": "user",
-                        "content": [
-                            {
-                                "type": "image",
-                                "source": {
-                                    "type": "base64",
-                                    "media_type": "image/jpeg",
-                                    "data": image_base64,
-                                },
-                            },
-                            {"type": "text", "text": prompt},
-                        ],
+                        "content": content,
                     }
                 ],
             )
+            record_usage(provider, self.anthropic_model, "image", usage_summary(provider, response.usage))
             
             return {
                 "analysis": response.content[0].text,
@@ -1134,52 +1602,58 @@ README.mdを生成する前に、以下を確認してください：
         else:
             raise ValueError(f"未サポートのプロバイダー: {provider}")
 
-    def _generate_text_with_provider(
+    async def _generate_text_with_provider(
         self,
         prompt: str,
         provider: str,
         max_tokens: int = 4096,
+        system: Optional[str] = None,
     ) -> Dict[str, Any]:
         """
         指定されたプロバイダーでテキスト生成を実行
 
         Args:
-            prompt: プロンプト
+            prompt: プロンプト（ユーザーメッセージ）
             provider: 'openai' または 'anthropic'
             max_tokens: 最大トークン数
+            system: システムメッセージ（リクエストによらず同じ内容にすること。プロンプトキャッシュの対象にする）
 
         Returns:
-            生成結果
+            生成結果 {"content", "model", "usage", "latency_ms"}
         """
+        import time
+        from llm_clients import anthropic_system_blocks, usage_summary
+
+        started_at = time.perf_counter()
         if provider == "openai":
-            from openai import OpenAI
+            logger.debug("🤖 OpenAI (%s)でテキスト生成中...", self.openai_model)
+            client = self._get_llm_client(provider)
             
-            print(f"  🤖 OpenAI ({self.openai_model})でテキスト生成中...")
-            client = OpenAI(api_key=self.openai_api_key)
-            
-            response = client.chat.completions.create(
+            # OpenAIのプロンプトキャッシュは先頭が一致する場合に自動で効くため、システムメッセージを先頭に置く
+            messages = [{"role": "system", "content": system}] if system else []
+            messages.append({
+                "role": "user",
+                "content": prompt
+            })
+            response = await client.chat.completions.create(
                 model=self.openai_model,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
+                messages=messages,
                 max_tokens=max_tokens,
             )
             
             return {
                 "content": response.choices[0].message.content,
                 "model": self.openai_model,
+                "usage": usage_summary(provider, response.usage),
+                "latency_ms": round((time.perf_counter() - started_at) * 1000, 1),
             }
             
         elif provider == "anthropic":
-            from anthropic import Anthropic
-            
-            print(f"  🤖 Anthropic ({self.anthropic_model})でテキスト生成中...")
-            client = Anthropic(api_key=self.anthropic_api_key)
+            logger.debug("🤖 Anthropic (%s)でテキスト生成中...", self.anthropic_model)
+            client = self._get_llm_client(provider)
             
-            response = client.messages.create(
+            options = {"system": anthropic_system_blocks(system)} if system else {}
+            response = await client.messages.create(
                 model=self.anthropic_model,
                 max_tokens=max_tokens,
                 messages=[
@@ -1188,77 +1662,995 @@ README.mdを生成する前に、以下を確認してください：
                         "content": prompt,
                     }
                 ],
+                **options,
             )
             
             return {
                 "content": response.content[0].text,
                 "model": self.anthropic_model,
+                "usage": usage_summary(provider, response.usage),
+                "latency_ms": round((time.perf_counter() - started_at) * 1000, 1),
             }
         else:
             raise ValueError(f"未サポートのプロバイダー: {provider}")
 
+    def _model_for_provider(self, provider: str) -> str:
+        """プロバイダーで使用するモデル名"""
+        return self.openai_model if provider == "openai" else self.anthropic_model
 
-# FastAPI Webエンドポイント
-@app.function(image=image, secrets=secrets)
-@modal.asgi_app()
-def fastapi_app():
-    """
-    FastAPI Webエンドポイント
-    """
-    from fastapi import FastAPI, UploadFile, File, Form, Request
-    from fastapi.responses import JSONResponse
+    def _response_cache_key(self, prompt: str, provider: str, max_tokens: int, system: Optional[str] = None) -> str:
+        """応答キャッシュのキー"""
+        from response_cache import ResponseCache
 
-    web_app = FastAPI(title="Realworld Agent GPU API")
+        return ResponseCache.make_key(prompt, provider, self._model_for_provider(provider), max_tokens, system or "")
 
-    @web_app.get("/")
-    async def root():
+    def _cache_info(self, tier: Optional[str]) -> Dict[str, Any]:
+        """レスポンスに含めるキャッシュ情報"""
         return {
-            "name": "Realworld Agent GPU Server",
-            "version": "0.1.0",
-            "status": "running",
+            "hit": tier is not None,
+            "tier": tier,
+            "stats": self.response_cache.stats(),
         }
 
-    @web_app.get("/health")
-    async def health():
-        return {"status": "healthy"}
+    async def _store_cached_response(self, key: str, result: Dict[str, Any]):
+        """応答をキャッシュに保存し、Volumeにコミットして他のコンテナからも参照できるようにする"""
+        if not self.response_cache.enabled:
+            return
+        import asyncio
 
-    @web_app.post("/api/transcribe")
-    async def transcribe(
-        audio: UploadFile = File(...),
-        language: str = Form("ja"),
-        enable_diarization: bool = Form(True),
-    ):
-        """音声文字起こしAPI"""
         try:
-            # 一時ファイルに保存
-            temp_path = f"/tmp/{audio.filename}"
-            with open(temp_path, "wb") as f:
-                f.write(await audio.read())
-
-            # GPUクラスを呼び出し
-            gpu = RealworldAgentGPU()
-            result = gpu.transcribe_audio.remote(
-                temp_path,
-                language=language,
-                enable_diarization=enable_diarization,
-            )
-
-            return JSONResponse(content=result)
-
+            await asyncio.to_thread(self.response_cache.put, key, result)
+            await models_volume.commit.aio()
         except Exception as e:
-            return JSONResponse(
-                status_code=500,
-                content={"error": str(e)},
-            )
+            logger.warning(f"⚠️ 応答キャッシュの保存エラー: {e}")
 
-    @web_app.post("/api/analyze-image")
-    async def analyze_image(image: UploadFile = File(...)):
+    async def _generate_text_cached(
+        self,
+        prompt: str,
+        provider: str,
+        max_tokens: int = 4096,
+        use_cache: bool = True,
+        operation: str = "text",
+        system: Optional[str] = None,
+    ):
+        """
+        応答キャッシュを参照してからテキスト生成を実行
+
+        Args:
+            prompt: プロンプト
+            provider: 'openai' または 'anthropic'
+            max_tokens: 最大トークン数
+            use_cache: Falseの場合はキャッシュを参照せずに生成する（結果は保存する）
+            operation: レイテンシ計測の処理種別
+            system: システムメッセージ（プロンプトキャッシュの対象）
+
+        Returns:
+            (生成結果, キャッシュ情報)
+        """
+        import asyncio
+        from metrics import RESPONSE_CACHE_LOOKUPS, record_usage
+
+        key = self._response_cache_key(prompt, provider, max_tokens, system)
+
+        if use_cache:
+            with span("response_cache.get", operation=operation, provider=provider) as cache_span:
+                cached, tier = await asyncio.to_thread(self.response_cache.get, key)
+                cache_span.set_attributes(result=tier or "miss")
+            RESPONSE_CACHE_LOOKUPS.inc(operation=operation, result=tier or "miss")
+            if cached is not None:
+                logger.debug("💾 キャッシュヒット（%s）", tier)
+                return cached, self._cache_info(tier)
+
+        result = await self._provider_call(
+            provider,
+            operation,
+            self._generate_text_with_provider(prompt, provider, max_tokens=max_tokens, system=system),
+        )
+        record_usage(provider, result["model"], operation, result.get("usage"))
+        await self._store_cached_response(key, result)
+        return result, self._cache_info(None)
+
+    async def _stream_text_with_provider(
+        self,
+        prompt: str,
+        provider: str,
+        max_tokens: int = 4096,
+        system: Optional[str] = None,
+        usage: Optional[Dict[str, int]] = None,
+    ):
+        """
+        指定されたプロバイダーでテキスト生成をストリーミング実行
+
+        Args:
+            prompt: プロンプト（ユーザーメッセージ）
+            provider: 'openai' または 'anthropic'
+            max_tokens: 最大トークン数
+            system: システムメッセージ（プロンプトキャッシュの対象）
+            usage: 指定した場合、完了時にトークン数（llm_clients.usage_summary の形式）を書き込む
+
+        Yields:
+            生成されたテキスト片
+        """
+        from llm_clients import anthropic_system_blocks, usage_summary
+
+        if provider == "openai":
+            logger.debug("🤖 OpenAI (%s)でテキスト生成中（ストリーミング）...", self.openai_model)
+            client = self._get_llm_client(provider)
+
+            messages = [{"role": "system", "content": system}] if system else []
+            messages.append({
+                "role": "user",
+                "content": prompt
+            })
+            stream = await client.chat.completions.create(
+                model=self.openai_model,
+                messages=messages,
+                max_tokens=max_tokens,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                # usage は choices が空の最後のチャンクに入る
+                if chunk.usage is not None and usage is not None:
+                    usage.update(usage_summary(provider, chunk.usage))
+
+        elif provider == "anthropic":
+            logger.debug("🤖 Anthropic (%s)でテキスト生成中（ストリーミング）...", self.anthropic_model)
+            client = self._get_llm_client(provider)
+
+            options = {"system": anthropic_system_blocks(system)} if system else {}
+            async with client.messages.stream(
+                model=self.anthropic_model,
+                max_tokens=max_tokens,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": prompt,
+                    }
+                ],
+                **options,
+            ) as stream:
+                async for text in stream.text_stream:
+                    yield text
+                if usage is not None:
+                    message = await stream.get_final_message()
+                    usage.update(usage_summary(provider, message.usage))
+        else:
+            raise ValueError(f"未サポートのプロバイダー: {provider}")
+
+
+@app.cls(
+    image=media_image,
+    gpu=MEDIA_GPU,  # GPUがあればwhisperx、なければfaster-whisper（int8）で文字起こし
+    secrets=secrets,
+    volumes={MODELS_DIR: models_volume},
+    timeout=600,  # 10分タイムアウト
+    # numpy・OpenCV・文字起こしモデルを読み込んだメモリから起動する（prepare_snapshot）
+    enable_memory_snapshot=True,
+    # 待機コンテナ数（update_autoscaler の min_containers）は adjust_warm_capacity が直近の入力と時間帯から調整する
+)
+# CPU（GPU）を使い切る処理のため、コンテナあたりの入力は少なくし、入力が増えたらコンテナを増やす
+@modal.concurrent(max_inputs=MEDIA_CONCURRENCY.max_inputs, target_inputs=MEDIA_CONCURRENCY.target_inputs)
+class RealworldAgentMedia:
+    """
+    音声・動画の処理（文字起こし・話者分離・シーン変化検出）のクラス
+
+    文字起こしモデル・ffmpeg・OpenCVを含むイメージで動かす。
+    """
+
+    def __init__(self):
+        """初期化"""
+        self.asr_backend = None
+        self.device = None
+        self.metrics_publisher = None
+        self.startup = ContainerStartup()
+
+    @modal.enter(snap=True)
+    def prepare_snapshot(self):
+        """パッケージのimport（メモリスナップショットの作成時に1回だけ実行）"""
+        from service_logging import configure_logging
+        from transcription import TranscriptionConfig
+
+        # ログの出力スレッドはスナップショットに含めず、load_models で起動する
+        configure_logging(background=False)
+        with self.startup.snapshot_phase():
+            logger.info("🚀 初期化中...")
+            import audio_chunking  # noqa: F401
+            import scene_detection  # noqa: F401
+
+            try:
+                import cv2  # noqa: F401
+            except ImportError:
+                logger.warning("⚠️ OpenCVがインストールされていません（シーン変化検出は利用できません）")
+
+            # 文字起こしモデルは復元後に読み込む（CTranslate2 はモデルの生成時に推論のスレッドプールを作り、
+            # 重みのダウンロードは Volume に書き込むため）。パッケージのimportだけスナップショットに含める
+            if MEDIA_GPU is None and TranscriptionConfig.from_env().backend != "none":
+                try:
+                    import faster_whisper  # noqa: F401
+                except ImportError:
+                    logger.warning("⚠️ faster-whisperがインストールされていません")
+
+    @modal.enter(snap=False)
+    def load_models(self):
+        """コンテナごとの初期化（ログ・メトリクス・トレースの書き出し、文字起こしモデルの読み込み）"""
+        from metrics import MetricsConfig, MetricsPublisher, container_id
+        from service_logging import configure_logging
+        from tracing import configure_tracing
+
+        with self.startup.post_snapshot_phase():
+            configure_logging()
+            configure_tracing("media", container_id(), commit=models_volume.commit)
+
+            self.metrics_publisher = MetricsPublisher(service_state, MetricsConfig.from_env(), service="media")
+            self.metrics_publisher.start()
+
+            self._load_asr_backend()
+
+    def _load_asr_backend(self):
+        """文字起こしモデルの読み込み（重みはmodels_volumeにキャッシュし、2回目以降の起動ではダウンロードしない）"""
+        from transcription import TranscriptionConfig, load_asr_backend
+        import time
+
+        asr_config = TranscriptionConfig.from_env()
+        if asr_config.backend == "none":
+            logger.info("ℹ️  文字起こしモデルは読み込みません（ASR_BACKEND=none）")
+            return
+        try:
+            loaded = load_asr_backend(asr_config, ASR_MODELS_DIR)
+            self.asr_backend = loaded["backend"]
+            self.device = self.asr_backend.device
+            if loaded["downloaded"]:
+                models_volume.commit()
+            logger.info(
+                f"🎙️ 文字起こしモデル: {self.asr_backend.name} {self.asr_backend.model_name}"
+                f"（{self.device}, {self.asr_backend.compute_type}、読み込み {loaded['load_seconds']:.1f}秒"
+                f"{'、ダウンロードしてVolumeに保存' if loaded['downloaded'] else ''}）"
+            )
+            if asr_config.warmup:
+                started_at = time.perf_counter()
+                self.asr_backend.warm_up()
+                logger.info(f"🔥 文字起こしモデルのウォームアップ: {time.perf_counter() - started_at:.1f}秒")
+        except Exception as e:
+            self.asr_backend = None
+            logger.warning(f"⚠️ 文字起こしモデルの読み込みエラー（文字起こしは利用できません）: {e}")
+
+    @modal.exit()
+    def shutdown(self):
+        """コンテナの終了時に最後のメトリクス・トレースを書き出す"""
+        from tracing import shutdown_tracing
+
+        if self.metrics_publisher is not None:
+            self.metrics_publisher.stop()
+        shutdown_tracing()
+
+    @modal.method()
+    @instrument("transcribe_audio")
+    @traced("transcribe_audio")
+    @limit_concurrency("transcribe_audio")
+    def transcribe_audio(
+        self,
+        audio_path: str,
+        language: str = "ja",
+        enable_diarization: bool = True,
+        min_speakers: int = 1,
+        max_speakers: int = 10,
+        traceparent: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        音声文字起こし（WhisperX + 話者分離）
+
+        Args:
+            audio_path: models_volume上の音声ファイルのパス（/models 以下、または /models からの相対パス）
+            language: 言語コード
+            enable_diarization: 話者分離を有効にするか
+            min_speakers: 最小話者数
+            max_speakers: 最大話者数
+            traceparent: トレースの親のスパン（Webエンドポイントから渡す）
+
+        Returns:
+            文字起こし結果
+        """
+        import time
+
+        if self.asr_backend is None:
+            raise RuntimeError("文字起こしモデルが読み込まれていません（ASR_BACKEND とコンテナのログを確認してください）")
+
+        audio_path = _volume_file(audio_path, "音声ファイル")
+        logger.info(f"🎙️ 音声文字起こし開始: {audio_path}")
+
+        try:
+            # 文字起こし（whisperxの場合は単語レベルのアライメントまで）
+            logger.debug("📝 %s（%s）で文字起こし中...", self.asr_backend.name, self.asr_backend.model_name)
+            started_at = time.perf_counter()
+            result = self.asr_backend.transcribe(audio_path, language)
+
+            # 話者分離
+            result, speakers_result = self._diarize(audio_path, result, enable_diarization, min_speakers, max_speakers)
+
+            output = self._transcription_output(result, language, speakers_result, time.perf_counter() - started_at)
+            logger.info(f"✅ 音声文字起こし完了（{output['duration']:.0f}秒の音声を{output['elapsed_seconds']:.1f}秒で処理）")
+            return output
+
+        except Exception as e:
+            logger.error(f"❌ 音声文字起こしエラー: {e}")
+            raise
+
+    @modal.method()
+    @instrument("transcribe_chunk")
+    @traced("transcribe_chunk")
+    @limit_concurrency("transcribe_chunk")
+    def transcribe_chunk(
+        self,
+        audio_path: str,
+        start: float,
+        end: float,
+        language: str = "ja",
+        traceparent: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        音声ファイルの一部（start〜end 秒）を文字起こし（transcribe_audio_parallel から呼ばれる）
+
+        Returns:
+            {"segments"（チャンク内の時刻）, "language", "elapsed_seconds"}
+        """
+        import time
+        from audio_chunking import load_audio_range
+
+        if self.asr_backend is None:
+            raise RuntimeError("文字起こしモデルが読み込まれていません（ASR_BACKEND とコンテナのログを確認してください）")
+
+        audio_path = _volume_file(audio_path, "音声ファイル")
+        started_at = time.perf_counter()
+        audio = load_audio_range(audio_path, start, end)
+        result = self.asr_backend.transcribe(audio, language)
+        elapsed = time.perf_counter() - started_at
+        logger.debug("🧩 チャンク文字起こし: %.1f〜%.1f秒（%.1f秒、%dセグメント）", start, end, elapsed, len(result["segments"]))
+        return {
+            "segments": result["segments"],
+            "language": result.get("language"),
+            "elapsed_seconds": round(elapsed, 3),
+        }
+
+    @modal.method()
+    @instrument("transcribe_pcm")
+    @traced("transcribe_pcm")
+    @limit_concurrency("transcribe_pcm")
+    def transcribe_pcm(
+        self,
+        pcm: bytes,
+        language: str = "ja",
+        beam_size: Optional[int] = None,
+        traceparent: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        短い音声（16kHzモノラルの16bit PCM）を文字起こし（ライブ文字起こしのウィンドウ用）
+
+        Returns:
+            {"segments"（音声の先頭を0とする時刻）, "language", "elapsed_ms"}
+        """
+        import time
+        from live_transcription import pcm_to_float
+
+        if self.asr_backend is None:
+            raise RuntimeError("文字起こしモデルが読み込まれていません（ASR_BACKEND とコンテナのログを確認してください）")
+
+        started_at = time.perf_counter()
+        result = self.asr_backend.transcribe(pcm_to_float(pcm), language, beam_size=beam_size)
+        return {
+            "segments": result["segments"],
+            "language": result.get("language"),
+            "elapsed_ms": round((time.perf_counter() - started_at) * 1000, 1),
+        }
+
+    @modal.method()
+    @instrument("assign_speakers")
+    @traced("assign_speakers")
+    @limit_concurrency("assign_speakers")
+    def assign_speakers(
+        self,
+        audio_path: str,
+        segments: List[Dict[str, Any]],
+        min_speakers: int = 1,
+        max_speakers: int = 10,
+        traceparent: Optional[str] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        文字起こし済みのセグメントに話者を割り当てる（ライブ文字起こしの終了後に使う）
+
+        Returns:
+            {"segments", "speakers"}（バックエンドが話者分離に対応していない場合はNone）
+        """
+        if self.asr_backend is None or not self.asr_backend.supports_diarization:
+            return None
+
+        audio_path = _volume_file(audio_path, "音声ファイル")
+        result, speakers = self._diarize(audio_path, {"segments": segments}, True, min_speakers, max_speakers)
+        if speakers is None:
+            return None
+        return {"segments": result["segments"], "speakers": speakers}
+
+    @modal.method()
+    @instrument("transcribe_audio_parallel")
+    @traced("transcribe_audio_parallel")
+    @limit_concurrency("transcribe_audio_parallel")
+    async def transcribe_audio_parallel(
+        self,
+        audio_path: str,
+        language: str = "ja",
+        enable_diarization: bool = True,
+        min_speakers: int = 1,
+        max_speakers: int = 10,
+        traceparent: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        長時間音声の並列文字起こし
+
+        発話区間（VAD）の切れ目で音声をチャンクに分け、transcribe_chunk を複数のコンテナで並列に実行する。
+        結果はタイムスタンプを音声全体の時刻に補正し、重なり部分の単語の重複を除いて1つのセグメントリストにまとめる。
+        話者分離はチャンク間で話者ラベルを揃えるため、まとめた後に音声全体に対して行う。
+
+        Args:
+            audio_path: models_volume上の音声ファイルのパス（/models 以下、または /models からの相対パス）
+            language: 言語コード
+            enable_diarization: 話者分離を有効にするか
+            min_speakers: 最小話者数
+            max_speakers: 最大話者数
+            traceparent: トレースの親のスパン（Webエンドポイントから渡す）
+
+        Returns:
+            文字起こし結果（transcribe_audio と同じ形式に "chunks" を追加）
+        """
+        import asyncio
+        import time
+        from audio_chunking import ChunkingConfig, detect_speech, plan_chunks, stitch_chunks
+        from metrics import STAGE_QUEUE, STAGE_SECONDS
+
+        audio_path = _volume_file(audio_path, "音声ファイル")
+        config = ChunkingConfig.from_env()
+        started_at = time.perf_counter()
+
+        # 発話区間の検出とチャンクの計画（ffmpeg / ONNX Runtimeの処理はスレッドで実行）
+        spans, duration = await asyncio.to_thread(detect_speech, audio_path, config)
+        chunks = plan_chunks(spans, duration, config)
+        forced = sum(1 for chunk in chunks if chunk.decode_start < chunk.start)
+        logger.info(
+            f"🎙️ 並列文字起こし開始: {audio_path}（{duration:.0f}秒、発話区間 {len(spans)}、"
+            f"{len(chunks)}チャンク、強制分割 {forced}、同時実行 {config.max_parallel}）"
+        )
+
+        worker = RealworldAgentMedia()
+        semaphore = asyncio.Semaphore(max(1, config.max_parallel))
+
+        async def transcribe(chunk):
+            queued_at = time.perf_counter()
+            async with semaphore:
+                STAGE_SECONDS.observe(time.perf_counter() - queued_at, operation="transcription", stage=STAGE_QUEUE)
+                for attempt in range(2):
+                    try:
+                        result = await worker.transcribe_chunk.remote.aio(
+                            audio_path,
+                            chunk.decode_start,
+                            chunk.decode_end,
+                            language=language,
+                            traceparent=current_traceparent(),
+                        )
+                        return chunk, result
+                    except Exception as e:
+                        if attempt == 1:
+                            raise
+                        logger.warning(f"⚠️ チャンク{chunk.index + 1}の文字起こしエラー（再試行）: {e}")
+
+        try:
+            chunk_results = await asyncio.gather(*(transcribe(chunk) for chunk in chunks))
+        except Exception as e:
+            logger.error(f"❌ 並列文字起こしエラー: {e}")
+            raise
+
+        result = {
+            "segments": stitch_chunks([(chunk, chunk_result["segments"]) for chunk, chunk_result in chunk_results]),
+            "language": next((r["language"] for _, r in chunk_results if r.get("language")), language),
+            "duration": duration,
+        }
+
+        # 話者分離（音声全体に対して1回）
+        if self.asr_backend is not None:
+            result, speakers_result = await asyncio.to_thread(
+                self._diarize, audio_path, result, enable_diarization, min_speakers, max_speakers
+            )
+        else:
+            speakers_result = None
+
+        output = self._transcription_output(result, language, speakers_result, time.perf_counter() - started_at)
+        output["chunks"] = [
+            {
+                "start": round(chunk.start, 3),
+                "end": round(chunk.end, 3),
+                "overlap": chunk.decode_start < chunk.start or chunk.decode_end > chunk.end,
+                "elapsed_seconds": chunk_result["elapsed_seconds"],
+            }
+            for chunk, chunk_result in chunk_results
+        ]
+        logger.info(
+            f"✅ 並列文字起こし完了（{duration:.0f}秒の音声を{output['elapsed_seconds']:.1f}秒で処理、"
+            f"{len(result['segments'])}セグメント）"
+        )
+        return output
+
+    @modal.method()
+    @instrument("detect_scene_changes")
+    @traced("detect_scene_changes")
+    @limit_concurrency("detect_scene_changes")
+    def detect_scene_changes(
+        self,
+        frames: List[bytes],
+        threshold: float = 0.3,
+        traceparent: Optional[str] = None,
+    ) -> List[int]:
+        """
+        シーン変化検出
+
+        Args:
+            frames: フレーム画像のリスト
+            threshold: 変化検出の閾値
+            traceparent: トレースの親のスパン（Webエンドポイントから渡す）
+
+        Returns:
+            シーン変化が検出されたフレームのインデックス
+        """
+        import time
+        from scene_detection import (
+            SceneDetectionConfig,
+            compute_histograms,
+            consecutive_similarities,
+            scene_change_indices,
+        )
+
+        logger.info(f"🎬 シーン変化検出開始（{len(frames)} フレーム）")
+
+        try:
+            started_at = time.perf_counter()
+            config = SceneDetectionConfig.from_env()
+
+            # 各フレームのヒストグラムは1回だけ計算（スレッドプール。SCENE_DECODE_REDUCTION で縮小デコード）
+            histograms = compute_histograms(frames, config)
+            # 隣接フレーム間の類似度をまとめて計算
+            similarities = consecutive_similarities(histograms)
+            changes = scene_change_indices(similarities, threshold)
+
+            for i in changes:
+                logger.debug("📍 フレーム %d: 変化検出（類似度: %.3f）", i, similarities[i - 1])
+
+            elapsed = time.perf_counter() - started_at
+            fps = len(frames) / elapsed if elapsed > 0 else 0.0
+            logger.info(f"✅ {len(changes)} 箇所のシーン変化を検出（{elapsed * 1000:.0f}ms、{fps:.0f} フレーム/秒）")
+            return changes
+
+        except Exception as e:
+            logger.error(f"❌ シーン変化検出エラー: {e}")
+            raise
+
+    @modal.method()
+    @instrument("detect_scene_changes_in_video")
+    @traced("detect_scene_changes_in_video")
+    @limit_concurrency("detect_scene_changes_in_video")
+    def detect_scene_changes_in_video(
+        self,
+        video_path: str,
+        threshold: float = 0.3,
+        sample_fps: Optional[float] = None,
+        traceparent: Optional[str] = None,
+    ):
+        """
+        動画ファイルのシーン変化検出（ストリーミング）
+
+        ffmpegのパイプでフレームを逐次デコードし、変化を検出するたびにイベントを返す。
+        フレームをメモリに溜めないため、長時間の録画でもメモリ使用量は一定。
+
+        Args:
+            video_path: models_volume上の動画ファイルのパス（/models 以下、または /models からの相対パス）
+            threshold: 変化検出の閾値
+            sample_fps: 動画から取り出すフレームレート（省略時は SCENE_SAMPLE_FPS、0は全フレーム）
+            traceparent: トレースの親のスパン（Webエンドポイントから渡す）
+
+        Yields:
+            イベント
+                - {"type": "change", "index", "timestamp", "similarity"}
+                - {"type": "done", "frames", "changes", "sample_fps", "elapsed_ms"}
+        """
+        import dataclasses
+        import time
+        from scene_detection import SceneDetectionConfig, stream_scene_changes
+
+        path = _volume_file(video_path, "動画ファイル")
+
+        config = SceneDetectionConfig.from_env()
+        if sample_fps is not None:
+            config = dataclasses.replace(config, sample_fps=sample_fps)
+
+        logger.info(f"🎬 シーン変化検出開始（動画: {path}、{config.sample_fps} fps）")
+        started_at = time.perf_counter()
+
+        try:
+            for event in stream_scene_changes(path, threshold, config):
+                if event["type"] == "change":
+                    logger.debug(
+                        "📍 フレーム %d（%s秒）: 変化検出（類似度: %.3f）",
+                        event["index"], event["timestamp"], event["similarity"],
+                    )
+                else:
+                    elapsed = time.perf_counter() - started_at
+                    event["elapsed_ms"] = round(elapsed * 1000, 1)
+                    fps = event["frames"] / elapsed if elapsed > 0 else 0.0
+                    logger.info(f"✅ {event['changes']} 箇所のシーン変化を検出（{event['frames']} フレーム、{fps:.0f} フレーム/秒）")
+                yield event
+
+        except Exception as e:
+            logger.error(f"❌ シーン変化検出エラー: {e}")
+            raise
+
+    # ヘルパーメソッド
+
+    def _diarize(
+        self,
+        audio_path: str,
+        result: Dict[str, Any],
+        enable_diarization: bool,
+        min_speakers: int,
+        max_speakers: int,
+    ) -> Tuple[Dict[str, Any], Optional[List[str]]]:
+        """
+        話者分離（バックエンドが対応している場合のみ）
+
+        Returns:
+            (話者を割り当てた結果, 話者リスト（話者分離しなかった場合はNone）)
+        """
+        if not enable_diarization or not self.asr_backend.supports_diarization:
+            return result, None
+
+        logger.debug("🎤 話者分離中...")
+        try:
+            result = self.asr_backend.diarize(audio_path, result, min_speakers, max_speakers)
+        except Exception as e:
+            logger.warning(f"⚠️ 話者分離エラー: {e}")
+            return result, None
+
+        speakers = self._extract_speakers(result)
+        logger.info(f"✅ {len(set(speakers))} 人の話者を検出")
+        return result, speakers
+
+    def _transcription_output(
+        self,
+        result: Dict[str, Any],
+        language: str,
+        speakers: Optional[List[str]],
+        elapsed: float,
+    ) -> Dict[str, Any]:
+        """文字起こし結果をレスポンスの形式に整形"""
+        from transcription import segments_text
+
+        duration = result.get("duration") or 0.0
+        return {
+            "text": segments_text(result["segments"]),
+            "segments": result["segments"],
+            "language": result.get("language") or language,
+            "speakers": speakers,
+            "backend": self.asr_backend.name if self.asr_backend else None,
+            "model": self.asr_backend.model_name if self.asr_backend else None,
+            "duration": duration,
+            "elapsed_seconds": round(elapsed, 3),
+            # 実時間係数（処理時間 / 音声の長さ）
+            "rtf": round(elapsed / duration, 3) if duration > 0 else None,
+            "timestamp": datetime.now().isoformat(),
+        }
+
+    def _extract_speakers(self, result: Dict) -> List[str]:
+        """話者リストを抽出"""
+        speakers = set()
+        for segment in result.get("segments", []):
+            if "speaker" in segment:
+                speakers.add(segment["speaker"])
+        return sorted(list(speakers))
+
+
+@app.function(
+    image=web_image,
+    secrets=secrets,
+    schedule=modal.Period(minutes=WARM_CAPACITY_INTERVAL_MINUTES),
+    timeout=120,
+)
+async def adjust_warm_capacity():
+    """
+    LLM・メディアのクラスの待機コンテナ数（update_autoscaler の min_containers）を直近の入力と時間帯から調整する
+
+    各コンテナが共有Dictに書き込んだメトリクスから前回の実行からの入力の数・処理時間・コンテナの起動を集計し、
+    直近 WARM_CAPACITY_WINDOW_MINUTES 分の履歴と決めた待機コンテナ数を共有Dictの warm:{llm / media} に保存する（/health で確認できる）。
+    """
+    import time
+    from metrics import MetricsConfig, published_snapshots
+    from service_logging import configure_logging
+    from warm_capacity import container_usage, plan_warm_containers, update_history
+
+    configure_logging()
+    # 環境変数（Secret）の変更を反映するため、実行のたびに読み込む
+    configs = {
+        "llm": (RealworldAgentLLM, WarmCapacityConfig.from_env("LLM", LLM_CONCURRENCY.target_inputs)),
+        "media": (RealworldAgentMedia, WarmCapacityConfig.from_env("MEDIA", MEDIA_CONCURRENCY.target_inputs, max_containers=1)),
+    }
+
+    now = time.time()
+    items = []
+    async for key, value in service_state.items.aio():
+        items.append((key, value))
+    snapshots, _ = published_snapshots(items, MetricsConfig.from_env().stale_seconds, now)
+
+    for service, (cls, config) in configs.items():
+        key = f"warm:{service}"
+        try:
+            state = await service_state.get.aio(key) or {}
+            history = update_history(state.get("history"), container_usage(snapshots, service), now, config.window_minutes * 60)
+            plan = plan_warm_containers(config, history, now)
+            if config.enabled:
+                # 再デプロイで min_containers が戻るため、変わらない場合も毎回設定する
+                await cls().update_autoscaler.aio(min_containers=plan.containers)
+                applied = plan.containers
+            elif state.get("applied"):
+                # 無効にしたときは、以前に設定した待機コンテナを0に戻す
+                await cls().update_autoscaler.aio(min_containers=0)
+                applied = 0
+            else:
+                applied = state.get("applied")
+            await service_state.put.aio(key, {"history": history, "plan": plan.to_dict(), "applied": applied, "updated_at": now})
+        except Exception as e:
+            logger.warning(f"⚠️ 待機コンテナ数の調整エラー（{service}）: {e}")
+            continue
+
+        starts = plan.cold_starts + plan.restored_starts
+        logger.info(
+            f"🌡️ 待機コンテナ（{service}）: {applied if applied is not None else '-'}（{plan.reason}）、"
+            f"直近{config.window_minutes}分の入力 {plan.inputs}件・起動 {starts}回"
+            + (f"（復元 {plan.restored_starts}回、平均 {plan.mean_init_seconds:.1f}秒）" if starts else "")
+        )
+
+
+@app.function(
+    image=web_image,
+    secrets=secrets,
+    volumes={MODELS_DIR: models_volume},
+    schedule=modal.Period(minutes=UPLOAD_PRUNE_INTERVAL_MINUTES),
+    timeout=600,
+)
+async def prune_uploads():
+    """
+    UPLOAD_DIR から最終利用が古いファイルと、合計サイズの上限を超えた分のファイルを削除する
+
+    削除の条件は upload_retention を参照。他のコンテナの保存・再利用を反映してから削除し、削除後にコミットする。
+    """
+    import asyncio
+    from service_logging import configure_logging
+    from upload_retention import prune_uploads as prune
+
+    configure_logging()
+    config = UploadRetentionConfig.from_env()
+    if not config.enabled:
+        return
+
+    await models_volume.reload.aio()
+    result = await asyncio.to_thread(prune, UPLOAD_DIR, config)
+    if result["removed"]:
+        await models_volume.commit.aio()
+    logger.info(
+        f"🧹 アップロードファイルの削除: {result['removed']}件（{result['removed_bytes'] / 1024 / 1024:.1f}MB）、"
+        f"残り {result['files']}件（{result['bytes'] / 1024 / 1024:.1f}MB）"
+    )
+
+
+# FastAPI Webエンドポイント
+@app.function(
+    image=web_image,
+    secrets=secrets,
+    volumes={MODELS_DIR: models_volume},
+    timeout=3600,  # ライブ文字起こしのWebSocket接続を1時間まで維持
+)
+@modal.asgi_app()
+def fastapi_app():
+    """
+    FastAPI Webエンドポイント
+    """
+    from fastapi import FastAPI, UploadFile, File, Form, Request, WebSocket, WebSocketDisconnect
+    from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+    from metrics import HTTP_INFLIGHT, HTTP_REQUEST_SECONDS, MetricsConfig, REGISTRY, container_id, published_snapshots, render
+    from service_logging import configure_logging
+    from tracing import activate, configure_tracing, start_span
+
+    configure_logging()
+    configure_tracing("web", container_id(), commit=models_volume.commit)
+    metrics_config = MetricsConfig.from_env()
+
+    web_app = FastAPI(title="Realworld Agent GPU API")
+
+    def route_path(request: Request) -> str:
+        # パスはルートのテンプレートを使う（一致しないパスは1つにまとめ、ラベルの種類を増やさない）
+        return getattr(request.scope.get("route"), "path", "unmatched")
+
+    @web_app.middleware("http")
+    async def record_request_metrics(request: Request, call_next):
+        import time
+
+        HTTP_INFLIGHT.inc()
+        started_at = time.perf_counter()
+        status = 500
+        # 呼び出し元（api-server など）が traceparent ヘッダーを付けた場合はそのトレースを続ける
+        request_span = start_span(f"HTTP {request.method}", request.headers.get("traceparent"))
+        try:
+            with activate(request_span):
+                response = await call_next(request)
+                status = response.status_code
+                request_span.name = f"{request.method} {route_path(request)}"
+                request_span.set_attributes(status=status)
+            response.headers["X-Trace-Id"] = request_span.trace_id
+            return response
+        finally:
+            HTTP_INFLIGHT.dec()
+            path = route_path(request)
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - started_at,
+                method=request.method,
+                path=path,
+                status=str(status),
+            )
+
+    @web_app.get("/")
+    async def root():
+        return {
+            "name": "Realworld Agent GPU Server",
+            "version": "0.1.0",
+            "status": "running",
+        }
+
+    @web_app.get("/health")
+    async def health():
+        import time
+
+        # サーキット状態はLLMのクラスを起動せずに共有Dictから読む（コールドスタートを発生させない）
+        providers = {}
+        for provider in ("openai", "anthropic"):
+            try:
+                snapshot = await service_state.get.aio(f"circuit:{provider}")
+            except Exception as e:
+                snapshot = {"state": "unknown", "error": str(e)}
+            if snapshot is None:
+                snapshot = {"state": "closed"}
+            elif snapshot.get("state") == "open" and snapshot.get("open_until", 0) <= time.time():
+                snapshot = {**snapshot, "state": "half_open"}
+            providers[provider] = snapshot
+
+        # 待機コンテナ数と直近のコールドスタート（adjust_warm_capacity が共有Dictに保存したもの）
+        warm_capacity = {}
+        for service in ("llm", "media"):
+            try:
+                state = await service_state.get.aio(f"warm:{service}")
+            except Exception as e:
+                state = {"error": str(e)}
+            if state is None:
+                warm_capacity[service] = None
+            elif "error" in state:
+                warm_capacity[service] = state
+            else:
+                warm_capacity[service] = {**state["plan"], "applied": state["applied"], "updated_at": state["updated_at"]}
+
+        all_open = all(p["state"] == "open" for p in providers.values())
+        return {
+            "status": "degraded" if all_open else "healthy",
+            "providers": providers,
+            "warm_capacity": warm_capacity,
+        }
+
+    @web_app.get("/metrics")
+    async def metrics():
+        """
+        Prometheus形式のメトリクス
+
+        LLM・メディアのクラスの各コンテナが共有Dictに書き込んだ集計結果と、このWebエンドポイントのコンテナの集計結果を、
+        container ラベルを付けて返す（クラスのコンテナは起動しない）。METRICS_STALE_SECONDS より古い集計結果は除いて削除する。
+        """
+        import time
+
+        items = []
+        try:
+            async for key, value in service_state.items.aio():
+                items.append((key, value))
+        except Exception as e:
+            logger.warning(f"⚠️ メトリクスの読み込みエラー: {e}")
+
+        snapshots, stale = published_snapshots(items, metrics_config.stale_seconds, time.time())
+        for key in stale:
+            try:
+                await service_state.pop.aio(key)
+            except Exception:
+                pass
+
+        snapshots.append(({"container": f"web-{container_id()}"}, REGISTRY.snapshot()))
+        return PlainTextResponse(render(snapshots), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+    @web_app.post("/api/transcribe")
+    async def transcribe(
+        audio: UploadFile = File(...),
+        language: str = Form("ja"),
+        enable_diarization: bool = Form(True),
+        parallel: bool = Form(False),
+    ):
+        """
+        音声文字起こしAPI
+
+        アップロードはチャンク単位でmodels_volumeに保存し（内容のハッシュをファイル名にするため、
+        同じ音声の再アップロードは保存を省略する）、そのパスをメディアのクラスに渡す。
+        parallel=true の場合は発話区間の切れ目で分割し、複数のコンテナで並列に文字起こしする（長時間の録音向け）。
+        """
+        try:
+            upload = await _save_upload_to_volume(audio, "audio")
+
+            # メディアのクラスを呼び出し
+            gpu = RealworldAgentMedia()
+            transcribe = gpu.transcribe_audio_parallel if parallel else gpu.transcribe_audio
+            with span(f"remote.{'transcribe_audio_parallel' if parallel else 'transcribe_audio'}"):
+                result = await transcribe.remote.aio(
+                    upload["path"],
+                    language=language,
+                    enable_diarization=enable_diarization,
+                    traceparent=current_traceparent(),
+                )
+            result["upload"] = {"bytes": upload["bytes"], "reused": upload["reused"]}
+
+            return JSONResponse(content=result)
+
+        except Exception as e:
+            return JSONResponse(
+                status_code=500,
+                content={"error": str(e)},
+            )
+
+    @web_app.post("/api/analyze-image")
+    async def analyze_image(image: UploadFile = File(...)):
         """画像分析API"""
         try:
             image_data = await image.read()
 
-            gpu = RealworldAgentGPU()
-            result = gpu.analyze_image.remote(image_data)
+            gpu = RealworldAgentLLM()
+            with span("remote.analyze_image", bytes=len(image_data)):
+                result = await gpu.analyze_image.remote.aio(image_data, traceparent=current_traceparent())
+
+            return JSONResponse(content=result)
+
+        except Exception as e:
+            return JSONResponse(
+                status_code=500,
+                content={"error": str(e)},
+            )
+
+    @web_app.post("/api/analyze-images")
+    async def analyze_images(
+        images: List[UploadFile] = File(...),
+        prompt: Optional[str] = Form(None),
+        pack: bool = Form(False),
+    ):
+        """
+        複数画像の一括分析API
+
+        結果は画像の順番どおりに返し、失敗した画像は {"index", "error"} になる。
+        pack=true の場合は小さい画像をまとめて1回のLLM呼び出しで分析する。
+        """
+        try:
+            image_data = [await image.read() for image in images]
+
+            gpu = RealworldAgentLLM()
+            with span("remote.analyze_images", images=len(image_data)):
+                result = await gpu.analyze_images.remote.aio(
+                    image_data, prompt=prompt, pack=pack, traceparent=current_traceparent()
+                )
 
             return JSONResponse(content=result)
 
@@ -1275,8 +2667,9 @@ def fastapi_app():
             body = await request.json()
             context = body.get("context", {})
 
-            gpu = RealworldAgentGPU()
-            result = gpu.generate_specification.remote(context)
+            gpu = RealworldAgentLLM()
+            with span("remote.generate_specification"):
+                result = await gpu.generate_specification.remote.aio(context, traceparent=current_traceparent())
 
             return JSONResponse(content=result)
 
@@ -1292,8 +2685,9 @@ def fastapi_app():
         try:
             body = await request.json()
 
-            gpu = RealworldAgentGPU()
-            result = gpu.generate_code.remote(body)
+            gpu = RealworldAgentLLM()
+            with span("remote.generate_code"):
+                result = await gpu.generate_code.remote.aio(body, traceparent=current_traceparent())
 
             return JSONResponse(content=result)
 
@@ -1303,5 +2697,374 @@ def fastapi_app():
                 content={"error": str(e)},
             )
 
+    @web_app.post("/api/generate-code/stream")
+    async def generate_code_stream(request: Request):
+        """コード生成API（Server-Sent Events）"""
+        body = await request.json()
+        # レスポンスの送信はハンドラーを抜けた後に行われるため、親のスパンをここで取っておく
+        parent = current_traceparent()
+
+        async def event_stream():
+            gpu = RealworldAgentLLM()
+            stream_span = start_span("remote.generate_code_stream", parent)
+            error = None
+            try:
+                async for event in gpu.generate_code_stream.remote_gen.aio(body, traceparent=stream_span.traceparent):
+                    yield _format_sse(event["type"], event)
+            except Exception as e:
+                error = e
+                yield _format_sse("error", {"type": "error", "error": str(e)})
+            finally:
+                stream_span.end(error)
+
+        return StreamingResponse(
+            event_stream(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    @web_app.post("/api/detect-scenes/stream")
+    async def detect_scenes_stream(
+        video: Optional[UploadFile] = File(None),
+        video_path: Optional[str] = Form(None),
+        threshold: float = Form(0.3),
+        sample_fps: Optional[float] = Form(None),
+    ):
+        """
+        動画のシーン変化検出API（Server-Sent Events）
+
+        video（アップロード）または video_path（models_volume上のパス）のどちらかを指定する。
+        アップロードはチャンク単位でmodels_volumeに保存してから処理する。
+        """
+        if video is None and not video_path:
+            return JSONResponse(
+                status_code=400,
+                content={"error": "video または video_path を指定してください"},
+            )
+
+        if video is not None:
+            try:
+                upload = await _save_upload_to_volume(video, "video")
+            except Exception as e:
+                return JSONResponse(
+                    status_code=500,
+                    content={"error": str(e)},
+                )
+            video_path = upload["path"]
+        parent = current_traceparent()
+
+        async def event_stream():
+            gpu = RealworldAgentMedia()
+            stream_span = start_span("remote.detect_scene_changes_in_video", parent)
+            error = None
+            try:
+                async for event in gpu.detect_scene_changes_in_video.remote_gen.aio(
+                    video_path,
+                    threshold=threshold,
+                    sample_fps=sample_fps,
+                    traceparent=stream_span.traceparent,
+                ):
+                    yield _format_sse(event["type"], event)
+            except Exception as e:
+                error = e
+                yield _format_sse("error", {"type": "error", "error": str(e)})
+            finally:
+                stream_span.end(error)
+
+        return StreamingResponse(
+            event_stream(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    @web_app.websocket("/ws/transcribe")
+    async def live_transcribe(
+        websocket: WebSocket,
+        language: str = "ja",
+        encoding: str = "pcm_s16le",
+        sample_rate: int = 16000,
+        diarization: bool = False,
+    ):
+        """
+        ライブ文字起こし（WebSocket）
+
+        クライアントは音声をバイナリメッセージで送り、終了時にテキストメッセージ {"type": "stop"} を送る。
+        encoding は pcm_s16le（モノラル、sample_rate で指定）/ webm / ogg（Opusなど）。
+
+        サーバーから送るメッセージ:
+            - {"type": "partial", "start", "end", "text", "latency_ms"}: 途中結果（次の partial / final で置き換わる）
+            - {"type": "final", "start", "end", "text", "words", "latency_ms"}: 確定結果
+            - {"type": "speakers", "segments", "speakers"}: 話者分離の結果（diarization=true で、対応している場合のみ）
+            - {"type": "done", "segments", "duration"}: 終了
+            - {"type": "error", "error"}
+        """
+        await websocket.accept()
+        try:
+            # WebSocketにはHTTPのミドルウェアが適用されないため、セッション全体をここでスパンにする
+            with span("WS /ws/transcribe", websocket.headers.get("traceparent"), encoding=encoding, diarization=diarization):
+                await _live_transcription_session(websocket, language, encoding, sample_rate, diarization)
+        except WebSocketDisconnect:
+            logger.info("🔌 ライブ文字起こし: クライアントが切断しました")
+        except Exception as e:
+            logger.error(f"❌ ライブ文字起こしエラー: {e}")
+            try:
+                await websocket.send_json({"type": "error", "error": str(e)})
+            except Exception:
+                pass
+        finally:
+            try:
+                await websocket.close()
+            except Exception:
+                pass
+
     return web_app
 
+
+async def _live_transcription_session(websocket, language: str, encoding: str, sample_rate: int, diarization: bool):
+    """
+    ライブ文字起こしのセッション
+
+    受信した音声を LiveTranscriber に溜め、hop_ms ごとに確定していない部分を transcribe_pcm で文字起こしする。
+    文字起こしは同時に1つだけ行い、処理中に届いた音声は次のウィンドウに含める（処理が遅れても遅延が積み上がらない）。
+    diarization が有効な場合は音声をmodels_volumeに保存し、終了後に音声全体で話者分離する。
+    """
+    import asyncio
+    import json
+    import time
+    import uuid
+    import wave
+    from concurrent.futures import ThreadPoolExecutor
+    from live_transcription import (
+        SAMPLE_RATE,
+        LiveTranscriber,
+        LiveTranscriptionConfig,
+        StreamDecoder,
+        float_to_pcm,
+        pcm_to_float,
+        resample,
+    )
+
+    config = LiveTranscriptionConfig.from_env()
+    transcriber = LiveTranscriber(config)
+    decoder = None if encoding == "pcm_s16le" else StreamDecoder(encoding)
+    gpu = RealworldAgentMedia()
+
+    recording_path = None
+    recording = None
+    # 録音の書き込みはイベントループを止めないよう1つのスレッドで順に行う（close も同じスレッドで最後に実行する）
+    recording_writer = None
+    if diarization:
+        directory = os.path.join(UPLOAD_DIR, "live")
+        os.makedirs(directory, exist_ok=True)
+        recording_path = os.path.join(directory, f"{uuid.uuid4().hex}.wav")
+        recording = wave.open(recording_path, "wb")
+        recording.setnchannels(1)
+        recording.setsampwidth(2)
+        recording.setframerate(SAMPLE_RATE)
+        recording_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="live-recording")
+
+    audio_arrived = asyncio.Event()
+    input_finished = asyncio.Event()
+
+    async def add_audio(audio):
+        transcriber.add_audio(audio)
+        audio_arrived.set()
+        if recording is not None:
+            await asyncio.get_running_loop().run_in_executor(recording_writer, recording.writeframes, float_to_pcm(audio))
+
+    async def receive():
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                if message.get("bytes"):
+                    if decoder is not None:
+                        await decoder.write(message["bytes"])
+                    else:
+                        await add_audio(resample(pcm_to_float(message["bytes"]), sample_rate))
+                elif message.get("text"):
+                    try:
+                        control = json.loads(message["text"])
+                    except ValueError:
+                        logger.warning(f"⚠️ 不正な制御メッセージを無視します: {message['text'][:200]}")
+                        continue
+                    if isinstance(control, dict) and control.get("type") == "stop":
+                        break
+        finally:
+            if decoder is not None:
+                await decoder.close_input()
+            else:
+                input_finished.set()
+
+    async def read_decoded():
+        while True:
+            data = await decoder.read()
+            if data is None:
+                break
+            await add_audio(pcm_to_float(data))
+        input_finished.set()
+
+    async def transcribe_window(final: bool):
+        audio, offset = transcriber.window()
+        started_at = time.perf_counter()
+        if len(audio):
+            result = await gpu.transcribe_pcm.remote.aio(
+                float_to_pcm(audio), language, config.beam_size, traceparent=current_traceparent()
+            )
+            segments = result["segments"]
+        else:
+            segments = []
+        events = transcriber.update(segments, offset, len(audio) / SAMPLE_RATE, final=final)
+        # 遅延 = ウィンドウを取り出した（最新の音声が届いた）時点から結果を送るまで
+        latency_ms = round((time.perf_counter() - started_at) * 1000)
+        for event in events:
+            await websocket.send_json({**event, "latency_ms": latency_ms})
+
+    if decoder is not None:
+        await decoder.start()
+    logger.info(f"🎙️ ライブ文字起こし開始（{encoding}、{language}、話者分離: {'有効' if diarization else '無効'}）")
+
+    tasks = [asyncio.create_task(receive())]
+    if decoder is not None:
+        tasks.append(asyncio.create_task(read_decoded()))
+    try:
+        while not input_finished.is_set() or transcriber.ready():
+            if transcriber.ready():
+                await transcribe_window(final=False)
+                continue
+            audio_arrived.clear()
+            try:
+                await asyncio.wait_for(audio_arrived.wait(), timeout=0.1)
+            except asyncio.TimeoutError:
+                pass
+        # 残りをすべて確定
+        if transcriber.unfinished():
+            await transcribe_window(final=True)
+    finally:
+        for task in tasks:
+            task.cancel()
+        if decoder is not None:
+            await decoder.close()
+        if recording is not None:
+            # キャンセルした受信タスクの書き込みが残っていても、その後に閉じる
+            await asyncio.get_running_loop().run_in_executor(recording_writer, recording.close)
+            recording_writer.shutdown()
+
+    if recording_path is not None:
+        await models_volume.commit.aio()
+        diarized = await gpu.assign_speakers.remote.aio(
+            recording_path, transcriber.segments, traceparent=current_traceparent()
+        )
+        if diarized is not None:
+            await websocket.send_json({"type": "speakers", **diarized})
+
+    logger.info(f"✅ ライブ文字起こし完了（{transcriber.duration:.0f}秒、{len(transcriber.segments)}セグメント）")
+    await websocket.send_json({
+        "type": "done",
+        "segments": transcriber.segments,
+        "duration": round(transcriber.duration, 3),
+    })
+
+
+async def _iterate_async(items):
+    """リストを非同期イテレーターとして返す"""
+    for item in items:
+        yield item
+
+
+def _format_sse(event_type: str, data: Dict[str, Any]) -> str:
+    """Server-Sent Eventsの1イベント分の文字列"""
+    import json
+
+    return f"event: {event_type}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+
+def _resolve_volume_path(path: str) -> str:
+    """models_volume上のパスを絶対パスに変換（/models の外を指すパスは拒否）"""
+    resolved = os.path.realpath(os.path.join(MODELS_DIR, path))
+    if os.path.commonpath([resolved, MODELS_DIR]) != MODELS_DIR:
+        raise ValueError(f"models_volume外のパスは指定できません: {path}")
+    return resolved
+
+
+# models_volume.reload() はコンテナ内で同時に1つだけ実行する
+_volume_reload_lock = threading.Lock()
+
+
+def _volume_file(path: str, label: str) -> str:
+    """
+    models_volume上の既存ファイルの絶対パス
+
+    Webエンドポイントが直前にアップロードしたファイルは、Volumeを読み込み直すまで見えないことがある。
+
+    Raises:
+        FileNotFoundError: ファイルが存在しない場合
+    """
+    resolved = _resolve_volume_path(path)
+    if not os.path.exists(resolved):
+        # 同時に処理中の入力が待っている間に読み込み直されていれば、もう一度は読み込まない
+        with _volume_reload_lock:
+            if not os.path.exists(resolved):
+                try:
+                    models_volume.reload()
+                except Exception as e:
+                    # 同じコンテナの他の入力がVolume上のファイルを開いている間は読み込み直せない
+                    logger.warning(f"⚠️ Volumeの読み込み直しエラー: {e}")
+    if not os.path.exists(resolved):
+        raise FileNotFoundError(f"{label}が見つかりません: {path}")
+    return resolved
+
+
+async def _save_upload_to_volume(upload, category: str) -> Dict[str, Any]:
+    """
+    アップロードファイルをチャンク単位でmodels_volumeに保存
+
+    ファイル全体をメモリに載せず、読み込みながらSHA-256を計算する。
+    内容のハッシュをファイル名にするため、同じ内容のファイルは1つだけ保存される。
+    既存のファイルを再利用する場合は更新日時を更新し、prune_uploads の削除の対象から外す。
+
+    Args:
+        upload: FastAPIのUploadFile
+        category: 保存先のサブディレクトリ（UPLOAD_DIR 以下）
+
+    Returns:
+        {"path", "bytes", "reused"}
+    """
+    import asyncio
+    import hashlib
+    import uuid
+
+    directory = os.path.join(UPLOAD_DIR, category)
+    os.makedirs(directory, exist_ok=True)
+    _, extension = os.path.splitext(upload.filename or "")
+    temp_path = os.path.join(directory, f".upload-{uuid.uuid4().hex}")
+
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with span("upload.save", category=category), open(temp_path, "wb") as f:
+            while True:
+                chunk = await upload.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                size += len(chunk)
+                await asyncio.to_thread(f.write, chunk)
+
+        path = os.path.join(directory, f"{digest.hexdigest()}{extension.lower()}")
+        reused = os.path.exists(path)
+        if reused:
+            os.remove(temp_path)
+            os.utime(path)
+        else:
+            os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    await models_volume.commit.aio()
+    logger.info(f"📥 アップロード保存: {path}（{size / 1024 / 1024:.1f}MB{'、既存ファイルを再利用' if reused else ''}）")
+    return {"path": path, "bytes": size, "reused": reused}
@@ -0,0 +1,337 @@
+"""
+トークン予算に収まるプロンプトの組み立て
+コンテキスト（文字起こし、仕様書、写真の分析）を項目に分け、新しさとユーザーの要求との関連度で順位を付けて、
+モデルのコンテキスト長から出力分（max_tokens）を差し引いた予算に入るだけ詰める
+
+トークン数は OpenAI では tiktoken（利用できる場合）で数え、それ以外はプロバイダーごとの文字数の比率で見積もる。
+見積もりは多めに出るように比率を決めているため、予算を超えることはない。
+"""
+
+import functools
+import logging
+import math
+import os
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# モデル名の前方一致でコンテキスト長を決める（上から順に判定）
+MODEL_CONTEXT_WINDOWS = [
+    ("gpt-4o", 128000),
+    ("gpt-4-turbo", 128000),
+    ("gpt-4.1", 1000000),
+    ("gpt-4", 8192),
+    ("gpt-3.5-turbo", 16385),
+    ("o1", 200000),
+    ("o3", 200000),
+    ("claude-", 200000),
+]
+DEFAULT_CONTEXT_WINDOW = 128000
+
+# トークン数の見積もり（1トークンあたりの文字数。ASCIIとそれ以外の文字で分ける）
+ESTIMATE_CHARS_PER_TOKEN = {
+    "openai": (4.0, 1.0),
+    "anthropic": (3.5, 0.8),
+}
+
+# 1項目あたりの区切り（改行）の分
+ITEM_OVERHEAD_TOKENS = 1
+
+# 1トークンあたりの文字数の上限（数える前に、明らかに予算に入らない項目を除くために使う）
+MAX_CHARS_PER_TOKEN = 8
+
+# 仕様書を見出しで分けたあと、これより長い節は段落で分ける
+SECTION_MAX_CHARS = 2000
+
+KINDS = ("summary", "specification", "transcription", "photo")
+
+_WORD_PATTERN = re.compile(r"[a-z0-9_]{2,}")
+_CJK_PATTERN = re.compile(r"[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff]+")
+
+
+@dataclass(frozen=True)
+class PromptBudgetConfig:
+    """
+    プロンプトのトークン予算の設定
+
+    環境変数:
+        PROMPT_MAX_INPUT_TOKENS: 入力（プロンプト）のトークン数の上限。コンテキスト長に余裕があってもこれ以上は使わない
+        PROMPT_CONTEXT_WINDOW_TOKENS: モデルのコンテキスト長（0はモデル名から判定）
+        PROMPT_SAFETY_TOKENS: 見積もりの誤差に備えて残すトークン数
+        PROMPT_RECENCY_WEIGHT: 順位付けでの新しさの重み（0〜1、残りが関連度の重み）
+        PROMPT_RECENCY_HALF_LIFE: 新しさの半減期（件数。この件数だけ古い項目は新しさが半分になる）
+    """
+
+    max_input_tokens: int = 16000
+    context_window_tokens: int = 0
+    safety_tokens: int = 512
+    recency_weight: float = 0.6
+    recency_half_life: float = 30.0
+
+    @classmethod
+    def from_env(cls) -> "PromptBudgetConfig":
+        """環境変数から設定を読み込む"""
+        return cls(
+            max_input_tokens=int(os.getenv("PROMPT_MAX_INPUT_TOKENS", cls.max_input_tokens)),
+            context_window_tokens=int(os.getenv("PROMPT_CONTEXT_WINDOW_TOKENS", cls.context_window_tokens)),
+            safety_tokens=int(os.getenv("PROMPT_SAFETY_TOKENS", cls.safety_tokens)),
+            recency_weight=min(1.0, max(0.0, float(os.getenv("PROMPT_RECENCY_WEIGHT", cls.recency_weight)))),
+            recency_half_life=max(1.0, float(os.getenv("PROMPT_RECENCY_HALF_LIFE", cls.recency_half_life))),
+        )
+
+    def context_window(self, model: str) -> int:
+        if self.context_window_tokens > 0:
+            return self.context_window_tokens
+        for prefix, tokens in MODEL_CONTEXT_WINDOWS:
+            if model.startswith(prefix):
+                return tokens
+        return DEFAULT_CONTEXT_WINDOW
+
+    def budget(self, model: str, max_tokens: int, fixed_tokens: int) -> int:
+        """
+        コンテキスト項目に使えるトークン数
+
+        Args:
+            model: モデル名
+            max_tokens: 出力に確保するトークン数
+            fixed_tokens: テンプレートなど必ず含める部分のトークン数
+        """
+        available = min(self.context_window(model) - max_tokens - self.safety_tokens, self.max_input_tokens)
+        return max(0, available - fixed_tokens)
+
+
+def estimate_tokens(text: str, provider: str) -> int:
+    """文字数からトークン数を見積もる（多めに出る）"""
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    other_chars = len(text) - ascii_chars
+    ascii_ratio, other_ratio = ESTIMATE_CHARS_PER_TOKEN.get(provider, ESTIMATE_CHARS_PER_TOKEN["anthropic"])
+    return math.ceil(ascii_chars / ascii_ratio + other_chars / other_ratio)
+
+
+@functools.lru_cache(maxsize=None)
+def _tiktoken_encoding(model: str):
+    """モデルのtiktokenのエンコーディング（使えない場合はNone）"""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        # エンコーディングのファイルを取得できない場合など
+        logger.warning(f"⚠️ tiktokenを利用できないため、トークン数は文字数から見積もります: {e}")
+        return None
+
+
+class TokenCounter:
+    """
+    プロバイダー・モデルごとのトークン数の計算
+
+    同じセッションの文字起こしは呼び出しのたびに数え直すことになるため、結果をテキストごとに保持する。
+    """
+
+    def __init__(self, provider: str, model: str, cache_size: int = 65536):
+        self.provider = provider
+        self.model = model
+        self.encoding = _tiktoken_encoding(model) if provider == "openai" else None
+        self.count = functools.lru_cache(maxsize=cache_size)(self._count)
+
+    @property
+    def method(self) -> str:
+        return "tiktoken" if self.encoding is not None else "estimate"
+
+    def _count(self, text: str) -> int:
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return estimate_tokens(text, self.provider)
+
+
+@functools.lru_cache(maxsize=None)
+def get_token_counter(provider: str, model: str) -> TokenCounter:
+    """TokenCounterを使い回す（エンコーディングの読み込みは1回だけ）"""
+    return TokenCounter(provider, model)
+
+
+@dataclass(frozen=True)
+class ContextItem:
+    """
+    プロンプトに含める候補の項目
+
+    index は種類ごとの元の順番（詰めたあとはこの順番で並べ直す）。
+    pinned の項目は順位に関係なく先に詰める。
+    """
+
+    kind: str
+    index: int
+    text: str
+    recency: float = 1.0
+    pinned: bool = False
+
+
+def _recency(position: int, count: int, half_life: float) -> float:
+    """末尾（最新）を1として、half_life 件ごとに半分になる"""
+    return 0.5 ** ((count - 1 - position) / half_life)
+
+
+def transcription_items(transcriptions: List[Dict[str, Any]], half_life: float) -> List[ContextItem]:
+    """文字起こし（古い順）を項目にする"""
+    items = []
+    for position, trans in enumerate(transcriptions):
+        speaker = trans.get("speaker", "不明")
+        text = trans.get("text", "")
+        items.append(ContextItem(
+            kind="transcription",
+            index=position,
+            text=f"[{speaker}] {text}",
+            recency=_recency(position, len(transcriptions), half_life),
+        ))
+    return items
+
+
+def transcription_line_items(lines: List[str], half_life: float) -> List[ContextItem]:
+    """整形済みの文字起こしの行（古い順）を項目にする"""
+    return [
+        ContextItem(kind="transcription", index=position, text=line, recency=_recency(position, len(lines), half_life))
+        for position, line in enumerate(lines)
+    ]
+
+
+def photo_items(photos: List[Dict[str, Any]], half_life: float) -> List[ContextItem]:
+    """写真のうち分析結果（analysis）があるものを項目にする"""
+    analyzed = [photo for photo in photos if (photo.get("analysis") or "").strip()]
+    return [
+        ContextItem(
+            kind="photo",
+            index=position,
+            text=f"[{photo.get('filename') or f'写真{position + 1}'}] {photo['analysis'].strip()}",
+            recency=_recency(position, len(analyzed), half_life),
+        )
+        for position, photo in enumerate(analyzed)
+    ]
+
+
+def split_sections(markdown: str) -> List[str]:
+    """
+    Markdownを見出しの前で分割し、長い節はさらに空行で分割する
+
+    各部分は改行を含めて元の文字列のままなので、すべてをつなげると元の文章に戻る。
+    """
+    sections: List[str] = []
+    current = ""
+    for line in markdown.splitlines(keepends=True):
+        if line.startswith("#") and current.strip():
+            sections.append(current)
+            current = ""
+        current += line
+    if current.strip():
+        sections.append(current)
+
+    parts = []
+    for section in sections:
+        if len(section) <= SECTION_MAX_CHARS:
+            parts.append(section)
+            continue
+        paragraph = ""
+        for line in section.splitlines(keepends=True):
+            paragraph += line
+            if not line.strip() and len(paragraph) >= SECTION_MAX_CHARS // 4:
+                parts.append(paragraph)
+                paragraph = ""
+        if paragraph:
+            parts.append(paragraph)
+    return parts
+
+
+def specification_items(specification: str) -> List[ContextItem]:
+    """仕様書を節ごとの項目にする（最初の節にはタイトルがあるため必ず含める）"""
+    return [
+        ContextItem(kind="specification", index=position, text=part, pinned=position == 0)
+        for position, part in enumerate(split_sections(specification))
+    ]
+
+
+def query_terms(text: str) -> frozenset:
+    """関連度の計算に使う語（英数字の単語と、日本語の文字の2-gram）"""
+    text = text.lower()
+    terms = set(_WORD_PATTERN.findall(text))
+    for run in _CJK_PATTERN.findall(text):
+        if len(run) == 1:
+            terms.add(run)
+        else:
+            terms.update(run[i:i + 2] for i in range(len(run) - 1))
+    return frozenset(terms)
+
+
+def relevance(query: frozenset, text: str) -> float:
+    """
+    ユーザーの要求の語のうち、項目に含まれる割合（0〜1）
+
+    項目側の語の集合は作らず、要求の語（数個〜数十個）を部分文字列として探す（長いセッションでも項目数に比例する時間で済む）
+    """
+    if not query:
+        return 0.0
+    text = text.lower()
+    return sum(1 for term in query if term in text) / len(query)
+
+
+def pack_context(
+    items: List[ContextItem],
+    budget: int,
+    counter: TokenCounter,
+    query: str = "",
+    recency_weight: float = 0.6,
+) -> Tuple[Dict[str, List[str]], Dict[str, Any]]:
+    """
+    予算に収まるように項目を選ぶ
+
+    pinned の項目を先に、残りは「新しさ × recency_weight + 関連度 × (1 - recency_weight)」の高い順に、
+    入るものだけを詰める（入らない項目は飛ばして次の項目を試す）。
+
+    Returns:
+        ({種類: [テキスト]（元の順番）}, 統計)
+    """
+    terms = query_terms(query)
+    weight = recency_weight if terms else 1.0
+
+    scored = []
+    for item in items:
+        scored.append((item, weight * item.recency + (1 - weight) * relevance(terms, item.text)))
+    scored.sort(key=lambda entry: (not entry[0].pinned, -entry[1]))
+
+    selected: List[ContextItem] = []
+    used = 0
+    for item, _ in scored:
+        remaining = budget - used
+        if remaining <= ITEM_OVERHEAD_TOKENS:
+            break
+        # 明らかに入らない項目はトークン数を数えずに飛ばす（1トークンは MAX_CHARS_PER_TOKEN 文字以下とみなす）
+        if len(item.text) > remaining * MAX_CHARS_PER_TOKEN:
+            continue
+        tokens = counter.count(item.text) + ITEM_OVERHEAD_TOKENS
+        if used + tokens <= budget:
+            selected.append(item)
+            used += tokens
+
+    packed: Dict[str, List[str]] = {kind: [] for kind in KINDS}
+    for item in sorted(selected, key=lambda item: (item.kind, item.index)):
+        packed.setdefault(item.kind, []).append(item.text)
+
+    stats = {
+        "counter": counter.method,
+        "budget_tokens": budget,
+        "context_tokens": used,
+        "candidates": len(items),
+        "selected": len(selected),
+        "dropped": {
+            kind: sum(1 for item in items if item.kind == kind) - len(packed.get(kind, []))
+            for kind in KINDS
+            if any(item.kind == kind for item in items)
+        },
+    }
+    return packed, stats
+
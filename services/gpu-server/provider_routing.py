@@ -0,0 +1,411 @@
+"""
+LLMプロバイダーのルーティング
+プロバイダーごとのレイテンシ計測、サーキットブレーカー、プライマリ/フォールバック間のヘッジリクエスト
+"""
+
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class HedgingConfig:
+    """
+    ヘッジリクエスト設定
+
+    環境変数:
+        LLM_HEDGING_ENABLED: ヘッジを有効にするか（デフォルト: false）
+        LLM_HEDGE_PERCENTILE: 待ち時間の基準にするレイテンシのパーセンタイル
+        LLM_HEDGE_MULTIPLIER: パーセンタイル値に掛ける係数
+        LLM_HEDGE_MIN_DELAY_SECONDS / LLM_HEDGE_MAX_DELAY_SECONDS: 待ち時間の下限・上限
+        LLM_HEDGE_DEFAULT_DELAY_SECONDS: 計測サンプルが足りない間の待ち時間
+        LLM_HEDGE_MIN_SAMPLES: パーセンタイルを使い始めるサンプル数
+    """
+
+    enabled: bool = False
+    percentile: float = 0.95
+    multiplier: float = 1.0
+    min_delay: float = 2.0
+    max_delay: float = 120.0
+    default_delay: float = 30.0
+    min_samples: int = 5
+
+    @classmethod
+    def from_env(cls) -> "HedgingConfig":
+        """環境変数から設定を読み込む"""
+        return cls(
+            enabled=os.getenv("LLM_HEDGING_ENABLED", "false").lower() == "true",
+            percentile=float(os.getenv("LLM_HEDGE_PERCENTILE", cls.percentile)),
+            multiplier=float(os.getenv("LLM_HEDGE_MULTIPLIER", cls.multiplier)),
+            min_delay=float(os.getenv("LLM_HEDGE_MIN_DELAY_SECONDS", cls.min_delay)),
+            max_delay=float(os.getenv("LLM_HEDGE_MAX_DELAY_SECONDS", cls.max_delay)),
+            default_delay=float(os.getenv("LLM_HEDGE_DEFAULT_DELAY_SECONDS", cls.default_delay)),
+            min_samples=int(os.getenv("LLM_HEDGE_MIN_SAMPLES", cls.min_samples)),
+        )
+
+
+class LatencyTracker:
+    """
+    プロバイダー・処理種別ごとの直近レイテンシ（秒）
+
+    画像分析とコード生成では所要時間の桁が違うため、(provider, operation) 単位で保持する。
+    コンテナ内で同時に処理する入力から記録・参照できる（スレッドセーフ）。
+    """
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._samples: Dict[Tuple[str, str], Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, provider: str, operation: str, seconds: float):
+        """成功したリクエストのレイテンシを記録"""
+        key = (provider, operation)
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def count(self, provider: str, operation: str) -> int:
+        with self._lock:
+            return len(self._samples.get((provider, operation), ()))
+
+    def percentile(self, provider: str, operation: str, q: float) -> Optional[float]:
+        """パーセンタイル（サンプルがない場合はNone）"""
+        with self._lock:
+            ordered = sorted(self._samples.get((provider, operation), ()))
+        return _percentile(ordered, q)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """計測状況（/health などでの表示用）"""
+        with self._lock:
+            samples = {key: sorted(values) for key, values in self._samples.items()}
+        return {
+            f"{provider}:{operation}": {
+                "samples": len(ordered),
+                "p50": _percentile(ordered, 0.5),
+                "p95": _percentile(ordered, 0.95),
+            }
+            for (provider, operation), ordered in samples.items()
+        }
+
+
+def _percentile(ordered: List[float], q: float) -> Optional[float]:
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _parse_operation_seconds(value: str) -> Dict[str, float]:
+    """'image=60,code=420' 形式の設定を辞書に変換"""
+    result = {}
+    for item in value.split(","):
+        if "=" in item:
+            operation, seconds = item.split("=", 1)
+            result[operation.strip()] = float(seconds)
+    return result
+
+
+@dataclass(frozen=True)
+class CircuitBreakerConfig:
+    """
+    サーキットブレーカー設定
+
+    環境変数:
+        LLM_CIRCUIT_BREAKER_ENABLED: サーキットブレーカーを有効にするか（デフォルト: true）
+        LLM_CIRCUIT_WINDOW_SECONDS: エラー率・遅延率を集計する期間（秒）
+        LLM_CIRCUIT_MIN_REQUESTS: 判定に必要な最小リクエスト数
+        LLM_CIRCUIT_ERROR_RATE: この割合以上が失敗したらオープン
+        LLM_CIRCUIT_SLOW_CALL_RATE: この割合以上が遅延したらオープン
+        LLM_CIRCUIT_SLOW_CALL_SECONDS: 処理種別ごとの遅延とみなす秒数（例: image=60,code=420）
+        LLM_CIRCUIT_OPEN_SECONDS: オープン状態を維持する秒数（経過後にハーフオープン）
+        LLM_CIRCUIT_HALF_OPEN_MAX_CALLS: ハーフオープン中に同時に流す試行リクエスト数
+        LLM_CIRCUIT_HALF_OPEN_SUCCESSES: クローズに戻すのに必要な試行の成功数
+    """
+
+    enabled: bool = True
+    window_seconds: float = 120.0
+    min_requests: int = 5
+    error_rate_threshold: float = 0.5
+    slow_call_rate_threshold: float = 0.8
+    slow_call_seconds: Tuple[Tuple[str, float], ...] = (
+        ("image", 60.0),
+        ("specification", 180.0),
+        ("code", 420.0),
+    )
+    open_seconds: float = 30.0
+    half_open_max_calls: int = 1
+    half_open_successes: int = 2
+
+    @classmethod
+    def from_env(cls) -> "CircuitBreakerConfig":
+        """環境変数から設定を読み込む"""
+        slow_call_seconds = dict(cls.slow_call_seconds)
+        slow_call_seconds.update(_parse_operation_seconds(os.getenv("LLM_CIRCUIT_SLOW_CALL_SECONDS", "")))
+        return cls(
+            enabled=os.getenv("LLM_CIRCUIT_BREAKER_ENABLED", "true").lower() == "true",
+            window_seconds=float(os.getenv("LLM_CIRCUIT_WINDOW_SECONDS", cls.window_seconds)),
+            min_requests=int(os.getenv("LLM_CIRCUIT_MIN_REQUESTS", cls.min_requests)),
+            error_rate_threshold=float(os.getenv("LLM_CIRCUIT_ERROR_RATE", cls.error_rate_threshold)),
+            slow_call_rate_threshold=float(os.getenv("LLM_CIRCUIT_SLOW_CALL_RATE", cls.slow_call_rate_threshold)),
+            slow_call_seconds=tuple(slow_call_seconds.items()),
+            open_seconds=float(os.getenv("LLM_CIRCUIT_OPEN_SECONDS", cls.open_seconds)),
+            half_open_max_calls=int(os.getenv("LLM_CIRCUIT_HALF_OPEN_MAX_CALLS", cls.half_open_max_calls)),
+            half_open_successes=int(os.getenv("LLM_CIRCUIT_HALF_OPEN_SUCCESSES", cls.half_open_successes)),
+        )
+
+
+class CircuitBreaker:
+    """
+    プロバイダー単位のサーキットブレーカー
+
+    - closed: 通常状態。直近の失敗率・遅延率が閾値を超えるとopenへ
+    - open: リクエストを流さない。open_seconds経過後にhalf_openへ
+    - half_open: 試行リクエストを少数だけ流す。規定数成功したらclosed、1回でも失敗したらopenへ
+
+    状態の参照・更新はロックの中で行う（コンテナ内で同時に処理する入力から呼び出せる）。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        config: CircuitBreakerConfig,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.config = config
+        self._clock = clock
+        self._slow_call_seconds = dict(config.slow_call_seconds)
+
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._outcomes: Deque[Tuple[float, bool, bool]] = deque()  # (時刻, 成功, 遅延)
+        self._half_open_in_flight = 0
+        self._half_open_successes = 0
+        self._state_changed = False
+        self.last_error: Optional[str] = None
+        self._lock = threading.RLock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and self._clock() - self._opened_at >= self.config.open_seconds:
+                self._transition(self.HALF_OPEN)
+            return self._state
+
+    def allow_request(self) -> bool:
+        """このプロバイダーにリクエストを流してよいか"""
+        if not self.config.enabled:
+            return True
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN:
+                return self._half_open_in_flight < self.config.half_open_max_calls
+            return False
+
+    def on_call_start(self):
+        """プロバイダー呼び出しの開始（ハーフオープン中の試行数を数える）"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._half_open_in_flight += 1
+
+    def record_success(self, operation: str, seconds: float):
+        """成功を記録（処理種別ごとの閾値を超えた場合は遅延として扱う）"""
+        slow = seconds >= self._slow_call_seconds.get(operation, float("inf"))
+        self._record(success=True, slow=slow)
+
+    def record_failure(self, error: Exception):
+        """失敗を記録"""
+        self.last_error = str(error)[:200]
+        self._record(success=False, slow=False)
+
+    def release(self):
+        """結果を記録せずに呼び出しを終えた場合（キャンセルなど）"""
+        with self._lock:
+            if self._state == self.HALF_OPEN and self._half_open_in_flight > 0:
+                self._half_open_in_flight -= 1
+
+    def consume_state_change(self) -> bool:
+        """前回の確認以降に状態が変わったか"""
+        with self._lock:
+            changed = self._state_changed
+            self._state_changed = False
+            return changed
+
+    def snapshot(self) -> Dict[str, Any]:
+        """状態（/health での表示用）"""
+        with self._lock:
+            now = self._clock()
+            self._prune(now)
+            total = len(self._outcomes)
+            failures = sum(1 for _, success, _ in self._outcomes if not success)
+            slow = sum(1 for _, _, is_slow in self._outcomes if is_slow)
+            state = self.state
+            opened_at = self._opened_at
+        return {
+            "state": state,
+            "requests": total,
+            "error_rate": round(failures / total, 3) if total else 0.0,
+            "slow_call_rate": round(slow / total, 3) if total else 0.0,
+            "retry_in_seconds": (
+                round(max(0.0, self.config.open_seconds - (now - opened_at)), 1)
+                if state == self.OPEN else None
+            ),
+            "last_error": self.last_error,
+        }
+
+    def _record(self, success: bool, slow: bool):
+        if not self.config.enabled:
+            return
+        with self._lock:
+            self._record_locked(success, slow)
+
+    def _record_locked(self, success: bool, slow: bool):
+        state = self.state
+        if state == self.HALF_OPEN:
+            self.release()
+            if not success or slow:
+                self._open()
+                return
+            self._half_open_successes += 1
+            if self._half_open_successes >= self.config.half_open_successes:
+                self._transition(self.CLOSED)
+            return
+
+        if state == self.OPEN:
+            # オープン前に開始していたリクエストの結果は判定に使わない
+            return
+
+        now = self._clock()
+        self._outcomes.append((now, success, slow))
+        self._prune(now)
+
+        total = len(self._outcomes)
+        if total < self.config.min_requests:
+            return
+        failures = sum(1 for _, ok, _ in self._outcomes if not ok)
+        slow_calls = sum(1 for _, _, is_slow in self._outcomes if is_slow)
+        if (
+            failures / total >= self.config.error_rate_threshold
+            or slow_calls / total >= self.config.slow_call_rate_threshold
+        ):
+            self._open()
+
+    def _prune(self, now: float):
+        while self._outcomes and now - self._outcomes[0][0] > self.config.window_seconds:
+            self._outcomes.popleft()
+
+    def _open(self):
+        self._opened_at = self._clock()
+        self._transition(self.OPEN)
+
+    def _transition(self, state: str):
+        if state == self._state:
+            return
+        self._state = state
+        self._state_changed = True
+        self._half_open_in_flight = 0
+        self._half_open_successes = 0
+        if state == self.CLOSED:
+            self._outcomes.clear()
+
+
+def order_providers(
+    providers: List[str],
+    breakers: Dict[str, CircuitBreaker],
+) -> List[str]:
+    """
+    サーキットの状態に応じてプロバイダーの試行順を決める
+
+    リクエストを流せるプロバイダーを優先順のまま前に並べ、オープン中のものは除外する。
+    すべてオープンの場合は、結果を返せる可能性があるため元の順序のまま試行する。
+    """
+    available = [p for p in providers if breakers[p].allow_request()]
+    return available or list(providers)
+
+
+def hedge_delay(tracker: LatencyTracker, config: HedgingConfig, provider: str, operation: str) -> float:
+    """
+    フォールバックを追加で投げるまでの待ち時間（秒）
+
+    プライマリの直近レイテンシのパーセンタイル × 係数を、下限・上限で丸める。
+    """
+    if tracker.count(provider, operation) < config.min_samples:
+        delay = config.default_delay
+    else:
+        delay = tracker.percentile(provider, operation, config.percentile) * config.multiplier
+    return min(config.max_delay, max(config.min_delay, delay))
+
+
+async def hedged_call(
+    call: Callable[[str], Awaitable[Any]],
+    primary: str,
+    fallback: str,
+    delay: float,
+    on_error: Optional[Callable[[str, Exception], None]] = None,
+    on_hedge: Optional[Callable[[str, float], None]] = None,
+) -> Tuple[Any, str, bool]:
+    """
+    ヘッジリクエスト
+
+    プライマリを実行し、delay秒以内に応答がなければフォールバックも並行して実行する。
+    先に成功した方の結果を採用し、もう一方はキャンセルする。
+    delay秒以内にプライマリが失敗した場合は、その時点でフォールバックを実行する。
+
+    Args:
+        call: プロバイダー名を受け取って処理を実行するコルーチン関数
+        primary: プライマリプロバイダー
+        fallback: フォールバックプロバイダー
+        delay: フォールバックを投げるまでの待ち時間（秒）
+        on_error: プロバイダーが失敗した時のコールバック
+        on_hedge: 待ち時間を超えてフォールバックを投げた時のコールバック
+
+    Returns:
+        (結果, 結果を返したプロバイダー, ヘッジが発動したか)
+    """
+    tasks: Dict[asyncio.Task, str] = {asyncio.ensure_future(call(primary)): primary}
+    hedged = False
+    fallback_started = False
+    last_error: Optional[Exception] = None
+
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            hedged = fallback_started = True
+            if on_hedge:
+                on_hedge(fallback, delay)
+            tasks[asyncio.ensure_future(call(fallback))] = fallback
+
+        while tasks:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                provider = tasks.pop(task)
+                error = task.exception()
+                if error is None:
+                    return task.result(), provider, hedged
+
+                last_error = error
+                if on_error:
+                    on_error(provider, error)
+                # プライマリが待ち時間内に失敗した場合は通常のフォールバック
+                if not fallback_started:
+                    fallback_started = True
+                    tasks[asyncio.ensure_future(call(fallback))] = fallback
+
+        raise last_error
+
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,230 @@
+"""
+LLM応答キャッシュ
+正規化したプロンプトのハッシュをキーとする2段構成（プロセス内LRU + Volume上の永続キャッシュ）
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+def normalize_prompt(prompt: str) -> str:
+    """改行コードと行末・前後の空白を正規化"""
+    lines = prompt.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip()
+
+
+class ResponseCache:
+    """
+    LLM応答キャッシュ
+
+    - メモリ層: コンテナ内のLRU（エントリ数上限）
+    - ディスク層: Volume上のJSONファイル（合計サイズ上限、古いものから削除）
+    どちらの層もTTLを過ぎたエントリはミスとして扱う。
+    get / put はスレッドから同時に呼び出せる（ファイルの読み書きはロックの外で行う）。
+
+    環境変数:
+        RESPONSE_CACHE_ENABLED: キャッシュを有効にするか（デフォルト: true）
+        RESPONSE_CACHE_TTL_SECONDS: 有効期限（秒）
+        RESPONSE_CACHE_MEMORY_ENTRIES: メモリ層のエントリ数上限
+        RESPONSE_CACHE_DISK_MAX_MB: ディスク層の合計サイズ上限（MB）
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        enabled: bool = True,
+        ttl_seconds: float = 86400,
+        memory_entries: int = 128,
+        disk_max_bytes: int = 512 * 1024 * 1024,
+    ):
+        self.directory = directory
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        self.memory_entries = memory_entries
+        self.disk_max_bytes = disk_max_bytes
+
+        self._memory: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._disk_bytes: Optional[int] = None
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        # メモリ層・カウンター・ディスク層の合計サイズを保護する
+        self._lock = threading.Lock()
+        # ディスク層の削除は同時に1つだけ行う（実行中なら他のスレッドは待たずに戻る）
+        self._evict_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, directory: str) -> "ResponseCache":
+        """環境変数から設定を読み込む"""
+        return cls(
+            directory=directory,
+            enabled=os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true",
+            ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", 86400)),
+            memory_entries=int(os.getenv("RESPONSE_CACHE_MEMORY_ENTRIES", 128)),
+            disk_max_bytes=int(float(os.getenv("RESPONSE_CACHE_DISK_MAX_MB", 512)) * 1024 * 1024),
+        )
+
+    @staticmethod
+    def make_key(prompt: str, provider: str, model: str, max_tokens: int, system: str = "") -> str:
+        """キャッシュキー（正規化プロンプト + プロバイダー + モデル + max_tokens (+ システムプロンプト) のSHA-256）"""
+        parts = [normalize_prompt(prompt), provider, model, max_tokens]
+        if system:
+            parts.append(normalize_prompt(system))
+        material = json.dumps(parts, ensure_ascii=False)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Tuple[Optional[Any], Optional[str]]:
+        """
+        キャッシュを参照
+
+        Returns:
+            (値, ヒットした層 'memory' / 'disk')。ミスの場合は (None, None)
+        """
+        if not self.enabled:
+            return None, None
+
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, value = entry
+                if now - created_at <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    return value, "memory"
+                del self._memory[key]
+
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            record = None
+
+        if record is not None:
+            if now - record["created_at"] <= self.ttl_seconds:
+                self._remember(key, record["created_at"], record["value"])
+                self._touch(path)
+                self._count("disk_hits")
+                return record["value"], "disk"
+            self._remove(path)
+
+        self._count("misses")
+        return None, None
+
+    def put(self, key: str, value: Any):
+        """キャッシュに保存（メモリ層とディスク層の両方）"""
+        if not self.enabled:
+            return
+
+        created_at = time.time()
+        self._remember(key, created_at, value)
+
+        path = self._path(key)
+        data = json.dumps({"created_at": created_at, "value": value}, ensure_ascii=False).encode("utf-8")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # 他のコンテナ・スレッドが書き途中のファイルを読まないよう一時ファイル経由で置き換える
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes += len(data)
+        self._evict_disk()
+
+    def stats(self) -> Dict[str, Any]:
+        """ヒット・ミスのカウンター"""
+        with self._lock:
+            counters = dict(self.counters)
+            memory_entries = len(self._memory)
+        hits = counters["memory_hits"] + counters["disk_hits"]
+        lookups = hits + counters["misses"]
+        return {
+            **counters,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "memory_entries": memory_entries,
+        }
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _remember(self, key: str, created_at: float, value: Any):
+        with self._lock:
+            self._memory[key] = (created_at, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _touch(self, path: str):
+        # 最終参照時刻を更新し、サイズ超過時の削除順に反映する
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _remove(self, path: str):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes -= size
+
+    def _scan_disk(self):
+        entries = []
+        for root, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if not filename.endswith(".json"):
+                    continue
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _evict_disk(self):
+        """合計サイズが上限を超えたら、期限切れ → 参照が古い順に削除"""
+        if self._disk_bytes is not None and self._disk_bytes <= self.disk_max_bytes:
+            return
+        if not self._evict_lock.acquire(blocking=False):
+            return
+        try:
+            self._evict_disk_locked()
+        finally:
+            self._evict_lock.release()
+
+    def _evict_disk_locked(self):
+        # Volumeは複数コンテナで共有されるため、超過時は実際のサイズを数え直す
+        entries = self._scan_disk()
+        total = sum(size for _, size, _ in entries)
+        now = time.time()
+
+        # 下限まで減らして、毎回の書き込みで削除が走らないようにする
+        target = self.disk_max_bytes * 0.9
+        if total > self.disk_max_bytes:
+            for mtime, size, path in sorted(entries):
+                if total <= target and now - mtime <= self.ttl_seconds:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+        with self._lock:
+            self._disk_bytes = total
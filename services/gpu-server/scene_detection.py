@@ -0,0 +1,342 @@
+"""
+シーン変化検出
+フレームごとの色ヒストグラムを1回だけ計算し、隣接フレーム間の相関をNumPyでまとめて求める
+
+動画ファイルはffmpegのパイプでデコードし、一定サイズのバッファを使い回しながら逐次処理する
+（動画の長さによらずメモリ使用量は一定）
+"""
+
+import json
+import os
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+# 8x8x8 ビンのBGRヒストグラム（従来実装と同じ）
+HIST_CHANNELS = [0, 1, 2]
+HIST_SIZE = [8, 8, 8]
+HIST_RANGES = [0, 256, 0, 256, 0, 256]
+HIST_BINS = 8 * 8 * 8
+CORREL_PLANE_SIZE = 8 * 8
+
+# ffmpegが失敗したときにエラーに含める stderr の末尾の行数
+FFMPEG_ERROR_LINES = 10
+
+# cv2.compareHist(HISTCMP_CORREL) と同じく、分母が0に近い場合は類似度1とする
+DBL_EPSILON = np.finfo(np.float64).eps
+
+
+@dataclass(frozen=True)
+class SceneDetectionConfig:
+    """
+    シーン変化検出の設定
+
+    環境変数:
+        SCENE_DECODE_REDUCTION: デコード時の縮小率（1, 2, 4, 8）。JPEGはDCTの段階で縮小されるため高速だが、
+            2以上ではヒストグラムが変わるため、検出結果はフル解像度の場合と一致しないことがある（近似）
+        SCENE_DECODE_WORKERS: デコードとヒストグラム計算を行うスレッド数（0はCPU数）
+        SCENE_SAMPLE_FPS: 動画から取り出すフレームレート（0は全フレーム）
+        SCENE_STREAM_MAX_WIDTH: 動画をデコードする際の最大幅（ピクセル）
+        SCENE_STREAM_BATCH_FRAMES: 動画を何フレームずつまとめて処理するか
+    """
+
+    decode_reduction: int = 1
+    workers: int = 0
+    sample_fps: float = 2.0
+    stream_max_width: int = 640
+    stream_batch_frames: int = 32
+
+    @classmethod
+    def from_env(cls) -> "SceneDetectionConfig":
+        """環境変数から設定を読み込む"""
+        return cls(
+            decode_reduction=int(os.getenv("SCENE_DECODE_REDUCTION", cls.decode_reduction)),
+            workers=int(os.getenv("SCENE_DECODE_WORKERS", cls.workers)),
+            sample_fps=float(os.getenv("SCENE_SAMPLE_FPS", cls.sample_fps)),
+            stream_max_width=int(os.getenv("SCENE_STREAM_MAX_WIDTH", cls.stream_max_width)),
+            stream_batch_frames=int(os.getenv("SCENE_STREAM_BATCH_FRAMES", cls.stream_batch_frames)),
+        )
+
+    @property
+    def max_workers(self) -> int:
+        return self.workers if self.workers > 0 else (os.cpu_count() or 1)
+
+
+def _imread_flag(reduction: int) -> int:
+    import cv2
+
+    flags = {
+        1: cv2.IMREAD_COLOR,
+        2: cv2.IMREAD_REDUCED_COLOR_2,
+        4: cv2.IMREAD_REDUCED_COLOR_4,
+        8: cv2.IMREAD_REDUCED_COLOR_8,
+    }
+    if reduction not in flags:
+        raise ValueError(f"未サポートの縮小率: {reduction}（1, 2, 4, 8のいずれか）")
+    return flags[reduction]
+
+
+def image_histogram(image: np.ndarray) -> np.ndarray:
+    """
+    BGR画像のL2正規化済みヒストグラム
+
+    Returns:
+        長さ512のfloat32配列
+    """
+    import cv2
+
+    hist = cv2.calcHist([image], HIST_CHANNELS, None, HIST_SIZE, HIST_RANGES)
+    cv2.normalize(hist, hist)
+    return hist.reshape(-1)
+
+
+def frame_histogram(frame_data: bytes, reduction: int = 1) -> np.ndarray:
+    """エンコード済みフレームをデコードしてヒストグラムを計算"""
+    import cv2
+
+    image = cv2.imdecode(np.frombuffer(frame_data, np.uint8), _imread_flag(reduction))
+    if image is None:
+        raise ValueError("フレームをデコードできません")
+    return image_histogram(image)
+
+
+def compute_histograms(frames: List[bytes], config: SceneDetectionConfig) -> np.ndarray:
+    """
+    全フレームのヒストグラムをスレッドプールで計算
+
+    cv2.imdecode / calcHist はGILを解放するため、スレッドで並列化できる
+
+    Returns:
+        (フレーム数, 512) の配列
+    """
+    histograms = np.empty((len(frames), HIST_BINS), dtype=np.float32)
+    if not frames:
+        return histograms
+
+    def compute(frame_data: bytes) -> np.ndarray:
+        return frame_histogram(frame_data, config.decode_reduction)
+
+    with ThreadPoolExecutor(max_workers=min(config.max_workers, len(frames))) as pool:
+        for i, hist in enumerate(pool.map(compute, frames)):
+            histograms[i] = hist
+    return histograms
+
+
+def consecutive_similarities(histograms: np.ndarray) -> np.ndarray:
+    """
+    隣接フレーム間のヒストグラム相関（8x8x8ヒストグラムに対する cv2.compareHist(HISTCMP_CORREL) と同じ値）
+
+    compareHist は3次元ヒストグラムの平均を1平面分の要素数（8x8=64）で計算するため、
+    従来の検出結果と一致するよう同じ式を使う
+
+    Args:
+        histograms: (N, 512) の配列
+
+    Returns:
+        長さ N-1 の配列。i番目はフレームiとi+1の類似度
+    """
+    if len(histograms) < 2:
+        return np.empty(0, dtype=np.float64)
+
+    hist = histograms.astype(np.float64)
+    scale = 1.0 / CORREL_PLANE_SIZE
+    sums = hist.sum(axis=1)
+    squares = np.einsum("ij,ij->i", hist, hist)
+    products = np.einsum("ij,ij->i", hist[:-1], hist[1:])
+
+    numerator = products - sums[:-1] * sums[1:] * scale
+    variances = squares - sums * sums * scale
+    denominator = variances[:-1] * variances[1:]
+
+    similarities = np.ones(len(numerator), dtype=np.float64)
+    valid = np.abs(denominator) > DBL_EPSILON
+    similarities[valid] = numerator[valid] / np.sqrt(denominator[valid])
+    return similarities
+
+
+def scene_change_indices(similarities: np.ndarray, threshold: float, offset: int = 0) -> List[int]:
+    """
+    類似度が 1 - threshold を下回ったフレームのインデックス
+
+    Args:
+        similarities: consecutive_similarities の結果
+        threshold: 変化検出の閾値
+        offset: 先頭フレームのインデックス
+    """
+    changed = np.flatnonzero(similarities < (1.0 - threshold))
+    return [int(i) + 1 + offset for i in changed]
+
+
+def probe_video(path: str) -> Dict[str, Any]:
+    """
+    ffprobeで動画の解像度・フレームレート・長さを取得
+
+    Returns:
+        {"width", "height", "fps", "duration"}
+    """
+    result = subprocess.run(
+        [
+            "ffprobe", "-v", "error",
+            "-select_streams", "v:0",
+            "-show_entries", "stream=width,height,avg_frame_rate,r_frame_rate:format=duration",
+            "-of", "json",
+            path,
+        ],
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    if result.returncode != 0:
+        raise ValueError(f"動画を読み込めません: {result.stderr.strip()}")
+
+    info = json.loads(result.stdout)
+    streams = info.get("streams") or []
+    if not streams:
+        raise ValueError("映像ストリームがありません")
+    stream = streams[0]
+
+    def parse_rate(rate: Optional[str]) -> float:
+        try:
+            numerator, _, denominator = (rate or "0/1").partition("/")
+            return float(numerator) / float(denominator or 1)
+        except (ValueError, ZeroDivisionError):
+            return 0.0
+
+    fps = parse_rate(stream.get("avg_frame_rate")) or parse_rate(stream.get("r_frame_rate"))
+    return {
+        "width": int(stream["width"]),
+        "height": int(stream["height"]),
+        "fps": fps,
+        "duration": float(info.get("format", {}).get("duration") or 0.0),
+    }
+
+
+def _output_size(width: int, height: int, max_width: int) -> Tuple[int, int]:
+    """デコード後のサイズ（アスペクト比を保ち、偶数に丸める）"""
+    if max_width <= 0 or width <= max_width:
+        return width, height
+    scaled_height = max(2, int(round(height * max_width / width / 2)) * 2)
+    return max_width - max_width % 2, scaled_height
+
+
+def iter_video_batches(path: str, config: SceneDetectionConfig, probe: Optional[Dict[str, Any]] = None) -> Iterator[np.ndarray]:
+    """
+    ffmpegのパイプで動画をデコードし、フレームをバッチ単位で返す
+
+    返す配列は同じバッファを使い回すため、次のバッチを要求する前に使い終えること
+
+    Yields:
+        (フレーム数, 高さ, 幅, 3) のBGR画像配列（最後のバッチは短い場合がある）
+    """
+    probe = probe or probe_video(path)
+    width, height = _output_size(probe["width"], probe["height"], config.stream_max_width)
+
+    filters = []
+    if config.sample_fps > 0:
+        filters.append(f"fps={config.sample_fps}")
+    filters.append(f"scale={width}:{height}")
+
+    command = [
+        "ffmpeg", "-v", "error", "-nostdin",
+        "-i", path,
+        "-an",
+        "-vf", ",".join(filters),
+        "-f", "rawvideo", "-pix_fmt", "bgr24",
+        "pipe:1",
+    ]
+    frame_bytes = width * height * 3
+    batch_size = max(1, config.stream_batch_frames)
+    buffer = np.empty((batch_size, height, width, 3), dtype=np.uint8)
+    view = memoryview(buffer.reshape(-1))
+
+    # stderr はパイプにすると、壊れた部分の多い動画でエラー行がパイプの容量（約64KB）を超えたときに
+    # ffmpegが書き込みで止まり、stdout の読み込みも終わらなくなる。一時ファイルに書かせて、失敗時に末尾だけ読む
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr, bufsize=0)
+        try:
+            while True:
+                filled = 0
+                while filled < batch_size:
+                    frame_view = view[filled * frame_bytes:(filled + 1) * frame_bytes]
+                    if _read_exact(process.stdout, frame_view) < frame_bytes:
+                        break
+                    filled += 1
+                if filled:
+                    yield buffer[:filled]
+                if filled < batch_size:
+                    break
+
+            process.wait()
+            if process.returncode != 0:
+                raise RuntimeError(f"ffmpegエラー（終了コード {process.returncode}）: {_tail_lines(stderr, FFMPEG_ERROR_LINES)}")
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            process.stdout.close()
+
+
+def _tail_lines(file, lines: int, max_bytes: int = 8192) -> str:
+    """ファイルの末尾 lines 行（末尾 max_bytes バイトの中から）"""
+    file.seek(0, os.SEEK_END)
+    file.seek(max(0, file.tell() - max_bytes))
+    text = file.read().decode(errors="replace").strip()
+    return "\n".join(text.splitlines()[-lines:])
+
+
+def _read_exact(stream, view: memoryview) -> int:
+    """viewが埋まるかEOFまで読み込み、読み込んだバイト数を返す"""
+    total = 0
+    while total < len(view):
+        read = stream.readinto(view[total:])
+        if not read:
+            break
+        total += read
+    return total
+
+
+def stream_scene_changes(path: str, threshold: float, config: SceneDetectionConfig) -> Iterator[Dict[str, Any]]:
+    """
+    動画ファイルのシーン変化を逐次検出
+
+    保持するのは直前フレームのヒストグラムと1バッチ分のフレームだけなので、
+    動画の長さによらずメモリ使用量は一定
+
+    Yields:
+        {"type": "change", "index", "timestamp", "similarity"}
+        最後に {"type": "done", "frames", "changes", "sample_fps"}
+    """
+    probe = probe_video(path)
+    sample_fps = config.sample_fps if config.sample_fps > 0 else probe["fps"]
+
+    previous: Optional[np.ndarray] = None
+    frames = 0
+    changes = 0
+
+    with ThreadPoolExecutor(max_workers=config.max_workers) as pool:
+        for batch in iter_video_batches(path, config, probe):
+            histograms = np.stack(list(pool.map(image_histogram, batch)))
+            if previous is not None:
+                histograms = np.concatenate([previous[None, :], histograms])
+                offset = frames - 1
+            else:
+                offset = 0
+
+            similarities = consecutive_similarities(histograms)
+            for index in scene_change_indices(similarities, threshold, offset=offset):
+                changes += 1
+                yield {
+                    "type": "change",
+                    "index": index,
+                    "timestamp": round(index / sample_fps, 3) if sample_fps > 0 else None,
+                    "similarity": float(similarities[index - offset - 1]),
+                }
+
+            previous = histograms[-1].copy()
+            frames += len(batch)
+
+    yield {"type": "done", "frames": frames, "changes": changes, "sample_fps": sample_fps}
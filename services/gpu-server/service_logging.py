@@ -0,0 +1,130 @@
+"""
+ログの設定
+レベルで絞り込み、JSON（1行1レコード）またはテキストで出力する
+
+出力はキュー経由でバックグラウンドのスレッドが行うため、ログを書く側（リクエストの処理）は標準出力への書き込みを待たない。
+メモリスナップショットの作成前（@modal.enter(snap=True)）はスレッドを起動せず、呼び出したスレッドで直接出力する。
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Optional
+
+SUPPORTED_FORMATS = ("json", "text")
+
+# LogRecord の標準の属性（これ以外の属性は extra で渡された項目として出力する）
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+# リクエストごとにINFOのログを出すライブラリ（WARNING以上だけ出す）
+_NOISY_LOGGERS = ("httpx", "httpcore", "openai", "anthropic", "hpack")
+
+_listener: Optional[logging.handlers.QueueListener] = None
+# ルートロガーに追加したハンドラー（スレッドなしの出力から、キュー経由の出力に切り替えるときに外す）
+_handler: Optional[logging.Handler] = None
+_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class LoggingConfig:
+    """
+    ログの設定
+
+    環境変数:
+        LOG_LEVEL: 出力するログのレベル（DEBUG / INFO / WARNING / ERROR）
+        LOG_FORMAT: json（1行1レコードのJSON）/ text
+    """
+
+    level: str = "INFO"
+    format: str = "json"
+
+    @classmethod
+    def from_env(cls) -> "LoggingConfig":
+        """環境変数から設定を読み込む"""
+        config = cls(
+            level=os.getenv("LOG_LEVEL", cls.level).upper(),
+            format=os.getenv("LOG_FORMAT", cls.format).lower(),
+        )
+        if config.format not in SUPPORTED_FORMATS:
+            raise ValueError(f"未サポートのLOG_FORMAT: {config.format}（{' / '.join(SUPPORTED_FORMATS)}）")
+        if not isinstance(logging.getLevelName(config.level), int):
+            raise ValueError(f"未サポートのLOG_LEVEL: {config.level}")
+        return config
+
+
+class JSONFormatter(logging.Formatter):
+    """ログを1行のJSONにする（extra で渡した項目もそのまま含める）"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging(config: Optional[LoggingConfig] = None, background: bool = True):
+    """
+    ルートロガーに出力を設定する（キュー経由の出力を設定した後の呼び出しではレベルだけ変える）
+
+    Args:
+        config: 省略時は環境変数から読み込む
+        background: キュー経由でバックグラウンドのスレッドが出力するか。
+            False はスレッドを起動せずに直接出力する（スナップショットにスレッドを含めないため）。
+            後で True で呼び出すと、キュー経由の出力に切り替える
+    """
+    global _listener, _handler
+
+    config = config or LoggingConfig.from_env()
+    root = logging.getLogger()
+    root.setLevel(config.level)
+    for name in _NOISY_LOGGERS:
+        logging.getLogger(name).setLevel(max(logging.WARNING, root.level))
+
+    with _lock:
+        if _listener is not None or (_handler is not None and not background):
+            return
+
+        stream = logging.StreamHandler(sys.stdout)
+        if config.format == "json":
+            stream.setFormatter(JSONFormatter())
+        else:
+            stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+        if _handler is not None:
+            root.removeHandler(_handler)
+        if background:
+            # 出力はリスナーのスレッドで行う（レコードは QueueHandler がメッセージを組み立ててから積む）
+            records: queue.SimpleQueue = queue.SimpleQueue()
+            _handler = logging.handlers.QueueHandler(records)
+            _listener = logging.handlers.QueueListener(records, stream, respect_handler_level=True)
+            _listener.start()
+            atexit.register(shutdown_logging)
+        else:
+            _handler = stream
+        root.addHandler(_handler)
+
+
+def shutdown_logging():
+    """キューに残ったログを出力してからリスナーを止める"""
+    global _listener
+
+    with _lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,296 @@
+"""
+セッションの文字起こしの段階的な要約
+文字起こしを一定の文字数ごとにチャンク要約し、チャンク要約がたまったらセクション要約にまとめる（要約の木）
+
+木の状態はセッションごとに保存し、次回は前回以降に追加された文字起こしだけを要約する。
+仕様書生成には「要約 + まだ要約していない最新の文字起こし（差分）」を渡すため、
+長いセッションでも序盤の内容を失わず、毎回同じ文字起こしを送り直すこともない。
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+STATE_VERSION = 1
+
+CHUNK_SUMMARY_PROMPT = """以下は会議・作業の文字起こしの一部です。技術仕様書の材料として要約してください。
+
+# 要求事項
+- 要件、決定事項、技術的な詳細（数値・名前・制約）、未解決の課題を漏らさない
+- 誰の発言かが重要な場合は話者を残す
+- 雑談やあいさつは省く
+- 箇条書きで、{max_chars}文字以内
+
+# 文字起こし
+{text}
+"""
+
+SECTION_SUMMARY_PROMPT = """以下は会議・作業の記録を時系列に区切って要約したものです。1つの要約にまとめてください。
+
+# 要求事項
+- 要件、決定事項、技術的な詳細（数値・名前・制約）、未解決の課題を漏らさない
+- 後の要約で変更・撤回された内容は最新のものに置き換える
+- 重複は1つにまとめる
+- 箇条書きで、{max_chars}文字以内
+
+# 要約
+{text}
+"""
+
+
+@dataclass(frozen=True)
+class SessionSummaryConfig:
+    """
+    セッション要約の設定
+
+    環境変数:
+        SESSION_SUMMARY_ENABLED: セッション要約を使うか（無効の場合は文字起こしを新しい順にトークン予算に入るだけ使う）
+        SESSION_SUMMARY_CHUNK_CHARS: 1つのチャンク要約にまとめる文字起こしの文字数
+        SESSION_SUMMARY_FANOUT: この数の要約がたまったら1つ上の階層（セクション要約）にまとめる
+        SESSION_SUMMARY_DELTA_CHARS: 要約せずにそのまま渡す最新の文字起こしの文字数の上限
+        SESSION_SUMMARY_MAX_CHARS: 1つの要約の目標の文字数
+        SESSION_SUMMARY_MAX_TOKENS: 要約の生成の最大トークン数
+        SESSION_SUMMARY_CONCURRENCY: 同時に生成するチャンク要約の数
+    """
+
+    enabled: bool = True
+    chunk_chars: int = 3000
+    fanout: int = 4
+    delta_chars: int = 6000
+    max_chars: int = 800
+    max_tokens: int = 1024
+    concurrency: int = 4
+
+    @classmethod
+    def from_env(cls) -> "SessionSummaryConfig":
+        """環境変数から設定を読み込む"""
+        return cls(
+            enabled=os.getenv("SESSION_SUMMARY_ENABLED", "true").lower() == "true",
+            chunk_chars=int(os.getenv("SESSION_SUMMARY_CHUNK_CHARS", cls.chunk_chars)),
+            fanout=max(2, int(os.getenv("SESSION_SUMMARY_FANOUT", cls.fanout))),
+            delta_chars=int(os.getenv("SESSION_SUMMARY_DELTA_CHARS", cls.delta_chars)),
+            max_chars=int(os.getenv("SESSION_SUMMARY_MAX_CHARS", cls.max_chars)),
+            max_tokens=int(os.getenv("SESSION_SUMMARY_MAX_TOKENS", cls.max_tokens)),
+            concurrency=max(1, int(os.getenv("SESSION_SUMMARY_CONCURRENCY", cls.concurrency))),
+        )
+
+
+def format_transcription(item: Dict[str, Any]) -> str:
+    """文字起こし1件をプロンプト用の1行にする"""
+    speaker = item.get("speaker") or "不明"
+    text = " ".join((item.get("text") or "").split())
+    return f"[{speaker}] {text}"
+
+
+def fingerprint(lines: List[str]) -> str:
+    """要約済みの文字起こしのハッシュ（途中が変更・削除されていないかの確認用）"""
+    digest = hashlib.sha256()
+    for line in lines:
+        digest.update(line.encode("utf-8"))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def empty_state(session_id: str) -> Dict[str, Any]:
+    """
+    要約の木の初期状態
+
+    levels[0] がチャンク要約、levels[1] 以降がセクション要約。
+    各ノードは {"summary", "first", "last"}（要約した文字起こしの範囲 first〜last-1）。
+    上の階層ほど古い範囲を受け持つため、上の階層から順に並べると時系列になる。
+    """
+    return {
+        "version": STATE_VERSION,
+        "session_id": session_id,
+        "folded": 0,
+        "fingerprint": fingerprint([]),
+        "levels": [],
+        "updated_at": None,
+    }
+
+
+def plan_folds(lines: List[str], config: SessionSummaryConfig) -> List[Tuple[int, int]]:
+    """
+    まだ要約していない文字起こしのうち、要約するチャンクの範囲を決める
+
+    残り（差分）が delta_chars 以下になるまで、先頭から chunk_chars ずつチャンクにする。
+
+    Returns:
+        [(開始位置, 終了位置)]（lines の添字）
+    """
+    total = sum(len(line) + 1 for line in lines)
+    folds = []
+    start = 0
+    while total > config.delta_chars and start < len(lines):
+        end = start
+        size = 0
+        while end < len(lines) and (end == start or size + len(lines[end]) + 1 <= config.chunk_chars):
+            size += len(lines[end]) + 1
+            end += 1
+        folds.append((start, end))
+        total -= size
+        start = end
+    return folds
+
+
+def render_summary(state: Dict[str, Any]) -> str:
+    """要約の木を時系列の1つのテキストにする"""
+    parts = []
+    for level in reversed(state["levels"]):
+        for node in level:
+            parts.append(node["summary"].strip())
+    return "\n\n".join(part for part in parts if part)
+
+
+def node_count(state: Dict[str, Any]) -> int:
+    return sum(len(level) for level in state["levels"])
+
+
+class SessionSummarizer:
+    """
+    要約の木を更新する
+
+    summarize はプロンプトを受け取って要約テキストを返すコルーチン関数（LLM呼び出し）。
+    """
+
+    def __init__(self, config: SessionSummaryConfig, summarize: Callable[[str], Awaitable[str]]):
+        self.config = config
+        self.summarize = summarize
+
+    async def update(
+        self,
+        state: Optional[Dict[str, Any]],
+        session_id: str,
+        transcriptions: List[Dict[str, Any]],
+    ) -> Tuple[Dict[str, Any], List[str], Dict[str, Any]]:
+        """
+        前回以降に追加された文字起こしを要約の木に取り込む
+
+        要約済みの範囲の文字起こしが変わっていた場合（削除・編集）は木を作り直す。
+        チャンク要約の生成に失敗した場合は、失敗したチャンク以降を差分として残す（次回に再試行する）。
+
+        Returns:
+            (更新後の状態, 差分（要約していない最新の文字起こしの行）, 統計)
+        """
+        lines = [format_transcription(item) for item in transcriptions]
+
+        rebuilt = False
+        if state is None or state.get("version") != STATE_VERSION:
+            state = empty_state(session_id)
+        elif state["folded"] > len(lines) or fingerprint(lines[:state["folded"]]) != state["fingerprint"]:
+            state = empty_state(session_id)
+            rebuilt = True
+
+        folded = state["folded"]
+        folds = plan_folds(lines[folded:], self.config)
+        calls = 0
+        failed = 0
+
+        if folds:
+            # チャンク要約は並行して生成し、時系列順に木に追加する
+            semaphore = asyncio.Semaphore(self.config.concurrency)
+
+            async def summarize_chunk(start: int, end: int) -> str:
+                async with semaphore:
+                    text = "\n".join(lines[folded + start:folded + end])
+                    return await self.summarize(
+                        CHUNK_SUMMARY_PROMPT.format(max_chars=self.config.max_chars, text=text)
+                    )
+
+            results = await asyncio.gather(
+                *(summarize_chunk(start, end) for start, end in folds),
+                return_exceptions=True,
+            )
+            calls += len(folds)
+
+            for index, ((start, end), result) in enumerate(zip(folds, results)):
+                if isinstance(result, BaseException):
+                    logger.warning(f"⚠️ チャンク要約エラー（{folded + start + 1}〜{folded + end}件目）: {result}")
+                    failed = len(folds) - index
+                    break
+                try:
+                    calls += await self._add_node(state, 0, {
+                        "summary": result,
+                        "first": folded + start,
+                        "last": folded + end,
+                    })
+                except Exception as e:
+                    # セクション要約に失敗した場合は、チャンク要約をそのまま残す（次に追加したときに再試行する）
+                    logger.warning(f"⚠️ セクション要約エラー: {e}")
+                state["folded"] = folded + end
+
+            state["fingerprint"] = fingerprint(lines[:state["folded"]])
+            state["updated_at"] = time.time()
+
+        delta = lines[state["folded"]:]
+        stats = {
+            "transcriptions": len(lines),
+            "folded": state["folded"],
+            "delta": len(delta),
+            "nodes": node_count(state),
+            "levels": len(state["levels"]),
+            "summary_calls": calls,
+            "failed_chunks": failed,
+            "rebuilt": rebuilt,
+        }
+        return state, delta, stats
+
+    async def _add_node(self, state: Dict[str, Any], level: int, node: Dict[str, Any]) -> int:
+        """
+        ノードを追加し、階層が fanout 個に達したら1つ上の階層にまとめる
+
+        Returns:
+            生成した要約の数
+        """
+        levels = state["levels"]
+        while len(levels) <= level:
+            levels.append([])
+        levels[level].append(node)
+        if len(levels[level]) < self.config.fanout:
+            return 0
+
+        children = levels[level]
+        text = "\n\n".join(
+            f"## {index + 1}（{child['first'] + 1}〜{child['last']}件目）\n{child['summary'].strip()}"
+            for index, child in enumerate(children)
+        )
+        summary = await self.summarize(SECTION_SUMMARY_PROMPT.format(max_chars=self.config.max_chars, text=text))
+        levels[level] = []
+        return 1 + await self._add_node(state, level + 1, {
+            "summary": summary,
+            "first": children[0]["first"],
+            "last": children[-1]["last"],
+        })
+
+
+def state_path(directory: str, session_id: str) -> str:
+    """セッションの要約の保存先（セッションIDはハッシュにしてファイル名にする）"""
+    name = hashlib.sha256(session_id.encode("utf-8")).hexdigest()[:32]
+    return os.path.join(directory, f"{name}.json")
+
+
+def load_state(directory: str, session_id: str) -> Optional[Dict[str, Any]]:
+    """保存された要約の木を読み込む（ないか壊れている場合はNone）"""
+    try:
+        with open(state_path(directory, session_id), encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return state if state.get("session_id") == session_id else None
+
+
+def save_state(directory: str, state: Dict[str, Any]):
+    """要約の木を保存（一時ファイルに書いてから置き換える）"""
+    os.makedirs(directory, exist_ok=True)
+    path = state_path(directory, state["session_id"])
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(temp_path, path)
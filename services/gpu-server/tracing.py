@@ -0,0 +1,546 @@
+"""
+リクエストのトレース（スパン）
+Webエンドポイントのハンドラーでトレースを始め、GPUクラスのメソッド・プロンプトの構築・プロバイダー呼び出し（フォールバックを含む）・
+応答の解析をスパンとして記録する
+
+トレースは W3C Trace Context の traceparent（00-{trace_id}-{span_id}-{flags}）で .remote の呼び出しに引き継ぐ。
+終了したスパンはバックグラウンドのスレッドがまとめて、コンテナごとのJSONLファイル、またはOTLP/HTTP（JSON）のコレクターに書き出す。
+
+JSONLファイルの確認（services/gpu-server で）:
+    python -m tracing /path/to/traces                  # 遅いトレースの一覧
+    python -m tracing /path/to/traces --trace-id <ID>  # スパンの木
+"""
+
+import argparse
+import atexit
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXPORTERS = ("jsonl", "otlp", "none")
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+_exporter: Optional["SpanExporter"] = None
+_lock = threading.Lock()
+
+# コンテナの起動状態（最初の入力のスパンにコールドスタートとして記録する）
+_container = {"init_ms": None, "start": None, "cold": True}
+
+
+@dataclass(frozen=True)
+class TracingConfig:
+    """
+    トレースの設定
+
+    環境変数:
+        TRACING_ENABLED: トレースを書き出すか（無効の場合も traceparent の引き継ぎは行う）
+        TRACE_EXPORTER: jsonl（TRACE_JSONL_DIR にコンテナごとのファイル）/ otlp（TRACE_OTLP_ENDPOINT に送信）/ none
+        TRACE_JSONL_DIR: JSONLファイルの保存先
+        TRACE_OTLP_ENDPOINT: OTLP/HTTP のエンドポイント（例: http://collector:4318/v1/traces）
+        TRACE_OTLP_HEADERS: OTLPの送信に付けるヘッダー（'key=value,key2=value2' 形式）
+        TRACE_SAMPLE_RATIO: 書き出すトレースの割合（0〜1。トレースの開始時に決め、途中のスパンは同じ判定に従う）
+        TRACE_FLUSH_SECONDS: スパンをまとめて書き出す間隔（秒）
+        TRACE_COMMIT_SECONDS: jsonl に書き出したファイルをVolumeにコミットする間隔（秒。コンテナの終了時は必ずコミットする）
+    """
+
+    enabled: bool = True
+    exporter: str = "jsonl"
+    jsonl_dir: str = "/models/traces"
+    otlp_endpoint: str = ""
+    otlp_headers: str = ""
+    sample_ratio: float = 1.0
+    flush_seconds: float = 5.0
+    commit_seconds: float = 60.0
+
+    @classmethod
+    def from_env(cls) -> "TracingConfig":
+        """環境変数から設定を読み込む"""
+        config = cls(
+            enabled=os.getenv("TRACING_ENABLED", "true").lower() == "true",
+            exporter=os.getenv("TRACE_EXPORTER", cls.exporter).lower(),
+            jsonl_dir=os.getenv("TRACE_JSONL_DIR", cls.jsonl_dir),
+            otlp_endpoint=os.getenv("TRACE_OTLP_ENDPOINT", cls.otlp_endpoint),
+            otlp_headers=os.getenv("TRACE_OTLP_HEADERS", cls.otlp_headers),
+            sample_ratio=min(1.0, max(0.0, float(os.getenv("TRACE_SAMPLE_RATIO", cls.sample_ratio)))),
+            flush_seconds=max(0.1, float(os.getenv("TRACE_FLUSH_SECONDS", cls.flush_seconds))),
+            commit_seconds=max(0.0, float(os.getenv("TRACE_COMMIT_SECONDS", cls.commit_seconds))),
+        )
+        if config.exporter not in SUPPORTED_EXPORTERS:
+            raise ValueError(f"未サポートのTRACE_EXPORTER: {config.exporter}（{' / '.join(SUPPORTED_EXPORTERS)}）")
+        if config.exporter == "otlp" and not config.otlp_endpoint:
+            raise ValueError("TRACE_EXPORTER=otlp の場合は TRACE_OTLP_ENDPOINT を指定してください")
+        return config
+
+    def headers(self) -> Dict[str, str]:
+        return dict(
+            item.split("=", 1) for item in (part.strip() for part in self.otlp_headers.split(",")) if "=" in item
+        )
+
+
+class Span:
+    """処理の区間（開始・終了時刻と属性）"""
+
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "attributes", "start_ns", "end_ns", "error", "sampled")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], sampled: bool, attributes: Optional[Dict[str, Any]] = None):
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.error: Optional[str] = None
+        self.sampled = sampled
+
+    @property
+    def traceparent(self) -> str:
+        """子の処理（.remote の呼び出し先など）に渡す traceparent"""
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def set_attributes(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, error: Optional[BaseException] = None):
+        """スパンを終了して書き出しのキューに積む（2回目以降の呼び出しは無視する）"""
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        if self.sampled and _exporter is not None:
+            _exporter.submit(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSONLの1行分"""
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "name": self.name,
+            "start_time": self.start_ns / 1e9,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """traceparent を (trace_id, 親のspan_id, sampled) に分解（形式が正しくない場合はNone）"""
+    if not value:
+        return None
+    parts = value.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16), int(parts[3], 16)
+    except ValueError:
+        return None
+    return parts[1], parts[2], bool(int(parts[3], 16) & 1)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def current_traceparent() -> Optional[str]:
+    """現在のスパンの traceparent（スパンの外ではNone）"""
+    span = _current_span.get()
+    return span.traceparent if span is not None else None
+
+
+def start_span(name: str, parent: Union[Span, str, None] = None, **attributes) -> Span:
+    """
+    スパンを開始する（現在のスパンには設定しない。非同期ジェネレーターなど with で囲めない区間に使う）
+
+    Args:
+        parent: 親のスパン、または traceparent（省略時は現在のスパン。どちらもなければ新しいトレースを始める）
+    """
+    if parent is None:
+        parent = _current_span.get()
+    if isinstance(parent, Span):
+        return Span(name, parent.trace_id, parent.span_id, parent.sampled, attributes)
+    parsed = parse_traceparent(parent)
+    if parsed is not None:
+        trace_id, parent_id, sampled = parsed
+        return Span(name, trace_id, parent_id, sampled, attributes)
+    sample_ratio = _exporter.config.sample_ratio if _exporter is not None else 1.0
+    return Span(name, f"{random.getrandbits(128):032x}", None, random.random() < sample_ratio, attributes)
+
+
+@contextmanager
+def activate(current: Span) -> Iterator[Span]:
+    """開始済みのスパンを with ブロック内で現在のスパンにし、ブロックの終わりで終了する（例外はスパンに記録して送出する）"""
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.end(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end()
+
+
+def span(name: str, parent: Union[Span, str, None] = None, **attributes):
+    """with ブロックをスパンとして記録し、ブロック内では現在のスパンにする"""
+    return activate(start_span(name, parent, **attributes))
+
+
+def mark_container_ready(init_seconds: float, start: str = "cold"):
+    """
+    コンテナの初期化（モデル・クライアントの読み込み）が終わったことを記録
+
+    Args:
+        init_seconds: 入力を受け付けるまでの時間
+        start: cold（初期化をすべて実行）/ restored（メモリスナップショットから復元）
+    """
+    _container["init_ms"] = round(init_seconds * 1000, 1)
+    _container["start"] = start
+    _container["cold"] = True
+
+
+def _method_span(name: str, kwargs: Dict[str, Any]) -> Span:
+    method_span = start_span(name, kwargs.get("traceparent"))
+    if _container["init_ms"] is not None:
+        # 同時に始まった入力のうち1つだけを最初の入力にする
+        with _lock:
+            cold = _container["cold"]
+            _container["cold"] = False
+        method_span.set_attributes(cold_start=cold, container_init_ms=_container["init_ms"], container_start=_container["start"])
+    return method_span
+
+
+def traced(name: str):
+    """
+    GPUクラスのメソッドをスパンとして記録するデコレーター
+
+    親は引数 traceparent（Webエンドポイントから渡す）。コンテナの最初の入力には cold_start=True を付ける。
+    ジェネレーターの場合は最後のイベントまでを1つのスパンにし、ジェネレーターの処理が進む間だけ現在のスパンにする
+    （yield をまたいで呼び出し側にスパンが漏れないようにする）。
+    """
+
+    def decorator(func):
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def async_gen_wrapper(*args, **kwargs):
+                method_span = _method_span(name, kwargs)
+                events = func(*args, **kwargs)
+                error = None
+                try:
+                    while True:
+                        token = _current_span.set(method_span)
+                        try:
+                            event = await events.__anext__()
+                        except StopAsyncIteration:
+                            break
+                        finally:
+                            _current_span.reset(token)
+                        yield event
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    await events.aclose()
+                    method_span.end(error)
+            return async_gen_wrapper
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def gen_wrapper(*args, **kwargs):
+                method_span = _method_span(name, kwargs)
+                events = func(*args, **kwargs)
+                error = None
+                try:
+                    while True:
+                        token = _current_span.set(method_span)
+                        try:
+                            event = next(events)
+                        except StopIteration:
+                            break
+                        finally:
+                            _current_span.reset(token)
+                        yield event
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    events.close()
+                    method_span.end(error)
+            return gen_wrapper
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with activate(_method_span(name, kwargs)):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with activate(_method_span(name, kwargs)):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+class TraceLogFilter(logging.Filter):
+    """ログに現在のトレースID（trace_id）を付ける（JSONのログではトレースとログを突き合わせられる）"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        current = _current_span.get()
+        if current is not None:
+            record.trace_id = current.trace_id
+        return True
+
+
+def to_otlp(spans: List[Dict[str, Any]], service_name: str) -> Dict[str, Any]:
+    """to_dict の形式のスパンをOTLP/HTTP（JSON）のリクエスト本文にする"""
+
+    def value(item: Any) -> Dict[str, Any]:
+        if isinstance(item, bool):
+            return {"boolValue": item}
+        if isinstance(item, int):
+            return {"intValue": str(item)}
+        if isinstance(item, float):
+            return {"doubleValue": item}
+        return {"stringValue": str(item)}
+
+    def otlp_span(span: Dict[str, Any]) -> Dict[str, Any]:
+        start_ns = int(span["start_time"] * 1e9)
+        result = {
+            "traceId": span["trace_id"],
+            "spanId": span["span_id"],
+            "name": span["name"],
+            "kind": 1,
+            "startTimeUnixNano": str(start_ns),
+            "endTimeUnixNano": str(start_ns + int(span["duration_ms"] * 1e6)),
+            "attributes": [{"key": key, "value": value(item)} for key, item in span["attributes"].items()],
+            "status": {"code": 2, "message": span["error"]} if span["error"] else {"code": 1},
+        }
+        if span["parent_span_id"]:
+            result["parentSpanId"] = span["parent_span_id"]
+        return result
+
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+            "scopeSpans": [{"scope": {"name": "realworld-agent"}, "spans": [otlp_span(span) for span in spans]}],
+        }]
+    }
+
+
+class SpanExporter:
+    """
+    終了したスパンをバックグラウンドのスレッドでまとめて書き出す
+
+    submit はキューに積むだけで、ファイルへの書き込みやネットワーク送信は flush_seconds ごとにスレッドで行う。
+    jsonl のファイルは commit（Volumeのコミット）を commit_seconds ごとと stop で呼び出すまで、他のコンテナからは見えない。
+    """
+
+    def __init__(self, config: TracingConfig, service_name: str, container: str, commit: Optional[Callable[[], None]] = None):
+        self.config = config
+        self.service_name = service_name
+        self.container = container
+        self._commit = commit
+        self._uncommitted = False
+        self._committed_at = time.monotonic()
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def submit(self, span: Span):
+        self._queue.put(span)
+
+    def stop(self):
+        """スレッドを止め、キューに残ったスパンを書き出してコミットする"""
+        self._stop.set()
+        self._thread.join(timeout=10)
+        self.flush()
+        self._commit_files(force=True)
+
+    def _run(self):
+        while not self._stop.wait(self.config.flush_seconds):
+            self.flush()
+            self._commit_files()
+
+    def flush(self):
+        spans = []
+        while True:
+            try:
+                spans.append(self._queue.get_nowait().to_dict())
+            except queue.Empty:
+                break
+        if not spans:
+            return
+        for span in spans:
+            span["service"] = self.service_name
+            span["container"] = self.container
+        try:
+            if self.config.exporter == "jsonl":
+                self._write_jsonl(spans)
+                self._uncommitted = True
+            elif self.config.exporter == "otlp":
+                self._send_otlp(spans)
+        except Exception as e:
+            logger.warning(f"⚠️ トレースの書き出しエラー（{len(spans)}スパンを破棄）: {e}")
+
+    def _commit_files(self, force: bool = False):
+        """書き出したファイルをコミットする（前回から commit_seconds が経っていない場合は次の書き出しまで待つ）"""
+        if self._commit is None or not self._uncommitted:
+            return
+        if not force and time.monotonic() - self._committed_at < self.config.commit_seconds:
+            return
+        try:
+            self._commit()
+            self._uncommitted = False
+            self._committed_at = time.monotonic()
+        except Exception as e:
+            logger.warning(f"⚠️ トレースのファイルのコミットエラー: {e}")
+
+    def _write_jsonl(self, spans: List[Dict[str, Any]]):
+        os.makedirs(self.config.jsonl_dir, exist_ok=True)
+        path = os.path.join(self.config.jsonl_dir, f"{datetime.now():%Y%m%d}-{self.service_name}-{self.container}.jsonl")
+        with open(path, "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(span, ensure_ascii=False, default=str) + "\n" for span in spans)
+
+    def _send_otlp(self, spans: List[Dict[str, Any]]):
+        request = urllib.request.Request(
+            self.config.otlp_endpoint,
+            data=json.dumps(to_otlp(spans, self.service_name), default=str).encode("utf-8"),
+            headers={"Content-Type": "application/json", **self.config.headers()},
+            method="POST",
+        )
+        with urllib.request.urlopen(request, timeout=10) as response:
+            response.read()
+
+
+def configure_tracing(
+    service_name: str,
+    container: str,
+    config: Optional[TracingConfig] = None,
+    commit: Optional[Callable[[], None]] = None,
+):
+    """
+    スパンの書き出しを開始する（2回目以降の呼び出しは何もしない）
+
+    Args:
+        service_name: トレースに記録するサービス名（Webエンドポイント / GPUクラス）
+        container: コンテナの識別子
+        config: 省略時は環境変数から読み込む
+        commit: jsonl に書き出したファイルを永続化する関数（TRACE_JSONL_DIR を置いたVolumeの commit）
+    """
+    global _exporter
+
+    config = config or TracingConfig.from_env()
+    with _lock:
+        if _exporter is not None or not config.enabled or config.exporter == "none":
+            return
+        _exporter = SpanExporter(config, service_name, container, commit)
+        _exporter.start()
+        atexit.register(shutdown_tracing)
+
+    # ルートロガーのハンドラー（service_logging.configure_logging で設定したもの）でトレースIDを付ける
+    for handler in logging.getLogger().handlers:
+        if not any(isinstance(item, TraceLogFilter) for item in handler.filters):
+            handler.addFilter(TraceLogFilter())
+
+
+def shutdown_tracing():
+    """残ったスパンを書き出してからスレッドを止める"""
+    global _exporter
+
+    with _lock:
+        exporter, _exporter = _exporter, None
+    if exporter is not None:
+        exporter.stop()
+
+
+def load_spans(paths: List[str]) -> List[Dict[str, Any]]:
+    """JSONLファイル（ディレクトリの場合は中の *.jsonl）からスパンを読み込む"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(".jsonl")))
+        else:
+            files.append(path)
+    spans = []
+    for file in files:
+        with open(file, encoding="utf-8") as f:
+            spans.extend(json.loads(line) for line in f if line.strip())
+    return spans
+
+
+def format_trace(spans: List[Dict[str, Any]]) -> str:
+    """1つのトレースのスパンを、開始時刻からの経過時間付きの木にする"""
+    span_ids = {span["span_id"] for span in spans}
+    children: Dict[Optional[str], List[Dict[str, Any]]] = {}
+    for span in spans:
+        # 親が記録されていない（サンプリング・書き出し前の終了など）スパンは根として扱う
+        parent = span["parent_span_id"] if span["parent_span_id"] in span_ids else None
+        children.setdefault(parent, []).append(span)
+    origin = min(span["start_time"] for span in spans)
+
+    lines = []
+
+    def walk(parent: Optional[str], depth: int):
+        for span in sorted(children.get(parent, []), key=lambda item: item["start_time"]):
+            offset_ms = (span["start_time"] - origin) * 1000
+            attributes = " ".join(f"{key}={value}" for key, value in span["attributes"].items())
+            error = f" ❌ {span['error']}" if span["error"] else ""
+            lines.append(
+                f"{offset_ms:>10.1f}ms {span['duration_ms']:>10.1f}ms  {'  ' * depth}{span['name']}"
+                f"  [{span.get('service', '')}] {attributes}{error}".rstrip()
+            )
+            walk(span["span_id"], depth + 1)
+
+    walk(None, 0)
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSONLに書き出したトレースの確認")
+    parser.add_argument("paths", nargs="+", help="JSONLファイル、またはそれを含むディレクトリ")
+    parser.add_argument("--trace-id", help="スパンの木を表示するトレース")
+    parser.add_argument("--limit", type=int, default=20, help="一覧に表示するトレースの数（遅い順）")
+    args = parser.parse_args()
+
+    traces: Dict[str, List[Dict[str, Any]]] = {}
+    for span in load_spans(args.paths):
+        traces.setdefault(span["trace_id"], []).append(span)
+
+    if args.trace_id:
+        if args.trace_id not in traces:
+            raise SystemExit(f"トレースが見つかりません: {args.trace_id}")
+        print(format_trace(traces[args.trace_id]))
+        return
+
+    def duration_ms(spans: List[Dict[str, Any]]) -> float:
+        return (max(s["start_time"] + s["duration_ms"] / 1000 for s in spans) - min(s["start_time"] for s in spans)) * 1000
+
+    print(f"{'トレースID':<34}{'時間(ms)':>12}{'スパン':>8}  最初のスパン")
+    for trace_id, spans in sorted(traces.items(), key=lambda item: -duration_ms(item[1]))[:args.limit]:
+        first = min(spans, key=lambda s: s["start_time"])
+        print(f"{trace_id:<34}{duration_ms(spans):>12.1f}{len(spans):>8}  {first['name']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+"""
+音声文字起こしのバックエンド
+GPUでは WhisperX（アライメント・話者分離あり）、CPUでは faster-whisper（CTranslate2のint8量子化）を使う
+"""
+
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+
+# Whisperの入力サンプリングレート
+SAMPLE_RATE = 16000
+
+SUPPORTED_BACKENDS = ("auto", "faster-whisper", "whisperx", "none")
+
+# 音声を渡す形式（ファイルパス、または16kHzモノラルのfloat32配列）
+Audio = Union[str, np.ndarray]
+
+
+@dataclass(frozen=True)
+class TranscriptionConfig:
+    """
+    文字起こしの設定
+
+    環境変数:
+        ASR_BACKEND: auto（GPUがあればwhisperx、なければfaster-whisper）/ faster-whisper / whisperx / none（読み込まない）
+        ASR_MODEL: Whisperのモデル（省略時はGPUで large-v2、CPUで small）
+        ASR_COMPUTE_TYPE: CTranslate2の計算精度（省略時はGPUで float16、CPUで int8）
+        ASR_CPU_THREADS: CPUで使うスレッド数（0はCPU数）
+        ASR_NUM_WORKERS: 同時に文字起こしできる数（faster-whisper）
+        ASR_BEAM_SIZE: ビームサーチの幅（faster-whisper）
+        ASR_BATCH_SIZE: バッチサイズ（whisperx）
+        ASR_VAD_FILTER: 無音区間を除いてから文字起こしするか（faster-whisper）
+        ASR_WORD_TIMESTAMPS: 単語単位のタイムスタンプを付けるか（faster-whisper）
+        ASR_DIARIZATION: 話者分離のモデルを読み込むか（whisperxのみ、HF_TOKEN が必要）
+        ASR_WARMUP: 起動時に無音で1回推論し、初回リクエストの遅延をなくすか
+    """
+
+    backend: str = "auto"
+    model: str = ""
+    compute_type: str = ""
+    cpu_threads: int = 0
+    num_workers: int = 1
+    beam_size: int = 5
+    batch_size: int = 16
+    vad_filter: bool = True
+    word_timestamps: bool = True
+    diarization: bool = True
+    warmup: bool = True
+
+    @classmethod
+    def from_env(cls) -> "TranscriptionConfig":
+        """環境変数から設定を読み込む"""
+        config = cls(
+            backend=os.getenv("ASR_BACKEND", cls.backend).lower(),
+            model=os.getenv("ASR_MODEL", cls.model),
+            compute_type=os.getenv("ASR_COMPUTE_TYPE", cls.compute_type),
+            cpu_threads=int(os.getenv("ASR_CPU_THREADS", cls.cpu_threads)),
+            num_workers=int(os.getenv("ASR_NUM_WORKERS", cls.num_workers)),
+            beam_size=int(os.getenv("ASR_BEAM_SIZE", cls.beam_size)),
+            batch_size=int(os.getenv("ASR_BATCH_SIZE", cls.batch_size)),
+            vad_filter=os.getenv("ASR_VAD_FILTER", "true").lower() == "true",
+            word_timestamps=os.getenv("ASR_WORD_TIMESTAMPS", "true").lower() == "true",
+            diarization=os.getenv("ASR_DIARIZATION", "true").lower() == "true",
+            warmup=os.getenv("ASR_WARMUP", "true").lower() == "true",
+        )
+        if config.backend not in SUPPORTED_BACKENDS:
+            raise ValueError(f"未サポートのASR_BACKEND: {config.backend}（{' / '.join(SUPPORTED_BACKENDS)}）")
+        return config
+
+    @property
+    def threads(self) -> int:
+        return self.cpu_threads if self.cpu_threads > 0 else (os.cpu_count() or 1)
+
+    def model_for(self, device: str) -> str:
+        return self.model or ("large-v2" if device == "cuda" else "small")
+
+    def compute_type_for(self, device: str) -> str:
+        return self.compute_type or ("float16" if device == "cuda" else "int8")
+
+
+def detect_device() -> str:
+    """CTranslate2から使えるGPUがあれば 'cuda'、なければ 'cpu'"""
+    try:
+        import ctranslate2
+    except ImportError:
+        return "cpu"
+    return "cuda" if ctranslate2.get_cuda_device_count() > 0 else "cpu"
+
+
+def _count_files(directory: str) -> int:
+    return sum(len(files) for _, _, files in os.walk(directory))
+
+
+class FasterWhisperBackend:
+    """
+    faster-whisper（CTranslate2）による文字起こし
+
+    CPUではint8量子化で動かせるため、GPUのないコンテナでも実用的な速度で処理できる。
+    CTranslate2のモデルは複数のスレッドから呼び出せ、同時に推論するのは ASR_NUM_WORKERS 件まで（残りは内部で待つ）
+    """
+
+    name = "faster-whisper"
+    supports_diarization = False
+
+    def __init__(self, config: TranscriptionConfig, device: str, download_root: str):
+        from faster_whisper import WhisperModel
+
+        self.config = config
+        self.device = device
+        self.model_name = config.model_for(device)
+        self.compute_type = config.compute_type_for(device)
+        self.model = WhisperModel(
+            self.model_name,
+            device=device,
+            compute_type=self.compute_type,
+            cpu_threads=config.threads,
+            num_workers=config.num_workers,
+            download_root=download_root,
+        )
+
+    def transcribe(self, audio: Audio, language: Optional[str], beam_size: Optional[int] = None) -> Dict[str, Any]:
+        """
+        文字起こし
+
+        Args:
+            beam_size: ビームサーチの幅（省略時は ASR_BEAM_SIZE。ライブ文字起こしでは1にして遅延を減らす）
+
+        Returns:
+            {"segments": [{"start", "end", "text", "words"?}], "language", "duration"}
+        """
+        segments, info = self.model.transcribe(
+            audio,
+            language=language,
+            beam_size=beam_size or self.config.beam_size,
+            vad_filter=self.config.vad_filter,
+            word_timestamps=self.config.word_timestamps,
+        )
+        # segments はジェネレーターで、消費するまで推論は進まない
+        return {
+            "segments": [self._segment_dict(segment) for segment in segments],
+            "language": info.language,
+            "duration": info.duration,
+        }
+
+    def _segment_dict(self, segment) -> Dict[str, Any]:
+        result = {
+            "start": round(segment.start, 3),
+            "end": round(segment.end, 3),
+            "text": segment.text.strip(),
+        }
+        if segment.words:
+            result["words"] = [
+                {
+                    "word": word.word,
+                    "start": round(word.start, 3),
+                    "end": round(word.end, 3),
+                    "score": round(word.probability, 3),
+                }
+                for word in segment.words
+            ]
+        return result
+
+    def warm_up(self, language: Optional[str] = None):
+        """無音で1回推論する（初回のメモリ確保やカーネルの初期化を済ませる）"""
+        segments, _ = self.model.transcribe(
+            np.zeros(SAMPLE_RATE, dtype=np.float32),
+            language=language,
+            beam_size=1,
+        )
+        list(segments)
+
+
+class WhisperXBackend:
+    """
+    WhisperXによる文字起こし（GPU向け）
+
+    バッチ推論のあとに単語単位のアライメントを行い、HF_TOKEN があれば話者分離にも対応する。
+    パイプラインはスレッドセーフではないため、文字起こし・話者分離はコンテナ内で1件ずつ実行する
+    """
+
+    name = "whisperx"
+
+    def __init__(self, config: TranscriptionConfig, device: str, download_root: str):
+        import whisperx
+
+        self.config = config
+        self.device = device
+        self.model_name = config.model_for(device)
+        self.compute_type = config.compute_type_for(device)
+        self.model = whisperx.load_model(
+            self.model_name,
+            device,
+            compute_type=self.compute_type,
+            download_root=download_root,
+            threads=config.threads,
+        )
+        # アライメントのモデルは言語ごとに初回だけ読み込む
+        self.align_models: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+        self.diarization_pipeline = None
+        hf_token = os.getenv("HF_TOKEN")
+        if config.diarization and hf_token:
+            self.diarization_pipeline = whisperx.DiarizationPipeline(use_auth_token=hf_token, device=device)
+
+    @property
+    def supports_diarization(self) -> bool:
+        return self.diarization_pipeline is not None
+
+    def transcribe(self, audio: Audio, language: Optional[str], beam_size: Optional[int] = None) -> Dict[str, Any]:
+        """
+        文字起こしと単語単位のアライメント（beam_size はバッチ推論では使わない）
+
+        Returns:
+            {"segments": [{"start", "end", "text", "words"}], "language", "duration"}
+        """
+        import whisperx
+
+        if isinstance(audio, str):
+            audio = whisperx.load_audio(audio)
+
+        with self._lock:
+            result = self.model.transcribe(audio, language=language, batch_size=self.config.batch_size)
+            language = result.get("language", language)
+
+            if language not in self.align_models:
+                self.align_models[language] = whisperx.load_align_model(language_code=language, device=self.device)
+            model_a, metadata = self.align_models[language]
+            aligned = whisperx.align(
+                result["segments"],
+                model_a,
+                metadata,
+                audio,
+                self.device,
+                return_char_alignments=False,
+            )
+        return {
+            "segments": aligned["segments"],
+            "language": language,
+            "duration": len(audio) / SAMPLE_RATE,
+        }
+
+    def diarize(self, audio_path: str, result: Dict[str, Any], min_speakers: int, max_speakers: int) -> Dict[str, Any]:
+        """話者分離を行い、各単語・セグメントに話者を割り当てる"""
+        import whisperx
+
+        with self._lock:
+            diarization = self.diarization_pipeline(
+                audio_path,
+                min_speakers=min_speakers,
+                max_speakers=max_speakers,
+            )
+        return {**result, **whisperx.assign_word_speakers(diarization, result)}
+
+    def warm_up(self, language: Optional[str] = None):
+        """無音で1回推論する（初回のメモリ確保やカーネルの初期化を済ませる）"""
+        self.model.transcribe(np.zeros(SAMPLE_RATE, dtype=np.float32), language=language or "en", batch_size=1)
+
+
+ASRBackend = Union[FasterWhisperBackend, WhisperXBackend]
+
+
+def load_asr_backend(config: TranscriptionConfig, download_root: str) -> Dict[str, Any]:
+    """
+    設定に応じた文字起こしバックエンドを読み込む
+
+    モデルの重みは download_root に保存され、次回以降はそこから読み込む
+
+    Returns:
+        {"backend", "downloaded"（重みを新たにダウンロードしたか）, "load_seconds"}
+    """
+    device = detect_device()
+    name = config.backend
+    if name == "auto":
+        name = "whisperx" if device == "cuda" and _module_available("whisperx") else "faster-whisper"
+    backend_classes = {"faster-whisper": FasterWhisperBackend, "whisperx": WhisperXBackend}
+    if name not in backend_classes:
+        raise ValueError(f"文字起こしバックエンドを読み込めません: {config.backend}")
+
+    os.makedirs(download_root, exist_ok=True)
+    files_before = _count_files(download_root)
+    started_at = time.perf_counter()
+    backend = backend_classes[name](config, device, download_root)
+    return {
+        "backend": backend,
+        "downloaded": _count_files(download_root) != files_before,
+        "load_seconds": time.perf_counter() - started_at,
+    }
+
+
+def _module_available(name: str) -> bool:
+    import importlib.util
+
+    return importlib.util.find_spec(name) is not None
+
+
+def segments_text(segments: List[Dict[str, Any]]) -> str:
+    """セグメントのテキストを連結"""
+    return " ".join(segment["text"].strip() for segment in segments if segment.get("text"))
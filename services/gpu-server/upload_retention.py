@@ -0,0 +1,102 @@
+"""
+アップロードファイルの保持期間
+models_volume の UPLOAD_DIR（音声・動画のアップロード、ライブ文字起こしの録音）から古いファイルを削除する
+
+一定間隔で実行する関数（modal_app.prune_uploads）が、応答キャッシュのディスク層と同じ方針で削除する。
+
+    期限切れ: 最終利用（保存・再アップロードで更新日時を更新する）から UPLOAD_TTL_HOURS を過ぎたファイル
+    サイズ超過: 合計が UPLOAD_MAX_GB を超えたら、上限の9割まで最終利用の古い順に削除する
+
+処理中のファイルを消さないよう、最終利用から IN_USE_SECONDS 以内のファイルは削除しない。
+"""
+
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+# Webエンドポイントの timeout（ライブ文字起こしの最長の接続時間）。この間は処理中とみなす
+IN_USE_SECONDS = 3600
+
+
+@dataclass(frozen=True)
+class UploadRetentionConfig:
+    """
+    アップロードファイルの削除の設定
+
+    環境変数:
+        UPLOAD_RETENTION_ENABLED: 古いアップロードファイルを削除するか
+        UPLOAD_TTL_HOURS: 最終利用からファイルを残す時間
+        UPLOAD_MAX_GB: アップロードファイルの合計サイズの上限（GB）
+        UPLOAD_PRUNE_INTERVAL_MINUTES: 削除の間隔（分。デプロイ時に読み込む）
+    """
+
+    enabled: bool = True
+    ttl_hours: float = 168.0
+    max_gb: float = 20.0
+    interval_minutes: int = 60
+
+    @classmethod
+    def from_env(cls) -> "UploadRetentionConfig":
+        """環境変数から設定を読み込む"""
+        return cls(
+            enabled=os.getenv("UPLOAD_RETENTION_ENABLED", "true").lower() == "true",
+            ttl_hours=float(os.getenv("UPLOAD_TTL_HOURS", cls.ttl_hours)),
+            max_gb=float(os.getenv("UPLOAD_MAX_GB", cls.max_gb)),
+            interval_minutes=max(1, int(os.getenv("UPLOAD_PRUNE_INTERVAL_MINUTES", cls.interval_minutes))),
+        )
+
+    @property
+    def ttl_seconds(self) -> float:
+        return self.ttl_hours * 3600
+
+    @property
+    def max_bytes(self) -> int:
+        return int(self.max_gb * 1024 * 1024 * 1024)
+
+
+def _scan(directory: str) -> List[Tuple[float, int, str]]:
+    """[(更新日時, サイズ, パス)]（アップロード中の一時ファイルを含む）"""
+    entries = []
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    return entries
+
+
+def prune_uploads(directory: str, config: UploadRetentionConfig, now: Optional[float] = None) -> Dict[str, Any]:
+    """
+    期限切れのファイルと、合計サイズの超過分のファイルを削除する
+
+    Returns:
+        {"files", "bytes"（削除後）, "removed", "removed_bytes"}
+    """
+    now = time.time() if now is None else now
+    entries = _scan(directory)
+    total = sum(size for _, size, _ in entries)
+    files = len(entries)
+    removed = removed_bytes = 0
+
+    # 下限まで減らして、毎回の実行で削除が走らないようにする
+    target = config.max_bytes * 0.9 if total > config.max_bytes else total
+    for mtime, size, path in sorted(entries):
+        age = now - mtime
+        if age <= IN_USE_SECONDS:
+            break
+        if age <= config.ttl_seconds and total <= target:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        files -= 1
+        removed += 1
+        removed_bytes += size
+
+    return {"files": files, "bytes": total, "removed": removed, "removed_bytes": removed_bytes}
@@ -0,0 +1,273 @@
+"""
+LLM・メディアのクラスの待機コンテナ数（update_autoscaler の min_containers）の調整
+
+一定間隔で実行する関数（modal_app.adjust_warm_capacity）が、各コンテナが共有Dictに書き込んだメトリクスから
+直近の入力の数・処理時間とコンテナの起動を集計し、曜日・時間帯のスケジュールと合わせて待機させるコンテナ数を決める。
+
+    必要数: ceil(到着率 × 平均処理時間 / コンテナあたりの入力数)（リトルの法則による同時に処理中の入力の数から）。
+            直近に入力があれば少なくとも1（アイドルになった後の次の入力がコールドスタートしないように）
+    下限:   スケジュールで指定した時間帯の待機コンテナ数
+    上限:   {prefix}_WARM_MAX_CONTAINERS
+
+入力がない時間帯は待機コンテナを0に戻すため、常に min_containers を設定する場合より費用を抑えられる。
+"""
+
+import math
+import os
+import re
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+from cold_start import PHASE_TOTAL, START_COLD, START_RESTORED
+from metrics import CONTAINER_INIT_SECONDS, CONTAINER_STARTS, METHOD_SECONDS
+
+DAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+_WINDOW_PATTERN = re.compile(r"^(?:(?P<days>[a-z,\-]+)\s+)?(?P<start>\d{1,2}:\d{2})-(?P<end>\d{1,2}:\d{2})\s*=\s*(?P<containers>\d+)$")
+
+
+@dataclass(frozen=True)
+class ScheduleWindow:
+    """スケジュールの時間帯（end_minute が start_minute 以下の場合は日をまたぐ）"""
+
+    days: FrozenSet[int]  # 0 = 月曜
+    start_minute: int
+    end_minute: int
+    containers: int
+
+    def matches(self, local: datetime) -> bool:
+        minute = local.hour * 60 + local.minute
+        if self.start_minute < self.end_minute:
+            return local.weekday() in self.days and self.start_minute <= minute < self.end_minute
+        # 日をまたぐ時間帯の翌日の部分は、開始した日の曜日で判定する
+        if minute >= self.start_minute:
+            return local.weekday() in self.days
+        return minute < self.end_minute and (local.weekday() - 1) % 7 in self.days
+
+
+def _parse_minute(value: str) -> int:
+    hour, minute = (int(part) for part in value.split(":"))
+    if not (0 <= hour <= 24 and 0 <= minute < 60) or hour * 60 + minute > 24 * 60:
+        raise ValueError(f"時刻が不正です: {value}")
+    return hour * 60 + minute
+
+
+def _parse_days(value: Optional[str]) -> FrozenSet[int]:
+    if not value:
+        return frozenset(range(7))
+    days = set()
+    for item in value.split(","):
+        first, _, last = item.partition("-")
+        if first not in DAYS or (last and last not in DAYS):
+            raise ValueError(f"曜日が不正です（{'/'.join(DAYS)}）: {item}")
+        start, end = DAYS.index(first), DAYS.index(last or first)
+        days.update(day % 7 for day in range(start, end + 1 if end >= start else end + 8))
+    return frozenset(days)
+
+
+def parse_schedule(value: str) -> Tuple[ScheduleWindow, ...]:
+    """'mon-fri 09:00-19:00=1; sat,sun 10:00-16:00=1' 形式の設定を時間帯の一覧に変換（曜日を省略すると毎日）"""
+    windows = []
+    for item in value.split(";"):
+        item = item.strip().lower()
+        if not item:
+            continue
+        match = _WINDOW_PATTERN.match(item)
+        if match is None:
+            raise ValueError(f"待機コンテナのスケジュールが不正です（例: mon-fri 09:00-19:00=1）: {item}")
+        windows.append(ScheduleWindow(
+            days=_parse_days(match.group("days")),
+            start_minute=_parse_minute(match.group("start")),
+            end_minute=_parse_minute(match.group("end")) % (24 * 60),
+            containers=int(match.group("containers")),
+        ))
+    return tuple(windows)
+
+
+@dataclass(frozen=True)
+class WarmCapacityConfig:
+    """
+    待機コンテナ数の調整の設定
+
+    環境変数（{prefix} はクラスごとの接頭辞。LLM / MEDIA）:
+        WARM_CAPACITY_ENABLED: 待機コンテナ数を調整するか（無効の場合は min_containers を変更しない）
+        WARM_CAPACITY_INTERVAL_MINUTES: 調整の間隔（分。デプロイ時に読み込む）
+        WARM_CAPACITY_WINDOW_MINUTES: 到着率・処理時間を求める直近の期間（分）
+        WARM_CAPACITY_UTC_OFFSET_HOURS: スケジュールの時刻のUTCとの差（時間。日本時間は9）
+        {prefix}_WARM_SCHEDULE: 曜日・時間帯ごとの待機コンテナ数の下限（例: mon-fri 09:00-19:00=1; sat 10:00-14:00=1）
+        {prefix}_WARM_MAX_CONTAINERS: 待機コンテナ数の上限（0は待機させない）
+    """
+
+    enabled: bool = True
+    interval_minutes: int = 5
+    window_minutes: int = 15
+    utc_offset_hours: float = 9.0
+    schedule: Tuple[ScheduleWindow, ...] = ()
+    max_containers: int = 2
+    inputs_per_container: int = 1
+
+    @classmethod
+    def from_env(cls, prefix: str = "LLM", inputs_per_container: int = 1, max_containers: Optional[int] = None) -> "WarmCapacityConfig":
+        """
+        環境変数から設定を読み込む
+
+        Args:
+            prefix: クラスごとの環境変数の接頭辞
+            inputs_per_container: コンテナあたりの入力数（ConcurrencyConfig.target_inputs）
+            max_containers: 環境変数がない場合の上限（省略時はクラスの既定値）
+        """
+        return cls(
+            enabled=os.getenv("WARM_CAPACITY_ENABLED", "true").lower() == "true",
+            interval_minutes=max(1, int(os.getenv("WARM_CAPACITY_INTERVAL_MINUTES", cls.interval_minutes))),
+            window_minutes=max(1, int(os.getenv("WARM_CAPACITY_WINDOW_MINUTES", cls.window_minutes))),
+            utc_offset_hours=float(os.getenv("WARM_CAPACITY_UTC_OFFSET_HOURS", cls.utc_offset_hours)),
+            schedule=parse_schedule(os.getenv(f"{prefix}_WARM_SCHEDULE", "")),
+            max_containers=max(0, int(os.getenv(f"{prefix}_WARM_MAX_CONTAINERS", cls.max_containers if max_containers is None else max_containers))),
+            inputs_per_container=max(1, inputs_per_container),
+        )
+
+    def scheduled_containers(self, now: float) -> int:
+        """時刻 now（UNIX時間）にスケジュールで指定された待機コンテナ数（該当する時間帯がなければ0）"""
+        local = datetime.fromtimestamp(now, timezone(timedelta(hours=self.utc_offset_hours)))
+        return max((window.containers for window in self.schedule if window.matches(local)), default=0)
+
+
+@dataclass(frozen=True)
+class ContainerUsage:
+    """1つのコンテナの起動からの累計（共有Dictのメトリクスから集計する）"""
+
+    inputs: int = 0
+    busy_seconds: float = 0.0
+    start: Optional[str] = None  # cold / restored（起動の記録の前は None）
+    init_seconds: float = 0.0
+
+
+def container_usage(snapshots: List[Tuple[Dict[str, str], Dict[str, Dict[str, Any]]]], service: str) -> Dict[str, ContainerUsage]:
+    """
+    metrics.published_snapshots の結果から、service のクラスのコンテナごとの累計を取り出す
+
+    入力の数と処理時間は gpu_method_duration_seconds、起動は gpu_container_starts_total / gpu_container_init_seconds（phase="total"）から求める。
+    """
+    usage = {}
+    for labels, snapshot in snapshots:
+        if labels.get("service") != service:
+            continue
+        inputs, busy_seconds = 0, 0.0
+        for _, value in snapshot.get(METHOD_SECONDS.name, {}).get("samples", []):
+            inputs += value["count"]
+            busy_seconds += value["sum"]
+        start = next(
+            (label_values[0] for label_values, count in snapshot.get(CONTAINER_STARTS.name, {}).get("samples", []) if count),
+            None,
+        )
+        init_seconds = sum(
+            value["sum"]
+            for label_values, value in snapshot.get(CONTAINER_INIT_SECONDS.name, {}).get("samples", [])
+            if label_values[1] == PHASE_TOTAL
+        )
+        usage[labels["container"]] = ContainerUsage(inputs, busy_seconds, start, init_seconds)
+    return usage
+
+
+def update_history(state: Optional[Dict[str, Any]], usage: Dict[str, ContainerUsage], now: float, window_seconds: float) -> Dict[str, Any]:
+    """
+    前回の集計からの増分を履歴に加え、window_seconds より古い履歴を捨てた新しい状態を返す（共有Dictに保存する）
+
+    状態: {"containers": {コンテナID: [入力の数, 処理時間, 起動を記録済みか]}, "since": 最初の集計の時刻,
+           "samples": [[時刻, 入力の数, 処理時間, cold の起動数, restored の起動数, 起動時間の合計]]}
+    最初の集計（state が None）は起点にするだけで、それまでの入力・起動は数えない。
+    停止したコンテナはメトリクスが古くなって共有Dictから消えるまで（METRICS_STALE_SECONDS）最後の値が残るため、増分は失われない。
+    """
+    previous = (state or {}).get("containers", {})
+    inputs, busy_seconds = 0, 0.0
+    starts = {START_COLD: 0, START_RESTORED: 0}
+    init_seconds = 0.0
+    for container, current in usage.items():
+        previous_inputs, previous_busy, previous_started = previous.get(container, (0, 0.0, False))
+        if current.inputs >= previous_inputs:
+            inputs += current.inputs - previous_inputs
+            busy_seconds += current.busy_seconds - previous_busy
+        if current.start in starts and not previous_started:
+            starts[current.start] += 1
+            init_seconds += current.init_seconds
+
+    samples = [sample for sample in (state or {}).get("samples", []) if now - sample[0] < window_seconds]
+    if state is not None:
+        samples.append([now, inputs, busy_seconds, starts[START_COLD], starts[START_RESTORED], init_seconds])
+    return {
+        "containers": {
+            container: [current.inputs, current.busy_seconds, current.start is not None]
+            for container, current in usage.items()
+        },
+        "since": (state or {}).get("since", now),
+        "samples": samples,
+    }
+
+
+@dataclass(frozen=True)
+class WarmPlan:
+    """待機コンテナ数の決定とその根拠"""
+
+    containers: int
+    scheduled: int
+    demand: int
+    inputs: int
+    rate: float  # 入力/秒
+    mean_seconds: float
+    cold_starts: int
+    restored_starts: int
+    mean_init_seconds: Optional[float]
+
+    @property
+    def reason(self) -> str:
+        if self.demand == 0 and self.scheduled == 0:
+            return "直近の入力なし"
+        if self.scheduled >= self.demand:
+            return "スケジュール"
+        return f"到着率 {self.rate * 60:.1f}件/分 × 平均 {self.mean_seconds:.1f}秒"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "containers": self.containers,
+            "reason": self.reason,
+            "scheduled": self.scheduled,
+            "demand": self.demand,
+            "inputs": self.inputs,
+            "rate_per_minute": round(self.rate * 60, 2),
+            "mean_seconds": round(self.mean_seconds, 2),
+            "cold_starts": self.cold_starts,
+            "restored_starts": self.restored_starts,
+            "mean_init_seconds": round(self.mean_init_seconds, 2) if self.mean_init_seconds is not None else None,
+        }
+
+
+def plan_warm_containers(config: WarmCapacityConfig, history: Dict[str, Any], now: float) -> WarmPlan:
+    """update_history の状態から、待機させるコンテナ数を決める"""
+    window_seconds = config.window_minutes * 60
+    samples = history.get("samples", [])
+    inputs = sum(sample[1] for sample in samples)
+    busy_seconds = sum(sample[2] for sample in samples)
+    cold_starts = sum(sample[3] for sample in samples)
+    restored_starts = sum(sample[4] for sample in samples)
+    init_seconds = sum(sample[5] for sample in samples)
+
+    # 最初の集計から window_seconds が経つまでは、経過した時間で割る
+    elapsed = min(window_seconds, max(1.0, now - history.get("since", now)))
+    rate = inputs / elapsed
+    mean_seconds = busy_seconds / inputs if inputs else 0.0
+    demand = max(1, math.ceil(rate * mean_seconds / config.inputs_per_container)) if inputs else 0
+    scheduled = config.scheduled_containers(now)
+    starts = cold_starts + restored_starts
+
+    return WarmPlan(
+        containers=min(config.max_containers, max(scheduled, demand)),
+        scheduled=scheduled,
+        demand=demand,
+        inputs=inputs,
+        rate=rate,
+        mean_seconds=mean_seconds,
+        cold_starts=cold_starts,
+        restored_starts=restored_starts,
+        mean_init_seconds=init_seconds / starts if starts else None,
+    )